@@ -0,0 +1,81 @@
+"""
+Benchmark the perceptual-hash index: hashing throughput, index build and similar-board queries
+
+Usage: python benchmarks/bench_image_index.py [entries]   (default 100000)
+"""
+import sys
+import time
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import numpy as np
+from PIL import Image
+
+import image_index
+
+
+def _near(values: np.ndarray, flips: int, rng) -> np.ndarray:
+    """Flip `flips` random bits of each hash (a lightly edited version of the same board)."""
+    result = values.copy()
+    for _ in range(flips):
+        result ^= np.uint64(1) << rng.integers(0, 64, len(values)).astype(np.uint64)
+    return result
+
+
+def main(entries: int) -> None:
+    rng = np.random.default_rng(7)
+    print("=" * 60)
+    print(f"Perceptual-hash index benchmark ({entries:,} entries)")
+    print("=" * 60)
+
+    board = Image.fromarray(rng.integers(0, 255, (1024, 1024, 3), dtype=np.uint8))
+    started = time.perf_counter()
+    for _ in range(20):
+        image_index.ImageIndex.describe(board)
+    print(f"  describe() on a 1024x1024 board: {(time.perf_counter() - started) / 20 * 1000:.2f} ms "
+          f"(pHash + dHash + pixel digest)")
+
+    grays = rng.random((10000, 32, 32), dtype=np.float32)
+    started = time.perf_counter()
+    image_index.phash_many(grays)
+    print(f"  phash_many on 10k 32x32 arrays: {(time.perf_counter() - started) / 10000 * 1e6:.2f} us/image")
+
+    # Boards come in families: an original plus lightly edited versions of it
+    originals = rng.integers(0, 2**63, entries // 4, dtype=np.uint64) * np.uint64(2)
+    phashes = np.concatenate([originals] + [_near(originals, flips, rng) for flips in (2, 5, 9)])
+    dhashes = np.concatenate([originals] + [_near(originals, flips, rng) for flips in (1, 4, 8)])
+    order = rng.permutation(len(phashes))
+    phashes, dhashes = phashes[order], dhashes[order]
+
+    index = image_index.HashIndex()
+    started = time.perf_counter()
+    for p, d in zip(phashes.tolist(), dhashes.tolist()):
+        index.add(p, d)
+    build_s = time.perf_counter() - started
+    print(f"  build: {build_s:.2f} s ({build_s / len(phashes) * 1e6:.1f} us/entry)")
+
+    queries = rng.integers(0, len(phashes), 1000)
+    for radius in (4, 10):
+        timings, hits = [], 0
+        for i in queries:
+            started = time.perf_counter()
+            found = index.query(int(phashes[i]), int(dhashes[i]), radius)
+            timings.append(time.perf_counter() - started)
+            hits += len(found)
+        timings_ms = np.array(timings) * 1000
+        print(f"  query radius {radius:2d}: mean {timings_ms.mean():.3f} ms, p99 {np.percentile(timings_ms, 99):.3f} ms, "
+              f"{hits / len(queries):.1f} matches/query")
+
+    started = time.perf_counter()
+    for i in queries[:100]:
+        distance = np.maximum(image_index.hamming(phashes, phashes[i]), image_index.hamming(dhashes, dhashes[i]))
+        expected = set(np.flatnonzero(distance <= 10).tolist())
+        assert expected == {entry_id for entry_id, _ in index.query(int(phashes[i]), int(dhashes[i]), 10)}
+    print(f"  brute-force scan (for comparison): {(time.perf_counter() - started) / 100 * 1000:.3f} ms/query; "
+          f"results identical")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
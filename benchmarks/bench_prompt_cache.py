@@ -0,0 +1,81 @@
+"""
+Benchmark the near-duplicate prompt cache: index build, lookups at full size (including
+subjects that collide in the same LSH buckets), and a new process loading the log
+
+Usage: python benchmarks/bench_prompt_cache.py [entries]   (default 1000000)
+"""
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import numpy as np
+
+import prompt_cache
+
+WORDS = ["silk", "denim", "linen", "wool", "leather", "velvet", "tweed", "satin", "cotton", "mesh",
+         "noir", "pastel", "neon", "earthy", "regal", "utility", "coastal", "alpine", "desert", "urban"]
+HOT_SUBJECT = "quiet luxury knitwear capsule"
+
+
+def _subject(i: int) -> str:
+    return f"{WORDS[i % 20]} {WORDS[(i // 20) % 20]} {WORDS[(i // 400) % 20]} look {i}"
+
+
+def _time_lookups(index: prompt_cache.PromptIndex, queries: list[str]) -> tuple[np.ndarray, int]:
+    timings, hits = [], 0
+    for query in queries:
+        started = time.perf_counter()
+        hits += index.lookup("ctx", query) is not None
+        timings.append(time.perf_counter() - started)
+    return np.array(timings) * 1000, hits
+
+
+def main(entries: int) -> None:
+    print("=" * 60)
+    print(f"Prompt cache benchmark ({entries:,} entries)")
+    print("=" * 60)
+
+    # 1% of the subjects are small variations of one popular subject: they share most bands
+    hot = entries // 100
+    index = prompt_cache.PromptIndex()
+    started = time.perf_counter()
+    for i in range(entries - hot):
+        index.add("ctx", _subject(i), f"/out/{i}.png")
+    for i in range(hot):
+        index.add("ctx", f"{HOT_SUBJECT} {i}", f"/out/hot-{i}.png")
+    build_s = time.perf_counter() - started
+    print(f"  build: {build_s:.1f} s ({build_s / entries * 1e6:.1f} us/entry)")
+    largest = max(len(found) for bucket in index._buckets for found in bucket.values() if isinstance(found, list))
+    print(f"  largest LSH bucket: {largest} entries (cap {index.max_bucket})")
+
+    for name, queries in [
+        ("exact repeat", [_subject(i).upper() for i in range(0, entries - hot, max((entries - hot) // 1000, 1))]),
+        ("near-duplicate", [f"{WORDS[i % 20]} {WORDS[(i // 3) % 20]} capsule wardrobe {i * 7}" for i in range(1000)]),
+        ("hot subject", [f"{HOT_SUBJECT} variant {i}" for i in range(1000)]),
+    ]:
+        timings_ms, hits = _time_lookups(index, queries)
+        print(f"  {name:14s}: mean {timings_ms.mean():.3f} ms, p99 {np.percentile(timings_ms, 99):.3f} ms, "
+              f"{hits}/{len(queries)} hits")
+
+    # A restarted process loads the same entries from the log, with their stored signatures
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "prompt_cache.jsonl"
+        with open(path, "w", encoding="utf-8") as f:
+            for (context, subject, output), sig in zip(index._entries, index._signatures):
+                f.write(json.dumps({"context": context, "subject": subject, "output": output,
+                                    "sig": prompt_cache._encode_signature(sig)}) + "\n")
+        cache = prompt_cache.PromptCache(path)
+        started = time.perf_counter()
+        cache.wait_ready()
+        load_s = time.perf_counter() - started
+        print(f"  load from log: {load_s:.1f} s ({load_s / entries * 1e6:.1f} us/entry, "
+              f"{len(cache.index):,} entries, lookups miss meanwhile)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
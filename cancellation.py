@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import metrics
+from structured_log import get_logger, log_event
+
+
+# How often a running model call checks whether its client is still there.
+CANCEL_POLL_INTERVAL_MS = int(os.environ.get("CANCEL_POLL_INTERVAL_MS", "250"))
+# Header the frontend sends so every call from one tab shares a session (Gradio's own
+# session_hash is used when it is absent).
+SESSION_HEADER = "x-client-session"
+
+logger = get_logger("cancellation")
+
+_current: ContextVar["CancelToken | None"] = ContextVar("moodboard_cancel_token", default=None)
+_active_lock = threading.Lock()
+_active: dict[str, set["CancelToken"]] = {}
+_loop_lock = threading.Lock()
+_loop: asyncio.AbstractEventLoop | None = None
+
+
+class RequestCancelled(Exception):
+    """The request's work was abandoned because its client left or sent a newer request."""
+
+    def __init__(self, reason: str):
+        self.reason = reason
+        super().__init__(f"Request cancelled ({reason}).")
+
+
+class CancelToken:
+    """Cancellation state shared by everything done on behalf of one request."""
+
+    def __init__(self, endpoint: str, session_key: str | None = None, probes: list | None = None):
+        self.endpoint = endpoint
+        self.session_key = session_key
+        self.reason = None
+        self._event = threading.Event()
+        # Callables returning True once a client has disconnected; the work is abandoned only
+        # when every client it serves is gone.
+        self._probes = probes or []
+        self._probe_lock = threading.Lock()
+        self._last_probe = 0.0
+
+    def cancel(self, reason: str) -> None:
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        if self._event.is_set():
+            return True
+        if self._probes:
+            now = time.monotonic()
+            with self._probe_lock:
+                if now - self._last_probe >= CANCEL_POLL_INTERVAL_MS / 1000:
+                    self._last_probe = now
+                    if all(probe() for probe in self._probes):
+                        self.cancel("client_disconnected")
+        return self._event.is_set()
+
+    def raise_if_cancelled(self) -> None:
+        if self.cancelled:
+            raise RequestCancelled(self.reason)
+
+
+def current_token() -> CancelToken | None:
+    return _current.get()
+
+
+def raise_if_cancelled() -> None:
+    """Abort the current request's work if it has been cancelled (no-op outside a request scope)."""
+    token = _current.get()
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+def session_key(request) -> str | None:
+    """The client session a request belongs to, if it can be told."""
+    if request is None:
+        return None
+    headers = getattr(request, "headers", None)
+    if headers is not None:
+        value = headers.get(SESSION_HEADER)
+        if value:
+            return value.strip()
+    session_hash = getattr(request, "session_hash", None)
+    return session_hash or None
+
+
+def _disconnect_probe(request):
+    """A probe for the HTTP connection behind `request`, or None when there is nothing to watch.
+
+    Only direct calls (headless endpoints, /gradio_api/api/...) hold their connection for the
+    whole call. Queued Gradio jobs outlive the request that joined the queue; those are
+    cancelled through cancel_session() when the page unloads instead."""
+    abandoned = getattr(request, "is_abandoned", None)
+    if callable(abandoned):
+        return abandoned  # a durable job (job_queue), cancelled through its store
+    inner = getattr(request, "request", None)  # gr.Request wraps the starlette request
+    http_request = inner if inner is not None else request
+    if http_request is None or not hasattr(http_request, "is_disconnected"):
+        return None
+    url = getattr(http_request, "url", None)
+    if url is not None and "/queue/" in url.path:
+        return None
+    try:
+        import anyio.from_thread
+
+        server_loop = anyio.from_thread.run_sync(asyncio.get_running_loop)
+    except Exception:
+        return None  # not running in a server worker thread
+
+    def probe() -> bool:
+        try:
+            future = asyncio.run_coroutine_threadsafe(http_request.is_disconnected(), server_loop)
+            return bool(future.result(timeout=1.0))
+        except Exception:
+            return False
+
+    return probe
+
+
+def _register(token: CancelToken, supersede: bool) -> None:
+    if token.session_key is None:
+        return
+    with _active_lock:
+        tokens = _active.setdefault(token.session_key, set())
+        if supersede:
+            for previous in tokens:
+                if previous.endpoint == token.endpoint:
+                    previous.cancel("superseded")
+        tokens.add(token)
+
+
+def _unregister(token: CancelToken) -> None:
+    if token.session_key is None:
+        return
+    with _active_lock:
+        tokens = _active.get(token.session_key)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                _active.pop(token.session_key, None)
+
+
+def cancel_session(session: str | None, reason: str = "client_gone") -> int:
+    """Cancel all in-flight work of a client session; returns how many requests were cancelled."""
+    if not session:
+        return 0
+    with _active_lock:
+        tokens = list(_active.get(session.strip(), ()))
+    for token in tokens:
+        token.cancel(reason)
+    if tokens:
+        log_event(logger, logging.INFO, "session_cancelled", session=session, requests=len(tokens), reason=reason)
+    return len(tokens)
+
+
+@contextmanager
+def request_scope(endpoint: str, requests, supersede: bool = False, error_type=None):
+    """Run a request's work under a cancel token.
+
+    `requests` is the request (or list of requests, for a coalesced edit batch) the work serves.
+    With supersede=True a newer request for the same endpoint from the same session cancels
+    this one. RequestCancelled is counted and re-raised, as error_type(message) if given."""
+    if not isinstance(requests, (list, tuple)):
+        requests = [requests]
+    requests = [request for request in requests if request is not None]
+    probes = [_disconnect_probe(request) for request in requests]
+    if not probes or any(probe is None for probe in probes):
+        probes = []  # some client cannot be watched, so it must be assumed to still be there
+    sessions = {session_key(request) for request in requests}
+    token = CancelToken(endpoint, sessions.pop() if len(sessions) == 1 else None, probes)
+    _register(token, supersede)
+    reset = _current.set(token)
+    try:
+        yield token
+    except RequestCancelled as e:
+        metrics.inc("moodboard_requests_cancelled_total", endpoint=endpoint, reason=e.reason)
+        log_event(logger, logging.INFO, "request_cancelled", endpoint=endpoint, reason=e.reason)
+        if error_type is not None:
+            raise error_type(str(e)) from e
+        raise
+    finally:
+        _current.reset(reset)
+        _unregister(token)
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="cancellable-calls", daemon=True).start()
+        return _loop
+
+
+def run_cancellable(coro):
+    """Run an async call (e.g. the async model client) to completion from a worker thread,
+    cancelling it as soon as the current request's token is cancelled."""
+    token = _current.get()
+    if token is not None and token.cancelled:
+        coro.close()
+        raise RequestCancelled(token.reason)
+    future = asyncio.run_coroutine_threadsafe(coro, _background_loop())
+    if token is None:
+        return future.result()
+    while True:
+        try:
+            return future.result(timeout=CANCEL_POLL_INTERVAL_MS / 1000)
+        except TimeoutError:
+            if token.cancelled:
+                future.cancel()
+                raise RequestCancelled(token.reason) from None
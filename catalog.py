@@ -0,0 +1,266 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import metrics
+from output_store import DATA_DIR
+from structured_log import get_logger, log_event
+
+
+CATALOG_ENABLED = os.environ.get("CATALOG_ENABLED", "1").strip().lower() not in ("0", "false", "no")
+# Shared by every backend process (it lives in the shared data directory by default).
+CATALOG_DB = Path(os.environ.get("CATALOG_DB") or DATA_DIR / "catalog.sqlite3")
+# Entries are written by a background thread, this many per transaction at most...
+CATALOG_BATCH_SIZE = int(os.environ.get("CATALOG_BATCH_SIZE", "64"))
+# ...and at most this long after the first of them was queued.
+CATALOG_FLUSH_MS = int(os.environ.get("CATALOG_FLUSH_MS", "200"))
+# Entries waiting to be written; beyond this new ones are dropped rather than slowing requests.
+CATALOG_QUEUE_SIZE = int(os.environ.get("CATALOG_QUEUE_SIZE", "10000"))
+CATALOG_MAX_PAGE_SIZE = 100
+
+logger = get_logger("catalog")
+
+COLUMNS = (
+    "output_id", "kind", "created_at", "subject", "prompt", "edit_request", "bbox", "parent",
+    "model", "served_model", "latency_profile", "generation_mode", "phase", "reasoning",
+    "duration_ms", "correlation_id",
+)
+# Relative bm25 weights of the indexed columns: subject, edit_request, reasoning, prompt
+_RANK = "bm25(generations_fts, 10.0, 5.0, 1.0, 0.5)"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS generations (
+    output_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    subject TEXT,
+    prompt TEXT,
+    edit_request TEXT,
+    bbox TEXT,
+    parent TEXT,
+    model TEXT,
+    served_model TEXT,
+    latency_profile TEXT,
+    generation_mode TEXT,
+    phase TEXT,
+    reasoning TEXT,
+    duration_ms REAL,
+    correlation_id TEXT
+);
+CREATE INDEX IF NOT EXISTS generations_created ON generations (created_at);
+CREATE INDEX IF NOT EXISTS generations_parent ON generations (parent);
+CREATE VIRTUAL TABLE IF NOT EXISTS generations_fts USING fts5(
+    subject, edit_request, reasoning, prompt,
+    content='generations', tokenize='porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS generations_ai AFTER INSERT ON generations BEGIN
+    INSERT INTO generations_fts (rowid, subject, edit_request, reasoning, prompt)
+    VALUES (new.rowid, new.subject, new.edit_request, new.reasoning, new.prompt);
+END;
+CREATE TRIGGER IF NOT EXISTS generations_ad AFTER DELETE ON generations BEGIN
+    INSERT INTO generations_fts (generations_fts, rowid, subject, edit_request, reasoning, prompt)
+    VALUES ('delete', old.rowid, old.subject, old.edit_request, old.reasoning, old.prompt);
+END;
+"""
+_TOKEN = re.compile(r"[^\W_]+")
+
+
+def match_query(text: str) -> str | None:
+    """Turn free text into a safe FTS5 query: every word must match, the last one as a prefix
+    (so results update while typing). Quotes and operators in the input are never interpreted."""
+    words = _TOKEN.findall(text or "")
+    if not words:
+        return None
+    return " ".join(f'"{word}"' for word in words[:-1]) + (" " if len(words) > 1 else "") + f'"{words[-1]}"*'
+
+
+def _column_value(entry: dict, column: str):
+    value = entry.get(column)
+    if column == "bbox" and isinstance(value, (list, tuple, dict)):
+        return json.dumps(value, separators=(",", ":"))
+    return value
+
+
+class Catalog:
+    """SQLite FTS5 catalog of every saved output. Each thread keeps its own connection, and
+    WAL mode lets searches run while the writer commits."""
+
+    def __init__(self, path: Path = CATALOG_DB, clock=time.time):
+        self.path = Path(path)
+        self._clock = clock
+        self._local = threading.local()
+        self._queue: queue.Queue = queue.Queue(maxsize=CATALOG_QUEUE_SIZE)
+        self._writer: threading.Thread | None = None
+        self._writer_lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as db:
+            db.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA busy_timeout=10000")
+            self._local.db = db
+        return db
+
+    def write(self, entries: list[dict]) -> None:
+        """Insert entries in one transaction (outputs already catalogued are left alone)."""
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany(
+                f"INSERT INTO generations ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))}) "
+                "ON CONFLICT (output_id) DO NOTHING",
+                [tuple(_column_value(entry, column) for column in COLUMNS) for entry in entries],
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def record(self, entry: dict) -> bool:
+        """Queue an entry for the background writer. Never blocks the caller."""
+        entry = dict(entry, created_at=entry.get("created_at") or self._clock())
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_batches, name="catalog-writer", daemon=True)
+                self._writer.start()
+                atexit.register(self.flush, 5)
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            metrics.inc("moodboard_catalog_dropped_total")
+            log_event(logger, logging.WARNING, "catalog_queue_full", output=entry.get("output_id"))
+            return False
+        return True
+
+    def _write_batches(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + CATALOG_FLUSH_MS / 1000
+            while len(batch) < CATALOG_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self.write(batch)
+                metrics.inc("moodboard_catalog_entries_total", len(batch))
+                metrics.inc("moodboard_catalog_batches_total")
+            except sqlite3.Error as e:
+                metrics.inc("moodboard_catalog_dropped_total", len(batch))
+                log_event(logger, logging.WARNING, "catalog_write_failed", entries=len(batch), error=str(e))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Wait until every queued entry has been written. False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def search(self, text: str = "", page: int = 1, page_size: int = 20) -> dict:
+        """One page of catalogued outputs matching `text` (best match first), or of all outputs
+        (newest first) when it is empty."""
+        page = max(int(page or 1), 1)
+        page_size = min(max(int(page_size or 20), 1), CATALOG_MAX_PAGE_SIZE)
+        offset = (page - 1) * page_size
+        fields = ", ".join(f"g.{column}" for column in COLUMNS if column not in ("prompt", "reasoning"))
+        db = self._connect()
+        query = match_query(text)
+        if query is None:
+            total = db.execute("SELECT COUNT(*) FROM generations").fetchone()[0]
+            rows = db.execute(
+                f"SELECT {fields}, NULL AS snippet FROM generations g ORDER BY g.created_at DESC LIMIT ? OFFSET ?",
+                (page_size, offset),
+            ).fetchall()
+        else:
+            total = db.execute(
+                "SELECT COUNT(*) FROM generations_fts WHERE generations_fts MATCH ?", (query,)
+            ).fetchone()[0]
+            rows = db.execute(
+                f"SELECT {fields}, snippet(generations_fts, -1, '[', ']', '…', 12) AS snippet "
+                "FROM generations_fts JOIN generations g ON g.rowid = generations_fts.rowid "
+                f"WHERE generations_fts MATCH ? ORDER BY {_RANK}, g.created_at DESC LIMIT ? OFFSET ?",
+                (query, page_size, offset),
+            ).fetchall()
+        results = []
+        for row in rows:
+            result = dict(row)
+            result["bbox"] = json.loads(result["bbox"]) if result["bbox"] else None
+            results.append(result)
+        return {
+            "results": results,
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+            "pages": (total + page_size - 1) // page_size,
+        }
+
+    def lineage(self, output_id: str) -> list[dict]:
+        """Every catalogued version of the board `output_id` belongs to: its root generation and
+        all edits descending from it (branches included), oldest first."""
+        rows = self._connect().execute(
+            """
+            WITH RECURSIVE
+                ancestors (output_id, parent, depth) AS (
+                    SELECT output_id, parent, 0 FROM generations WHERE output_id = ?
+                    UNION ALL
+                    SELECT g.output_id, g.parent, a.depth + 1
+                    FROM generations g JOIN ancestors a ON g.output_id = a.parent
+                ),
+                root (output_id) AS (SELECT output_id FROM ancestors ORDER BY depth DESC LIMIT 1),
+                versions (output_id) AS (
+                    SELECT output_id FROM root
+                    UNION
+                    SELECT g.output_id FROM generations g JOIN versions v ON g.parent = v.output_id
+                )
+            SELECT g.* FROM generations g JOIN versions USING (output_id) ORDER BY g.created_at, g.rowid
+            """,
+            (output_id,),
+        ).fetchall()
+        entries = []
+        for row in rows:
+            entry = dict(row)
+            entry["bbox"] = json.loads(entry["bbox"]) if entry["bbox"] else None
+            entries.append(entry)
+        return entries
+
+    def get(self, output_id: str) -> dict | None:
+        row = self._connect().execute("SELECT * FROM generations WHERE output_id = ?", (output_id,)).fetchone()
+        if row is None:
+            return None
+        entry = dict(row)
+        entry["bbox"] = json.loads(entry["bbox"]) if entry["bbox"] else None
+        return entry
+
+
+_catalog_lock = threading.Lock()
+_catalog: Catalog | None = None
+
+
+def catalog() -> Catalog:
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = Catalog()
+        return _catalog
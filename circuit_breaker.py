@@ -0,0 +1,133 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import metrics
+from structured_log import get_logger, log_event
+
+
+BREAKER_ENABLED = os.environ.get("BREAKER_ENABLED", "1").strip().lower() not in ("0", "false", "no")
+# The breaker judges the last BREAKER_WINDOW calls, once at least BREAKER_MIN_CALLS were made.
+BREAKER_WINDOW = int(os.environ.get("BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.environ.get("BREAKER_MIN_CALLS", "5"))
+# Trip when this fraction of those calls failed...
+BREAKER_ERROR_RATE = float(os.environ.get("BREAKER_ERROR_RATE", "0.5"))
+# ...or took longer than BREAKER_SLOW_CALL_S.
+BREAKER_SLOW_CALL_S = float(os.environ.get("BREAKER_SLOW_CALL_S", "90"))
+BREAKER_SLOW_RATE = float(os.environ.get("BREAKER_SLOW_RATE", "0.8"))
+# How long an open breaker rejects calls before letting probes through (half-open).
+BREAKER_OPEN_SECONDS = float(os.environ.get("BREAKER_OPEN_SECONDS", "30"))
+BREAKER_HALF_OPEN_PROBES = int(os.environ.get("BREAKER_HALF_OPEN_PROBES", "1"))
+# Opt-in: while a model's breaker is open, serve its requests with the fallback model.
+MODEL_FALLBACK_ENABLED = os.environ.get("MODEL_FALLBACK_ENABLED", "0").strip().lower() in ("1", "true", "yes")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+logger = get_logger("circuit_breaker")
+
+
+class CircuitBreaker:
+    """Error-rate and slow-call breaker for one model.
+
+    closed: calls flow and outcomes are recorded. open: calls are rejected until
+    BREAKER_OPEN_SECONDS have passed. half_open: a few probe calls are let through; a healthy
+    probe closes the breaker, a failed or slow one opens it again."""
+
+    def __init__(self, name: str, clock=time.monotonic):
+        self.name = name
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=BREAKER_WINDOW)  # (failed, slow) per call
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+
+    def _transition(self, state: str) -> None:
+        previous, self._state = self._state, state
+        if state == OPEN:
+            self._opened_at = self._clock()
+        self._outcomes.clear()
+        self._probes = 0
+        metrics.inc("moodboard_breaker_transitions_total", model=self.name, state=state)
+        log_event(logger, logging.WARNING if state == OPEN else logging.INFO, "breaker_state_changed",
+                  model=self.name, previous=previous, state=state)
+
+    def _refresh(self) -> None:
+        if self._state == OPEN and self._clock() - self._opened_at >= BREAKER_OPEN_SECONDS:
+            self._transition(HALF_OPEN)
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._refresh()
+            return self._state
+
+    def retry_after(self) -> float:
+        with self._lock:
+            if self._state != OPEN:
+                return 0.0
+            return max(BREAKER_OPEN_SECONDS - (self._clock() - self._opened_at), 0.0)
+
+    def acquire(self) -> bool:
+        """Whether a call may go ahead now; every granted call must end in record() or release()."""
+        if not BREAKER_ENABLED:
+            return True
+        with self._lock:
+            self._refresh()
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._probes < BREAKER_HALF_OPEN_PROBES:
+                self._probes += 1
+                return True
+            return False
+
+    def release(self) -> None:
+        """A granted call ended without saying anything about the model (e.g. it was cancelled)."""
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def record(self, success: bool, seconds: float) -> None:
+        if not BREAKER_ENABLED:
+            return
+        slow = seconds > BREAKER_SLOW_CALL_S
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._transition(CLOSED if success and not slow else OPEN)
+                return
+            if self._state == OPEN:
+                return  # a call granted before the breaker tripped
+            self._outcomes.append((not success, slow))
+            if len(self._outcomes) < BREAKER_MIN_CALLS:
+                return
+            calls = len(self._outcomes)
+            error_rate = sum(failed for failed, _ in self._outcomes) / calls
+            slow_rate = sum(slow for _, slow in self._outcomes) / calls
+            if error_rate >= BREAKER_ERROR_RATE or slow_rate >= BREAKER_SLOW_RATE:
+                self._transition(OPEN)
+
+
+_registry_lock = threading.Lock()
+_breakers: dict[str, CircuitBreaker] = {}
+
+
+def breaker_for(model_id: str) -> CircuitBreaker:
+    with _registry_lock:
+        if model_id not in _breakers:
+            _breakers[model_id] = CircuitBreaker(model_id)
+        return _breakers[model_id]
+
+
+def states() -> dict:
+    with _registry_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.state for breaker in breakers}
+
+
+def reset() -> None:
+    with _registry_lock:
+        _breakers.clear()
@@ -0,0 +1,132 @@
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+import metrics
+from handle_cache import HandleCache
+from structured_log import get_logger, log_event
+
+
+# Opt-in: a cached template is billed for storage while it lives, and models only accept
+# caches above a minimum token count (requests fall back to the full prompt below it).
+CONTEXT_CACHE_ENABLED = os.environ.get("CONTEXT_CACHE_ENABLED", "0").strip().lower() in ("1", "true", "yes")
+# Lifetime given to a cached template, and how close to expiry it gets before it is extended.
+CONTEXT_CACHE_TTL_S = int(os.environ.get("CONTEXT_CACHE_TTL_S", "3600"))
+CONTEXT_CACHE_REFRESH_S = float(os.environ.get("CONTEXT_CACHE_REFRESH_S", "300"))
+# After a failed create (e.g. a template below the model's minimum), send full prompts for this long.
+CONTEXT_CACHE_RETRY_S = float(os.environ.get("CONTEXT_CACHE_RETRY_S", "600"))
+# Distinct cached templates kept at once; custom templates beyond this are sent in full.
+CONTEXT_CACHE_MAX_ENTRIES = int(os.environ.get("CONTEXT_CACHE_MAX_ENTRIES", "32"))
+
+# Stands in, within the cached instructions, for the lines that change per request.
+VARIABLE_MARKER = "(given in the request)"
+_PLACEHOLDER = re.compile(r"\{[A-Z_]+\}")
+
+logger = get_logger("context_cache")
+
+
+def split_prompt(template, prompt: str) -> tuple[str, str] | None:
+    """Split a prompt built from template (its text, or a compiled template_registry.Template)
+    into (static instructions, variable part).
+
+    Lines copied verbatim from the template (and blank lines) are static; every other line was
+    filled in for this request and is sent with it, each run of them leaving VARIABLE_MARKER
+    behind. Sections a builder dropped (e.g. the bbox sections of an edit without a bbox) are
+    simply absent, so each variant of a template gets its own static text. None when the prompt
+    has no static part worth caching."""
+    static_lines = getattr(template, "static_lines", None)
+    if static_lines is None:
+        static_lines = {line for line in template.splitlines() if line.strip() and not _PLACEHOLDER.search(line)}
+    static, variable = [], []
+    for line in prompt.splitlines():
+        if not line.strip() or line in static_lines:
+            static.append(line)
+        else:
+            if not static or static[-1] != VARIABLE_MARKER:
+                static.append(VARIABLE_MARKER)
+            variable.append(line)
+    if not variable or not any(line in static_lines for line in static):
+        return None
+    return "\n".join(static).strip(), "\n".join(variable)
+
+
+def _expires_at(cached) -> float:
+    expiration = getattr(cached, "expire_time", None)
+    if isinstance(expiration, datetime):
+        if expiration.tzinfo is None:
+            expiration = expiration.replace(tzinfo=timezone.utc)
+        return expiration.timestamp()
+    return time.time() + CONTEXT_CACHE_TTL_S
+
+
+class ContextCaches:
+    """Explicit cached contents holding static template instructions, one per (API key, model,
+    static text). Created on first use, extended before they expire, and shared by concurrent
+    requests."""
+
+    def __init__(self, ttl_s: int = CONTEXT_CACHE_TTL_S, refresh_s: float = CONTEXT_CACHE_REFRESH_S,
+                 retry_s: float = CONTEXT_CACHE_RETRY_S, max_entries: int = CONTEXT_CACHE_MAX_ENTRIES):
+        self.ttl_s = ttl_s
+        # A cache unused for its whole lifetime has expired, so its entry is dropped too
+        self._entries = HandleCache(refresh_s, retry_s, idle_s=ttl_s, max_entries=max_entries)
+
+    def cached_content(self, client, api_key: str, model_id: str, static: str) -> str | None:
+        """Name of the cached content holding `static` for model_id, or None to send the full prompt."""
+        key = HandleCache.key(api_key, model_id, static)
+        try:
+            found = self._entries.get(key, lambda current: self._create(client, model_id, static, key, current))
+        except Exception as e:
+            metrics.inc("moodboard_context_cache_failures_total", model=model_id)
+            log_event(logger, logging.WARNING, "context_cache_create_failed", model=model_id, error=str(e))
+            return None
+        if found is None:
+            return None
+        name, reused = found
+        if reused:
+            metrics.inc("moodboard_context_cache_hits_total", model=model_id)
+        return name
+
+    def _create(self, client, model_id: str, static: str, key: str, current: str | None) -> tuple[str, float]:
+        """Extend the cached content `current` if it is still alive, else create a new one."""
+        from google.genai import types
+
+        ttl = f"{int(self.ttl_s)}s"
+        if current is not None:
+            try:
+                cached = client.caches.update(name=current, config=types.UpdateCachedContentConfig(ttl=ttl))
+                metrics.inc("moodboard_context_cache_refreshes_total", model=model_id)
+                return getattr(cached, "name", None) or current, _expires_at(cached)
+            except Exception as e:
+                log_event(logger, logging.INFO, "context_cache_refresh_failed", model=model_id, error=str(e))
+        cached = client.caches.create(
+            model=model_id,
+            config=types.CreateCachedContentConfig(
+                system_instruction=static, ttl=ttl, display_name=f"moodboard-{key[:12]}",
+            ),
+        )
+        metrics.inc("moodboard_context_cache_creates_total", model=model_id)
+        log_event(logger, logging.INFO, "context_cache_created", model=model_id, cache=cached.name,
+                  static_chars=len(static))
+        return cached.name, _expires_at(cached)
+
+    def invalidate(self, api_key: str, model_id: str, static: str) -> None:
+        """Forget a cached content the API no longer knows (it is created again on next use)."""
+        self._entries.invalidate(HandleCache.key(api_key, model_id, static))
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+_caches_lock = threading.Lock()
+_caches: ContextCaches | None = None
+
+
+def caches() -> ContextCaches:
+    global _caches
+    with _caches_lock:
+        if _caches is None:
+            _caches = ContextCaches()
+        return _caches
@@ -2,16 +2,57 @@
 set -eu
 
 BACKEND_PORT="${BACKEND_PORT:-7861}"
-export GRADIO_SERVER_PORT="${BACKEND_PORT}"
+# Number of backend processes, listening on consecutive ports starting at BACKEND_PORT.
+BACKEND_WORKERS="${BACKEND_WORKERS:-1}"
+NGINX_UPSTREAM_CONF="${NGINX_UPSTREAM_CONF:-/etc/nginx/conf.d/00-upstream.conf}"
 export GRADIO_SERVER_NAME="${GRADIO_SERVER_NAME:-0.0.0.0}"
+# The React frontend only calls the named endpoints, so skip building the Gradio UI by default.
+export MOODBOARD_HEADLESS="${MOODBOARD_HEADLESS:-1}"
+# All workers share one output store so any of them can serve or edit any image.
+export MOODBOARD_OUTPUT_DIR="${MOODBOARD_OUTPUT_DIR:-/app/outputs}"
+mkdir -p "${MOODBOARD_OUTPUT_DIR}"
+# Job queue and indexes are shared the same way, but kept outside the served store.
+export MOODBOARD_DATA_DIR="${MOODBOARD_DATA_DIR:-/app/data}"
+mkdir -p "${MOODBOARD_DATA_DIR}"
+# nginx serves outputs directly from the store; the backend only hands out these URLs
+# and answers access-checked downloads with X-Accel-Redirect.
+export MOODBOARD_OUTPUT_URL_PREFIX="${MOODBOARD_OUTPUT_URL_PREFIX:-/outputs/}"
+export MOODBOARD_X_ACCEL_PREFIX="${MOODBOARD_X_ACCEL_PREFIX:-/_protected_outputs/}"
 
-python -u mb_app.py &
-BACKEND_PID="$!"
+BACKEND_PIDS=""
+SERVERS=""
+i=0
+while [ "${i}" -lt "${BACKEND_WORKERS}" ]; do
+  port=$((BACKEND_PORT + i))
+  GRADIO_SERVER_PORT="${port}" python -u mb_app.py &
+  BACKEND_PIDS="${BACKEND_PIDS} $!"
+  SERVERS="${SERVERS}  server 127.0.0.1:${port} max_fails=3 fail_timeout=10s;
+"
+  i=$((i + 1))
+done
+
+# Stateless endpoints (named API calls, files) go to the least busy worker. Gradio's queue
+# and call/stream protocol keep per-process state, so those requests stick to one worker.
+cat > "${NGINX_UPSTREAM_CONF}" <<EOF
+map \$host \$moodboard_output_dir {
+  default "${MOODBOARD_OUTPUT_DIR}";
+}
+
+upstream moodboard_backend {
+  least_conn;
+${SERVERS}  keepalive 16;
+}
+
+upstream moodboard_sticky {
+  hash \$http_x_forwarded_for\$remote_addr consistent;
+${SERVERS}}
+EOF
 
 cleanup() {
-  kill "${BACKEND_PID}" 2>/dev/null || true
+  for pid in ${BACKEND_PIDS}; do
+    kill "${pid}" 2>/dev/null || true
+  done
 }
 trap cleanup INT TERM EXIT
 
 exec nginx -g "daemon off;"
-
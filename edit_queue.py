@@ -0,0 +1,214 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from structured_log import get_logger, log_event, text_summary
+from tracing import request_span
+
+
+# Edits racing on the same parent image are serialized and merged instead of each producing
+# a version that the next one immediately throws away. State is per process.
+EDIT_QUEUE_ENABLED = os.environ.get("EDIT_QUEUE_ENABLED", "1").strip().lower() not in ("0", "false", "no")
+# How long the first edit of a batch queued behind a running call on its lineage keeps
+# collecting instructions at least. An edit on an idle lineage is sent at once.
+EDIT_COALESCE_WINDOW_MS = int(os.environ.get("EDIT_COALESCE_WINDOW_MS", "250"))
+# Most edits merged into one model call (each bbox edit becomes one region).
+EDIT_COALESCE_MAX = int(os.environ.get("EDIT_COALESCE_MAX", "8"))
+# Whether edit_image_region params describe one bbox, several regions or the whole image.
+BBOX_PARAMS = ("x_top", "y_top", "x_bottom", "y_bottom")
+
+logger = get_logger("edit_queue")
+
+
+class PendingEdit:
+    """One edit_image_region call waiting in a lineage queue."""
+
+    __slots__ = ("params", "request", "superseded")
+
+    def __init__(self, params: dict, request=None):
+        self.params = params
+        self.request = request
+        self.superseded = False
+
+
+class _Batch:
+    __slots__ = ("compat_key", "edits", "started", "done", "result", "error")
+
+    def __init__(self, compat_key):
+        self.compat_key = compat_key
+        self.edits = []
+        self.started = False
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Lineage:
+    __slots__ = ("batches", "head")
+
+    def __init__(self):
+        self.batches = deque()
+        # Output of the last batch while later ones are still queued: they raced on the same
+        # parent, so they build on it instead of discarding it.
+        self.head = None
+
+
+_lock = threading.Condition()
+_lineages: dict[str, _Lineage] = {}
+_stats = {"submitted": 0, "batches": 0, "coalesced": 0, "superseded": 0}
+
+
+def lineage_key(image_path_file, current_image) -> str | None:
+    """Identify the parent image of an edit by its file name (outputs are uniquely named).
+    In-memory images have no lineage and are not queued."""
+    for candidate in (image_path_file, current_image):
+        if isinstance(candidate, str) and candidate.strip():
+            return candidate.strip().split("=")[-1].replace("\\", "/").split("/")[-1]
+    return None
+
+
+def stats() -> dict:
+    with _lock:
+        return dict(_stats)
+
+
+def _bbox(params: dict) -> tuple | None:
+    try:
+        return tuple(int(params[key]) for key in BBOX_PARAMS)
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _regions(params: dict) -> list[dict]:
+    regions = params.get("regions")
+    if isinstance(regions, str):
+        if not regions.strip():
+            return []
+        try:
+            regions = json.loads(regions)
+        except ValueError:
+            return []
+    return regions if isinstance(regions, list) else []
+
+
+def _combine_text(instructions: list[str]) -> str:
+    if len(instructions) <= 1:
+        return instructions[0] if instructions else ""
+    return "Apply all of these changes:\n" + "\n".join(
+        f"{number}. {instruction}" for number, instruction in enumerate(instructions, start=1)
+    )
+
+
+def combine_edits(edits: list[PendingEdit]) -> dict:
+    """Merge a batch into one set of edit_image_region params.
+
+    Whole-image instructions are joined into one EDIT_REQUEST; bbox edits become regions.
+    A later instruction for the exact same region (or a repeated whole-image instruction)
+    supersedes the earlier one, which is then never sent to the model."""
+    if len(edits) == 1:
+        return dict(edits[0].params)
+
+    regions = {}  # region box -> (edit, region dict); later edits overwrite earlier ones
+    instructions = {}  # normalized text -> (edit, text)
+    for edit in edits:
+        params = edit.params
+        edit_request = (params.get("edit_request") or "").strip()
+        own_regions = _regions(params)
+        bbox = _bbox(params)
+        if own_regions:
+            entries = [dict(region, edit_request=region.get("edit_request") or edit_request) for region in own_regions]
+        elif bbox:
+            entries = [dict(zip(BBOX_PARAMS, bbox), edit_request=edit_request)]
+        else:
+            key = " ".join(edit_request.lower().split())
+            if key in instructions:
+                instructions[key][0].superseded = True
+            instructions[key] = (edit, edit_request)
+            continue
+        for entry in entries:
+            key = tuple(entry.get(name) for name in BBOX_PARAMS)
+            if key in regions and regions[key][0] is not edit:
+                regions[key][0].superseded = True
+            regions[key] = (edit, entry)
+
+    # An edit is only superseded if none of its instructions survived
+    surviving = {id(edit) for edit, _ in list(regions.values()) + list(instructions.values())}
+    for edit in edits:
+        if id(edit) in surviving:
+            edit.superseded = False
+
+    combined = dict(edits[-1].params)
+    combined.update(dict.fromkeys(BBOX_PARAMS))
+    combined["edit_request"] = _combine_text([text for _, text in instructions.values()])
+    combined["regions"] = [entry for _, entry in regions.values()] or None
+    return combined
+
+
+def submit(key: str, compat_key, params: dict, run_batch, request=None):
+    """Queue an edit on lineage `key` and return its result.
+
+    An edit on an idle lineage is sent at once. Compatible edits (same compat_key, e.g. model and
+    template) arriving while an earlier batch on the lineage is still running are merged into one
+    call to run_batch(params, parent_override, requests); every caller of the batch gets the same result."""
+    edit = PendingEdit(params, request)
+    with _lock:
+        lineage = _lineages.setdefault(key, _Lineage())
+        _stats["submitted"] += 1
+        batch = lineage.batches[-1] if lineage.batches else None
+        if batch is None or batch.started or batch.compat_key != compat_key or len(batch.edits) >= EDIT_COALESCE_MAX:
+            batch = _Batch(compat_key)
+            lineage.batches.append(batch)
+            leader = True
+            # Only worth waiting for more edits when this one could not be sent yet anyway
+            in_flight = lineage.batches[0] is not batch
+        else:
+            leader = False
+            _stats["coalesced"] += 1
+        batch.edits.append(edit)
+
+    if not leader:
+        with request_span("edit_queue_wait", request, **{"moodboard.lineage": key}):
+            batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        return batch.result
+
+    if in_flight and EDIT_COALESCE_WINDOW_MS > 0:
+        time.sleep(EDIT_COALESCE_WINDOW_MS / 1000)
+    with _lock:
+        while lineage.batches[0] is not batch:
+            _lock.wait()
+        batch.started = True
+        parent_override = lineage.head
+        edits = list(batch.edits)
+
+    try:
+        combined = combine_edits(edits)
+        superseded = [e for e in edits if e.superseded]
+        if len(edits) > 1:
+            log_event(
+                logger, logging.INFO, "edits_coalesced",
+                lineage=key, edits=len(edits), superseded=len(superseded),
+                edit_request=text_summary(combined.get("edit_request")),
+            )
+        batch.result = run_batch(combined, parent_override, [e.request for e in edits])
+    except BaseException as e:
+        batch.error = e
+    finally:
+        with _lock:
+            _stats["batches"] += 1
+            _stats["superseded"] += sum(1 for e in edits if e.superseded)
+            lineage.batches.popleft()
+            if batch.error is None and batch.result:
+                lineage.head = batch.result[0]
+            if not lineage.batches:
+                _lineages.pop(key, None)
+            _lock.notify_all()
+        batch.done.set()
+
+    if batch.error is not None:
+        raise batch.error
+    return batch.result
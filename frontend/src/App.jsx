@@ -6,6 +6,8 @@ function App() {
   const [currentImage, setCurrentImage] = useState(null)
   const [selectedModel, setSelectedModel] = useState('gemini-3-pro-image-preview')
   const [apiKey, setApiKey] = useState('')
+  const [latencyProfile, setLatencyProfile] = useState('') // '' = server default
+  const [progressive, setProgressive] = useState(false) // quick draft first, then the refined board
 
   return (
     <div className="h-screen flex flex-col overflow-hidden">
@@ -14,11 +16,17 @@ function App() {
         onModelChange={setSelectedModel}
         apiKey={apiKey}
         onApiKeyChange={setApiKey}
+        latencyProfile={latencyProfile}
+        onLatencyProfileChange={setLatencyProfile}
+        progressive={progressive}
+        onProgressiveChange={setProgressive}
       />
       <UnifiedMoodboard 
         selectedModel={selectedModel}
         onImageChange={setCurrentImage}
         apiKey={apiKey}
+        latencyProfile={latencyProfile}
+        progressive={progressive}
       />
     </div>
   )
@@ -1,6 +1,22 @@
 import { useState, useRef, useEffect } from 'react'
 
-function BoundingBoxSelector({ imageUrl, bbox, onBboxChange, disabled = false }) {
+// Snap a coordinate to the nearest panel edge within `threshold` image pixels
+function snapToEdges(value, edges, threshold) {
+  let snapped = value
+  let bestDistance = threshold
+  for (const edge of edges) {
+    const distance = Math.abs(edge - value)
+    if (distance <= bestDistance) {
+      snapped = edge
+      bestDistance = distance
+    }
+  }
+  return snapped
+}
+
+// panels: rectangles from the backend panel index ({ box: [left, top, right, bottom] }),
+// used to snap the dragged bbox to panel borders. Hold Alt while dragging to disable snapping.
+function BoundingBoxSelector({ imageUrl, bbox, onBboxChange, disabled = false, panels = null, snapThreshold = 12 }) {
   const [isDrawing, setIsDrawing] = useState(false)
   const [startPos, setStartPos] = useState(null)
   const [hasMoved, setHasMoved] = useState(false) // Track if mouse moved during drag
@@ -123,12 +139,23 @@ function BoundingBoxSelector({ imageUrl, bbox, onBboxChange, disabled = false })
     
     if (distance > 5) {
       setHasMoved(true)
-      onBboxChange({
+      let next = {
         x1: Math.min(startPos.x, pos.x),
         y1: Math.min(startPos.y, pos.y),
         x2: Math.max(startPos.x, pos.x),
         y2: Math.max(startPos.y, pos.y)
-      })
+      }
+      if (panels && panels.length > 0 && !e.altKey) {
+        const xEdges = panels.flatMap(panel => [panel.box[0], panel.box[2]])
+        const yEdges = panels.flatMap(panel => [panel.box[1], panel.box[3]])
+        next = {
+          x1: snapToEdges(next.x1, xEdges, snapThreshold),
+          y1: snapToEdges(next.y1, yEdges, snapThreshold),
+          x2: snapToEdges(next.x2, xEdges, snapThreshold),
+          y2: snapToEdges(next.y2, yEdges, snapThreshold)
+        }
+      }
+      onBboxChange(next)
     }
   }
 
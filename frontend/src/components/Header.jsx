@@ -2,7 +2,11 @@ function Header({
   selectedModel,
   onModelChange,
   apiKey,
-  onApiKeyChange
+  onApiKeyChange,
+  latencyProfile,
+  onLatencyProfileChange,
+  progressive,
+  onProgressiveChange
 }) {
   return (
     <header className="bg-white border-b border-gray-200 z-10">
@@ -34,6 +38,28 @@ function Header({
                 <option value="gemini-2.5-flash-image">Gemini 2.5 Flash</option>
               </select>
             </label>
+            <label className="flex items-center gap-2 text-sm text-gray-700">
+              <span>Profile:</span>
+              <select
+                value={latencyProfile}
+                onChange={(e) => onLatencyProfileChange(e.target.value)}
+                className="px-3 py-1.5 text-sm border border-gray-300 rounded-lg focus:ring-2 focus:ring-blue-500 focus:border-transparent bg-white"
+              >
+                <option value="">Default</option>
+                <option value="fast">Fast (iterate)</option>
+                <option value="balanced">Balanced</option>
+                <option value="quality">Quality (final board)</option>
+              </select>
+            </label>
+            <label className="flex items-center gap-2 text-sm text-gray-700">
+              <input
+                type="checkbox"
+                checked={progressive}
+                onChange={(e) => onProgressiveChange(e.target.checked)}
+                className="rounded border-gray-300 text-blue-600 focus:ring-blue-500"
+              />
+              <span>Draft first</span>
+            </label>
           </div>
         </div>
       </div>
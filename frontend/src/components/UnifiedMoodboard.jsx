@@ -1,14 +1,29 @@
 import { useState, useEffect, useRef } from 'react'
-import { generateImage, editImageRegion, getImageUrl } from '../services/api'
+import { generateImage, generateImageProgressive, editImageRegion, findSimilarMoodboard, getImageUrl, getPanelIndex } from '../services/api'
 import BoundingBoxSelector from './BoundingBoxSelector'
 import ReasoningTracesBar from './ReasoningTracesBar'
 import HistoryPanel from './HistoryPanel'
 
-function UnifiedMoodboard({ selectedModel, onImageChange, onReasoningChange, apiKey }) {
+// Tell the user when the backend served a different model than the one they picked
+function fallbackNotice(runInfo) {
+  if (!runInfo || !runInfo.fallback) return null
+  return `${runInfo.requested_model} is temporarily unavailable, so this result was made with ${runInfo.served_model}.`
+}
+
+// Progressive generation: say what the board on screen is while the refinement is pending or if it failed
+function phaseNotice(runInfo) {
+  if (runInfo?.phase === 'draft') return 'Draft ready - refining in the background...'
+  if (runInfo?.refine_error) return `Refinement failed, keeping the draft: ${runInfo.refine_error}`
+  return fallbackNotice(runInfo)
+}
+
+function UnifiedMoodboard({ selectedModel, onImageChange, onReasoningChange, apiKey, latencyProfile = '', progressive = false }) {
   const [currentImage, setCurrentImage] = useState(null)
   const [inputText, setInputText] = useState('')
   const [loading, setLoading] = useState(false)
   const [error, setError] = useState(null)
+  const [notice, setNotice] = useState(null) // e.g. which model served when the requested one was unavailable
+  const [cachedMatch, setCachedMatch] = useState(null) // { prompt, subject, similarity } when an earlier board was reused
   const [bbox, setBbox] = useState(null) // No default bbox - only set when user drags
   const [imageUrl, setImageUrl] = useState(null)
   const [isEditMode, setIsEditMode] = useState(false)
@@ -17,6 +32,7 @@ function UnifiedMoodboard({ selectedModel, onImageChange, onReasoningChange, api
   const [historyOpen, setHistoryOpen] = useState(false) // History panel visibility
   const [selectedVersionId, setSelectedVersionId] = useState(null) // ID of currently selected/active version
   const [isViewMode, setIsViewMode] = useState(false) // Track if we're viewing a non-active entry (read-only)
+  const [panels, setPanels] = useState(null) // Panel rectangles of the current image, for bbox snapping
   const inputRef = useRef(null)
 
   // Detect if running on Mac
@@ -35,6 +51,19 @@ function UnifiedMoodboard({ selectedModel, onImageChange, onReasoningChange, api
     }
   }, [currentImage])
 
+  // Fetch the panel index of the current image so the bbox can snap to panel borders
+  useEffect(() => {
+    setPanels(null)
+    if (!currentImage) return
+    const imagePath = typeof currentImage === 'object' ? (currentImage.path || currentImage.url) : currentImage
+    if (!imagePath) return
+    let cancelled = false
+    getPanelIndex(imagePath).then(index => {
+      if (!cancelled && index) setPanels(index.panels)
+    })
+    return () => { cancelled = true }
+  }, [currentImage])
+
   // Notify parent of image changes
   useEffect(() => {
     if (onImageChange) {
@@ -42,13 +71,16 @@ function UnifiedMoodboard({ selectedModel, onImageChange, onReasoningChange, api
     }
   }, [currentImage, onImageChange])
 
-  const handleSubmit = async () => {
-    if (!inputText.trim()) {
-      setError(isEditMode ? 'Please enter an edit request' : 'Please enter a subject description')
+  // regeneratePrompt: skip the similar-board lookup and generate this subject fresh
+  const handleSubmit = async (regeneratePrompt = null) => {
+    const prompt = regeneratePrompt ?? inputText
+    const editing = isEditMode && regeneratePrompt === null
+    if (!prompt.trim()) {
+      setError(editing ? 'Please enter an edit request' : 'Please enter a subject description')
       return
     }
 
-    if (isEditMode && !currentImage) {
+    if (editing && !currentImage) {
       setError('Please generate an image first')
       return
     }
@@ -58,10 +90,12 @@ function UnifiedMoodboard({ selectedModel, onImageChange, onReasoningChange, api
 
     setLoading(true)
     setError(null)
+    setNotice(null)
+    setCachedMatch(null)
     setReasoningTrace('') // Clear previous reasoning on new submission
 
     try {
-      if (isEditMode && currentImage) {
+      if (editing && currentImage) {
         // Edit mode: edit the existing image
         const imagePath = typeof currentImage === 'object' && currentImage.path ? currentImage.path : currentImage
 
@@ -78,12 +112,16 @@ function UnifiedMoodboard({ selectedModel, onImageChange, onReasoningChange, api
           bboxCoords,
           inputText,
           selectedModel,
-          apiKey
+          apiKey,
+          '', // edit mode: server default
+          null, // regions: use the bbox
+          latencyProfile
         )
 
         // Add to history (store snapshot of image, reasoning, and bbox)
         addToHistory(response.image, 'edit', inputText, response.reasoning, bbox)
         setReasoningTrace(response.reasoning)
+        setNotice(fallbackNotice(response.runInfo))
 
         // Create an "active" duplicate entry for continued editing (without reasoning/bbox)
         // and automatically select it to clear reasoning/bbox
@@ -95,22 +133,39 @@ function UnifiedMoodboard({ selectedModel, onImageChange, onReasoningChange, api
         // setBbox(null)
       } else {
         // Generate mode: create new image
-        const response = await generateImage(inputText, selectedModel, apiKey)
-
-        // Add to history (store snapshot of image, reasoning, and bbox)
-        // For generation, bbox is null initially
-        addToHistory(response.image, 'generate', inputText, response.reasoning, null)
-        setReasoningTrace(response.reasoning)
-
-        // Create an "active" duplicate entry for continued editing (without reasoning/bbox)
-        // and automatically select it to clear reasoning/bbox
-        const activeEntry = createActiveEntry(response.image, response.reasoning)
-        handleSelectVersion(activeEntry) // Select active entry to clear reasoning/bbox and enable editing
-
-        setInputText('') // Clear input after generation
+        const showGenerated = (response) => {
+          // Add to history (store snapshot of image, reasoning, and bbox)
+          // For generation, bbox is null initially
+          addToHistory(response.image, 'generate', prompt, response.reasoning, null)
+          setReasoningTrace(response.reasoning)
+          setNotice(phaseNotice(response.runInfo))
+
+          // Create an "active" duplicate entry for continued editing (without reasoning/bbox)
+          // and automatically select it to clear reasoning/bbox
+          const activeEntry = createActiveEntry(response.image, response.reasoning)
+          handleSelectVersion(activeEntry) // Select active entry to clear reasoning/bbox and enable editing
+        }
+
+        // A near-identical subject was generated before: show that board instantly and offer to regenerate
+        const cached = regeneratePrompt === null && !progressive
+          ? await findSimilarMoodboard(prompt, selectedModel, '', latencyProfile)
+          : null
+        if (cached) {
+          showGenerated({ image: cached.image, reasoning: '', runInfo: cached.runInfo })
+          setCachedMatch({ prompt, subject: cached.subject, similarity: cached.similarity })
+        } else if (progressive) {
+          // Show the quick draft right away; the refined board replaces it when it lands
+          const response = await generateImageProgressive(prompt, selectedModel, apiKey, '', showGenerated)
+          if (!response.runInfo?.refine_error) showGenerated(response)
+          else setNotice(phaseNotice(response.runInfo))
+        } else {
+          showGenerated(await generateImage(prompt, selectedModel, apiKey, '', latencyProfile))
+        }
+
+        if (regeneratePrompt === null) setInputText('') // Clear input after generation
       }
     } catch (err) {
-      setError(err.message || (isEditMode ? 'Failed to edit image' : 'Failed to generate image'))
+      setError(err.message || (editing ? 'Failed to edit image' : 'Failed to generate image'))
     } finally {
       setLoading(false)
     }
@@ -298,6 +353,7 @@ function UnifiedMoodboard({ selectedModel, onImageChange, onReasoningChange, api
                 bbox={bbox}
                 onBboxChange={setBbox}
                 disabled={isViewMode}
+                panels={panels}
               />
             </div>
           </div>
@@ -397,6 +453,26 @@ function UnifiedMoodboard({ selectedModel, onImageChange, onReasoningChange, api
                 {error}
               </div>
             )}
+            {notice && !error && (
+              <div className="mb-4 bg-amber-50 border border-amber-200 text-amber-800 px-4 py-3 rounded-lg">
+                {notice}
+              </div>
+            )}
+            {cachedMatch && !error && (
+              <div className="mb-4 flex items-center justify-between gap-4 bg-blue-50 border border-blue-200 text-blue-800 px-4 py-3 rounded-lg">
+                <span>
+                  Instant result from an earlier request for "{cachedMatch.subject}"
+                  {cachedMatch.similarity < 1 ? ` (${Math.round(cachedMatch.similarity * 100)}% similar)` : ''}.
+                </span>
+                <button
+                  onClick={() => handleSubmit(cachedMatch.prompt)}
+                  disabled={loading}
+                  className="shrink-0 px-3 py-1.5 text-sm font-medium bg-blue-600 text-white rounded-lg hover:bg-blue-700 disabled:opacity-50"
+                >
+                  Regenerate
+                </button>
+              </div>
+            )}
 
             <div className="relative group">
               <textarea
@@ -416,7 +492,7 @@ function UnifiedMoodboard({ selectedModel, onImageChange, onReasoningChange, api
                 className="w-full pl-4 pr-14 py-3 border border-gray-300 rounded-2xl shadow-sm focus:ring-2 focus:ring-blue-500 focus:border-transparent resize-none text-base disabled:bg-gray-50 disabled:cursor-not-allowed transition-all"
               />
               <button
-                onClick={handleSubmit}
+                onClick={() => handleSubmit()}
                 disabled={loading || isViewMode || !inputText.trim()}
                 className={`absolute bottom-3 right-3 p-2.5 rounded-xl transition-all duration-300 shadow-sm flex items-center justify-center
                   ${loading || isViewMode || !inputText.trim()
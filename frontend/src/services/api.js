@@ -4,6 +4,64 @@ import axios from 'axios'
 // Override with VITE_API_BASE_URL if you host the backend elsewhere.
 const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || ''
 
+// Identifies this tab to the backend: a newer generate request from the same tab cancels the
+// previous one, and closing the tab cancels whatever is still running for it.
+const CLIENT_SESSION_ID = (globalThis.crypto?.randomUUID?.() || `${Date.now()}-${Math.random().toString(36).slice(2)}`)
+axios.defaults.headers.common['X-Client-Session'] = CLIENT_SESSION_ID
+
+if (typeof window !== 'undefined' && navigator.sendBeacon) {
+  window.addEventListener('pagehide', () => {
+    const apiUrl = `${API_BASE_URL}/gradio_api/api/cancel_session`
+    navigator.sendBeacon(apiUrl, new Blob([JSON.stringify({ data: [CLIENT_SESSION_ID] })], { type: 'application/json' }))
+  })
+}
+
+// Model calls go through the durable job queue: submit_job answers with a job id at once and
+// the result is polled, so no connection is held open and a backend restart does not lose the
+// job. Set VITE_USE_JOB_QUEUE=false to call the endpoints directly instead.
+const USE_JOB_QUEUE = import.meta.env.VITE_USE_JOB_QUEUE !== 'false'
+const JOB_POLL_INTERVAL_MS = 1000
+const JOB_POLL_RETRIES = 30 // consecutive failed polls (e.g. during a deploy) before giving up
+
+const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms))
+
+function postEndpoint(name, data, timeout) {
+  return axios.post(
+    `${API_BASE_URL}/gradio_api/api/${name}`,
+    { data },
+    {
+      headers: {
+        'Content-Type': 'application/json'
+      },
+      timeout
+    }
+  )
+}
+
+// Run a model endpoint; resolves with a response shaped like a direct call ({ data: { data: outputs } })
+async function runEndpoint(name, data, timeout) {
+  if (!USE_JOB_QUEUE) return postEndpoint(name, data, timeout)
+
+  const submitted = await postEndpoint('submit_job', [name, data], 10000)
+  const jobId = submitted.data.data[0].job_id
+  let failures = 0
+  for (;;) {
+    await sleep(JOB_POLL_INTERVAL_MS)
+    let job
+    try {
+      job = (await postEndpoint('get_job', [jobId], 10000)).data.data[0]
+      failures = 0
+    } catch (error) {
+      // The backend may be restarting; the job outlives it, so keep polling for a while
+      if ((error.response && error.response.status < 500) || ++failures >= JOB_POLL_RETRIES) throw error
+      continue
+    }
+    if (job.status === 'succeeded') return { data: { data: job.data } }
+    if (job.status === 'failed') throw new Error(`API Error: ${job.error}`)
+    if (job.status === 'cancelled') throw new Error('API Error: the job was cancelled')
+  }
+}
+
 // Helper to wait for Gradio API to be ready
 async function waitForAPI() {
   // Skip the check in browser - just proceed with API calls
@@ -23,43 +81,37 @@ async function getAPIInfo() {
 }
 
 // Generate image
-export async function generateImage(subject, modelId, apiKey = "") {
+// generationMode: "single", "panels" (8 panels generated in parallel and tiled) or "" for the server default
+// latencyProfile: "fast", "balanced", "quality" or "" for the server default
+export async function generateImage(subject, modelId, apiKey = "", generationMode = "", latencyProfile = "") {
   await waitForAPI()
   
   try {
     // Gradio named endpoints use /gradio_api/api/{endpoint_name} format
     // The generate_image function needs 3 inputs: user_input, model_id, template
     // template can be null to use the default template
-    // Use Vite proxy in dev mode (relative URL) or direct URL in production
-    const apiUrl = API_BASE_URL ? `${API_BASE_URL}/gradio_api/api/generate_image` : '/gradio_api/api/generate_image'
-    
-    const response = await axios.post(
-      apiUrl,
-      {
-        data: [
-          subject, // user_input
-          modelId, // model_id
-          "", // template (empty string = use default)
-          apiKey || "" // api_key (optional)
-        ],
-      },
-      {
-        headers: {
-          'Content-Type': 'application/json'
-        },
-        timeout: 120000, // 2 minutes for image generation
-        withCredentials: false
-      }
+    const response = await runEndpoint(
+      'generate_image',
+      [
+        subject, // user_input
+        modelId, // model_id
+        "", // template (empty string = use default)
+        apiKey || "", // api_key (optional)
+        generationMode || "", // generation_mode (empty string = server default)
+        latencyProfile || "" // latency_profile (empty string = server default)
+      ],
+      120000 // 2 minutes for image generation (direct calls only)
     )
 
     if (response.data && response.data.data) {
       if (response.data.data.length > 1) {
-        // Handle multiple outputs (image path and reasoning)
+        // Handle multiple outputs (image path, reasoning and run info)
         // Backend now returns file path as string
         const imagePath = response.data.data[0]
         return {
           image: imagePath, // File path string
-          reasoning: response.data.data[1]
+          reasoning: response.data.data[1],
+          runInfo: response.data.data[2] || null // { requested_model, served_model, fallback }
         }
       } else if (response.data.data.length === 1) {
         // Handle single output (image path only)
@@ -76,54 +128,144 @@ export async function generateImage(subject, modelId, apiKey = "") {
   }
 }
 
-// Edit image region
-// bboxCoords can be null/undefined if no region is selected (edit entire image)
-export async function editImageRegion(imagePath, bboxCoords, editRequest, modelId, apiKey = "") {
+// Parse a Gradio /gradio_api/call event stream, calling onEvent(event, data) per event
+async function readEventStream(response, onEvent) {
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  let buffer = ''
+  for (;;) {
+    const { value, done } = await reader.read()
+    if (done) break
+    buffer += decoder.decode(value, { stream: true })
+    let boundary
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const block = buffer.slice(0, boundary)
+      buffer = buffer.slice(boundary + 2)
+      let event = 'message'
+      let data = ''
+      for (const line of block.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim()
+        else if (line.startsWith('data:')) data += line.slice(5).trim()
+      }
+      if (onEvent(event, data ? JSON.parse(data) : null)) return
+    }
+  }
+}
+
+// Draft-then-refine generation: onDraft({ image, reasoning, runInfo }) is called as soon as the
+// quick draft lands; resolves with the refined result (or the draft, with runInfo.refine_error set)
+export async function generateImageProgressive(subject, modelId, apiKey = "", generationMode = "", onDraft = null) {
   await waitForAPI()
-  
+
+  const toResult = (data) => ({ image: data[0], reasoning: data[1], runInfo: data[2] || null })
   try {
-    // Gradio named endpoints use /gradio_api/api/{endpoint_name} format
-    // Use Vite proxy in dev mode (relative URL) or direct URL in production
-    const apiUrl = API_BASE_URL ? `${API_BASE_URL}/gradio_api/api/edit_image_region` : '/gradio_api/api/edit_image_region'
-    
-    // If bboxCoords is null/undefined, pass null for all coordinates (edit entire image)
-    const xTop = bboxCoords ? bboxCoords.x1 : null
-    const yTop = bboxCoords ? bboxCoords.y1 : null
-    const xBottom = bboxCoords ? bboxCoords.x2 : null
-    const yBottom = bboxCoords ? bboxCoords.y2 : null
-    
-    const response = await axios.post(
+    const apiUrl = `${API_BASE_URL}/gradio_api/call/generate_image_progressive`
+    const submitted = await axios.post(
       apiUrl,
       {
         data: [
-          null, // image_display (not used when image_path_input is provided)
-          imagePath, // image_path_input - the file path
-          xTop,
-          yTop,
-          xBottom,
-          yBottom,
-          editRequest,
-          modelId,
-          "", // edit_template (empty string = use default)
-          apiKey || "" // api_key (optional)
+          subject, // user_input
+          modelId, // model_id
+          "", // template (empty string = use default)
+          apiKey || "", // api_key (optional)
+          generationMode || "" // generation_mode (empty string = server default)
         ],
       },
       {
         headers: {
           'Content-Type': 'application/json'
         },
-        timeout: 120000 // 2 minutes for image editing
+        timeout: 10000
+      }
+    )
+
+    // fetch (not axios) so the events can be read as they arrive
+    const response = await fetch(`${apiUrl}/${submitted.data.event_id}`, {
+      headers: { 'X-Client-Session': CLIENT_SESSION_ID }
+    })
+    if (!response.ok) {
+      throw new Error(`API Error: ${response.status} - ${response.statusText}`)
+    }
+
+    let latest = null
+    let failure = null
+    await readEventStream(response, (event, data) => {
+      if (event === 'generating' && data) {
+        latest = toResult(data)
+        if (latest.runInfo?.phase === 'draft' && onDraft) onDraft(latest)
+      } else if (event === 'complete') {
+        if (data) latest = toResult(data)
+        return true
+      } else if (event === 'error') {
+        failure = new Error(`API Error: ${data || 'generation failed'}`)
+        return true
       }
+      return false
+    })
+    if (failure) throw failure
+    if (!latest) throw new Error('No data returned from API')
+    return latest
+  } catch (error) {
+    if (error.response) {
+      const errorMsg = error.response.data?.error || error.response.data?.detail || error.response.statusText
+      throw new Error(`API Error: ${error.response.status} - ${errorMsg}`)
+    }
+    throw new Error(error.message || 'Failed to generate image')
+  }
+}
+
+// Edit image region
+// bboxCoords can be null/undefined if no region is selected (edit entire image)
+// editMode: "full", "regional" (send only the region and blend it back) or "" for the server default
+// regions: optional list of { x1, y1, x2, y2, editRequest } edited together in one call (replaces bboxCoords)
+// latencyProfile: "fast", "balanced", "quality" or "" for the server default
+export async function editImageRegion(imagePath, bboxCoords, editRequest, modelId, apiKey = "", editMode = "", regions = null, latencyProfile = "") {
+  await waitForAPI()
+  
+  try {
+    // If bboxCoords is null/undefined, pass null for all coordinates (edit entire image)
+    const xTop = bboxCoords ? bboxCoords.x1 : null
+    const yTop = bboxCoords ? bboxCoords.y1 : null
+    const xBottom = bboxCoords ? bboxCoords.x2 : null
+    const yBottom = bboxCoords ? bboxCoords.y2 : null
+    
+    const response = await runEndpoint(
+      'edit_image_region',
+      [
+        null, // image_display (not used when image_path_input is provided)
+        imagePath, // image_path_input - the file path
+        xTop,
+        yTop,
+        xBottom,
+        yBottom,
+        editRequest,
+        modelId,
+        "", // edit_template (empty string = use default)
+        apiKey || "", // api_key (optional)
+        editMode || "", // edit_mode (empty string = server default)
+        regions && regions.length > 0 // regions (JSON list, empty string = use the bbox above)
+          ? JSON.stringify(regions.map(region => ({
+              x_top: Math.round(region.x1),
+              y_top: Math.round(region.y1),
+              x_bottom: Math.round(region.x2),
+              y_bottom: Math.round(region.y2),
+              edit_request: region.editRequest || ""
+            })))
+          : "",
+        latencyProfile || "" // latency_profile (empty string = server default)
+      ],
+      120000 // 2 minutes for image editing (direct calls only)
     )
 
     if (response.data && response.data.data) {
       if (response.data.data.length > 1) {
-        // Handle multiple outputs (image path and reasoning)
+        // Handle multiple outputs (image path, reasoning and run info)
         // Backend now returns file path as string
         const imagePath = response.data.data[0]
         return {
           image: imagePath, // File path string
-          reasoning: response.data.data[1]
+          reasoning: response.data.data[1],
+          runInfo: response.data.data[2] || null // { requested_model, served_model, fallback }
         }
       } else if (response.data.data.length === 1) {
         // Handle single output (image path only)
@@ -140,6 +282,43 @@ export async function editImageRegion(imagePath, bboxCoords, editRequest, modelI
   }
 }
 
+// Look up a board generated earlier for a near-identical subject (same model, mode, profile and template)
+// Returns { image, subject, similarity, runInfo } or null; the cache is a shortcut, never an error
+export async function findSimilarMoodboard(subject, modelId, generationMode = "", latencyProfile = "") {
+  try {
+    const response = await postEndpoint(
+      'find_similar_moodboard',
+      [subject, modelId, "", generationMode || "", latencyProfile || ""],
+      3000
+    )
+    const match = response.data?.data?.[0]?.match
+    return match ? { image: match.image, subject: match.subject, similarity: match.similarity, runInfo: match.run_info } : null
+  } catch (e) {
+    return null
+  }
+}
+
+// Get the panel rectangles detected when the image was saved (used to snap the bbox to panels)
+// Returns null if the index is unavailable; snapping is a convenience, never an error
+export async function getPanelIndex(imagePath) {
+  try {
+    const apiUrl = API_BASE_URL ? `${API_BASE_URL}/gradio_api/api/get_panel_index` : '/gradio_api/api/get_panel_index'
+    const response = await axios.post(
+      apiUrl,
+      { data: [imagePath] },
+      {
+        headers: {
+          'Content-Type': 'application/json'
+        },
+        timeout: 10000
+      }
+    )
+    return response.data?.data?.[0] || null
+  } catch (e) {
+    return null
+  }
+}
+
 // Helper to get image URL from file path, URL, or image data object
 export function getImageUrl(filePathOrUrlOrObject) {
   if (!filePathOrUrlOrObject) return null
@@ -19,6 +19,10 @@ export default defineConfig({
         target: 'http://127.0.0.1:7860',
         changeOrigin: true,
       },
+      '/outputs': {
+        target: 'http://127.0.0.1:7860',
+        changeOrigin: true,
+      },
       '/file': {
         target: 'http://127.0.0.1:7860',
         changeOrigin: true,
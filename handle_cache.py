@@ -0,0 +1,100 @@
+import hashlib
+import threading
+import time
+
+
+class _Slot:
+    __slots__ = ("lock", "value", "expires_at", "retry_after", "used_at")
+
+    def __init__(self, now: float):
+        self.lock = threading.Lock()
+        self.value = None
+        self.expires_at = 0.0
+        self.retry_after = 0.0
+        self.used_at = now
+
+
+class HandleCache:
+    """Remote handles that expire (uploaded files, cached contents), one per key.
+
+    A handle is created on first use and again once it is within refresh_s of expiring;
+    concurrent requests for a key share a single create. After a failed create the key is not
+    tried again for retry_s. Keys unused for idle_s are forgotten, locks included, so the cache
+    does not grow with every API key ever seen."""
+
+    def __init__(self, refresh_s: float, retry_s: float, idle_s: float = 3600, max_entries: int | None = None,
+                 clock=time.time):
+        self.refresh_s = refresh_s
+        self.retry_s = retry_s
+        self.idle_s = idle_s
+        self.max_entries = max_entries
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._slots: dict[str, _Slot] = {}
+        self._next_sweep = 0.0
+
+    @staticmethod
+    def key(*parts: str) -> str:
+        # Keys are hashed so that API keys are never held here in clear
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._slots)
+
+    def get(self, key: str, create) -> tuple[object, bool] | None:
+        """(handle, reused) for key. create(current) makes a new handle and returns (handle,
+        expires_at); `current` is the handle being replaced while it is still valid (so it can be
+        extended), else None. Returns None while the key is in its retry window, or when the cache
+        holds max_entries handles and the key is new. An error from create is re-raised."""
+        now = self._clock()
+        with self._lock:
+            self._sweep(now)
+            slot = self._slots.get(key)
+            if slot is None:
+                if self.max_entries is not None and self._filled() >= self.max_entries:
+                    return None
+                slot = self._slots[key] = _Slot(now)
+            slot.used_at = now
+            if slot.value is None and slot.retry_after > now:
+                return None
+            if slot.value is not None and slot.expires_at - now > self.refresh_s:
+                return slot.value, True
+        with slot.lock:
+            now = self._clock()
+            with self._lock:
+                if slot.value is not None and slot.expires_at - now > self.refresh_s:
+                    return slot.value, True  # created by a concurrent request
+                if slot.value is None and slot.retry_after > now:
+                    return None  # a concurrent request just failed
+                current = slot.value if slot.value is not None and slot.expires_at > now else None
+            try:
+                value, expires_at = create(current)
+            except Exception:
+                with self._lock:
+                    slot.value = None
+                    slot.retry_after = self._clock() + self.retry_s
+                raise
+            with self._lock:
+                slot.value, slot.expires_at, slot.retry_after = value, expires_at, 0.0
+            return value, False
+
+    def invalidate(self, key: str) -> None:
+        """Forget the handle for key (e.g. the API no longer knows it); it is created on next use."""
+        with self._lock:
+            self._slots.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._slots.clear()
+
+    def _filled(self) -> int:
+        return sum(slot.value is not None for slot in self._slots.values())
+
+    def _sweep(self, now: float) -> None:
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + min(self.idle_s, 60)
+        for key, slot in list(self._slots.items()):
+            if now - slot.used_at > self.idle_s and not slot.lock.locked():
+                del self._slots[key]
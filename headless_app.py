@@ -0,0 +1,212 @@
+import inspect
+import json
+import os
+import threading
+import uuid
+from pathlib import Path
+
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+
+import cancellation
+import lineage_export
+import mb_app
+import metrics
+import output_store
+import panel_slices
+from output_store import output_url
+
+
+# When set (e.g. "/_protected_outputs/"), file requests are access-checked here and then
+# handed to nginx via X-Accel-Redirect, so the bytes are sent by nginx with sendfile.
+X_ACCEL_PREFIX = os.environ.get("MOODBOARD_X_ACCEL_PREFIX", "")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+# Same names and positional `data` contract as the Gradio endpoints the React app calls.
+API_ENDPOINTS = {
+    "generate_image": mb_app.generate_image,
+    "generate_image_progressive": mb_app.generate_image_progressive,
+    "edit_image_region": mb_app.edit_image_region,
+    "list_templates": mb_app.list_templates,
+    "get_panel_index": mb_app.get_panel_index,
+    "find_similar_moodboard": mb_app.find_similar_moodboard,
+    "find_similar_boards": mb_app.find_similar_boards,
+    "get_board_palette": mb_app.get_board_palette,
+    "find_boards_by_palette": mb_app.find_boards_by_palette,
+    "search_catalog": mb_app.search_catalog,
+    "cancel_session": mb_app.cancel_session,
+    "submit_job": mb_app.submit_job,
+    "get_job": mb_app.get_job,
+    "cancel_job": mb_app.cancel_job,
+}
+
+
+def _input_count(fn) -> int:
+    """Number of positional inputs an endpoint accepts (everything except the injected request)."""
+    return sum(1 for name in inspect.signature(fn).parameters if name != "request")
+
+
+def _file_data(path: str) -> dict:
+    """Describe an output file the way Gradio's FileData payload does."""
+    return {
+        "path": path,
+        "url": output_url(path) or f"/gradio_api/file={path}",
+        "orig_name": Path(path).name,
+        "meta": {"_type": "gradio.FileData"},
+    }
+
+
+def _serialize_outputs(outputs) -> list:
+    if not isinstance(outputs, (list, tuple)):
+        outputs = [outputs]
+    serialized = []
+    for value in outputs:
+        if isinstance(value, str) and value.startswith(str(mb_app.OUTPUT_DIR)):
+            serialized.append(_file_data(value))
+        else:
+            serialized.append(value)
+    return serialized
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def create_app() -> FastAPI:
+    """Build the lean HTTP app that serves the named endpoints without any UI components."""
+    app = FastAPI(title="Fashion Moodboard API", docs_url=None, redoc_url=None)
+    output_root = mb_app.OUTPUT_DIR.resolve()
+
+    @app.exception_handler(mb_app.AppError)
+    async def _app_error_handler(request: Request, exc: mb_app.AppError):
+        return JSONResponse({"error": str(exc)}, status_code=400)
+
+    @app.exception_handler(cancellation.RequestCancelled)
+    async def _cancelled_handler(request: Request, exc: cancellation.RequestCancelled):
+        # 499 "client closed request", as nginx logs it; usually nobody is left to read it
+        return JSONResponse({"error": str(exc), "reason": exc.reason}, status_code=499)
+
+    # Calls submitted via /gradio_api/call/{api_name}, waiting for their event stream to be opened
+    pending_calls: dict[str, tuple] = {}
+    pending_lock = threading.Lock()
+
+    def _endpoint_call(api_name: str, payload: dict):
+        fn = API_ENDPOINTS.get(api_name)
+        if fn is None:
+            raise HTTPException(status_code=404, detail=f"Unknown endpoint: {api_name}")
+        data = payload.get("data")
+        if not isinstance(data, list):
+            raise HTTPException(status_code=422, detail="Request body must contain a `data` list.")
+        expected = _input_count(fn)
+        if len(data) > expected:
+            raise HTTPException(
+                status_code=422,
+                detail=f"{api_name} takes at most {expected} inputs, got {len(data)}.",
+            )
+        return fn, data
+
+    @app.post("/gradio_api/api/{api_name}")
+    def call_endpoint(api_name: str, payload: dict, request: Request):
+        fn, data = _endpoint_call(api_name, payload)
+        outputs = fn(*data, request=request)
+        if inspect.isgenerator(outputs):
+            # Streaming endpoints answer a plain call with their final result
+            for outputs in outputs:
+                pass
+        return {"data": _serialize_outputs(outputs)}
+
+    @app.post("/gradio_api/call/{api_name}")
+    def submit_call(api_name: str, payload: dict):
+        fn, data = _endpoint_call(api_name, payload)
+        event_id = uuid.uuid4().hex
+        with pending_lock:
+            pending_calls[event_id] = (api_name, fn, data)
+        return {"event_id": event_id}
+
+    @app.get("/gradio_api/call/{api_name}/{event_id}")
+    def stream_call(api_name: str, event_id: str, request: Request):
+        """Server-sent events in Gradio's format: `generating` per intermediate output, then
+        `complete` with the final one (or `error`)."""
+        with pending_lock:
+            call = pending_calls.pop(event_id, None)
+        if call is None or call[0] != api_name:
+            raise HTTPException(status_code=404, detail="Unknown event id.")
+        _, fn, data = call
+
+        def events():
+            try:
+                outputs = fn(*data, request=request)
+                if not inspect.isgenerator(outputs):
+                    yield _sse("complete", _serialize_outputs(outputs))
+                    return
+                last = None
+                for last in outputs:
+                    yield _sse("generating", _serialize_outputs(last))
+                yield _sse("complete", _serialize_outputs(last))
+            except mb_app.AppError as e:
+                yield _sse("error", str(e))
+            except cancellation.RequestCancelled as e:
+                yield _sse("error", str(e))
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    def _serve_stored_file(file_path: str):
+        candidate = Path(file_path)
+        if not candidate.is_absolute():
+            candidate = output_root / candidate
+        candidate = candidate.resolve()
+        if not output_store.is_public(candidate):
+            # Same allow-list as the nginx locations: indexes, sidecars and the like stay private
+            raise HTTPException(status_code=404, detail="File not found.")
+        if not candidate.is_file() and panel_slices.ensure_slice(candidate) is None:
+            # Panel slices are written after save; one requested before that is cut now
+            raise HTTPException(status_code=404, detail="File not found.")
+        if X_ACCEL_PREFIX:
+            relative = candidate.relative_to(output_root).as_posix()
+            return Response(headers={"X-Accel-Redirect": f"{X_ACCEL_PREFIX.rstrip('/')}/{relative}"})
+        return FileResponse(candidate, headers={"Cache-Control": IMMUTABLE_CACHE_CONTROL})
+
+    @app.get("/gradio_api/file={file_path:path}")
+    def serve_output(file_path: str):
+        return _serve_stored_file(file_path)
+
+    @app.get("/outputs/{file_path:path}")
+    def serve_output_direct(file_path: str):
+        # Normally answered by nginx from disk; this covers running without the proxy.
+        return _serve_stored_file(file_path)
+
+    @app.get("/gradio_api/export/{image_name}")
+    def export_lineage(image_name: str, format: str = "zip", images: list[str] | None = Query(None)):
+        """Stream a board and all its edit versions (or the given `images`, in order) as a ZIP, or
+        as a PDF contact sheet. Nothing is buffered beyond one chunk or one sheet page."""
+        export_format = format.strip().lower()
+        if export_format not in lineage_export.EXPORT_FORMATS:
+            raise HTTPException(status_code=400, detail=f"Unknown format: {format}. Use zip or pdf.")
+        path = mb_app._stored_output_path(image_name)
+        if images:
+            entries = lineage_export.versions([mb_app._stored_output_path(image).name for image in images])
+        else:
+            entries = lineage_export.lineage(path.name)
+        filename = lineage_export.export_filename(path.name, export_format)
+        return StreamingResponse(
+            lineage_export.export_stream(entries, export_format),
+            media_type="application/zip" if export_format == "zip" else "application/pdf",
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        )
+
+    @app.get("/metrics")
+    def metrics_endpoint():
+        return PlainTextResponse(metrics.render_prometheus())
+
+    @app.get("/healthz")
+    def healthz():
+        return {"status": "ok", "headless": True}
+
+    return app
+
+
+def run(server_name: str = "0.0.0.0", server_port: int = 7860) -> None:
+    import uvicorn
+
+    uvicorn.run(create_app(), host=server_name, port=server_port, log_level="warning")
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import os
+import threading
+from collections import deque
+
+import metrics
+from structured_log import get_logger, log_event
+
+
+# Off by default: a hedge is a second, paid model call.
+HEDGE_ENABLED = os.environ.get("HEDGE_ENABLED", "0").strip().lower() in ("1", "true", "yes")
+# A generate call still running at this percentile of recent latencies gets a hedge.
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "95"))
+# Recent successful call latencies kept per model, and how many are needed before hedging.
+HEDGE_LATENCY_WINDOW = int(os.environ.get("HEDGE_LATENCY_WINDOW", "200"))
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", "20"))
+# Never hedge earlier than this, whatever the percentile says.
+HEDGE_MIN_DELAY_S = float(os.environ.get("HEDGE_MIN_DELAY_S", "2"))
+# At most this fraction of calls may be hedged (token bucket; a short burst is allowed).
+HEDGE_BUDGET_FRACTION = float(os.environ.get("HEDGE_BUDGET_FRACTION", "0.05"))
+HEDGE_BUDGET_BURST = float(os.environ.get("HEDGE_BUDGET_BURST", "3"))
+
+logger = get_logger("hedging")
+
+
+def latency_key(model_id: str, *variant) -> str:
+    """Tracker key for calls to model_id whose latency depends on `variant` (e.g. the image size),
+    so that slower and faster kinds of call are never compared against each other."""
+    return "/".join([model_id, *(str(part) for part in variant if part not in (None, ""))])
+
+
+class LatencyTracker:
+    """Sliding window of successful hedge-eligible (generate) call latencies per latency key."""
+
+    def __init__(self, window: int = HEDGE_LATENCY_WINDOW):
+        self._window = window
+        self._lock = threading.Lock()
+        self._samples: dict[str, deque] = {}
+
+    def record(self, model_id: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(model_id, deque(maxlen=self._window)).append(seconds)
+
+    def percentile(self, model_id: str, percentile: float, min_samples: int = 1) -> float | None:
+        with self._lock:
+            samples = sorted(self._samples.get(model_id, ()))
+        if len(samples) < max(min_samples, 1):
+            return None
+        rank = min(int(round(percentile / 100 * (len(samples) - 1))), len(samples) - 1)
+        return samples[rank]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._samples.clear()
+
+
+class HedgeBudget:
+    """Token bucket: every call earns `fraction` of a token and a hedge spends a whole one."""
+
+    def __init__(self, fraction: float = HEDGE_BUDGET_FRACTION, burst: float = HEDGE_BUDGET_BURST):
+        self.fraction = fraction
+        self.burst = burst
+        self._tokens = burst
+        self._lock = threading.Lock()
+
+    def record_call(self) -> None:
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.fraction)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+latencies = LatencyTracker()
+budget = HedgeBudget()
+
+
+def hedge_delay(key: str) -> float | None:
+    """Seconds to wait before hedging a call with this latency key, or None if it should not be hedged."""
+    if not HEDGE_ENABLED:
+        return None
+    threshold = latencies.percentile(key, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES)
+    return None if threshold is None else max(threshold, HEDGE_MIN_DELAY_S)
+
+
+async def _timed(key: str, coro):
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    result = await coro
+    latencies.record(key, loop.time() - started)
+    return result
+
+
+async def race(model_id: str, start_call, hedge: bool = True, key: str | None = None):
+    """Await start_call(); if it is still running after the hedge delay (and the budget allows),
+    issue an identical second call. The first successful attempt wins and the other is cancelled.
+    The delay comes from earlier calls with the same latency key (default: the model)."""
+    key = key or model_id
+    if hedge:
+        budget.record_call()
+    # Only hedge-eligible calls feed the tracker: edit calls would skew generate's percentile
+    primary = asyncio.ensure_future(_timed(key, start_call()) if hedge else start_call())
+    delay = hedge_delay(key) if hedge else None
+    tasks = {primary}
+    hedged = None
+    try:
+        if delay is not None:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                if budget.try_spend():
+                    hedged = asyncio.ensure_future(_timed(key, start_call()))
+                    tasks.add(hedged)
+                    metrics.inc("moodboard_hedged_calls_total", model=model_id)
+                    log_event(logger, logging.INFO, "hedge_issued", model=model_id, delay_s=round(delay, 3))
+                else:
+                    metrics.inc("moodboard_hedges_over_budget_total", model=model_id)
+        while True:
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            tasks = pending
+            winners = [task for task in done if task.exception() is None]
+            if winners:
+                if hedged in winners and primary not in winners:
+                    metrics.inc("moodboard_hedge_wins_total", model=model_id)
+                return winners[0].result()
+            if not tasks:
+                return done.pop().result()  # every attempt failed: raise the last error
+            # A failed attempt does not decide the race while another is still running
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,259 @@
+import hashlib
+import logging
+import os
+import threading
+from functools import lru_cache
+from itertools import combinations
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+import metrics
+from output_store import DATA_DIR, OUTPUT_DIR, AppendLog, save_output
+from structured_log import get_logger, log_event
+from tracing import span
+
+
+IMAGE_INDEX_ENABLED = os.environ.get("IMAGE_INDEX_ENABLED", "1").strip().lower() not in ("0", "false", "no")
+# Append-only log of every saved output's hashes, shared by all backend processes.
+IMAGE_INDEX_FILE = Path(os.environ.get("IMAGE_INDEX_FILE") or DATA_DIR / "image_hashes.jsonl")
+# Outputs with exactly the same pixels as an earlier one are hard-linked to it instead of re-encoded.
+IMAGE_DEDUP_ENABLED = os.environ.get("IMAGE_DEDUP_ENABLED", "1").strip().lower() not in ("0", "false", "no")
+# Boards whose 64-bit pHash and dHash both differ in at most this many bits count as similar.
+SIMILAR_BOARD_MAX_DISTANCE = int(os.environ.get("SIMILAR_BOARD_MAX_DISTANCE", "10"))
+# Multi-index hashing: the 64-bit hash is split into this many 16-bit chunks, one table each.
+HASH_CHUNKS = 4
+CHUNK_BITS = 64 // HASH_CHUNKS
+
+logger = get_logger("image_index")
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * x + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+_DCT32 = _dct_matrix(32)
+_BIT_WEIGHTS = np.uint64(1) << np.arange(63, -1, -1, dtype=np.uint64)
+
+
+def _pack(bits: np.ndarray) -> np.ndarray:
+    """Pack the last axis of 64 booleans into uint64 (first bit most significant)."""
+    return (bits.astype(np.uint64) * _BIT_WEIGHTS).sum(axis=-1, dtype=np.uint64)
+
+
+def _gray(image, size: tuple[int, int]) -> np.ndarray:
+    return np.asarray(image.convert("L").resize(size, Image.Resampling.BOX), dtype=np.float32)
+
+
+def phash_many(grays: np.ndarray) -> np.ndarray:
+    """pHash of a batch of 32x32 grayscale arrays (shape [n, 32, 32]): the signs of the 8x8
+    lowest DCT frequencies against their median (DC term excluded)."""
+    coefficients = _DCT32 @ grays @ _DCT32.T
+    low = coefficients[:, :8, :8].reshape(len(grays), 64)
+    median = np.median(low[:, 1:], axis=1, keepdims=True)
+    return _pack(low > median)
+
+
+def dhash_many(grays: np.ndarray) -> np.ndarray:
+    """dHash of a batch of 8x9 grayscale arrays (shape [n, 8, 9]): horizontal gradient signs."""
+    return _pack((grays[:, :, 1:] > grays[:, :, :-1]).reshape(len(grays), 64))
+
+
+def phash(image) -> int:
+    return int(phash_many(_gray(image, (32, 32))[None])[0])
+
+
+def dhash(image) -> int:
+    return int(dhash_many(_gray(image, (9, 8))[None])[0])
+
+
+def content_digest(image) -> str:
+    """Digest of the decoded pixels: equal digests mean identical images, however they were encoded."""
+    digest = hashlib.sha256(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+_POPCOUNT8 = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def _popcount(values: np.ndarray) -> np.ndarray:
+    """Set bits of each uint64, by table lookup over its bytes (np.bitwise_count needs numpy 2)."""
+    as_bytes = np.ascontiguousarray(values).reshape(-1).view(np.uint8).reshape(*values.shape, 8)
+    return _POPCOUNT8[as_bytes].sum(axis=-1, dtype=np.uint8)
+
+
+def hamming(a, b) -> np.ndarray:
+    distance = np.bitwise_xor(np.asarray(a, dtype=np.uint64), np.uint64(b))
+    return np.bitwise_count(distance) if hasattr(np, "bitwise_count") else _popcount(distance)
+
+
+@lru_cache(maxsize=None)
+def _flip_masks(radius: int) -> tuple[int, ...]:
+    """XOR masks turning a CHUNK_BITS-bit value into every value within `radius` bit flips."""
+    masks = [0]
+    for flips in range(1, radius + 1):
+        for bits in combinations(range(CHUNK_BITS), flips):
+            masks.append(sum(1 << bit for bit in bits))
+    return tuple(masks)
+
+
+class HashIndex:
+    """Multi-index hash table over 64-bit perceptual hashes.
+
+    Each hash is split into HASH_CHUNKS chunks, each with its own table. Two hashes within
+    distance d agree to within d // HASH_CHUNKS bits on at least one chunk (pigeonhole), so a
+    query only probes the chunk values that close to its own and verifies the few candidates
+    with a vectorized popcount, instead of scanning every hash."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._phashes = np.empty(1024, dtype=np.uint64)
+        self._dhashes = np.empty(1024, dtype=np.uint64)
+        self._count = 0
+        self._tables: list[dict[int, list[int]]] = [{} for _ in range(HASH_CHUNKS)]
+
+    def __len__(self) -> int:
+        return self._count
+
+    @staticmethod
+    def _chunks(value: int) -> list[int]:
+        mask = (1 << CHUNK_BITS) - 1
+        return [(value >> (CHUNK_BITS * i)) & mask for i in range(HASH_CHUNKS)]
+
+    def add(self, phash_value: int, dhash_value: int) -> int:
+        with self._lock:
+            entry_id = self._count
+            if entry_id == len(self._phashes):
+                self._phashes = np.concatenate([self._phashes, np.empty_like(self._phashes)])
+                self._dhashes = np.concatenate([self._dhashes, np.empty_like(self._dhashes)])
+            self._phashes[entry_id] = phash_value
+            self._dhashes[entry_id] = dhash_value
+            for table, chunk in zip(self._tables, self._chunks(phash_value)):
+                table.setdefault(chunk, []).append(entry_id)
+            self._count += 1
+            return entry_id
+
+    def get(self, entry_id: int) -> tuple[int, int]:
+        with self._lock:
+            return int(self._phashes[entry_id]), int(self._dhashes[entry_id])
+
+    def query(self, phash_value: int, dhash_value: int, max_distance: int) -> list[tuple[int, int]]:
+        """(entry id, distance) of every entry within max_distance, nearest first. The distance
+        is the larger of the pHash and dHash distances."""
+        masks = _flip_masks(max_distance // HASH_CHUNKS)
+        candidates = set()
+        with self._lock:
+            for table, chunk in zip(self._tables, self._chunks(phash_value)):
+                get = table.get
+                for mask in masks:
+                    found = get(chunk ^ mask)
+                    if found:
+                        candidates.update(found)
+            if not candidates:
+                return []
+            ids = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+            distance = np.maximum(hamming(self._phashes[ids], phash_value), hamming(self._dhashes[ids], dhash_value))
+        keep = distance <= max_distance
+        ids, distance = ids[keep], distance[keep]
+        order = np.lexsort((-ids, distance))  # nearest first, newest first among equals
+        return [(int(ids[i]), int(distance[i])) for i in order]
+
+
+class ImageIndex:
+    """Hashes of every saved output: pixel digests for dedup, perceptual hashes for
+    similar-board queries. Backed by an append-only log shared by all workers."""
+
+    def __init__(self, path: Path = IMAGE_INDEX_FILE):
+        self.log = AppendLog(path)
+        self.hashes = HashIndex()
+        self._names: list[str] = []
+        self._by_name: dict[str, int] = {}
+        self._by_digest: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _sync(self) -> None:
+        with self._lock:  # entry ids and names must be added in the same order
+            for entry in self.log.read_new():
+                try:
+                    entry_id = self.hashes.add(int(entry["phash"], 16), int(entry["dhash"], 16))
+                except (KeyError, ValueError):
+                    continue
+                self._names.append(entry["name"])
+                self._by_name[entry["name"]] = entry_id
+                self._by_digest[entry["digest"]] = entry["name"]
+
+    @staticmethod
+    def describe(image) -> dict:
+        return {"phash": f"{phash(image):016x}", "dhash": f"{dhash(image):016x}", "digest": content_digest(image)}
+
+    def record(self, path: Path, hashes: dict) -> None:
+        self.log.append({"name": Path(path).name, **hashes})
+        self._sync()
+
+    def identical(self, digest: str) -> Path | None:
+        """An existing output with exactly these pixels, if one is still in the store."""
+        self._sync()
+        with self._lock:
+            name = self._by_digest.get(digest)
+        if name is None or not (OUTPUT_DIR / name).is_file():
+            return None
+        return OUTPUT_DIR / name
+
+    def hashes_of(self, name: str) -> tuple[int, int] | None:
+        self._sync()
+        with self._lock:
+            entry_id = self._by_name.get(name)
+        return None if entry_id is None else self.hashes.get(entry_id)
+
+    def similar(self, phash_value: int, dhash_value: int, max_distance: int = SIMILAR_BOARD_MAX_DISTANCE,
+                limit: int = 8, exclude: str | None = None) -> list[dict]:
+        self._sync()
+        matches, seen = [], set()
+        for entry_id, distance in self.hashes.query(phash_value, dhash_value, max_distance):
+            with self._lock:
+                name = self._names[entry_id]
+            if name == exclude or name in seen or not (OUTPUT_DIR / name).is_file():
+                continue
+            seen.add(name)
+            matches.append({"name": name, "distance": distance})
+            if len(matches) >= limit:
+                break
+        return matches
+
+
+_index_lock = threading.Lock()
+_index: ImageIndex | None = None
+
+
+def index() -> ImageIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = ImageIndex()
+        return _index
+
+
+def save_image(pil_image, prefix: str) -> Path:
+    """save_output, plus hashing the image into the index. An output whose pixels match an
+    earlier one is stored as a hard link to it (store once, reference many)."""
+    if not IMAGE_INDEX_ENABLED:
+        return save_output(pil_image, prefix)
+    with span("hash_image"):
+        hashes = ImageIndex.describe(pil_image)
+    image_index = index()
+    same_as = image_index.identical(hashes["digest"]) if IMAGE_DEDUP_ENABLED else None
+    output_path = save_output(pil_image, prefix, same_as=same_as)
+    if same_as is not None:
+        metrics.inc("moodboard_outputs_deduplicated_total")
+        log_event(logger, logging.INFO, "output_deduplicated", output=output_path.name, same_as=same_as.name)
+    try:
+        image_index.record(output_path, hashes)
+    except OSError as e:
+        log_event(logger, logging.WARNING, "image_index_write_failed", output=output_path.name, error=str(e))
+    return output_path
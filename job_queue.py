@@ -0,0 +1,405 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import metrics
+from cancellation import SESSION_HEADER
+from output_store import DATA_DIR
+from structured_log import get_logger, log_event
+
+
+# Shared by every backend process (it lives in the shared data directory by default).
+JOB_QUEUE_DB = Path(os.environ.get("JOB_QUEUE_DB") or DATA_DIR / "jobs.sqlite3")
+# Jobs run concurrently per process; 0 makes a process submit-only (run workers with `python job_queue.py`).
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+# A running job is owned by its worker for this long and renewed while it runs; jobs whose
+# lease ran out (their process died or was redeployed) are picked up again.
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "30"))
+# A job interrupted this many times is failed instead of being run again.
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+JOB_POLL_INTERVAL_MS = int(os.environ.get("JOB_POLL_INTERVAL_MS", "500"))
+# Finished jobs are kept this long for clients to collect their result.
+JOB_RETENTION_HOURS = float(os.environ.get("JOB_RETENTION_HOURS", "24"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+# Jobs holding private arguments (a user's API key) are pinned to the process they were
+# submitted to: those arguments stay in its memory and are never written to the store.
+PROCESS_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+_private_lock = threading.Lock()
+_private_args: dict[str, dict[int, object]] = {}  # job id -> {position: value}
+
+logger = get_logger("job_queue")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    endpoint TEXT NOT NULL,
+    data TEXT,
+    correlation_id TEXT,
+    session TEXT,
+    pinned_to TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    lease_until REAL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_session ON jobs (session, status);
+"""
+
+
+class JobStore:
+    """SQLite-backed job table. Every state change is a single guarded UPDATE, so several
+    processes can share the file; each thread keeps its own connection."""
+
+    def __init__(self, path: Path = JOB_QUEUE_DB, clock=time.time):
+        self.path = Path(path)
+        self._clock = clock
+        self._local = threading.local()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as db:
+            db.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA busy_timeout=10000")
+            self._local.db = db
+        return db
+
+    def submit(self, endpoint: str, data: list, correlation_id: str | None = None,
+               pinned_to: str | None = None, session: str | None = None) -> str:
+        """Queue a job. A job pinned to a process is only claimed by that process's workers, and
+        is leased to it while queued so other processes can tell once it stopped. `session` is
+        the client session it was submitted from (see cancel_session)."""
+        job_id = uuid.uuid4().hex
+        now = self._clock()
+        self._connect().execute(
+            "INSERT INTO jobs (id, endpoint, data, correlation_id, session, pinned_to, status, lease_until, "
+            "created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, endpoint, json.dumps(data), correlation_id, session, pinned_to, QUEUED,
+             now + JOB_LEASE_SECONDS if pinned_to else None, now),
+        )
+        return job_id
+
+    def claim(self, owner: str, process_id: str = PROCESS_ID) -> sqlite3.Row | None:
+        """Take the oldest runnable job: queued, or running under a lease that ran out."""
+        now = self._clock()
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            # Jobs that keep dying with their worker are given up on
+            db.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ?, owner = NULL, data = NULL "
+                "WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                (FAILED, "The job was interrupted too many times.", now, RUNNING, now, JOB_MAX_ATTEMPTS),
+            )
+            # ...and so are pinned jobs whose process stopped: their private arguments went with it
+            db.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ?, owner = NULL, data = NULL "
+                "WHERE status IN (?, ?) AND pinned_to IS NOT NULL AND pinned_to != ? AND lease_until < ?",
+                (FAILED, "The server holding this job stopped before it finished. Please submit it again.",
+                 now, QUEUED, RUNNING, process_id, now),
+            )
+            row = db.execute(
+                "SELECT id FROM jobs WHERE (status = ? OR (status = ? AND lease_until < ?)) "
+                "AND (pinned_to IS NULL OR pinned_to = ?) ORDER BY created_at LIMIT 1",
+                (QUEUED, RUNNING, now, process_id),
+            ).fetchone()
+            if row is None:
+                db.execute("COMMIT")
+                return None
+            job = db.execute(
+                "UPDATE jobs SET status = ?, owner = ?, lease_until = ?, attempts = attempts + 1, "
+                "started_at = COALESCE(started_at, ?) WHERE id = ? RETURNING *",
+                (RUNNING, owner, now + JOB_LEASE_SECONDS, now, row["id"]),
+            ).fetchone()
+            db.execute("COMMIT")
+            return job
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def renew(self, job_ids: list[str], owner: str) -> None:
+        if job_ids:
+            self._connect().executemany(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND owner = ? AND status = ?",
+                [(self._clock() + JOB_LEASE_SECONDS, job_id, owner, RUNNING) for job_id in job_ids],
+            )
+
+    def renew_pinned(self, process_id: str = PROCESS_ID) -> None:
+        """Extend the lease on the queued jobs pinned to a process that is still alive."""
+        self._connect().execute(
+            "UPDATE jobs SET lease_until = ? WHERE pinned_to = ? AND status = ?",
+            (self._clock() + JOB_LEASE_SECONDS, process_id, QUEUED),
+        )
+
+    def finish(self, job_id: str, owner: str, status: str, result=None, error: str | None = None) -> bool:
+        """Record a job's outcome; False if the job is no longer this worker's (cancelled or re-leased)."""
+        cursor = self._connect().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, owner = NULL, lease_until = NULL, "
+            "data = NULL WHERE id = ? AND owner = ? AND status = ?",
+            (status, None if result is None else json.dumps(result), error, self._clock(), job_id, owner, RUNNING),
+        )
+        return cursor.rowcount == 1
+
+    def cancel(self, job_id: str) -> bool:
+        cursor = self._connect().execute(
+            "UPDATE jobs SET status = ?, finished_at = ?, owner = NULL, lease_until = NULL, data = NULL "
+            "WHERE id = ? AND status IN (?, ?)",
+            (CANCELLED, self._clock(), job_id, QUEUED, RUNNING),
+        )
+        return cursor.rowcount == 1
+
+    def cancel_session(self, session: str, endpoint: str | None = None) -> int:
+        """Cancel a client session's queued and running jobs (only those for `endpoint`, if given);
+        running ones are abandoned by their workers. Returns how many were cancelled."""
+        query = ("UPDATE jobs SET status = ?, finished_at = ?, owner = NULL, lease_until = NULL, data = NULL "
+                 "WHERE session = ? AND status IN (?, ?)")
+        params = [CANCELLED, self._clock(), session, QUEUED, RUNNING]
+        if endpoint is not None:
+            query += " AND endpoint = ?"
+            params.append(endpoint)
+        return self._connect().execute(query, params).rowcount
+
+    def owns(self, job_id: str, owner: str) -> bool:
+        row = self._connect().execute(
+            "SELECT 1 FROM jobs WHERE id = ? AND owner = ? AND status = ?", (job_id, owner, RUNNING)
+        ).fetchone()
+        return row is not None
+
+    def status(self, job_id: str) -> str | None:
+        row = self._connect().execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row["status"] if row else None
+
+    def get(self, job_id: str) -> dict | None:
+        db = self._connect()
+        row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = {
+            "job_id": row["id"],
+            "endpoint": row["endpoint"],
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "data": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+        }
+        if row["status"] == QUEUED:
+            job["position"] = db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at < ?", (QUEUED, row["created_at"])
+            ).fetchone()[0]
+        return job
+
+    def prune(self) -> int:
+        cutoff = self._clock() - JOB_RETENTION_HOURS * 3600
+        cursor = self._connect().execute(
+            f"DELETE FROM jobs WHERE status IN ({', '.join('?' * len(FINISHED))}) AND finished_at < ?",
+            (*FINISHED, cutoff),
+        )
+        return cursor.rowcount
+
+
+class JobRequest:
+    """Stands in for the HTTP request a job was submitted with: it carries the correlation ID and
+    client session, and reports the job as abandoned once it is cancelled or no longer leased to
+    its worker."""
+
+    def __init__(self, store: JobStore, job: sqlite3.Row, owner: str):
+        self.job_id = job["id"]
+        self.headers = {"x-request-id": job["correlation_id"] or job["id"]}
+        if job["session"]:
+            self.headers[SESSION_HEADER] = job["session"]
+        self._store = store
+        self._owner = owner
+
+    def is_abandoned(self) -> bool:
+        return not self._store.owns(self.job_id, self._owner)
+
+
+class WorkerPool:
+    """Runs jobs from the store with bounded concurrency. `handlers` maps endpoint names to the
+    functions serving them; each is called as handler(*data, request=JobRequest)."""
+
+    def __init__(self, store: JobStore, handlers: dict, workers: int = JOB_WORKERS):
+        self.store = store
+        self.handlers = handlers
+        self.workers = workers
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._stop = threading.Event()
+        self._running: set[str] = set()
+        self._running_lock = threading.Lock()
+        self._threads: list[threading.Thread] = []
+
+    def start(self) -> "WorkerPool":
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if self.workers:
+            thread = threading.Thread(target=self._keep_leases, name="job-leases", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+            log_event(logger, logging.INFO, "job_workers_started", owner=self.owner, workers=self.workers)
+        return self
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _keep_leases(self) -> None:
+        while not self._stop.wait(JOB_LEASE_SECONDS / 3):
+            with self._running_lock:
+                running = list(self._running)
+            try:
+                self.store.renew(running, self.owner)
+                self.store.renew_pinned()
+                _forget_private(self.store)
+                self.store.prune()
+            except sqlite3.Error as e:
+                log_event(logger, logging.WARNING, "job_lease_renewal_failed", error=str(e))
+
+    def _work(self) -> None:
+        while not self._stop.is_set():
+            try:
+                job = self.store.claim(self.owner)
+            except sqlite3.Error as e:
+                log_event(logger, logging.WARNING, "job_claim_failed", error=str(e))
+                job = None
+            if job is None:
+                self._stop.wait(JOB_POLL_INTERVAL_MS / 1000)
+                continue
+            with self._running_lock:
+                self._running.add(job["id"])
+            try:
+                self._run(job)
+            finally:
+                with self._running_lock:
+                    self._running.discard(job["id"])
+
+    def _run(self, job: sqlite3.Row) -> None:
+        from cancellation import RequestCancelled
+
+        endpoint = job["endpoint"]
+        handler = self.handlers.get(endpoint)
+        started = time.perf_counter()
+        log_event(logger, logging.INFO, "job_started", job_id=job["id"], endpoint=endpoint, attempt=job["attempts"])
+        if handler is None:
+            self.store.finish(job["id"], self.owner, FAILED, error=f"Unknown endpoint: {endpoint}")
+            return
+        args = json.loads(job["data"])
+        if job["pinned_to"]:
+            with _private_lock:
+                private = _private_args.get(job["id"])
+            if private is None:
+                self.store.finish(job["id"], self.owner, FAILED,
+                                  error="The server holding this job restarted before it ran. Please submit it again.")
+                return
+            args += [None] * (max(private) + 1 - len(args))
+            for index, value in private.items():
+                args[index] = value
+        try:
+            outputs = handler(*args, request=JobRequest(self.store, job, self.owner))
+        except Exception as e:
+            if isinstance(e, RequestCancelled) or self.store.status(job["id"]) == CANCELLED:
+                status, error = CANCELLED, None
+            else:
+                status, error = FAILED, str(e) or type(e).__name__
+            result = None
+        else:
+            status, error = SUCCEEDED, None
+            result = list(outputs) if isinstance(outputs, (list, tuple)) else [outputs]
+        recorded = self.store.finish(job["id"], self.owner, status, result, error)
+        with _private_lock:
+            _private_args.pop(job["id"], None)
+        metrics.inc("moodboard_jobs_total", endpoint=endpoint, status=status)
+        log_event(
+            logger, logging.INFO if status != FAILED else logging.WARNING, "job_finished",
+            job_id=job["id"], endpoint=endpoint, status=status if recorded else "superseded",
+            seconds=round(time.perf_counter() - started, 3), error=error,
+        )
+
+
+_store_lock = threading.Lock()
+_store: JobStore | None = None
+_pool: WorkerPool | None = None
+
+
+def store() -> JobStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = JobStore()
+        return _store
+
+
+def has_local_workers() -> bool:
+    """Whether this process runs job workers (and so can take jobs with private arguments)."""
+    return _pool is not None
+
+
+def submit(endpoint: str, data: list, correlation_id: str | None = None, private: dict[int, object] | None = None,
+           session: str | None = None) -> str:
+    """Queue a job on the shared store. Arguments at the `private` positions (e.g. a user's API
+    key) are left out of the stored data: they are kept in this process's memory and the job is
+    pinned to this process's workers, so it needs has_local_workers()."""
+    if not private:
+        return store().submit(endpoint, data, correlation_id, session=session)
+    stored = [None if index in private else value for index, value in enumerate(data)]
+    # Held while inserting so a worker cannot claim the job before its arguments are in place
+    with _private_lock:
+        job_id = store().submit(endpoint, stored, correlation_id, pinned_to=PROCESS_ID, session=session)
+        _private_args[job_id] = dict(private)
+    return job_id
+
+
+def _forget_private(job_store: JobStore) -> None:
+    """Drop the private arguments of jobs that ended without running here (e.g. cancelled)."""
+    with _private_lock:
+        held = list(_private_args)
+    for job_id in held:
+        if job_store.status(job_id) not in (QUEUED, RUNNING):
+            with _private_lock:
+                _private_args.pop(job_id, None)
+
+
+def start_workers(handlers: dict, workers: int = JOB_WORKERS) -> WorkerPool | None:
+    """Start this process's workers once; queued and interrupted jobs are picked up right away."""
+    global _pool
+    if workers <= 0:
+        return None
+    job_store = store()
+    with _store_lock:
+        if _pool is None:
+            _pool = WorkerPool(job_store, handlers, workers).start()
+        return _pool
+
+
+if __name__ == "__main__":
+    # Standalone worker process, scaled independently of the HTTP backends
+    os.environ.setdefault("MOODBOARD_HEADLESS", "1")
+    import mb_app
+
+    start_workers(mb_app.JOB_HANDLERS, max(JOB_WORKERS, 1))
+    threading.Event().wait()
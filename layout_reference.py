@@ -0,0 +1,169 @@
+import hashlib
+import logging
+import mimetypes
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+import metrics
+from handle_cache import HandleCache
+from structured_log import get_logger, log_event
+
+
+# The generate template asks the model to follow "the 2x4 grid structure shown in the attached
+# image". When this file exists it is uploaded once per API key through the Files API and every
+# single-board generation attaches it by handle instead of inlining its bytes.
+LAYOUT_REFERENCE_IMAGE = Path(
+    os.environ.get("LAYOUT_REFERENCE_IMAGE")
+    or Path(__file__).parent / "prompt_templates" / "layout_reference.png"
+)
+LAYOUT_REFERENCE_ENABLED = os.environ.get("LAYOUT_REFERENCE_ENABLED", "1").strip().lower() not in ("0", "false", "no")
+# Uploaded files expire after 48 hours; a handle this close to expiring is replaced before use.
+LAYOUT_REFERENCE_REFRESH_S = float(os.environ.get("LAYOUT_REFERENCE_REFRESH_S", "3600"))
+# After a failed upload, generations go ahead without the reference for this long before retrying.
+LAYOUT_REFERENCE_RETRY_S = float(os.environ.get("LAYOUT_REFERENCE_RETRY_S", "300"))
+# Assumed lifetime of an upload whose expiration time the API does not report.
+FILE_TTL_S = 48 * 3600
+
+logger = get_logger("layout_reference")
+
+
+def _expires_at(handle) -> float:
+    expiration = getattr(handle, "expiration_time", None)
+    if isinstance(expiration, datetime):
+        if expiration.tzinfo is None:
+            expiration = expiration.replace(tzinfo=timezone.utc)
+        return expiration.timestamp()
+    return time.time() + FILE_TTL_S
+
+
+class LocalFiles:
+    """In-memory stand-in for client.files (upload / get / delete), for tests and offline runs.
+    Uploads expire after ttl_s, like real ones do after 48 hours."""
+
+    def __init__(self, ttl_s: float = FILE_TTL_S):
+        self.ttl_s = ttl_s
+        self.uploads = 0
+        self._files: dict[str, SimpleNamespace] = {}
+        self._lock = threading.Lock()
+
+    def upload(self, file, config=None):
+        config = config or {}
+        data = Path(file).read_bytes()
+        with self._lock:
+            self.uploads += 1
+            name = f"files/local-{self.uploads}"
+            handle = SimpleNamespace(
+                name=name,
+                uri=f"local://{name}",
+                mime_type=config.get("mime_type") or mimetypes.guess_type(str(file))[0],
+                display_name=config.get("display_name"),
+                size_bytes=len(data),
+                expiration_time=datetime.fromtimestamp(time.time() + self.ttl_s, timezone.utc),
+            )
+            self._files[name] = handle
+        return handle
+
+    def get(self, name):
+        with self._lock:
+            handle = self._files.get(name)
+        if handle is None or _expires_at(handle) <= time.time():
+            raise FileNotFoundError(name)
+        return handle
+
+    def delete(self, name):
+        with self._lock:
+            self._files.pop(name, None)
+
+
+class ReferenceFiles:
+    """Uploaded layout reference per API key, re-uploaded when the image changes or the handle
+    nears expiry. Concurrent requests for the same key share a single upload."""
+
+    def __init__(self, path: str | Path = LAYOUT_REFERENCE_IMAGE, refresh_s: float = LAYOUT_REFERENCE_REFRESH_S,
+                 retry_s: float = LAYOUT_REFERENCE_RETRY_S):
+        self.path = Path(path)
+        self._handles = HandleCache(refresh_s, retry_s)
+        self._digest: tuple[float, str] | None = None
+
+    def available(self) -> bool:
+        return LAYOUT_REFERENCE_ENABLED and self.path.is_file()
+
+    def _image_digest(self) -> str:
+        mtime = self.path.stat().st_mtime
+        if self._digest is None or self._digest[0] != mtime:
+            self._digest = (mtime, hashlib.sha256(self.path.read_bytes()).hexdigest())
+        return self._digest[1]
+
+    def _key(self, api_key: str) -> str:
+        return HandleCache.key(api_key, self._image_digest())
+
+    def handle(self, client, api_key: str):
+        """The uploaded file for api_key, uploading it first when missing or about to expire;
+        None for a while after an upload failed."""
+        found = self._handles.get(self._key(api_key), lambda current: self._upload(client, current))
+        if found is None:
+            return None
+        handle, reused = found
+        if reused:
+            metrics.inc("moodboard_layout_reference_hits_total")
+        return handle
+
+    def _upload(self, client, current) -> tuple[object, float]:
+        started = time.perf_counter()
+        handle = client.files.upload(
+            file=str(self.path),
+            config={
+                "mime_type": mimetypes.guess_type(self.path.name)[0] or "image/png",
+                "display_name": f"moodboard-layout-{self._image_digest()[:12]}",
+            },
+        )
+        expires_at = _expires_at(handle)
+        metrics.inc("moodboard_layout_reference_uploads_total")
+        log_event(
+            logger, logging.INFO, "layout_reference_uploaded",
+            file=getattr(handle, "name", None), refreshed=current is not None,
+            expires_in_s=round(expires_at - time.time()), upload_ms=round((time.perf_counter() - started) * 1000, 1),
+        )
+        return handle, expires_at
+
+    def part(self, client, api_key: str):
+        """A file-handle Part to put before the prompt, or None when no reference is configured
+        or the upload failed (the generation then goes ahead on the text prompt alone)."""
+        from google.genai import types
+
+        if not self.available():
+            return None
+        try:
+            handle = self.handle(client, api_key)
+        except Exception as e:
+            metrics.inc("moodboard_layout_reference_failures_total")
+            log_event(logger, logging.WARNING, "layout_reference_upload_failed", error=str(e))
+            return None
+        if handle is None:
+            return None
+        return types.Part.from_uri(file_uri=handle.uri, mime_type=handle.mime_type)
+
+    def invalidate(self, api_key: str) -> None:
+        """Forget the upload for api_key (e.g. the API no longer knows the file)."""
+        if not self.available():
+            return
+        self._handles.invalidate(self._key(api_key))
+
+    def clear(self) -> None:
+        self._handles.clear()
+
+
+_references: ReferenceFiles | None = None
+_references_lock = threading.Lock()
+
+
+def references() -> ReferenceFiles:
+    global _references
+    with _references_lock:
+        if _references is None:
+            _references = ReferenceFiles()
+        return _references
@@ -0,0 +1,286 @@
+import io
+import json
+import logging
+import os
+import time
+import zipfile
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator
+
+from PIL import Image, ImageDraw, ImageFont
+
+import metrics
+from output_store import OUTPUT_DIR
+from structured_log import get_logger, log_event
+
+
+# Files are streamed into the archive in chunks of this size, so memory stays flat however
+# many versions a lineage has.
+EXPORT_CHUNK_SIZE = int(os.environ.get("EXPORT_CHUNK_SIZE", str(256 * 1024)))
+# Longest side of the cached thumbnails used by contact sheets.
+THUMBNAIL_SIZE = int(os.environ.get("THUMBNAIL_SIZE", "512"))
+THUMBNAIL_KIND = "thumb"
+EXPORT_FORMATS = ("zip", "pdf")
+# Contact sheets are A4 landscape (in PDF points), rendered at SHEET_DPI with a grid of versions per page.
+SHEET_PAGE_POINTS = (842, 595)
+SHEET_DPI = 150
+SHEET_GRID = (3, 2)
+SHEET_JPEG_QUALITY = 85
+# TrueType font for sheet captions; Pillow's built-in font has no accented glyphs.
+SHEET_FONT = os.environ.get("SHEET_FONT", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf")
+
+logger = get_logger("lineage_export")
+
+
+def thumbnail_path(path: str | Path) -> Path:
+    path = Path(path)
+    return path.with_name(f"{path.stem}.{THUMBNAIL_KIND}.jpg")
+
+
+def make_thumbnail(path: str | Path) -> Path:
+    """Write an output's thumbnail next to it (atomically, like every other sidecar)."""
+    path = Path(path)
+    target = thumbnail_path(path)
+    tmp_path = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+    try:
+        with Image.open(path) as image:
+            image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.Resampling.LANCZOS)
+            image.convert("RGB").save(tmp_path, format="JPEG", quality=88)
+        os.replace(tmp_path, target)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    if not path.is_file():  # deleted while we worked on it: leave no orphaned thumbnail behind
+        target.unlink(missing_ok=True)
+    return target
+
+
+def open_thumbnail(path: str | Path) -> Image.Image:
+    """An output's thumbnail: the cached one when present, otherwise made (and cached) now."""
+    cached = thumbnail_path(path)
+    if not cached.is_file():
+        try:
+            make_thumbnail(path)
+        except OSError as e:  # e.g. a read-only store: just scale the original
+            log_event(logger, logging.WARNING, "thumbnail_write_failed", output=Path(path).name, error=str(e))
+            with Image.open(path) as image:
+                image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.Resampling.LANCZOS)
+                return image.convert("RGB")
+    with Image.open(cached) as image:
+        return image.convert("RGB")
+
+
+def lineage(output_id: str) -> list[dict]:
+    """The versions of a board, oldest first, from the catalog. A board the catalog does not know
+    (or with the catalog disabled) is exported on its own."""
+    import catalog
+
+    entries = catalog.catalog().lineage(output_id) if catalog.CATALOG_ENABLED else []
+    if entries and entries[0].get("parent") and (OUTPUT_DIR / entries[0]["parent"]).is_file():
+        # The root was saved before the catalog existed
+        entries.insert(0, {"output_id": entries[0]["parent"]})
+    entries = [entry for entry in entries if (OUTPUT_DIR / entry["output_id"]).is_file()]
+    return entries or [{"output_id": output_id}]
+
+
+def versions(output_ids: list[str]) -> list[dict]:
+    """Catalog entries for an explicit list of versions (e.g. a client's history), in the given order."""
+    import catalog
+
+    entries = []
+    for output_id in output_ids:
+        entry = catalog.catalog().get(output_id) if catalog.CATALOG_ENABLED else None
+        entries.append(entry or {"output_id": output_id})
+    return entries
+
+
+def _manifest(entries: list[dict]) -> list[dict]:
+    fields = ("kind", "subject", "edit_request", "bbox", "parent", "model", "served_model", "latency_profile")
+    manifest = []
+    for number, entry in enumerate(entries, start=1):
+        item = {"version": number, "file": _archive_name(number, entry["output_id"])}
+        item.update({field: entry[field] for field in fields if entry.get(field) is not None})
+        if entry.get("created_at"):
+            item["created_at"] = datetime.fromtimestamp(entry["created_at"]).isoformat(timespec="seconds")
+        manifest.append(item)
+    return manifest
+
+
+def _archive_name(number: int, output_id: str) -> str:
+    return f"{number:03d}_{output_id}"
+
+
+class _Sink(io.RawIOBase):
+    """Write-only, unseekable file collecting bytes until the stream hands them on. zipfile
+    writes data descriptors instead of seeking back when it cannot seek."""
+
+    def __init__(self):
+        self._chunks = []
+        self.written = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self.written += len(data)
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def zip_stream(entries: list[dict]) -> Iterator[bytes]:
+    """A ZIP of every version (stored as-is: PNGs do not compress further) plus a lineage.json
+    manifest, produced chunk by chunk."""
+    sink = _Sink()
+    started = time.perf_counter()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as archive:
+        for number, entry in enumerate(entries, start=1):
+            path = OUTPUT_DIR / entry["output_id"]
+            stat = path.stat()
+            info = zipfile.ZipInfo(_archive_name(number, path.name), date_time=time.localtime(stat.st_mtime)[:6])
+            info.file_size = stat.st_size
+            with open(path, "rb") as source, archive.open(info, "w") as target:
+                while chunk := source.read(EXPORT_CHUNK_SIZE):
+                    target.write(chunk)
+                    yield sink.drain()
+        archive.writestr("lineage.json", json.dumps(_manifest(entries), indent=2))
+    yield sink.drain()
+    _log_export("zip", entries, sink.written, started)
+
+
+def _font(size: int):
+    try:
+        return ImageFont.truetype(SHEET_FONT, size)
+    except OSError:
+        pass
+    try:
+        return ImageFont.load_default(size=size)
+    except (TypeError, OSError):  # Pillow without FreeType: fixed-size bitmap font
+        return ImageFont.load_default()
+
+
+def _ellipsize(draw: ImageDraw.ImageDraw, text: str, font, width: int) -> str:
+    text = " ".join((text or "").split())
+    if draw.textlength(text, font=font) <= width:
+        return text
+    while text and draw.textlength(text + "…", font=font) > width:
+        text = text[:-1]
+    return text + "…"
+
+
+def render_sheet(entries: list[tuple[int, dict]], title: str, page: int, pages: int) -> Image.Image:
+    """One contact-sheet page: a grid of version thumbnails with captions."""
+    width, height = (round(points * SHEET_DPI / 72) for points in SHEET_PAGE_POINTS)
+    sheet = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(sheet)
+    margin = SHEET_DPI // 3
+    title_font, caption_font = _font(SHEET_DPI // 5), _font(SHEET_DPI // 9)
+    draw.text((margin, margin), _ellipsize(draw, title, title_font, width - 2 * margin), fill="black", font=title_font)
+    draw.text((width - margin, height - margin), f"{page} / {pages}", fill="gray", font=caption_font, anchor="rd")
+
+    columns, rows = SHEET_GRID
+    top = margin * 2 + SHEET_DPI // 5
+    cell_w = (width - margin * (columns + 1)) // columns
+    cell_h = (height - top - margin * (rows + 1)) // rows
+    caption_h = SHEET_DPI // 3
+    for slot, (number, entry) in enumerate(entries):
+        left = margin + (slot % columns) * (cell_w + margin)
+        cell_top = top + (slot // columns) * (cell_h + margin)
+        thumb = open_thumbnail(OUTPUT_DIR / entry["output_id"])
+        thumb.thumbnail((cell_w, cell_h - caption_h), Image.Resampling.LANCZOS)
+        sheet.paste(thumb, (left + (cell_w - thumb.width) // 2, cell_top))
+        draw.rectangle(
+            [left + (cell_w - thumb.width) // 2 - 1, cell_top - 1,
+             left + (cell_w + thumb.width) // 2, cell_top + thumb.height], outline="#808080",
+        )
+        when = datetime.fromtimestamp(entry["created_at"]).strftime("%Y-%m-%d %H:%M") if entry.get("created_at") else ""
+        heading = " · ".join(part for part in (f"v{number}", entry.get("kind") or "", when) if part)
+        detail = entry.get("edit_request") or entry.get("subject") or entry["output_id"]
+        caption_top = cell_top + thumb.height + SHEET_DPI // 20
+        draw.text((left, caption_top), _ellipsize(draw, heading, caption_font, cell_w), fill="black", font=caption_font)
+        draw.text((left, caption_top + SHEET_DPI // 7), _ellipsize(draw, detail, caption_font, cell_w),
+                  fill="#444444", font=caption_font)
+    return sheet
+
+
+def pdf_stream(entries: list[dict], title: str) -> Iterator[bytes]:
+    """A contact-sheet PDF, one page rendered and sent at a time. Each page is a single JPEG
+    (DCTDecode) image, so a minimal writer is enough; only the object offsets are kept."""
+    started = time.perf_counter()
+    offsets: dict[int, int] = {}
+    position = 0
+
+    def emit(data: bytes) -> bytes:
+        nonlocal position
+        position += len(data)
+        return data
+
+    def obj(number: int, body: bytes, stream: bytes | None = None) -> bytes:
+        offsets[number] = position
+        data = f"{number} 0 obj\n".encode() + body
+        if stream is not None:
+            data += b"\nstream\n" + stream + b"\nendstream"
+        return emit(data + b"\nendobj\n")
+
+    yield emit(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    per_page = SHEET_GRID[0] * SHEET_GRID[1]
+    numbered = list(enumerate(entries, start=1))
+    pages = max((len(numbered) + per_page - 1) // per_page, 1)
+    page_width, page_height = SHEET_PAGE_POINTS
+    page_ids = []
+    for page in range(pages):
+        sheet = render_sheet(numbered[page * per_page:(page + 1) * per_page], title, page + 1, pages)
+        jpeg = io.BytesIO()
+        sheet.save(jpeg, format="JPEG", quality=SHEET_JPEG_QUALITY)
+        image_id, content_id, page_id = 3 + page * 3, 4 + page * 3, 5 + page * 3
+        yield obj(image_id, (
+            f"<< /Type /XObject /Subtype /Image /Width {sheet.width} /Height {sheet.height} "
+            f"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /DCTDecode /Length {jpeg.tell()} >>"
+        ).encode(), jpeg.getvalue())
+        content = f"q {page_width} 0 0 {page_height} 0 0 cm /Im0 Do Q".encode()
+        yield obj(content_id, f"<< /Length {len(content)} >>".encode(), content)
+        yield obj(page_id, (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_width} {page_height}] "
+            f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode())
+        page_ids.append(page_id)
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    yield obj(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode())
+    yield obj(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+    xref_at = position
+    count = max(offsets) + 1
+    xref = [f"xref\n0 {count}\n", "0000000000 65535 f \n"]
+    xref += [f"{offsets[number]:010d} 00000 n \n" for number in range(1, count)]
+    xref.append(f"trailer\n<< /Size {count} /Root 1 0 R >>\nstartxref\n{xref_at}\n%%EOF\n")
+    yield emit("".join(xref).encode())
+    _log_export("pdf", entries, position, started)
+
+
+def _log_export(export_format: str, entries: list[dict], size: int, started: float) -> None:
+    metrics.inc("moodboard_exports_total", format=export_format)
+    metrics.inc("moodboard_export_bytes_total", size, format=export_format)
+    log_event(
+        logger, logging.INFO, "lineage_exported", format=export_format, versions=len(entries), bytes=size,
+        seconds=round(time.perf_counter() - started, 3), root=entries[0]["output_id"] if entries else None,
+    )
+
+
+def export_filename(output_id: str, export_format: str) -> str:
+    return f"{Path(output_id).stem}_lineage.{export_format}"
+
+
+def export_stream(entries: list[dict], export_format: str) -> Iterator[bytes]:
+    """Stream a lineage as "zip" or "pdf"; empty chunks are skipped."""
+    if export_format == "pdf":
+        title = next((entry["subject"] for entry in entries if entry.get("subject")), None) or "Moodboard"
+        chunks = pdf_stream(entries, f"{title} · {len(entries)} version{'s' if len(entries) != 1 else ''}")
+    else:
+        chunks = zip_stream(entries)
+    for chunk in chunks:
+        if chunk:
+            yield chunk
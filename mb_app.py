@@ -1,32 +1,83 @@
+from __future__ import annotations
+
+import json
+import logging
 import os
 import re
-import uuid
-from datetime import datetime
+import sys
+import time
 from functools import lru_cache
 from pathlib import Path
 
-import gradio as gr
-from google import genai
-from google.genai import types
-from google.genai.types import ThinkingConfig
-
+import cancellation
+import metrics
+import template_registry
+from output_store import OUTPUT_DIR
 from real_time_patterns import (
     _REAL_TIME_DIRECT_PATTERNS,
     _REAL_TIME_TIME_PATTERN,
     _REAL_TIME_TOPIC_PATTERN,
 )
+from structured_log import get_logger, log_event, text_summary
+from tracing import current_correlation_id, request_span, span
+
+
+# Headless mode serves the named endpoints as plain HTTP routes (see headless_app.py)
+# and never imports Gradio or builds the Blocks UI.
+HEADLESS = os.environ.get("MOODBOARD_HEADLESS", "").strip().lower() in ("1", "true", "yes")
 
+if HEADLESS:
+    class AppError(Exception):
+        """User-facing error; plays the role of gr.Error when Gradio is not loaded."""
+else:
+    import gradio as gr
+
+    AppError = gr.Error
 
 GEMINI_3_MODEL_ID = "gemini-3-pro-image-preview"
 GEMINI_25_MODEL_ID = "gemini-2.5-flash-image"
 DEFAULT_MODEL_ID = GEMINI_3_MODEL_ID
 MODEL_CHOICES = [GEMINI_3_MODEL_ID, GEMINI_25_MODEL_ID]
+# Model that serves a request while the requested model's circuit breaker is open
+# (only when MODEL_FALLBACK_ENABLED is set, see circuit_breaker.py).
+MODEL_FALLBACKS = {GEMINI_3_MODEL_ID: GEMINI_25_MODEL_ID}
 DEFAULT_ASPECT_RATIO = "16:9"
 DEFAULT_IMAGE_SIZE = "1K"
-PROMPT_TEMPLATE_FILE = Path(__file__).parent / "prompt_templates" / "prompt_template.txt"
-EDIT_TEMPLATE_FILE = Path(__file__).parent / "prompt_templates" / "edit_template.txt"
-OUTPUT_DIR = Path(__file__).parent / "outputs"
-OUTPUT_DIR.mkdir(exist_ok=True)
+# Named latency presets selectable per request. "model" replaces the requested model when set;
+# thinking_level and image_size only apply to Gemini 3 (Flash Image takes neither).
+LATENCY_PROFILES = {
+    "fast": {
+        "model": GEMINI_25_MODEL_ID,
+        "include_thoughts": False,
+        "thinking_level": "LOW",
+        "image_size": DEFAULT_IMAGE_SIZE,
+        "grounding": False,
+    },
+    "balanced": {
+        "model": None,
+        "include_thoughts": True,
+        "thinking_level": None,
+        "image_size": DEFAULT_IMAGE_SIZE,
+        "grounding": True,
+    },
+    "quality": {
+        "model": GEMINI_3_MODEL_ID,
+        "include_thoughts": True,
+        "thinking_level": "HIGH",
+        "image_size": "2K",
+        "grounding": True,
+    },
+}
+DEFAULT_LATENCY_PROFILE = os.environ.get("DEFAULT_LATENCY_PROFILE", "balanced")
+# Draft-then-refine: profiles for the quick draft and for the refinement generated alongside it.
+PROGRESSIVE_DRAFT_PROFILE = os.environ.get("PROGRESSIVE_DRAFT_PROFILE", "fast")
+PROGRESSIVE_REFINE_PROFILE = os.environ.get("PROGRESSIVE_REFINE_PROFILE", "quality")
+# Sidecar (next to each output) recording how it was produced.
+RUN_SIDECAR_KIND = "run"
+# Default templates, by registry name (see template_registry.py). Requests may name another
+# template by ID ("name" or "name@version") or send template text inline.
+PROMPT_TEMPLATE_NAME = "prompt_template"
+EDIT_TEMPLATE_NAME = "edit_template"
 SUBJECT_PLACEHOLDER = "{SUBJECT_PLACEHOLDER}"
 EDIT_PLACEHOLDERS = {
     "X_TOP": "{X_TOP}",
@@ -37,26 +88,28 @@ EDIT_PLACEHOLDERS = {
     "HEIGHT": "{HEIGHT}",
     "EDIT_REQUEST": "{EDIT_REQUEST}",
 }
+# Upper bound on regions in one multi-region edit request.
+MAX_EDIT_REGIONS = int(os.environ.get("MAX_EDIT_REGIONS", "8"))
+logger = get_logger("mb_app")
+
+
+def _resolve_template(template: str | None, default: str) -> template_registry.Template:
+    """The compiled template for a request's template input: empty for the default one, a
+    template ID, or inline template text (see TemplateRegistry.resolve)."""
+    try:
+        return template_registry.registry().resolve(template, default)
+    except template_registry.UnknownTemplate as e:
+        raise AppError(f"{e}. Pass a template ID, template text, or leave it empty for the default.")
 
 
-@lru_cache(maxsize=1)
 def _load_prompt_template() -> str:
-    """Load the prompt template from external file"""
-    if not PROMPT_TEMPLATE_FILE.exists():
-        raise gr.Error(f"Prompt template file not found: {PROMPT_TEMPLATE_FILE}")
-    
-    with open(PROMPT_TEMPLATE_FILE, "r", encoding="utf-8") as f:
-        return f.read()
+    """Current text of the default prompt template (reloaded when its file changes)"""
+    return _resolve_template(None, PROMPT_TEMPLATE_NAME).text
 
 
-@lru_cache(maxsize=1)
 def _load_edit_template() -> str:
-    """Load the edit template from external file"""
-    if not EDIT_TEMPLATE_FILE.exists():
-        raise gr.Error(f"Edit template file not found: {EDIT_TEMPLATE_FILE}")
-    
-    with open(EDIT_TEMPLATE_FILE, "r", encoding="utf-8") as f:
-        return f.read()
+    """Current text of the default edit template (reloaded when its file changes)"""
+    return _resolve_template(None, EDIT_TEMPLATE_NAME).text
 
 
 _REAL_TIME_PROXIMITY_PATTERNS = [
@@ -89,88 +142,81 @@ def _contains_real_time_info(prompt: str) -> bool:
     return False
 
 
-def _build_prompt(user_input: str, template: str) -> str:
+def _build_prompt(user_input: str, template: str | template_registry.Template) -> str:
     """Build the final prompt by replacing placeholder with user input"""
+    if isinstance(template, template_registry.Template):
+        return template.render({SUBJECT_PLACEHOLDER: user_input})
     return template.replace(SUBJECT_PLACEHOLDER, user_input)
 
 
-def _calculate_grid_cell(
-    x_top: int,
-    y_top: int,
-    x_bottom: int,
-    y_bottom: int,
-    img_width: int,
-    img_height: int,
-) -> dict:
+def _calculate_grid_cells(boxes, img_width: int, img_height: int, index: dict | None = None) -> list[dict]:
     """
-    Calculate which grid cell(s) the bounding box overlaps with.
+    Calculate which grid cell(s) each bounding box overlaps with, for all boxes in one pass.
     The moodboard has a 2x4 grid:
     - Top row: 4 vertical portrait images (Row 1, Cells 1-4)
     - Bottom row: 4 square images (Row 2, Cells 1-4)
+    When the image's panel index is given, the detected panel rectangles are used instead of
+    the fixed 60/40 row split and quarter-width columns (boxes outside every panel fall back).
     """
-    # Calculate the center point of the bounding box
-    bbox_center_x = (x_top + x_bottom) / 2
-    bbox_center_y = (y_top + y_bottom) / 2
-    
-    # Normalize center coordinates
-    center_x_norm = bbox_center_x / img_width
-    center_y_norm = bbox_center_y / img_height
-    
+    import numpy as np
+    import panel_index
+
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+    # Calculate the center point of each bounding box, normalized
+    center_x_norm = (boxes[:, 0] + boxes[:, 2]) / 2 / img_width
+    center_y_norm = (boxes[:, 1] + boxes[:, 3]) / 2 / img_height
+
     # Determine which row (top or bottom)
-    # Assuming roughly equal height split between top and bottom rows
     # Top row typically takes more vertical space (taller images)
     # Based on the prompt: "Top Row appear significantly taller than the bottom row"
     # Let's estimate top row is ~60% of height, bottom row is ~40%
     row_split = 0.6  # Top row ends at 60% of image height
-    
-    if center_y_norm < row_split:
-        row = 1  # Top row (The Look)
-        row_name = "Top Row (The Look)"
-        num_cells = 4
-    else:
-        row = 2  # Bottom row (The Details)
-        row_name = "Bottom Row (The Details)"
-        num_cells = 4
-    
+    rows = np.where(center_y_norm < row_split, 1, 2)
+
     # Determine which column (1-4)
     # Each row has 4 equal-width columns
+    num_cells = 4
     cell_width = 1.0 / num_cells
-    column = min(int(center_x_norm / cell_width) + 1, num_cells)
-    
-    # Calculate cell boundaries for more precise description
-    cell_left_norm = (column - 1) * cell_width
-    cell_right_norm = column * cell_width
-    
-    # Determine if bbox overlaps multiple cells
-    bbox_left_norm = x_top / img_width
-    bbox_right_norm = x_bottom / img_width
-    
-    overlapping_cells = []
-    for col in range(1, num_cells + 1):
-        col_left = (col - 1) * cell_width
-        col_right = col * cell_width
-        # Check if bbox overlaps with this column
-        if not (bbox_right_norm < col_left or bbox_left_norm > col_right):
-            overlapping_cells.append(col)
-    
-    # Create description
-    if len(overlapping_cells) == 1:
-        cell_desc = f"Cell {overlapping_cells[0]}"
-    elif len(overlapping_cells) == 2:
-        cell_desc = f"Cells {overlapping_cells[0]} and {overlapping_cells[1]}"
-    else:
-        cell_desc = f"Cells {', '.join(map(str, overlapping_cells))}"
-    
-    return {
-        "row": row,
-        "row_name": row_name,
-        "column": column,
-        "cell": f"Row {row}, Cell {column}",
-        "cell_description": f"{row_name}, {cell_desc}",
-        "overlapping_cells": overlapping_cells,
-        "cell_left_norm": cell_left_norm,
-        "cell_right_norm": cell_right_norm,
-    }
+    columns = np.minimum((center_x_norm / cell_width).astype(int) + 1, num_cells)
+
+    # Determine which columns each bbox overlaps: (N boxes x 4 columns)
+    col_left = np.arange(num_cells) * cell_width
+    col_right = (np.arange(num_cells) + 1) * cell_width
+    bbox_left_norm = (boxes[:, 0] / img_width)[:, None]
+    bbox_right_norm = (boxes[:, 2] / img_width)[:, None]
+    overlaps = ~((bbox_right_norm < col_left) | (bbox_left_norm > col_right))
+
+    indexed = panel_index.lookup_cells(index, boxes)
+    row_names = {1: "Top Row (The Look)", 2: "Bottom Row (The Details)"}
+    cells = []
+    for n, indexed_cell in enumerate(indexed):
+        if indexed_cell:
+            cells.append(indexed_cell)
+            continue
+        row, column = int(rows[n]), int(columns[n])
+        cells.append(panel_index.cell_info(
+            row,
+            row_names[row],
+            column,
+            [int(col) + 1 for col in np.flatnonzero(overlaps[n])],
+            (column - 1) * cell_width,
+            column * cell_width,
+        ))
+    return cells
+
+
+def _calculate_grid_cell(
+    x_top: int,
+    y_top: int,
+    x_bottom: int,
+    y_bottom: int,
+    img_width: int,
+    img_height: int,
+    index: dict | None = None,
+) -> dict:
+    """Calculate which grid cell(s) a single bounding box overlaps with (see _calculate_grid_cells)."""
+    return _calculate_grid_cells([(x_top, y_top, x_bottom, y_bottom)], img_width, img_height, index=index)[0]
 
 
 def _build_edit_prompt(
@@ -183,10 +229,22 @@ def _build_edit_prompt(
     img_width: int = None,
     img_height: int = None,
     has_bbox: bool = True,
+    grid_info: dict | None = None,
+    regions: list[dict] | None = None,
 ) -> str:
     """Build the edit prompt by replacing placeholders in template.
-    If has_bbox is False, removes all bbox-related sections from the prompt."""
+    If has_bbox is False, removes all bbox-related sections from the prompt.
+    Pass grid_info when the coordinates are relative to a crop rather than the full board.
+    Pass regions (from _parse_edit_regions, with grid_info set) to describe several regions,
+    each with its own instruction, in one prompt; the single-bbox sections are then removed."""
     
+    if regions:
+        return _build_edit_prompt(
+            None, None, None, None,
+            _format_edit_regions(regions, edit_request, img_width, img_height),
+            template, img_width=img_width, img_height=img_height, has_bbox=False,
+        )
+
     prompt = template
     
     # Replace image dimensions (always available)
@@ -235,9 +293,10 @@ def _build_edit_prompt(
             height_norm = round(height / img_height, 4)
             
             # Calculate grid cell information
-            grid_info = _calculate_grid_cell(
-                x_top, y_top, x_bottom, y_bottom, img_width, img_height
-            )
+            if grid_info is None:
+                grid_info = _calculate_grid_cell(
+                    x_top, y_top, x_bottom, y_bottom, img_width, img_height
+                )
         else:
             grid_info = None
         
@@ -316,6 +375,74 @@ def _build_edit_prompt(
     return prompt
 
 
+def _format_edit_regions(regions: list[dict], edit_request: str, img_width: int, img_height: int) -> str:
+    """Describe every region and its instruction for the {EDIT_REQUEST} slot of the edit template."""
+    lines = []
+    if edit_request:
+        lines.append(f"{edit_request}\n")
+    lines.append(
+        (f"Apply all {len(regions)} region edits" if len(regions) > 1 else "Apply the region edit")
+        + " below in this single pass. Leave everything outside "
+        + ("these regions" if len(regions) > 1 else "this region") + " unchanged."
+    )
+    for number, region in enumerate(regions, start=1):
+        x_top, y_top, x_bottom, y_bottom = region["box"]
+        grid_info = region.get("grid_info")
+        lines.append(f"\n**Region {number}:** {region['edit_request']}")
+        if grid_info:
+            lines.append(
+                f"- Target Grid Cell: {grid_info['cell_description']} "
+                f"(Row {grid_info['row']}, Column {grid_info['column']})"
+            )
+        lines.append(
+            f"- Normalized coordinates: ({round(x_top / img_width, 4)}, {round(y_top / img_height, 4)}) "
+            f"to ({round(x_bottom / img_width, 4)}, {round(y_bottom / img_height, 4)})"
+        )
+        lines.append(f"- Region size: {x_bottom - x_top} x {y_bottom - y_top} pixels at ({x_top}, {y_top})")
+    lines.append(f"\nFull image size: {img_width} x {img_height} pixels")
+    return "\n".join(lines)
+
+
+def _parse_edit_regions(regions, img_width: int, img_height: int, edit_request: str = "") -> list[dict]:
+    """Validate the `regions` input of edit_image_region.
+
+    Accepts a list (or its JSON string) of {x_top, y_top, x_bottom, y_bottom, edit_request}
+    dicts. A region without its own edit_request uses the shared one. Returns
+    [{"box": (x_top, y_top, x_bottom, y_bottom), "edit_request": str}, ...]."""
+    if regions is None or (isinstance(regions, str) and not regions.strip()):
+        return []
+    if isinstance(regions, str):
+        try:
+            regions = json.loads(regions)
+        except ValueError as e:
+            raise AppError(f"Invalid regions: expected a JSON list ({e}).")
+    if not isinstance(regions, list):
+        raise AppError("Invalid regions: expected a list of {x_top, y_top, x_bottom, y_bottom, edit_request}.")
+    if len(regions) > MAX_EDIT_REGIONS:
+        raise AppError(f"Too many regions: at most {MAX_EDIT_REGIONS} can be edited in one request.")
+
+    parsed = []
+    for number, region in enumerate(regions, start=1):
+        if not isinstance(region, dict):
+            raise AppError(f"Invalid region {number}: expected an object.")
+        try:
+            box = tuple(int(region[key]) for key in ("x_top", "y_top", "x_bottom", "y_bottom"))
+        except (KeyError, TypeError, ValueError):
+            raise AppError(f"Invalid region {number}: x_top, y_top, x_bottom and y_bottom must be integers.")
+        x_top, y_top, x_bottom, y_bottom = box
+        if x_top >= x_bottom or y_top >= y_bottom:
+            raise AppError(f"Invalid region {number}: top coordinates must be less than bottom coordinates.")
+        if x_top < 0 or y_top < 0 or x_bottom > img_width or y_bottom > img_height:
+            raise AppError(
+                f"Region {number} must be within image bounds (0-{img_width} for x, 0-{img_height} for y)."
+            )
+        instruction = str(region.get("edit_request") or "").strip() or edit_request
+        if not instruction:
+            raise AppError(f"Region {number} has no edit request.")
+        parsed.append({"box": box, "edit_request": instruction})
+    return parsed
+
+
 def _extract_image_from_parts(parts):
     """Replicate the original logic: return the first inline image part, else None."""
     for part in parts:
@@ -359,86 +486,606 @@ def _resolve_api_key(user_api_key: str | None) -> str:
     if user_api_key:
         return user_api_key
 
-    raise gr.Error(
+    raise AppError(
         "Missing API key. Set GEMINI_API_KEY or GOOGLE_API_KEY, or paste your key into the UI."
     )
 
 
 def _get_client(user_api_key: str | None) -> genai.Client:
+    from google import genai
+
     api_key = _resolve_api_key(user_api_key)
     return genai.Client(api_key=api_key)
 
 
-def _generate_single_image(prompt: str, model_id: str, user_api_key: str | None):
-    tools = None
-    if _contains_real_time_info(prompt):
-        print(f"{prompt} likely contains some info that could benefit from search-grounding.")
-        tools = [{"google_search": {}}]
-    
-    client = _get_client(user_api_key)
-    image_config = {"aspect_ratio": DEFAULT_ASPECT_RATIO}
-    config_kwargs = {}
+def _resolve_latency_profile(latency_profile: str | None) -> tuple[str, dict]:
+    name = (latency_profile or DEFAULT_LATENCY_PROFILE).strip().lower()
+    if name not in LATENCY_PROFILES:
+        raise AppError(f"Unknown latency profile: {name}. Choose one of {', '.join(LATENCY_PROFILES)}.")
+    return name, LATENCY_PROFILES[name]
+
 
+def _generation_config(
+    model_id: str, aspect_ratio: str, tools=None, profile: dict | None = None, cached_content: str | None = None
+):
+    """Image generation config for model_id under a latency profile (only Gemini 3 takes an
+    image_size or thinking level). cached_content names cached template instructions."""
+    from google.genai import types
+
+    profile = profile or LATENCY_PROFILES["balanced"]
+    image_config = {"aspect_ratio": aspect_ratio}
+    thinking_config = {"include_thoughts": profile["include_thoughts"]}
     if model_id == GEMINI_3_MODEL_ID:
-        image_config["image_size"] = DEFAULT_IMAGE_SIZE
+        image_config["image_size"] = profile["image_size"]
+        if profile["thinking_level"]:
+            thinking_config["thinking_level"] = profile["thinking_level"]
 
-    image_config = types.ImageConfig(**image_config)
-    config_kwargs["image_config"] = image_config
-    config_kwargs["thinking_config"] = ThinkingConfig(include_thoughts=True)
-    
+    config_kwargs = {
+        "image_config": types.ImageConfig(**image_config),
+        "thinking_config": types.ThinkingConfig(**thinking_config),
+    }
     if tools:
         config_kwargs["tools"] = tools
+    if cached_content:
+        config_kwargs["cached_content"] = cached_content
+    return types.GenerateContentConfig(**config_kwargs)
+
+
+def _is_model_fault(error: Exception) -> bool:
+    """Whether a failed call says something about the model's health (bad keys or requests do not)."""
+    try:
+        from google.genai import errors
+    except ImportError:
+        return True
+    if isinstance(error, errors.ClientError):
+        return error.code in (408, 429)
+    return True
 
-    response = client.models.generate_content(
-        model=model_id,
-        contents=prompt,
-        config=types.GenerateContentConfig(**config_kwargs),
+
+def _acquire_model(model_id: str) -> str:
+    """The model to call for a request to model_id, honouring the per-model circuit breakers."""
+    import circuit_breaker
+
+    breaker = circuit_breaker.breaker_for(model_id)
+    if breaker.acquire():
+        return model_id
+    fallback = MODEL_FALLBACKS.get(model_id)
+    if circuit_breaker.MODEL_FALLBACK_ENABLED and fallback and circuit_breaker.breaker_for(fallback).acquire():
+        metrics.inc("moodboard_model_fallbacks_total", model=model_id, fallback=fallback)
+        log_event(logger, logging.WARNING, "model_fallback", model=model_id, fallback=fallback)
+        return fallback
+    metrics.inc("moodboard_breaker_rejected_total", model=model_id)
+    message = (
+        f"{model_id} is temporarily unavailable after repeated failures. "
+        f"Please retry in {max(int(breaker.retry_after()), 1)} seconds"
     )
-    
-    image = _extract_image_from_parts(response.parts)
-    reasoning_text = _collect_reasoning_text(response)
-    return image, reasoning_text
+    raise AppError(message + (f" or switch to {fallback}." if fallback else "."))
 
 
-def generate_image(
-    user_input: str,
+def _cache_template(client, api_key: str | None, model_id: str, contents, template: str):
+    """Swap the static template instructions in contents (a prompt, or parts ending with one) for
+    a cached content (see context_cache.py). Returns (contents, cached content name, static text);
+    the contents are unchanged and the name None when nothing is cached."""
+    import context_cache
+
+    prompt = contents if isinstance(contents, str) else contents[-1]
+    split = context_cache.split_prompt(template, prompt) if isinstance(prompt, str) else None
+    if split is None:
+        return contents, None, None
+    static, variable = split
+    with span("context_cache", **{"gen_ai.request.model": model_id}) as cache_span:
+        name = context_cache.caches().cached_content(client, _resolve_api_key(api_key), model_id, static)
+        cache_span.set_attribute("moodboard.context_cache_hit", name is not None)
+    if name is None:
+        return contents, None, None
+    return (variable if isinstance(contents, str) else [*contents[:-1], variable]), name, static
+
+
+def _latency_key(model_id: str, profile: dict | None, tools=None) -> str:
+    """Hedging latency key: calls only hedge against earlier ones of the same model, image size,
+    thinking level and grounding."""
+    import hedging
+
+    profile = profile or {}
+    return hedging.latency_key(model_id, profile.get("image_size"), profile.get("thinking_level"),
+                               "grounded" if tools else None)
+
+
+def _call_model(
+    client,
     model_id: str,
-    template: str,
+    contents,
+    aspect_ratio: str,
+    tools=None,
+    hedge: bool = False,
+    profile: dict | None = None,
+    template: template_registry.Template | str | None = None,
     api_key: str | None = None,
 ):
-    """Generate image using the prompt template with user input"""
-    user_input = user_input.strip()
-    if not user_input:
-        raise gr.Error("Input cannot be empty. Please describe the fashion moodboard subject.")
-    
-    # If template is empty or None, use the default template
-    if not template or not template.strip():
-        template = _load_prompt_template()
+    """Run generate_content, abandoning it as soon as the current request is cancelled.
+    The async client is used when available so the HTTP call itself is torn down; with
+    hedge=True a slow call may be raced by an identical one (see hedging.py), once it runs longer
+    than earlier calls with the same model and profile (see _latency_key).
+    With template (the one the prompt was built from) and CONTEXT_CACHE_ENABLED, the template's
+    static instructions are sent as cached content and only the filled-in lines as the prompt.
+
+    Returns (response, served_model_id): the call goes through model_id's circuit breaker and
+    may be served by its fallback model while the breaker is open."""
+    import circuit_breaker
+    import context_cache
+    import hedging
+
+    model_id = _acquire_model(model_id)
+    breaker = circuit_breaker.breaker_for(model_id)
+    cached_content = static = None
+    # Cached contents are per model and cannot be combined with tools in the same request
+    if template and not tools and context_cache.CONTEXT_CACHE_ENABLED:
+        try:
+            contents, cached_content, static = _cache_template(client, api_key, model_id, contents, template)
+        except Exception:
+            breaker.release()
+            raise
+    config = _generation_config(model_id, aspect_ratio, tools, profile, cached_content)
+    latency_key = _latency_key(model_id, profile, tools)
+    started = time.perf_counter()
+    try:
+        aio = getattr(client, "aio", None)
+        if aio is not None:
+            response = cancellation.run_cancellable(hedging.race(
+                model_id,
+                lambda: aio.models.generate_content(model=model_id, contents=contents, config=config),
+                hedge=hedge,
+                key=latency_key,
+            ))
+        else:
+            cancellation.raise_if_cancelled()
+            response = client.models.generate_content(model=model_id, contents=contents, config=config)
+            if hedge:
+                hedging.latencies.record(latency_key, time.perf_counter() - started)
+    except cancellation.RequestCancelled:
+        # Credit the rest of a typical call for this model as saved
+        elapsed = time.perf_counter() - started
+        typical = metrics.average("moodboard_model_call_seconds", model=model_id)
+        metrics.inc("moodboard_model_calls_cancelled_total", model=model_id)
+        if typical is not None:
+            metrics.inc("moodboard_model_seconds_saved_total", max(typical - elapsed, 0.0), model=model_id)
+        breaker.release()
+        raise
+    except Exception as e:
+        if _is_model_fault(e):
+            breaker.record(False, time.perf_counter() - started)
+        else:
+            breaker.release()
+        if cached_content and getattr(e, "code", None) in (403, 404):
+            # The cached content may have been deleted; create it again on the next request
+            context_cache.caches().invalidate(_resolve_api_key(api_key), model_id, static)
+        raise
+    elapsed = time.perf_counter() - started
+    breaker.record(True, elapsed)
+    metrics.observe_average("moodboard_model_call_seconds", elapsed, model=model_id)
+    return response, model_id
 
-    # Build the full prompt from template
-    full_prompt = _build_prompt(user_input, template)
-    
-    image, reasoning_text = _generate_single_image(full_prompt, model_id=model_id, user_api_key=api_key)
-    
-    if not image:
-        raise gr.Error("The model did not return any image data. Please try again.")
 
-    pil_image = image._pil_image
+def _run_info(requested_model: str, served_models: list[str], latency_profile: str) -> dict:
+    """Which model and latency profile actually served a request (reported alongside every result)."""
+    served = sorted(set(served_models))
+    info = {
+        "latency_profile": latency_profile,
+        "requested_model": requested_model,
+        "served_model": served[0] if len(served) == 1 else "mixed",
+        "fallback": any(model != requested_model for model in served),
+    }
+    if len(served) > 1:
+        info["served_models"] = served
+    return info
+
+
+def _record_run(output_path: Path, run_info: dict) -> None:
+    """Store run_info next to the output so the profile and model stay attached to it."""
+    from output_store import write_sidecar
+
+    try:
+        write_sidecar(output_path, RUN_SIDECAR_KIND, run_info)
+    except OSError as e:
+        log_event(logger, logging.WARNING, "run_sidecar_write_failed", output=output_path.name, error=str(e))
+
+
+def _catalog_output(output_path: Path, kind: str, run_info: dict, duration_ms: float, **fields) -> None:
+    """Queue a searchable record of a saved output; the catalog writes it in batches off the request path."""
+    import catalog
+
+    if not catalog.CATALOG_ENABLED:
+        return
+    try:
+        catalog.catalog().record(dict(
+            fields,
+            output_id=output_path.name,
+            kind=kind,
+            model=run_info["requested_model"],
+            served_model=run_info["served_model"],
+            latency_profile=run_info["latency_profile"],
+            phase=run_info.get("phase"),
+            duration_ms=round(duration_ms, 1),
+            correlation_id=current_correlation_id(),
+        ))
+    except (OSError, catalog.sqlite3.Error) as e:
+        log_event(logger, logging.WARNING, "catalog_record_failed", output=output_path.name, error=str(e))
+
+
+def _cancel_scope(endpoint: str, requests, supersede: bool = False):
+    """Cancellation scope for a request. Headless mode answers cancelled requests with 499;
+    in the UI they surface as a plain error."""
+    return cancellation.request_scope(endpoint, requests, supersede, error_type=None if HEADLESS else AppError)
+
+
+def _discard_if_cancelled(endpoint: str) -> None:
+    """Drop a finished result whose request was cancelled instead of saving it."""
+    try:
+        cancellation.raise_if_cancelled()
+    except cancellation.RequestCancelled:
+        metrics.inc("moodboard_outputs_discarded_total", endpoint=endpoint)
+        raise
+
+
+def _generate_single_image(
+    prompt: str,
+    model_id: str,
+    user_api_key: str | None,
+    aspect_ratio: str = DEFAULT_ASPECT_RATIO,
+    profile: dict | None = None,
+    layout_reference: bool = False,
+    template: template_registry.Template | str | None = None,
+    hedge: bool = True,
+):
+    """Returns (image, reasoning, served_model_id).
+    With layout_reference the configured grid layout image is attached by file handle
+    (see layout_reference.py); it only applies to prompts describing the whole board.
+    template is the one the prompt was built from, for context caching (see _call_model).
+    hedge=False for calls that are not whole boards (panels), which must not be hedged against
+    board latencies or feed them."""
+    import layout_reference as layout_files
+
+    profile = profile or LATENCY_PROFILES["balanced"]
+    tools = None
+    if profile["grounding"] and _contains_real_time_info(prompt):
+        log_event(logger, logging.INFO, "grounding_enabled", prompt=text_summary(prompt))
+        tools = [{"google_search": {}}]
     
-    # Save image with unique filename
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    unique_id = str(uuid.uuid4())[:8]
-    filename = f"generated_{timestamp}_{unique_id}.png"
-    output_path = OUTPUT_DIR / filename
-    pil_image.save(output_path)
+    client = _get_client(user_api_key)
+    contents = prompt
+    reference = None
+    if layout_reference and layout_files.references().available():
+        with span("layout_reference"):
+            reference = layout_files.references().part(client, _resolve_api_key(user_api_key))
+        if reference is not None:
+            contents = [reference, prompt]
+
+    with span(
+        "model_call",
+        **{
+            "gen_ai.request.model": model_id,
+            "moodboard.grounding": bool(tools),
+            "moodboard.layout_reference": reference is not None,
+            "moodboard.payload_bytes": len(prompt.encode("utf-8")),
+        },
+    ) as call_span:
+        try:
+            response, served_model = _call_model(
+                client, model_id, contents, aspect_ratio, tools, hedge=hedge, profile=profile,
+                template=template, api_key=user_api_key,
+            )
+        except Exception as e:
+            if reference is not None and getattr(e, "code", None) in (403, 404):
+                # The uploaded reference may be gone; upload it again on the next request
+                layout_files.references().invalidate(_resolve_api_key(user_api_key))
+            raise
+        call_span.set_attribute("gen_ai.response.model", served_model)
     
+    image = _extract_image_from_parts(response.parts)
+    reasoning_text = _collect_reasoning_text(response)
+    return image, reasoning_text, served_model
+
+
+def _generate_panel_board(full_prompt: str, model_id: str, api_key: str | None, profile: dict | None = None):
+    """Generate the 8 panels concurrently (retrying failures per panel) and tile them into the board.
+    Returns (board, reasoning, layout, served models); the layout doubles as the board's exact panel index."""
+    import panel_assembly
+
+    _resolve_api_key(api_key)  # fail fast instead of once per panel
+    layout = panel_assembly.panel_layout()
+    with span("split_panel_prompts"):
+        panel_prompts = panel_assembly.split_panel_prompts(full_prompt, layout)
+
+    served_models = []
+
+    def generate_panel(prompt, aspect_ratio):
+        image, reasoning, served_model = _generate_single_image(
+            prompt, model_id=model_id, user_api_key=api_key, aspect_ratio=aspect_ratio, profile=profile,
+            hedge=False,  # panels are retried individually instead
+        )
+        served_models.append(served_model)
+        return (image._pil_image if image else None), reasoning
+
+    try:
+        results = panel_assembly.generate_panels(panel_prompts, generate_panel, layout)
+    except panel_assembly.PanelGenerationError as e:
+        raise AppError(f"{e} Please try again.")
+
+    with span("compose_panels"):
+        board = panel_assembly.compose_moodboard([image for image, _ in results], layout)
+    reasoning = panel_assembly.combine_reasoning(layout, [reasoning for _, reasoning in results])
+    return board, reasoning, layout, served_models
+
+
+def _prepare_generation(
+    user_input: str, template: str, generation_mode: str | None
+) -> tuple[str, str, template_registry.Template]:
+    """Validate a generate request; returns (full prompt, generation mode, compiled template)."""
+    import panel_assembly
+
+    user_input = (user_input or "").strip()
+    if not user_input:
+        raise AppError("Input cannot be empty. Please describe the fashion moodboard subject.")
+
+    generation_mode = (generation_mode or panel_assembly.DEFAULT_GENERATION_MODE).strip().lower()
+    if generation_mode not in panel_assembly.GENERATION_MODES:
+        raise AppError(
+            f"Unknown generation mode: {generation_mode}. "
+            f"Choose one of {', '.join(panel_assembly.GENERATION_MODES)}."
+        )
+
+    # An empty template means the default one; IDs and inline text are compiled once per version
+    compiled = _resolve_template(template, PROMPT_TEMPLATE_NAME)
+
+    # Build the full prompt from template
+    with span("build_prompt", **{"moodboard.template": compiled.id}):
+        full_prompt = _build_prompt(user_input, compiled)
+    return full_prompt, generation_mode, compiled
+
+
+def _generate_output(
+    full_prompt: str,
+    model_id: str,
+    api_key: str | None,
+    generation_mode: str,
+    profile_name: str,
+    extra_info: dict | None = None,
+    subject: str | None = None,
+    template: template_registry.Template | None = None,
+):
+    """Generate one board under a latency profile and save it. Returns (path, reasoning, run_info);
+    extra_info is merged into run_info (and its sidecar), subject is recorded in the catalog and
+    template (the one full_prompt was built from) is recorded in run_info and allows its static
+    part to be sent as cached content."""
+    import image_index
+    import panel_assembly
+    import panel_index
+    import panel_slices
+    import post_save
+
+    started = time.perf_counter()
+    profile = LATENCY_PROFILES[profile_name]
+    model_id = profile["model"] or model_id
+    panels = None
+    if generation_mode == panel_assembly.GENERATION_MODE_PANELS:
+        pil_image, reasoning_text, panels, served_models = _generate_panel_board(
+            full_prompt, model_id, api_key, profile
+        )
+    else:
+        image, reasoning_text, served_model = _generate_single_image(
+            full_prompt, model_id=model_id, user_api_key=api_key, profile=profile, layout_reference=True,
+            template=template,
+        )
+        served_models = [served_model]
+
+        if not image:
+            raise AppError("The model did not return any image data. Please try again.")
+
+        pil_image = image._pil_image
+
+    # Save image with unique filename (unless nobody is waiting for it any more)
+    _discard_if_cancelled("generate_image")
+    with span("save_png") as save_span:
+        output_path = image_index.save_image(pil_image, "generated")
+        save_span.set_attribute("moodboard.output", output_path.name)
+    filename = output_path.name
+    index = panel_index.index_output(output_path, pil_image, panels)
+    post_save.submit(output_path)
+
     # Return the file path string - Gradio can display it and serve it via /file= endpoint
     # Using the saved file path ensures each version has its own unique, immutable file
     reasoning_output = reasoning_text
-    print("Reasoning output (generate):", reasoning_output)
-    print(f"Saved generated image to: {output_path}")
+    run_info = dict(_run_info(model_id, served_models, profile_name), **(extra_info or {}))
+    if template is not None:
+        run_info["template"] = template.id
+    run_info["panels"] = panel_slices.describe(output_path, index)
+    _record_run(output_path, run_info)
+    _catalog_output(
+        output_path, "generated", run_info, (time.perf_counter() - started) * 1000,
+        subject=subject, prompt=full_prompt, generation_mode=generation_mode, reasoning=reasoning_output,
+    )
+    log_event(
+        logger, logging.INFO, "generate_complete",
+        model=model_id, served_model=run_info["served_model"], latency_profile=profile_name, output=filename,
+        generation_mode=generation_mode, phase=run_info.get("phase"), reasoning=text_summary(reasoning_output),
+    )
     # Return the absolute path as a string - Gradio will handle serving it
-    return str(output_path), reasoning_output
+    return str(output_path), reasoning_output, run_info
+
+
+def _prompt_cache_context(
+    model_id: str, template: template_registry.Template, generation_mode: str, profile_name: str
+) -> str:
+    """Cached boards only match requests made with the same model, mode, profile and template text."""
+    return f"{model_id}|{generation_mode}|{profile_name}|{template.digest[:16]}"
+
+
+def _remember_prompt(user_input, model_id, template, generation_mode, profile_name, output_path) -> None:
+    """Offer this board for near-identical subjects later (not for time-sensitive ones)."""
+    import prompt_cache
+
+    if not prompt_cache.PROMPT_CACHE_ENABLED or _contains_real_time_info(user_input):
+        return
+    context = _prompt_cache_context(model_id, template, generation_mode, profile_name)
+    prompt_cache.cache().record(context, user_input.strip(), str(output_path))
+
+
+def generate_image(
+    user_input: str,
+    model_id: str,
+    template: str,
+    api_key: str | None = None,
+    generation_mode: str | None = None,
+    latency_profile: str | None = None,
+    request: gr.Request | None = None,
+):
+    """Generate image using the prompt template with user input.
+    In "panels" mode the 8 grid panels are generated concurrently and tiled locally.
+    `latency_profile` ("fast", "balanced", "quality") picks the model, thinking, size and grounding.
+    A newer generate request from the same client session cancels this one."""
+    with (
+        request_span("generate_image", request, **{"gen_ai.request.model": model_id}) as root,
+        _cancel_scope("generate_image", request, supersede=True),
+    ):
+        full_prompt, generation_mode, compiled = _prepare_generation(user_input, template, generation_mode)
+        profile_name, profile = _resolve_latency_profile(latency_profile)
+        root.set_attributes(**{
+            "moodboard.generation_mode": generation_mode,
+            "moodboard.latency_profile": profile_name,
+            "gen_ai.request.model": profile["model"] or model_id,
+        })
+
+        output_path, reasoning_output, run_info = _generate_output(
+            full_prompt, model_id, api_key, generation_mode, profile_name, subject=user_input, template=compiled
+        )
+        root.set_attribute("moodboard.output", Path(output_path).name)
+        _remember_prompt(user_input, profile["model"] or model_id, compiled, generation_mode, profile_name, output_path)
+        return output_path, reasoning_output, run_info
+
+
+def generate_image_progressive(
+    user_input: str,
+    model_id: str,
+    template: str,
+    api_key: str | None = None,
+    generation_mode: str | None = None,
+    request: gr.Request | None = None,
+):
+    """Draft-then-refine generation, streamed in two phases.
+    Yields a quick draft (PROGRESSIVE_DRAFT_PROFILE) as soon as it lands, then the refinement
+    (PROGRESSIVE_REFINE_PROFILE) that was generated alongside it from the same prompt.
+    If the refinement fails the draft is yielded again as the final result."""
+    import queue
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from contextvars import copy_context
+
+    updates = queue.Queue()
+    job = {}
+
+    def run():
+        with (
+            request_span("generate_image_progressive", request, **{"gen_ai.request.model": model_id}) as root,
+            _cancel_scope("generate_image", request, supersede=True),
+        ):
+            job["token"] = cancellation.current_token()
+            full_prompt, mode, compiled = _prepare_generation(user_input, template, generation_mode)
+            root.set_attribute("moodboard.generation_mode", mode)
+            with ThreadPoolExecutor(max_workers=1, thread_name_prefix="refine") as pool:
+                refine = pool.submit(
+                    copy_context().run, _generate_output,
+                    full_prompt, model_id, api_key, mode, PROGRESSIVE_REFINE_PROFILE, {"phase": "final"},
+                    subject=user_input, template=compiled,
+                )
+                draft = None
+                try:
+                    draft = _generate_output(
+                        full_prompt, model_id, api_key, mode, PROGRESSIVE_DRAFT_PROFILE, {"phase": "draft"},
+                        subject=user_input, template=compiled,
+                    )
+                    updates.put(("draft", draft))
+                except cancellation.RequestCancelled:
+                    raise
+                except Exception as e:
+                    # The refinement can still answer the request on its own
+                    log_event(logger, logging.WARNING, "draft_failed", error=str(e))
+
+                try:
+                    final = refine.result()
+                except cancellation.RequestCancelled:
+                    raise
+                except Exception as e:
+                    if draft is None:
+                        raise
+                    log_event(logger, logging.WARNING, "refine_failed", draft=Path(draft[0]).name, error=str(e))
+                    final = (draft[0], draft[1], dict(draft[2], phase="final", refine_error=str(e)))
+                else:
+                    if draft is not None:
+                        final[2]["draft"] = Path(draft[0]).name
+                        _record_run(final[0], final[2])
+                    refine_profile = LATENCY_PROFILES[PROGRESSIVE_REFINE_PROFILE]
+                    _remember_prompt(
+                        user_input, refine_profile["model"] or model_id, compiled, mode,
+                        PROGRESSIVE_REFINE_PROFILE, final[0],
+                    )
+            root.set_attribute("moodboard.output", Path(final[0]).name)
+            updates.put(("final", final))
+
+    def worker(context):
+        try:
+            context.run(run)
+        except BaseException as e:
+            updates.put(("error", e))
+
+    threading.Thread(target=worker, args=(copy_context(),), name="progressive", daemon=True).start()
+    finished = False
+    try:
+        while True:
+            phase, value = updates.get()
+            if phase == "error":
+                finished = True
+                raise value
+            if phase == "final":
+                finished = True
+                yield value
+                return
+            yield value
+    finally:
+        token = job.get("token")
+        if not finished and token is not None:
+            # The consumer stopped listening before the refinement landed
+            token.cancel("client_gone")
+
+
+def find_similar_moodboard(
+    user_input: str,
+    model_id: str,
+    template: str,
+    generation_mode: str | None = None,
+    latency_profile: str | None = None,
+) -> dict:
+    """Look up a board generated earlier for a near-identical subject (same model, mode,
+    profile and template), so the client can show it instantly and offer to regenerate.
+    Returns {"match": None} or {"match": {image, subject, similarity, run_info}}."""
+    import panel_assembly
+    import prompt_cache
+    from output_store import read_sidecar
+
+    if not prompt_cache.PROMPT_CACHE_ENABLED or not (user_input or "").strip() or _contains_real_time_info(user_input):
+        return {"match": None}
+    generation_mode = (generation_mode or panel_assembly.DEFAULT_GENERATION_MODE).strip().lower()
+    profile_name, profile = _resolve_latency_profile(latency_profile)
+    compiled = _resolve_template(template, PROMPT_TEMPLATE_NAME)
+    context = _prompt_cache_context(profile["model"] or model_id, compiled, generation_mode, profile_name)
+    match = prompt_cache.cache().lookup(context, user_input)
+    if match is None:
+        return {"match": None}
+    return {"match": {
+        "image": match["output"],
+        "subject": match["subject"],
+        "similarity": match["similarity"],
+        "run_info": read_sidecar(match["output"], RUN_SIDECAR_KIND),
+    }}
 
 
 def edit_image_region(
@@ -452,424 +1099,860 @@ def edit_image_region(
     model_id: str,
     edit_template: str,
     api_key: str | None = None,
+    edit_mode: str | None = None,
+    regions=None,
+    latency_profile: str | None = None,
+    request: gr.Request | None = None,
 ):
-    """Edit a specific region of the image defined by bounding box, or entire image if bbox is None"""
-    from PIL import Image
-    
-    # Priority: use image_path_file if provided (for API), otherwise use current_image (for UI)
-    image_to_edit = None
-    
-    if image_path_file and image_path_file.strip():
-        # Textbox returns a string path
-        file_path = image_path_file.strip()
-        
-        # Handle case where path might be a URL or temp file path
-        # If it's a URL, extract the filename and look for it in outputs/
-        if file_path.startswith('http'):
-            # Extract filename from URL (e.g., "generated_20251129_102303_74a7602b.png")
-            filename = file_path.split('/')[-1].split('=')[-1] if '=' in file_path else file_path.split('/')[-1]
-            # Try to find the file in outputs directory
-            potential_path = OUTPUT_DIR / filename
-            if potential_path.exists():
-                file_path = str(potential_path)
-            else:
-                raise gr.Error(f"Image file not found. Tried to locate: {potential_path}")
-        # If it's a temp file path (Gradio's temp directory), try to find the original in outputs/
-        elif '/tmp/' in file_path or '/private/var/folders' in file_path or 'gradio' in file_path.lower():
-            # Extract filename from temp path
-            filename = os.path.basename(file_path)
-            # Try to find the file in outputs directory
-            potential_path = OUTPUT_DIR / filename
-            if potential_path.exists():
-                file_path = str(potential_path)
-            elif os.path.exists(file_path):
-                # Use the temp file if it exists
-                pass
-            else:
-                raise gr.Error(f"Image file not found. Tried to locate: {potential_path}")
-        
-        if os.path.exists(file_path):
-            image_to_edit = Image.open(file_path)
-        else:
-            raise gr.Error(f"Image file not found: {file_path}")
-    elif current_image is not None:
-        # Handle both file path (str) and PIL Image from image_display
-        if isinstance(current_image, str):
-            # It's a file path, load it
-            file_path = current_image
-            # Handle URL or temp file path similar to above
+    """Edit a specific region of the image defined by bounding box, or entire image if bbox is None.
+    Edits racing on the same parent image are serialized and coalesced (see edit_queue.py)."""
+    import edit_queue
+
+    params = {
+        "current_image": current_image,
+        "image_path_file": image_path_file,
+        "x_top": x_top,
+        "y_top": y_top,
+        "x_bottom": x_bottom,
+        "y_bottom": y_bottom,
+        "edit_request": edit_request,
+        "model_id": model_id,
+        "edit_template": edit_template,
+        "api_key": api_key,
+        "edit_mode": edit_mode,
+        "regions": regions,
+        "latency_profile": latency_profile,
+    }
+    key = edit_queue.lineage_key(image_path_file, current_image)
+    if key is None or not edit_queue.EDIT_QUEUE_ENABLED:
+        with _cancel_scope("edit_image_region", request):
+            return _edit_image_region(**params, request=request)
+
+    def run_batch(combined: dict, parent_override: str | None, requests: list):
+        if parent_override:
+            # An earlier batch on this parent just finished: build on its output
+            combined = dict(combined, current_image=None, image_path_file=parent_override)
+        # A coalesced batch is only abandoned once every client waiting on it is gone
+        with _cancel_scope("edit_image_region", requests):
+            return _edit_image_region(**combined, request=request)
+
+    compat_key = (
+        model_id,
+        _resolve_template(edit_template, EDIT_TEMPLATE_NAME).id,
+        (api_key or "").strip(),
+        (edit_mode or "").strip().lower(),
+        (latency_profile or "").strip().lower(),
+    )
+    return edit_queue.submit(key, compat_key, params, run_batch, request=request)
+
+
+def _edit_image_region(
+    current_image,
+    image_path_file,
+    x_top,
+    y_top,
+    x_bottom,
+    y_bottom,
+    edit_request: str,
+    model_id: str,
+    edit_template: str,
+    api_key: str | None = None,
+    edit_mode: str | None = None,
+    regions=None,
+    latency_profile: str | None = None,
+    request: gr.Request | None = None,
+):
+    """Run one (possibly coalesced) edit: the region defined by bounding box, or entire image if bbox is None.
+    In "regional" mode only the bbox neighbourhood is sent and the result is blended back.
+    `regions` (a list or JSON list of {x_top, y_top, x_bottom, y_bottom, edit_request}) replaces
+    the single bbox and edits every region in one model call and one saved version."""
+    with request_span("edit_image_region", request, **{"gen_ai.request.model": model_id}) as root:
+        from PIL import Image
+
+        profile_name, profile = _resolve_latency_profile(latency_profile)
+        model_id = profile["model"] or model_id
+        root.set_attributes(**{"moodboard.latency_profile": profile_name, "gen_ai.request.model": model_id})
+
+        # Priority: use image_path_file if provided (for API), otherwise use current_image (for UI)
+        image_to_edit = None
+        source_path = None
+
+        if image_path_file and image_path_file.strip():
+            # Textbox returns a string path
+            file_path = image_path_file.strip()
+
+            # Handle case where path might be a URL or temp file path
+            # If it's a URL, extract the filename and look for it in outputs/
             if file_path.startswith('http'):
+                # Extract filename from URL (e.g., "generated_20251129_102303_74a7602b.png")
                 filename = file_path.split('/')[-1].split('=')[-1] if '=' in file_path else file_path.split('/')[-1]
+                # Try to find the file in outputs directory
                 potential_path = OUTPUT_DIR / filename
                 if potential_path.exists():
                     file_path = str(potential_path)
+                else:
+                    raise AppError(f"Image file not found. Tried to locate: {potential_path}")
+            # If it's a temp file path (Gradio's temp directory), try to find the original in outputs/
             elif '/tmp/' in file_path or '/private/var/folders' in file_path or 'gradio' in file_path.lower():
+                # Extract filename from temp path
                 filename = os.path.basename(file_path)
+                # Try to find the file in outputs directory
                 potential_path = OUTPUT_DIR / filename
                 if potential_path.exists():
                     file_path = str(potential_path)
-            
-            if not os.path.exists(file_path):
-                raise gr.Error(f"Image file not found: {file_path}")
-            image_to_edit = Image.open(file_path)
-        elif hasattr(current_image, 'size'):
-            # It's a PIL Image - we can't track the original path, so we'll create a new file
-            image_to_edit = current_image
+                elif os.path.exists(file_path):
+                    # Use the temp file if it exists
+                    pass
+                else:
+                    raise AppError(f"Image file not found. Tried to locate: {potential_path}")
+
+            if os.path.exists(file_path):
+                image_to_edit = Image.open(file_path)
+                source_path = file_path
+            else:
+                raise AppError(f"Image file not found: {file_path}")
+        elif current_image is not None:
+            # Handle both file path (str) and PIL Image from image_display
+            if isinstance(current_image, str):
+                # It's a file path, load it
+                file_path = current_image
+                # Handle URL or temp file path similar to above
+                if file_path.startswith('http'):
+                    filename = file_path.split('/')[-1].split('=')[-1] if '=' in file_path else file_path.split('/')[-1]
+                    potential_path = OUTPUT_DIR / filename
+                    if potential_path.exists():
+                        file_path = str(potential_path)
+                elif '/tmp/' in file_path or '/private/var/folders' in file_path or 'gradio' in file_path.lower():
+                    filename = os.path.basename(file_path)
+                    potential_path = OUTPUT_DIR / filename
+                    if potential_path.exists():
+                        file_path = str(potential_path)
+
+                if not os.path.exists(file_path):
+                    raise AppError(f"Image file not found: {file_path}")
+                image_to_edit = Image.open(file_path)
+                source_path = file_path
+            elif hasattr(current_image, 'size'):
+                # It's a PIL Image - we can't track the original path, so we'll create a new file
+                image_to_edit = current_image
+            else:
+                raise AppError("Invalid image format. Expected PIL Image or file path.")
         else:
-            raise gr.Error("Invalid image format. Expected PIL Image or file path.")
-    else:
-        raise gr.Error("No image available. Please generate an image first or provide an image file.")
-    
-    current_image = image_to_edit
-    
-    edit_request = edit_request.strip()
-    if not edit_request:
-        raise gr.Error("Edit request cannot be empty.")
-    
-    # Get image dimensions
-    img_width, img_height = current_image.size
-    
-    # Check if bbox is provided (all coordinates must be non-None and non-empty)
-    # Handle both None and empty string cases from API
-    # Also handle the case where Gradio might pass None as a string "None" or "null"
-    def is_valid_coord(coord):
-        # Check for None first
-        if coord is None:
-            return False
-        # Check for empty string
-        if coord == "":
-            return False
-        # Check for string representations of None/null
-        if isinstance(coord, str):
-            coord_lower = coord.strip().lower()
-            if coord_lower in ("", "none", "null", "undefined"):
+            raise AppError("No image available. Please generate an image first or provide an image file.")
+
+        current_image = image_to_edit
+
+        edit_request = (edit_request or "").strip()
+
+        # Get image dimensions
+        img_width, img_height = current_image.size
+
+        region_list = _parse_edit_regions(regions, img_width, img_height, edit_request)
+        if not edit_request and not region_list:
+            raise AppError("Edit request cannot be empty.")
+
+        # Check if bbox is provided (all coordinates must be non-None and non-empty)
+        # Handle both None and empty string cases from API
+        # Also handle the case where Gradio might pass None as a string "None" or "null"
+        def is_valid_coord(coord):
+            # Check for None first
+            if coord is None:
+                return False
+            # Check for empty string
+            if coord == "":
                 return False
-            # Try to parse as int - if it fails, it's not a valid coordinate
+            # Check for string representations of None/null
+            if isinstance(coord, str):
+                coord_lower = coord.strip().lower()
+                if coord_lower in ("", "none", "null", "undefined"):
+                    return False
+                # Try to parse as int - if it fails, it's not a valid coordinate
+                try:
+                    int(coord)
+                    return True
+                except (ValueError, TypeError):
+                    return False
+            # For numeric types, consider them valid
             try:
                 int(coord)
                 return True
             except (ValueError, TypeError):
                 return False
-        # For numeric types, consider them valid
-        try:
-            int(coord)
-            return True
-        except (ValueError, TypeError):
-            return False
-    
-    has_bbox = (
-        is_valid_coord(x_top) and
-        is_valid_coord(y_top) and
-        is_valid_coord(x_bottom) and
-        is_valid_coord(y_bottom)
-    )
-    
-    if has_bbox:
-        # Validate bounding box coordinates - convert to int only if they're valid
-        # Double-check that coordinates are not None before conversion
-        if x_top is None or y_top is None or x_bottom is None or y_bottom is None:
-            has_bbox = False
-        else:
-            try:
-                x_top = int(x_top)
-                y_top = int(y_top)
-                x_bottom = int(x_bottom)
-                y_bottom = int(y_bottom)
-            except (ValueError, TypeError) as e:
-                # If conversion fails, treat as no bbox instead of raising error
+
+        # An explicit region list takes the place of the single bbox inputs
+        has_bbox = (
+            not region_list and
+            is_valid_coord(x_top) and
+            is_valid_coord(y_top) and
+            is_valid_coord(x_bottom) and
+            is_valid_coord(y_bottom)
+        )
+
+        if has_bbox:
+            # Validate bounding box coordinates - convert to int only if they're valid
+            # Double-check that coordinates are not None before conversion
+            if x_top is None or y_top is None or x_bottom is None or y_bottom is None:
                 has_bbox = False
-        
-        # Validate bounding box (top < bottom, left < right)
-        if x_top >= x_bottom or y_top >= y_bottom:
-            raise gr.Error("Invalid bounding box: top coordinates must be less than bottom coordinates.")
-        
-        # Validate coordinates are within image bounds
-        if x_top < 0 or y_top < 0 or x_bottom > img_width or y_bottom > img_height:
-            raise gr.Error(f"Bounding box coordinates must be within image bounds (0-{img_width} for x, 0-{img_height} for y).")
-    
-    # Validate edit template
-    # If edit_template is empty or None, use the default template
-    if not edit_template or not edit_template.strip():
-        edit_template = _load_edit_template()
-    
-    # Build the edit prompt from template (with or without bbox)
-    # When has_bbox is False, pass None for coordinates to avoid any arithmetic issues
-    edit_prompt = _build_edit_prompt(
-        x_top if has_bbox else None,
-        y_top if has_bbox else None,
-        x_bottom if has_bbox else None,
-        y_bottom if has_bbox else None,
-        edit_request, edit_template,
-        img_width=img_width, img_height=img_height, has_bbox=has_bbox
-    )
-    tools = None
-    if _contains_real_time_info(edit_prompt):
-        print(f"{edit_prompt} likely contains some info that could benefit from search-grounding.")
-        tools = [{"google_search": {}}]
-    
-    client = _get_client(api_key)
-    
-    # Prepare image for API - convert PIL Image to format expected by Gemini
-    import io
-    
-    # Convert PIL image to bytes
-    img_bytes = io.BytesIO()
-    current_image.save(img_bytes, format='PNG')
-    img_bytes.seek(0)
-    image_data = img_bytes.read()
-    
-    # Create content with image and text prompt
-    # Gemini API expects a list of parts (image + text)
-    contents = [
-        types.Part.from_bytes(
-            data=image_data,
-            mime_type="image/png"
-        ),
-        edit_prompt
-    ]
-    
-    # Configure image generation
-    image_config = {"aspect_ratio": DEFAULT_ASPECT_RATIO}
-    config_kwargs = {}
-    
-    if model_id == GEMINI_3_MODEL_ID:
-        image_config["image_size"] = DEFAULT_IMAGE_SIZE
-    
-    image_config = types.ImageConfig(**image_config)
-    config_kwargs["image_config"] = image_config
-    config_kwargs["thinking_config"] = ThinkingConfig(include_thoughts=True)
-    if tools:
-        config_kwargs["tools"] = tools
-    
-    # Generate edited image
-    response = client.models.generate_content(
-        model=model_id,
-        contents=contents,
-        config=types.GenerateContentConfig(**config_kwargs),
-    )
-    
-    edited_image = _extract_image_from_parts(response.parts)
-    if not edited_image:
-        raise gr.Error("The model did not return any image data. Please try again.")
-    
-    pil_image = edited_image._pil_image
-    
-    # Always save edited image to a NEW unique file (never overwrite original)
-    # This ensures each version has its own immutable file for history tracking
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    unique_id = str(uuid.uuid4())[:8]
-    filename = f"edited_{timestamp}_{unique_id}.png"
-    output_path = OUTPUT_DIR / filename
-    pil_image.save(output_path)
-    
-    reasoning_output = _collect_reasoning_text(response)
-    
-    # Return the file path string - Gradio can display it and serve it via /file= endpoint
-    # Using the saved file path ensures each version has its own unique, immutable file
-    print("Reasoning output (edit):", reasoning_output)
-    print(f"Saved edited image to: {output_path}")
-    # Return the absolute path as a string - Gradio will handle serving it
-    return str(output_path), reasoning_output
+            else:
+                try:
+                    x_top = int(x_top)
+                    y_top = int(y_top)
+                    x_bottom = int(x_bottom)
+                    y_bottom = int(y_bottom)
+                except (ValueError, TypeError) as e:
+                    # If conversion fails, treat as no bbox instead of raising error
+                    has_bbox = False
 
+            # Validate bounding box (top < bottom, left < right)
+            if x_top >= x_bottom or y_top >= y_bottom:
+                raise AppError("Invalid bounding box: top coordinates must be less than bottom coordinates.")
 
-with gr.Blocks(title="Fashion Moodboard", css="""
-    .main-container {
-        display: flex;
-        flex-direction: column;
-        height: 100vh;
-    }
-    .image-section {
-        flex: 5;
-        display: flex;
-        align-items: center;
-        justify-content: center;
-        min-height: 0;
-    }
-    .input-section {
-        flex: 1;
-        display: flex;
-        align-items: center;
-        justify-content: center;
-        padding: 20px;
-    }
-    .input-wrapper {
-        width: 100%;
-        max-width: 900px;
-        display: flex;
-        gap: 10px;
-    }
-""") as demo:
-    env_api_key_present = _env_api_key() is not None
+            # Validate coordinates are within image bounds
+            if x_top < 0 or y_top < 0 or x_bottom > img_width or y_bottom > img_height:
+                raise AppError(f"Bounding box coordinates must be within image bounds (0-{img_width} for x, 0-{img_height} for y).")
 
-    # Load default template content
-    try:
-        default_template = _load_prompt_template()
-    except Exception as e:
-        default_template = f"Error loading template: {str(e)}"
-    
-    try:
-        default_edit_template = _load_edit_template()
-    except Exception as e:
-        default_edit_template = f"Error loading edit template: {str(e)}"
-    
-    # Model selector and prompt templates at the top
-    if not env_api_key_present:
-        gr.Markdown(
-            "### API key required\n"
-            "No `GEMINI_API_KEY` / `GOOGLE_API_KEY` found in the environment. "
-            "Paste your Gemini API key below to use the app."
+        if len(region_list) == 1 and (not edit_request or region_list[0]["edit_request"] == edit_request):
+            # A single region is just the classic bbox edit
+            (x_top, y_top, x_bottom, y_bottom), edit_request = region_list[0]["box"], region_list[0]["edit_request"]
+            has_bbox = True
+            region_list = []
+        multi_region = bool(region_list)
+        root.set_attribute("moodboard.regions", len(region_list) if multi_region else int(has_bbox))
+
+        # Validate edit template: empty means the default one, otherwise a template ID or inline text
+        compiled_edit_template = _resolve_template(edit_template, EDIT_TEMPLATE_NAME)
+        edit_template = compiled_edit_template.text
+        root.set_attribute("moodboard.template", compiled_edit_template.id)
+
+        import image_index
+        import panel_index
+        import panel_slices
+        import post_save
+        import regional_edit
+
+        # Map the bbox (or every region, in one vectorized pass) to board cells using the
+        # panels indexed when the image was saved
+        grid_info = None
+        index = None
+        if has_bbox or multi_region:
+            with span("panel_lookup") as lookup_span:
+                if source_path:
+                    index = panel_index.load_index(source_path, current_image)
+                else:
+                    index = panel_index.build_index(current_image)
+                boxes = [region["box"] for region in region_list] or [(x_top, y_top, x_bottom, y_bottom)]
+                cells = _calculate_grid_cells(boxes, img_width, img_height, index=index)
+                grid_info = cells[0]
+                for region, cell in zip(region_list, cells):
+                    region["grid_info"] = cell
+                lookup_span.set_attribute("moodboard.panel_source", index["source"])
+
+        edit_mode = (edit_mode or regional_edit.DEFAULT_EDIT_MODE).strip().lower()
+        if edit_mode not in regional_edit.EDIT_MODES:
+            raise AppError(f"Unknown edit mode: {edit_mode}. Choose one of {', '.join(regional_edit.EDIT_MODES)}.")
+        # Regional edits need a region; without a bbox the whole board is edited as before
+        has_regions = has_bbox or multi_region
+        regional = edit_mode == regional_edit.EDIT_MODE_REGIONAL and has_regions
+        root.set_attribute("moodboard.edit_mode", edit_mode if has_regions else regional_edit.EDIT_MODE_FULL)
+        parent_image = current_image
+        aspect_ratio = DEFAULT_ASPECT_RATIO
+
+        # Build the edit prompt from template (with or without bbox)
+        # When has_bbox is False, pass None for coordinates to avoid any arithmetic issues
+        with span("build_edit_prompt", **{"moodboard.has_bbox": has_regions}):
+            if regional and multi_region:
+                # One crop around all regions; each keeps its own feathered blend mask
+                bbox = [region["box"] for region in region_list]
+                union = (
+                    min(box[0] for box in bbox), min(box[1] for box in bbox),
+                    max(box[2] for box in bbox), max(box[3] for box in bbox),
+                )
+                crop_box, aspect_ratio = regional_edit.plan_crop(union, (img_width, img_height))
+                crop_left, crop_top = crop_box[0], crop_box[1]
+                current_image = parent_image.crop(crop_box)
+                crop_regions = [
+                    dict(region, box=(
+                        region["box"][0] - crop_left, region["box"][1] - crop_top,
+                        region["box"][2] - crop_left, region["box"][3] - crop_top,
+                    ))
+                    for region in region_list
+                ]
+                edit_prompt = regional_edit.REGIONAL_EDIT_PREAMBLE + _build_edit_prompt(
+                    None, None, None, None, edit_request, edit_template,
+                    img_width=current_image.width, img_height=current_image.height, regions=crop_regions,
+                )
+            elif regional:
+                bbox = (x_top, y_top, x_bottom, y_bottom)
+                crop_box, aspect_ratio = regional_edit.plan_crop(bbox, (img_width, img_height))
+                crop_left, crop_top = crop_box[0], crop_box[1]
+                current_image = parent_image.crop(crop_box)
+                # Coordinates are relative to the crop, but the grid cell still names the board cell
+                edit_prompt = regional_edit.REGIONAL_EDIT_PREAMBLE + _build_edit_prompt(
+                    x_top - crop_left, y_top - crop_top, x_bottom - crop_left, y_bottom - crop_top,
+                    edit_request, edit_template,
+                    img_width=current_image.width, img_height=current_image.height, has_bbox=True,
+                    grid_info=grid_info,
+                )
+            elif multi_region:
+                edit_prompt = _build_edit_prompt(
+                    None, None, None, None, edit_request, edit_template,
+                    img_width=img_width, img_height=img_height, regions=region_list,
+                )
+            else:
+                edit_prompt = _build_edit_prompt(
+                    x_top if has_bbox else None,
+                    y_top if has_bbox else None,
+                    x_bottom if has_bbox else None,
+                    y_bottom if has_bbox else None,
+                    edit_request, edit_template,
+                    img_width=img_width, img_height=img_height, has_bbox=has_bbox,
+                    grid_info=grid_info,
+                )
+        tools = None
+        if profile["grounding"] and _contains_real_time_info(edit_prompt):
+            log_event(logger, logging.INFO, "grounding_enabled", prompt=text_summary(edit_prompt))
+            tools = [{"google_search": {}}]
+
+        client = _get_client(api_key)
+
+        # Prepare image for API - convert PIL Image to format expected by Gemini
+        import io
+
+        from google.genai import types
+
+        # Convert PIL image to bytes
+        with span(
+            "encode_png",
+            **{"moodboard.image_width": current_image.width, "moodboard.image_height": current_image.height},
+        ) as encode_span:
+            img_bytes = io.BytesIO()
+            current_image.save(img_bytes, format='PNG')
+            img_bytes.seek(0)
+            image_data = img_bytes.read()
+            encode_span.set_attribute("moodboard.png_bytes", len(image_data))
+
+        # Create content with image and text prompt
+        # Gemini API expects a list of parts (image + text)
+        contents = [
+            types.Part.from_bytes(
+                data=image_data,
+                mime_type="image/png"
+            ),
+            edit_prompt
+        ]
+
+        # Generate edited image
+        with span(
+            "model_call",
+            **{
+                "gen_ai.request.model": model_id,
+                "moodboard.grounding": bool(tools),
+                "moodboard.payload_bytes": len(image_data) + len(edit_prompt.encode("utf-8")),
+            },
+        ) as call_span:
+            response, served_model = _call_model(
+                client, model_id, contents, aspect_ratio, tools, profile=profile,
+                template=compiled_edit_template, api_key=api_key,
+            )
+            call_span.set_attribute("gen_ai.response.model", served_model)
+
+        edited_image = _extract_image_from_parts(response.parts)
+        if not edited_image:
+            raise AppError("The model did not return any image data. Please try again.")
+
+        pil_image = edited_image._pil_image
+        if regional:
+            with span("composite_patch", **{"moodboard.crop_box": str(crop_box)}):
+                pil_image = regional_edit.composite_patch(parent_image, pil_image, crop_box, bbox)
+
+        # Always save edited image to a NEW unique file (never overwrite original)
+        # This ensures each version has its own immutable file for history tracking
+        _discard_if_cancelled("edit_image_region")
+        with span("save_png") as save_span:
+            output_path = image_index.save_image(pil_image, "edited")
+            save_span.set_attribute("moodboard.output", output_path.name)
+        filename = output_path.name
+        # A regional edit leaves the grid untouched, so the parent's panels carry over
+        if regional and index and index["panels"]:
+            index = panel_index.index_output(output_path, pil_image, index["panels"], source="inherited")
+        else:
+            index = panel_index.index_output(output_path, pil_image)
+        post_save.submit(output_path)
+        root.set_attribute("moodboard.output", filename)
+
+        reasoning_output = _collect_reasoning_text(response)
+        run_info = _run_info(model_id, [served_model], profile_name)
+        run_info["template"] = compiled_edit_template.id
+        run_info["panels"] = panel_slices.describe(output_path, index)
+        _record_run(output_path, run_info)
+        _catalog_output(
+            output_path, "edited", run_info, root.duration_ms,
+            prompt=edit_prompt, reasoning=reasoning_output,
+            edit_request="\n".join(region["edit_request"] for region in region_list) if multi_region else edit_request,
+            bbox=[list(region["box"]) for region in region_list] if multi_region
+            else [x_top, y_top, x_bottom, y_bottom] if has_bbox else None,
+            parent=Path(source_path).name if source_path else None,
         )
-    api_key_input = gr.Textbox(
-        label="Gemini API Key",
-        placeholder="Paste your GEMINI_API_KEY / GOOGLE_API_KEY here",
-        type="password",
-        visible=not env_api_key_present,
-    )
 
-    with gr.Row():
-        with gr.Column(scale=0):
-            model_selector = gr.Radio(
-                choices=MODEL_CHOICES,
-                value=DEFAULT_MODEL_ID,
-                label="Model",
+        # Return the file path string - Gradio can display it and serve it via /file= endpoint
+        # Using the saved file path ensures each version has its own unique, immutable file
+        log_event(
+            logger, logging.INFO, "edit_complete",
+            model=model_id, served_model=served_model, latency_profile=profile_name, output=filename, has_bbox=has_bbox,
+            regions=len(region_list) if multi_region else int(has_bbox),
+            edit_request=text_summary(edit_request), reasoning=text_summary(reasoning_output),
+        )
+        # Return the absolute path as a string - Gradio will handle serving it
+        return str(output_path), reasoning_output, run_info
+
+
+def _stored_output_path(image_path: str) -> Path:
+    """Resolve a filename, path or file URL to an existing file inside the output store."""
+    image_path = (image_path or "").strip()
+    if not image_path:
+        raise AppError("Image path cannot be empty.")
+    filename = image_path.split("=")[-1].split("/")[-1].split("?")[0]
+    candidate = (OUTPUT_DIR / filename).resolve()
+    if not candidate.is_relative_to(OUTPUT_DIR.resolve()) or not candidate.is_file():
+        raise AppError(f"Image file not found: {filename}")
+    return candidate
+
+
+def list_templates(request: gr.Request | None = None) -> dict:
+    """The registered templates (latest versions), by ID. Pass an ID as the template input of
+    generate_image / edit_image_region instead of the template text."""
+    return {"templates": template_registry.registry().templates()}
+
+
+def get_panel_index(image_path_file: str, request: gr.Request | None = None) -> dict:
+    """Return the panel rectangles indexed for a saved moodboard (used for bbox snapping)."""
+    with request_span("get_panel_index", request):
+        import panel_index
+        from PIL import Image
+
+        path = _stored_output_path(image_path_file)
+        index = panel_index.load_index(path)
+        if index is None:
+            with Image.open(path) as image:
+                index = panel_index.load_index(path, image)
+        return index
+
+
+def find_similar_boards(image_path_file: str, limit: int = 8, request: gr.Request | None = None) -> dict:
+    """Saved boards that look like the given one (perceptual-hash distance), nearest first."""
+    with request_span("find_similar_boards", request):
+        import image_index
+        from PIL import Image
+
+        path = _stored_output_path(image_path_file)
+        hashes = image_index.index().hashes_of(path.name)
+        if hashes is None:  # saved before the index existed
+            with Image.open(path) as image:
+                hashes = image_index.phash(image), image_index.dhash(image)
+        matches = image_index.index().similar(*hashes, limit=int(limit or 8), exclude=path.name)
+        return {"boards": [{"image": str(OUTPUT_DIR / match["name"]), "distance": match["distance"]} for match in matches]}
+
+
+def get_board_palette(image_path_file: str, request: gr.Request | None = None) -> dict:
+    """Return a saved moodboard's colour palette: its swatch strip, dominant board colours and per-panel colours."""
+    with request_span("get_board_palette", request):
+        import palette_index
+
+        return palette_index.load_palette(_stored_output_path(image_path_file))
+
+
+def find_boards_by_palette(palette: str | list[str], limit: int = 8, request: gr.Request | None = None) -> dict:
+    """Saved boards whose palette is near the given hex colours (Lab distance), nearest first."""
+    with request_span("find_boards_by_palette", request):
+        import palette_index
+
+        try:
+            query = palette_index.parse_palette(palette)
+        except ValueError as e:
+            raise AppError(str(e))
+        matches = palette_index.index().near(query, limit=int(limit or 8))
+        return {"boards": [{"image": str(OUTPUT_DIR / match["name"]), "distance": match["distance"]} for match in matches]}
+
+
+def search_catalog(query: str = "", page: int = 1, page_size: int = 20, request: gr.Request | None = None) -> dict:
+    """Full-text search over catalogued subjects, prompts, edit requests and reasoning, one page
+    at a time (best match first; newest first for an empty query)."""
+    with request_span("search_catalog", request):
+        import catalog
+
+        if not catalog.CATALOG_ENABLED:
+            raise AppError("The catalog is disabled (CATALOG_ENABLED=0).")
+        page = catalog.catalog().search(query, page, page_size)
+        for result in page["results"]:
+            result["image"] = str(OUTPUT_DIR / result["output_id"])
+        return page
+
+
+def _cancel_session_jobs(session: str | None, endpoint: str | None = None) -> int:
+    import job_queue
+
+    return job_queue.store().cancel_session(session, endpoint) if session else 0
+
+
+def cancel_session(session_id: str, request: gr.Request | None = None) -> dict:
+    """Cancel all in-flight work of a client session, including its queued and running jobs
+    (sent by the frontend when its tab closes)."""
+    session = session_id or cancellation.session_key(request)
+    return {"cancelled": cancellation.cancel_session(session), "jobs_cancelled": _cancel_session_jobs(session)}
+
+
+def _cancel_on_unload(request: gr.Request):
+    session = cancellation.session_key(request)
+    cancellation.cancel_session(session)
+    _cancel_session_jobs(session)
+
+
+# Endpoints that can also be run through the durable job queue
+JOB_HANDLERS = {
+    "generate_image": generate_image,
+    "edit_image_region": edit_image_region,
+}
+# As when they are called directly, a newer job for these from the same client session cancels the older one
+SUPERSEDING_JOBS = ("generate_image",)
+
+
+def submit_job(endpoint: str, data: list, request: gr.Request | None = None) -> dict:
+    """Queue a generate/edit call and return its job ID right away; poll get_job for the result.
+    `data` is the positional input list the endpoint takes when called directly."""
+    import inspect
+
+    import job_queue
+    from tracing import correlation_id_from_request
+
+    fn = JOB_HANDLERS.get(endpoint)
+    if fn is None:
+        raise AppError(f"Unknown job endpoint: {endpoint}. Choose one of {', '.join(JOB_HANDLERS)}.")
+    accepted = [name for name in inspect.signature(fn).parameters if name != "request"]
+    if not isinstance(data, list) or len(data) > len(accepted):
+        raise AppError(f"{endpoint} takes a list of at most {len(accepted)} inputs.")
+    # A user's API key is never written to the job store; it stays with this process's workers
+    key_index = accepted.index("api_key")
+    private = {key_index: data[key_index]} if len(data) > key_index and data[key_index] else None
+    if private and not job_queue.has_local_workers():
+        raise AppError("Queued jobs on this server use its own API key. Leave the API key empty, or call "
+                       f"{endpoint} directly.")
+    session = cancellation.session_key(request)
+    superseded = _cancel_session_jobs(session, endpoint) if endpoint in SUPERSEDING_JOBS else 0
+    job_id = job_queue.submit(endpoint, data, correlation_id_from_request(request), private=private, session=session)
+    metrics.inc("moodboard_jobs_submitted_total", endpoint=endpoint)
+    log_event(logger, logging.INFO, "job_submitted", job_id=job_id, endpoint=endpoint, superseded=superseded)
+    return {"job_id": job_id, "status": job_queue.QUEUED}
+
+
+def get_job(job_id: str) -> dict:
+    """Status of a queued job, with its outputs (`data`) once it succeeded or `error` if it failed."""
+    import job_queue
+
+    job = job_queue.store().get(job_id or "")
+    if job is None:
+        raise AppError("Unknown job. It may have expired; please submit it again.")
+    return job
+
+
+def cancel_job(job_id: str) -> dict:
+    """Cancel a queued or running job."""
+    import job_queue
+
+    return {"cancelled": job_queue.store().cancel(job_id or "")}
+
+
+def build_demo():
+    """Build the Gradio Blocks UI (skipped entirely in headless mode)."""
+    import panel_assembly
+    import regional_edit
+
+    with gr.Blocks(title="Fashion Moodboard", css="""
+        .main-container {
+            display: flex;
+            flex-direction: column;
+            height: 100vh;
+        }
+        .image-section {
+            flex: 5;
+            display: flex;
+            align-items: center;
+            justify-content: center;
+            min-height: 0;
+        }
+        .input-section {
+            flex: 1;
+            display: flex;
+            align-items: center;
+            justify-content: center;
+            padding: 20px;
+        }
+        .input-wrapper {
+            width: 100%;
+            max-width: 900px;
+            display: flex;
+            gap: 10px;
+        }
+    """) as demo:
+        env_api_key_present = _env_api_key() is not None
+
+        # Load default template content
+        try:
+            default_template = _load_prompt_template()
+        except Exception as e:
+            default_template = f"Error loading template: {str(e)}"
+
+        try:
+            default_edit_template = _load_edit_template()
+        except Exception as e:
+            default_edit_template = f"Error loading edit template: {str(e)}"
+
+        # Model selector and prompt templates at the top
+        if not env_api_key_present:
+            gr.Markdown(
+                "### API key required\n"
+                "No `GEMINI_API_KEY` / `GOOGLE_API_KEY` found in the environment. "
+                "Paste your Gemini API key below to use the app."
             )
-        with gr.Tabs():
-            with gr.Tab("Generation Template"):
-                prompt_template_component = gr.Textbox(
-                    label="Prompt Template",
-                    value=default_template,
-                    lines=10,
-                    placeholder="Enter or modify the prompt template. Use {SUBJECT_PLACEHOLDER} for user input.",
+        api_key_input = gr.Textbox(
+            label="Gemini API Key",
+            placeholder="Paste your GEMINI_API_KEY / GOOGLE_API_KEY here",
+            type="password",
+            visible=not env_api_key_present,
+        )
+
+        with gr.Row():
+            with gr.Column(scale=0):
+                model_selector = gr.Radio(
+                    choices=MODEL_CHOICES,
+                    value=DEFAULT_MODEL_ID,
+                    label="Model",
+                )
+                generation_mode_selector = gr.Radio(
+                    choices=panel_assembly.GENERATION_MODES,
+                    value=panel_assembly.DEFAULT_GENERATION_MODE,
+                    label="Generation Mode (panels builds the grid from 8 parallel panels)",
                 )
-            with gr.Tab("Edit Template"):
-                with gr.Column():
-                    edit_template_component = gr.Textbox(
-                        label="Edit Template",
-                        value=default_edit_template,
+                latency_profile_selector = gr.Radio(
+                    choices=list(LATENCY_PROFILES),
+                    value=DEFAULT_LATENCY_PROFILE,
+                    label="Latency Profile (fast for iterating, quality for final boards)",
+                )
+            with gr.Tabs():
+                with gr.Tab("Generation Template"):
+                    prompt_template_component = gr.Textbox(
+                        label="Prompt Template",
+                        value=default_template,
                         lines=10,
-                        placeholder="Enter or modify the edit template. Use {X_TOP}, {Y_TOP}, {X_BOTTOM}, {Y_BOTTOM}, {WIDTH}, {HEIGHT}, {EDIT_REQUEST} as placeholders.",
-                    )
-                    gr.Markdown("### Edit Image Region")
-                    image_path_input = gr.Textbox(
-                        label="Image File Path (for API usage - use the path returned from generation)",
-                        placeholder="Leave empty to use the displayed image, or enter a file path",
-                        visible=False,  # Hidden in UI, but available for API
+                        placeholder="Enter or modify the prompt template. Use {SUBJECT_PLACEHOLDER} for user input.",
                     )
-                    with gr.Row():
-                        bbox_x_top = gr.Number(
-                            label="X Top",
-                            value=0,
-                            precision=0,
-                            minimum=0,
+                    # What requests send: the template ID until the text above is edited
+                    prompt_template_ref = gr.Textbox(value=PROMPT_TEMPLATE_NAME, visible=False)
+                with gr.Tab("Edit Template"):
+                    with gr.Column():
+                        edit_template_component = gr.Textbox(
+                            label="Edit Template",
+                            value=default_edit_template,
+                            lines=10,
+                            placeholder="Enter or modify the edit template. Use {X_TOP}, {Y_TOP}, {X_BOTTOM}, {Y_BOTTOM}, {WIDTH}, {HEIGHT}, {EDIT_REQUEST} as placeholders.",
                         )
-                        bbox_y_top = gr.Number(
-                            label="Y Top",
-                            value=0,
-                            precision=0,
-                            minimum=0,
+                        edit_template_ref = gr.Textbox(value=EDIT_TEMPLATE_NAME, visible=False)
+                        gr.Markdown("### Edit Image Region")
+                        image_path_input = gr.Textbox(
+                            label="Image File Path (for API usage - use the path returned from generation)",
+                            placeholder="Leave empty to use the displayed image, or enter a file path",
+                            visible=False,  # Hidden in UI, but available for API
                         )
-                    with gr.Row():
-                        bbox_x_bottom = gr.Number(
-                            label="X Bottom",
-                            value=100,
-                            precision=0,
-                            minimum=0,
+                        with gr.Row():
+                            bbox_x_top = gr.Number(
+                                label="X Top",
+                                value=0,
+                                precision=0,
+                                minimum=0,
+                            )
+                            bbox_y_top = gr.Number(
+                                label="Y Top",
+                                value=0,
+                                precision=0,
+                                minimum=0,
+                            )
+                        with gr.Row():
+                            bbox_x_bottom = gr.Number(
+                                label="X Bottom",
+                                value=100,
+                                precision=0,
+                                minimum=0,
+                            )
+                            bbox_y_bottom = gr.Number(
+                                label="Y Bottom",
+                                value=100,
+                                precision=0,
+                                minimum=0,
+                            )
+                        edit_request_input = gr.Textbox(
+                            label="Edit Request",
+                            placeholder="Describe what you want to change in this region...",
+                            lines=3,
                         )
-                        bbox_y_bottom = gr.Number(
-                            label="Y Bottom",
-                            value=100,
-                            precision=0,
-                            minimum=0,
+                        regions_input = gr.Textbox(
+                            label="Regions (optional JSON list of {x_top, y_top, x_bottom, y_bottom, edit_request}; replaces the bbox above)",
+                            placeholder='[{"x_top": 0, "y_top": 0, "x_bottom": 360, "y_bottom": 600, "edit_request": "..."}]',
+                            lines=2,
+                        )
+                        edit_mode_selector = gr.Radio(
+                            choices=regional_edit.EDIT_MODES,
+                            value=regional_edit.DEFAULT_EDIT_MODE,
+                            label="Edit Mode (regional sends only the region and blends it back)",
+                        )
+                        edit_button = gr.Button(
+                            "Apply Edit",
+                            variant="secondary",
+                            size="lg",
                         )
-                    edit_request_input = gr.Textbox(
-                        label="Edit Request",
-                        placeholder="Describe what you want to change in this region...",
-                        lines=3,
-                    )
-                    edit_button = gr.Button(
-                        "Apply Edit",
-                        variant="secondary",
-                        size="lg",
-                    )
-    
-    # Image display area (5 parts of height ratio)
-    with gr.Row(elem_classes=["image-section"]):
-        with gr.Column():
-            image_display = gr.Image(
-                label="",
-                type="filepath",  # Changed to filepath to work with saved file paths
-                show_label=False,
-                container=True,
-            )
-            with gr.Accordion("Reasoning Trace", open=False):
-                reasoning_display = gr.Markdown(value="")
-    
-    # Input area at bottom center (1 part of height ratio)
-    with gr.Row(elem_classes=["input-section"]):
-        with gr.Row(elem_classes=["input-wrapper"]):
-            prompt_input = gr.Textbox(
-                label="",
-                placeholder="Enter the fashion moodboard subject (e.g., 'sustainable luxury dress collection')...",
-                lines=1,
-                show_label=False,
-                scale=10,
-            )
-            send_button = gr.Button(
-                "Send",
-                variant="primary",
-                size="lg",
-                scale=1,
-            )
-    
-    # Set up the click handler
-    send_button.click(
-        fn=generate_image,
-        inputs=[
-            prompt_input,
-            model_selector,
-            prompt_template_component,
-            api_key_input,
-        ],
-        outputs=[image_display, reasoning_display],
-        api_name="generate_image",
-    )
-    
-    # Also allow Enter key to submit
-    prompt_input.submit(
-        fn=generate_image,
-        inputs=[
-            prompt_input,
-            model_selector,
-            prompt_template_component,
-            api_key_input,
-        ],
-        outputs=[image_display, reasoning_display],
-        api_name="generate_image_1",
-    )
-    
-    # Image editing handler
-    edit_button.click(
-        fn=edit_image_region,
-        inputs=[
-            image_display,
-            image_path_input,
-            bbox_x_top,
-            bbox_y_top,
-            bbox_x_bottom,
-            bbox_y_bottom,
-            edit_request_input,
-            model_selector,
-            edit_template_component,
-            api_key_input,
-        ],
-        outputs=[image_display, reasoning_display],
-        api_name="edit_image_region",
-    )
 
+        # Image display area (5 parts of height ratio)
+        with gr.Row(elem_classes=["image-section"]):
+            with gr.Column():
+                image_display = gr.Image(
+                    label="",
+                    type="filepath",  # Changed to filepath to work with saved file paths
+                    show_label=False,
+                    container=True,
+                )
+                with gr.Accordion("Reasoning Trace", open=False):
+                    reasoning_display = gr.Markdown(value="")
+                    run_info_display = gr.JSON(label="Run info")
 
-if __name__ == "__main__":
-    import os
+        # Input area at bottom center (1 part of height ratio)
+        with gr.Row(elem_classes=["input-section"]):
+            with gr.Row(elem_classes=["input-wrapper"]):
+                prompt_input = gr.Textbox(
+                    label="",
+                    placeholder="Enter the fashion moodboard subject (e.g., 'sustainable luxury dress collection')...",
+                    lines=1,
+                    show_label=False,
+                    scale=10,
+                )
+                send_button = gr.Button(
+                    "Send",
+                    variant="primary",
+                    size="lg",
+                    scale=1,
+                )
+                draft_button = gr.Button(
+                    "Draft → Refine",
+                    size="lg",
+                    scale=1,
+                )
+
+        # An edited template is sent inline from then on; copied in the browser, no server round trip
+        prompt_template_component.input(
+            fn=None, inputs=[prompt_template_component], outputs=[prompt_template_ref], js="(text) => text"
+        )
+        edit_template_component.input(
+            fn=None, inputs=[edit_template_component], outputs=[edit_template_ref], js="(text) => text"
+        )
+
+        # Set up the click handler
+        send_button.click(
+            fn=generate_image,
+            inputs=[
+                prompt_input,
+                model_selector,
+                prompt_template_ref,
+                api_key_input,
+                generation_mode_selector,
+                latency_profile_selector,
+            ],
+            outputs=[image_display, reasoning_display, run_info_display],
+            api_name="generate_image",
+        )
+
+        # Also allow Enter key to submit
+        prompt_input.submit(
+            fn=generate_image,
+            inputs=[
+                prompt_input,
+                model_selector,
+                prompt_template_ref,
+                api_key_input,
+                generation_mode_selector,
+                latency_profile_selector,
+            ],
+            outputs=[image_display, reasoning_display, run_info_display],
+            api_name="generate_image_1",
+        )
 
+        # Quick draft first, swapped for the refined board when it lands
+        draft_button.click(
+            fn=generate_image_progressive,
+            inputs=[
+                prompt_input,
+                model_selector,
+                prompt_template_ref,
+                api_key_input,
+                generation_mode_selector,
+            ],
+            outputs=[image_display, reasoning_display, run_info_display],
+            api_name="generate_image_progressive",
+        )
+
+        # Image editing handler
+        edit_button.click(
+            fn=edit_image_region,
+            inputs=[
+                image_display,
+                image_path_input,
+                bbox_x_top,
+                bbox_y_top,
+                bbox_x_bottom,
+                bbox_y_bottom,
+                edit_request_input,
+                model_selector,
+                edit_template_ref,
+                api_key_input,
+                edit_mode_selector,
+                regions_input,
+                latency_profile_selector,
+            ],
+            outputs=[image_display, reasoning_display, run_info_display],
+            api_name="edit_image_region",
+        )
+
+        gr.api(list_templates, api_name="list_templates")
+        gr.api(get_panel_index, api_name="get_panel_index")
+        gr.api(find_similar_moodboard, api_name="find_similar_moodboard")
+        gr.api(find_similar_boards, api_name="find_similar_boards")
+        gr.api(get_board_palette, api_name="get_board_palette")
+        gr.api(find_boards_by_palette, api_name="find_boards_by_palette")
+        gr.api(search_catalog, api_name="search_catalog")
+        gr.api(cancel_session, api_name="cancel_session")
+        gr.api(submit_job, api_name="submit_job")
+        gr.api(get_job, api_name="get_job")
+        gr.api(cancel_job, api_name="cancel_job")
+        # Closing the tab abandons whatever this page still has queued or in flight
+        demo.unload(_cancel_on_unload)
+
+    return demo
+
+
+demo = None if HEADLESS else build_demo()
+
+
+if __name__ == "__main__":
     server_port = int(os.environ.get("GRADIO_SERVER_PORT", os.environ.get("PORT", "7860")))
     server_name = os.environ.get("GRADIO_SERVER_NAME", "0.0.0.0")
-    demo.launch(show_error=True, server_name=server_name, server_port=server_port, share=False)
+    import job_queue
+    import prompt_cache
+
+    # Picks up jobs left queued or interrupted by a previous run
+    job_queue.start_workers(JOB_HANDLERS)
+    if prompt_cache.PROMPT_CACHE_ENABLED:
+        prompt_cache.cache()  # starts loading the prompt cache, so the first lookups do not wait for it
+    if HEADLESS:
+        # Let headless_app's `import mb_app` reuse this module instead of re-executing it.
+        sys.modules.setdefault("mb_app", sys.modules[__name__])
+        import headless_app
+
+        headless_app.run(server_name=server_name, server_port=server_port)
+    else:
+        demo.launch(show_error=True, server_name=server_name, server_port=server_port, share=False)
@@ -0,0 +1,68 @@
+import threading
+
+
+# Smoothing for running averages (e.g. typical model-call latency per model).
+EWMA_ALPHA = 0.2
+
+_lock = threading.Lock()
+_counters: dict[tuple, float] = {}
+_averages: dict[tuple, float] = {}
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+
+def inc(name: str, value: float = 1.0, **labels) -> None:
+    """Add to a monotonically increasing counter."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0.0) + value
+
+
+def get(name: str, **labels) -> float:
+    with _lock:
+        return _counters.get(_key(name, labels), 0.0)
+
+
+def observe_average(name: str, value: float, **labels) -> None:
+    """Fold a sample into an exponentially weighted moving average."""
+    key = _key(name, labels)
+    with _lock:
+        previous = _averages.get(key)
+        _averages[key] = value if previous is None else previous + EWMA_ALPHA * (value - previous)
+
+
+def average(name: str, **labels) -> float | None:
+    with _lock:
+        return _averages.get(_key(name, labels))
+
+
+def _series(key: tuple) -> str:
+    name, labels = key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def snapshot() -> dict:
+    """All counters and averages as {"name{label=...}": value}."""
+    with _lock:
+        values = {_series(key): value for key, value in _counters.items()}
+        values.update({_series(key): value for key, value in _averages.items()})
+    return values
+
+
+def render_prometheus() -> str:
+    """Counters and averages in the Prometheus text exposition format."""
+    with _lock:
+        series = [(key, value, "counter") for key, value in _counters.items()]
+        series += [(key, value, "gauge") for key, value in _averages.items()]
+    lines = []
+    typed = set()
+    for key, value, kind in sorted(series, key=lambda item: item[0]):
+        if key[0] not in typed:
+            lines.append(f"# TYPE {key[0]} {kind}")
+            typed.add(key[0])
+        lines.append(f"{_series(key)} {value:g}")
+    return "\n".join(lines) + "\n"
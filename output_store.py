@@ -0,0 +1,144 @@
+import json
+import os
+import re
+import threading
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+
+# Every backend worker reads and writes the same directory, so any worker can serve or
+# edit an image another one produced. Point this at a shared volume when scaling out.
+OUTPUT_DIR = Path(os.environ.get("MOODBOARD_OUTPUT_DIR") or Path(__file__).parent / "outputs")
+OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+# Databases and indexes kept about the outputs (job queue, catalog, lookup indexes). Shared by
+# every worker like OUTPUT_DIR, but never served: keep it outside the public output store.
+DATA_DIR = Path(os.environ.get("MOODBOARD_DATA_DIR") or Path(__file__).parent / "data")
+DATA_DIR.mkdir(parents=True, exist_ok=True)
+# When a front proxy serves the store directly (nginx `location /outputs/`), hand out
+# URLs under this prefix instead of routing image bytes through the Python process.
+OUTPUT_URL_PREFIX = os.environ.get("MOODBOARD_OUTPUT_URL_PREFIX", "")
+
+# The only files served from the store: outputs, their thumbnails (lineage_export) and panel
+# slices (panel_slices). Sidecars and anything else kept next to them are never served.
+PUBLIC_FILE_NAME = re.compile(r"^(?:generated|edited)_[A-Za-z0-9_-]+(?:\.thumb\.jpg|\.panel_r\d+c\d+\.png|\.png)$")
+
+
+def new_output_path(prefix: str, suffix: str = ".png") -> Path:
+    """Return a fresh, never-reused path such as outputs/generated_20251129_102303_74a7602b.png."""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    unique_id = str(uuid.uuid4())[:8]
+    return OUTPUT_DIR / f"{prefix}_{timestamp}_{unique_id}{suffix}"
+
+
+def save_output(pil_image, prefix: str, same_as: Path | None = None) -> Path:
+    """Save a PNG atomically so other workers never observe a partially written file.
+    With `same_as` (an existing output with identical pixels) the new path is a hard link to
+    it, so the bytes are stored once however many versions reference them."""
+    output_path = new_output_path(prefix)
+    tmp_path = output_path.with_name(f".{output_path.name}.{os.getpid()}.tmp")
+    try:
+        linked = False
+        if same_as is not None:
+            try:
+                os.link(same_as, tmp_path)
+                linked = True
+            except OSError:
+                pass  # e.g. hard links unsupported on this volume: store a copy
+        if not linked:
+            pil_image.save(tmp_path, format="PNG")
+        os.replace(tmp_path, output_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    return output_path
+
+
+def sidecar_path(path: str | Path, kind: str) -> Path:
+    """Path of a JSON sidecar stored next to an output, e.g. generated_x.png -> generated_x.panels.json."""
+    path = Path(path)
+    return path.with_name(f"{path.stem}.{kind}.json")
+
+
+def sidecars(path: str | Path) -> list[Path]:
+    """All sidecars stored next to an output (JSON sidecars and derived files such as thumbnails)."""
+    path = Path(path)
+    return sorted(p for p in path.parent.glob(f"{path.stem}.*") if p.name != path.name)
+
+
+def write_sidecar(path: str | Path, kind: str, data) -> Path:
+    """Write a sidecar atomically, like save_output, so readers never see partial JSON."""
+    target = sidecar_path(path, kind)
+    tmp_path = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, target)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    return target
+
+
+def read_sidecar(path: str | Path, kind: str):
+    """Return a sidecar's data, or None if it does not exist or is unreadable."""
+    try:
+        with open(sidecar_path(path, kind), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_public(path: str | Path) -> bool:
+    """Whether a path names a servable file directly inside OUTPUT_DIR (it need not exist yet)."""
+    path = Path(path).resolve()
+    return path.parent == OUTPUT_DIR.resolve() and PUBLIC_FILE_NAME.match(path.name) is not None
+
+
+def output_url(path: str | Path) -> str | None:
+    """Public URL for a stored output, or None when no direct-serving prefix is configured."""
+    if not OUTPUT_URL_PREFIX:
+        return None
+    relative = Path(path).resolve().relative_to(OUTPUT_DIR.resolve())
+    return f"{OUTPUT_URL_PREFIX.rstrip('/')}/{relative.as_posix()}"
+
+
+class AppendLog:
+    """Append-only JSON-lines file in the shared data directory. Every worker appends to it and tails
+    it from its own offset, so all of them see each other's entries."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._offset = 0
+        self._lock = threading.Lock()
+
+    def append(self, entry: dict) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # One write() per line in append mode, so concurrent writers never interleave
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def read_new(self, max_bytes: int | None = None) -> list[dict]:
+        """Entries appended since the last call (all of them on the first call). With max_bytes
+        only about that much is read (at least one entry), so a long log can be read in batches."""
+        with self._lock:
+            try:
+                size = self.path.stat().st_size
+            except FileNotFoundError:
+                return []
+            if size <= self._offset:
+                return []
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                chunk = f.read(size - self._offset if max_bytes is None else min(max_bytes, size - self._offset))
+                if max_bytes is not None and b"\n" not in chunk:
+                    chunk += f.readline()
+            complete = chunk.rfind(b"\n") + 1  # leave a partially written line for next time
+            self._offset += complete
+        entries = []
+        for line in chunk[:complete].splitlines():
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+        return entries
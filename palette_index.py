@@ -0,0 +1,317 @@
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from output_store import DATA_DIR, OUTPUT_DIR, AppendLog, read_sidecar, sidecars, write_sidecar
+from panel_index import PANEL_BACKGROUND_THRESHOLD
+from structured_log import get_logger, log_event
+
+
+PALETTE_INDEX_ENABLED = os.environ.get("PALETTE_INDEX_ENABLED", "1").strip().lower() not in ("0", "false", "no")
+# Append-only log of every board's palette (in Lab), shared by all backend processes.
+PALETTE_INDEX_FILE = Path(os.environ.get("PALETTE_INDEX_FILE") or DATA_DIR / "palettes.jsonl")
+# Boards whose palette is within this distance (mean CIE76 delta E, see palette_distance) match a query.
+PALETTE_MAX_DISTANCE = float(os.environ.get("PALETTE_MAX_DISTANCE", "20"))
+PALETTE_KIND = "palette"
+PALETTE_VERSION = 1
+# The template asks for "5 distinct, solid earthy color swatches" in the last Details panel.
+PALETTE_COLORS = 5
+SWATCH_PANEL = (2, 4)  # (row, column)
+# A swatch panel is trusted when this fraction of its pixels lies within SWATCH_MAX_DELTA_E of
+# their cluster colour, and the same fraction of neighbouring pixels share a cluster (i.e. it
+# really is solid blocks, not a photo).
+SWATCH_MIN_SOLID = 0.8
+SWATCH_MAX_DELTA_E = 10.0
+# Clusters covering less than this fraction of a panel are dropped (antialiased edges, specks).
+PALETTE_MIN_WEIGHT = 0.02
+# Panels are downsampled to this many pixels per side before clustering, after trimming this
+# fraction off each side (the hairline border and its antialiasing).
+PALETTE_SAMPLE_SIZE = 48
+PALETTE_INSET = 0.03
+KMEANS_ITERATIONS = 12
+
+logger = get_logger("palette_index")
+
+_SRGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+], dtype=np.float32)
+_D65_WHITE = np.array([0.95047, 1.0, 1.08883], dtype=np.float32)
+_HEX = re.compile(r"#?([0-9a-fA-F]{6}|[0-9a-fA-F]{3})")
+
+
+def srgb_to_lab(rgb) -> np.ndarray:
+    """CIE Lab (D65) of sRGB values in 0-255, over the last axis."""
+    c = np.asarray(rgb, dtype=np.float32) / 255
+    linear = np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+    t = (linear @ _SRGB_TO_XYZ.T) / _D65_WHITE
+    f = np.where(t > (6 / 29) ** 3, np.cbrt(t), t / (3 * (6 / 29) ** 2) + 4 / 29)
+    return np.stack([116 * f[..., 1] - 16, 500 * (f[..., 0] - f[..., 1]), 200 * (f[..., 1] - f[..., 2])], axis=-1)
+
+
+def _hex(rgb) -> str:
+    return "#" + "".join(f"{int(round(float(v))):02x}" for v in np.clip(rgb, 0, 255))
+
+
+def kmeans(points: np.ndarray, k: int, valid: np.ndarray | None = None, iterations: int = KMEANS_ITERATIONS):
+    """Batched k-means: clusters each of P point sets (shape [P, N, D]) at once.
+
+    Deterministic farthest-point initialization, so a palette's distinct colours each get a
+    centre even when one of them covers little area. `valid` ([P, N]) masks points out.
+    Returns (centres [P, k, D], one-hot assignment [P, N, k])."""
+    points = np.asarray(points, dtype=np.float32)
+    count, n, _ = points.shape
+    valid = np.ones((count, n), dtype=bool) if valid is None else valid
+    rows = np.arange(count)
+
+    mean = (points * valid[..., None]).sum(axis=1) / np.maximum(valid.sum(axis=1), 1)[:, None]
+    first = np.where(valid, ((points - mean[:, None]) ** 2).sum(axis=-1), np.inf).argmin(axis=1)
+    centres = [points[rows, first]]
+    nearest = ((points - centres[0][:, None]) ** 2).sum(axis=-1)
+    for _ in range(1, k):
+        pick = np.where(valid, nearest, -1).argmax(axis=1)
+        centres.append(points[rows, pick])
+        nearest = np.minimum(nearest, ((points - centres[-1][:, None]) ** 2).sum(axis=-1))
+    centres = np.stack(centres, axis=1)
+
+    norms = (points ** 2).sum(axis=-1)[..., None]
+    labels = None
+    for _ in range(iterations):
+        distances = norms - 2 * (points @ centres.transpose(0, 2, 1)) + (centres ** 2).sum(axis=-1)[:, None, :]
+        new_labels = distances.argmin(axis=2)
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        assigned = (labels[..., None] == np.arange(k)) & valid[..., None]
+        sizes = assigned.sum(axis=1)
+        sums = np.einsum("pnk,pnd->pkd", assigned.astype(np.float32), points)
+        centres = np.where(sizes[..., None] > 0, sums / np.maximum(sizes, 1)[..., None], centres)
+    assigned = (labels[..., None] == np.arange(k)) & valid[..., None]
+    return centres, assigned
+
+
+def _samples(image, boxes) -> np.ndarray:
+    """RGB pixels of each box, downsampled to PALETTE_SAMPLE_SIZE squared ([P, N, 3])."""
+    size = (PALETTE_SAMPLE_SIZE, PALETTE_SAMPLE_SIZE)
+    rgb = image.convert("RGB")
+    samples = []
+    for left, top, right, bottom in boxes:
+        dx, dy = int((right - left) * PALETTE_INSET), int((bottom - top) * PALETTE_INSET)
+        crop = rgb.crop((left + dx, top + dy, right - dx, bottom - dy))
+        samples.append(np.asarray(crop.resize(size, Image.Resampling.BOX), dtype=np.float32).reshape(-1, 3))
+    return np.stack(samples)
+
+
+def _colors(rgb_means, labs, weights, order) -> list[dict]:
+    return [
+        {"hex": _hex(rgb_means[i]), "lab": [round(float(v), 1) for v in labs[i]], "weight": round(float(weights[i]), 3)}
+        for i in order
+    ]
+
+
+def extract(image, panels: list[dict]) -> dict:
+    """Dominant colours of every panel and of the whole board, plus the swatch strip's colours
+    in display order when the board has one. One batched k-means over all of them."""
+    boxes = [panel["box"] for panel in panels] + [[0, 0, image.size[0], image.size[1]]]
+    rgb = _samples(image, boxes)
+    lab = srgb_to_lab(rgb)
+    valid = ~(rgb >= PANEL_BACKGROUND_THRESHOLD).all(axis=-1)  # gutters and white margins
+    valid[valid.sum(axis=1) < PALETTE_COLORS] = True  # an all-white panel is still clustered
+    centres, assigned = kmeans(lab, PALETTE_COLORS, valid)
+
+    sizes = assigned.sum(axis=1)
+    weights = sizes / np.maximum(sizes.sum(axis=1, keepdims=True), 1)
+    rgb_means = np.einsum("pnk,pnd->pkd", assigned.astype(np.float32), rgb) / np.maximum(sizes, 1)[..., None]
+    keep = weights >= PALETTE_MIN_WEIGHT
+    by_weight = [[i for i in np.argsort(-weights[p], kind="stable") if keep[p, i]] for p in range(len(boxes))]
+
+    result = {
+        "version": PALETTE_VERSION,
+        "source": "dominant",
+        "swatches": [],
+        "board": _colors(rgb_means[-1], centres[-1], weights[-1], by_weight[-1]),
+        "panels": [
+            {"row": panel["row"], "column": panel["column"], "colors": _colors(rgb_means[p], centres[p], weights[p], by_weight[p])}
+            for p, panel in enumerate(panels)
+        ],
+    }
+    swatch = next((p for p, panel in enumerate(panels) if (panel["row"], panel["column"]) == SWATCH_PANEL), None)
+    if swatch is not None:
+        labels = assigned[swatch].argmax(axis=1)
+        error = np.sqrt(((lab[swatch] - centres[swatch][labels]) ** 2).sum(axis=-1))
+        solid = (error[valid[swatch]] <= SWATCH_MAX_DELTA_E).mean()
+        grid_labels = labels.reshape(PALETTE_SAMPLE_SIZE, PALETTE_SAMPLE_SIZE)
+        coherent = min((grid_labels[:, 1:] == grid_labels[:, :-1]).mean(), (grid_labels[1:] == grid_labels[:-1]).mean())
+        if min(solid, coherent) >= SWATCH_MIN_SOLID and len(by_weight[swatch]) >= 3:
+            # Order along the strip: whichever axis the swatch centres are spread over
+            grid = np.indices((PALETTE_SAMPLE_SIZE, PALETTE_SAMPLE_SIZE)).reshape(2, -1).T.astype(np.float32)
+            positions = np.einsum("nk,nd->kd", assigned[swatch].astype(np.float32), grid) / np.maximum(sizes[swatch], 1)[:, None]
+            kept = by_weight[swatch]
+            axis = int(np.ptp(positions[kept], axis=0).argmax())
+            order = sorted(kept, key=lambda i: positions[i, axis])
+            result["swatches"] = _colors(rgb_means[swatch], centres[swatch], weights[swatch], order)
+            result["source"] = "swatches"
+    return result
+
+
+def palette_labs(palette: dict) -> list[list[float]]:
+    """The colours a board is indexed under: its swatches, or its dominant colours if it has none."""
+    return [color["lab"] for color in (palette["swatches"] or palette["board"])]
+
+
+def parse_palette(colors) -> np.ndarray:
+    """Lab array of a query palette given as hex colours (a list, or one comma/space separated string)."""
+    if isinstance(colors, str):
+        colors = re.split(r"[\s,;]+", colors.strip())
+    colors = [c for c in (colors or []) if c]
+    if not colors or len(colors) > 16:
+        raise ValueError("Give between 1 and 16 hex colours, e.g. '#8b5a2b, #d2b48c'.")
+    rgb = []
+    for color in colors:
+        match = _HEX.fullmatch(str(color).strip())
+        if not match:
+            raise ValueError(f"Not a hex colour: {color!r}")
+        digits = match.group(1)
+        if len(digits) == 3:
+            digits = "".join(d * 2 for d in digits)
+        rgb.append([int(digits[i:i + 2], 16) for i in (0, 2, 4)])
+    return srgb_to_lab(np.array(rgb, dtype=np.float32))
+
+
+def palette_distance(boards: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """Symmetric chamfer distance between each board palette ([B, K, 3]) and a query ([Q, 3]):
+    the mean delta E from every colour to the nearest colour of the other palette, averaged
+    over both directions. Order-free, and palettes of different lengths compare fine."""
+    # |b - q|^2 = |b|^2 - 2 b.q + |q|^2, so the cross term is one matmul. Boards go last so the
+    # reductions below run over long contiguous rows.
+    flat = boards.transpose(1, 0, 2).reshape(-1, 3)
+    squared = (query ** 2).sum(axis=-1)[:, None] - 2 * (query @ flat.T) + (flat ** 2).sum(axis=-1)
+    delta = np.sqrt(np.maximum(squared, 0)).reshape(len(query), boards.shape[1], len(boards))  # [Q, K, B]
+    return (delta.min(axis=1).mean(axis=0) + delta.min(axis=0).mean(axis=0)) / 2
+
+
+class PaletteIndex:
+    """In-memory Lab palettes of all boards, scanned with vectorized distance chunks."""
+
+    CHUNK = 65536
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._labs = np.empty((1024, PALETTE_COLORS, 3), dtype=np.float32)
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add(self, labs) -> int:
+        labs = np.asarray(labs, dtype=np.float32).reshape(-1, 3)
+        with self._lock:
+            entry_id = self._count
+            if entry_id == len(self._labs):
+                self._labs = np.concatenate([self._labs, np.empty_like(self._labs)])
+            # Shorter palettes repeat their colours; nearest-colour distances are unchanged
+            self._labs[entry_id] = labs[np.arange(PALETTE_COLORS) % len(labs)]
+            self._count += 1
+            return entry_id
+
+    def query(self, query: np.ndarray, max_distance: float) -> list[tuple[int, float]]:
+        """(entry id, distance) of every palette within max_distance, nearest first."""
+        with self._lock:
+            labs, count = self._labs, self._count
+        ids, distances = [], []
+        for start in range(0, count, self.CHUNK):
+            distance = palette_distance(labs[start:min(start + self.CHUNK, count)], query)
+            found = np.flatnonzero(distance <= max_distance)
+            ids.append(found + start)
+            distances.append(distance[found])
+        if not ids:
+            return []
+        ids, distances = np.concatenate(ids), np.concatenate(distances)
+        order = np.lexsort((-ids, distances))  # nearest first, newest first among equals
+        return [(int(ids[i]), float(distances[i])) for i in order]
+
+
+class BoardPalettes:
+    """PaletteIndex backed by an append-only log shared by all workers."""
+
+    def __init__(self, path: Path = PALETTE_INDEX_FILE):
+        self.log = AppendLog(path)
+        self.palettes = PaletteIndex()
+        self._names: list[str] = []
+        self._lock = threading.Lock()
+
+    def _sync(self) -> None:
+        with self._lock:  # entry ids and names must be added in the same order
+            for entry in self.log.read_new():
+                try:
+                    self.palettes.add(entry["lab"])
+                except (KeyError, ValueError, ZeroDivisionError):
+                    continue
+                self._names.append(entry["name"])
+
+    def record(self, name: str, palette: dict) -> None:
+        self.log.append({"name": name, "source": palette["source"], "lab": palette_labs(palette)})
+        self._sync()
+
+    def near(self, query: np.ndarray, max_distance: float = PALETTE_MAX_DISTANCE, limit: int = 8) -> list[dict]:
+        self._sync()
+        matches, seen = [], set()
+        for entry_id, distance in self.palettes.query(query, max_distance):
+            with self._lock:
+                name = self._names[entry_id]
+            if name in seen or not (OUTPUT_DIR / name).is_file():
+                continue
+            seen.add(name)
+            matches.append({"name": name, "distance": round(distance, 2)})
+            if len(matches) >= limit:
+                break
+        return matches
+
+
+_index_lock = threading.Lock()
+_index: BoardPalettes | None = None
+
+
+def index() -> BoardPalettes:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = BoardPalettes()
+        return _index
+
+
+def analyze(path) -> dict:
+    """Extract a saved output's palette, store it next to it and add it to the index.
+    Runs as a post-save stage, off the request path."""
+    import panel_index
+
+    path = Path(path)
+    with Image.open(path) as image:
+        image.load()
+        panels = panel_index.load_index(path, image)
+        palette = extract(image, panels["panels"] if panels else [])
+    write_sidecar(path, PALETTE_KIND, palette)
+    if not path.is_file():  # deleted while we worked on it: leave no orphaned sidecars behind
+        for sidecar in sidecars(path):
+            sidecar.unlink(missing_ok=True)
+        return palette
+    try:
+        index().record(path.name, palette)
+    except OSError as e:
+        log_event(logger, logging.WARNING, "palette_index_write_failed", output=path.name, error=str(e))
+    return palette
+
+
+def load_palette(path) -> dict:
+    """An output's palette; extracted now if the background stage has not got to it (or it
+    was saved before palettes existed)."""
+    palette = read_sidecar(path, PALETTE_KIND)
+    if palette and palette.get("version") == PALETTE_VERSION:
+        return palette
+    return analyze(path)
@@ -0,0 +1,237 @@
+import contextvars
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageDraw, ImageOps
+
+from cancellation import RequestCancelled
+from structured_log import get_logger, log_event
+from tracing import span
+
+
+GENERATION_MODE_SINGLE = "single"
+GENERATION_MODE_PANELS = "panels"
+GENERATION_MODES = [GENERATION_MODE_SINGLE, GENERATION_MODE_PANELS]
+DEFAULT_GENERATION_MODE = os.environ.get("DEFAULT_GENERATION_MODE", GENERATION_MODE_SINGLE)
+# One worker per panel by default, so the board takes about one panel's latency.
+PANEL_WORKERS = int(os.environ.get("PANEL_WORKERS", "8"))
+PANEL_MAX_ATTEMPTS = int(os.environ.get("PANEL_MAX_ATTEMPTS", "3"))
+
+# Geometry from prompt_template.txt: a 1440x1024 canvas, 4 portrait 3:4 "Look" panels over
+# 4 slightly-wider-than-square "Details" panels, 1px #808080 borders and white spacing.
+CANVAS_SIZE = (1440, 1024)
+CANVAS_BACKGROUND = "#FFFFFF"
+BORDER_COLOR = "#808080"
+BORDER_WIDTH = 1
+CANVAS_MARGIN = 24
+PANEL_GAP = 16
+LOOK_ASPECT = 3 / 4
+DETAIL_ASPECT = 1.1
+# Closest ratios image_config accepts for each row; panels are cover-cropped to the exact cell.
+LOOK_MODEL_ASPECT_RATIO = "3:4"
+DETAIL_MODEL_ASPECT_RATIO = "1:1"
+
+DEFAULT_LOOK_BRIEF = "Full-body or 3/4 editorial shot of a fashion model wearing a garment from the collection."
+DEFAULT_DETAIL_BRIEFS = [
+    "Detailed close-up product shot of a key accessory.",
+    "Detailed close-up product shot of footwear or secondary metal/stone jewelry.",
+    "Macro photography filling the frame with raw fabric texture.",
+    "A minimalist visual strip showing 5 distinct, solid color swatches from the collection palette.",
+]
+PANEL_INSTRUCTIONS = (
+    "Produce one standalone image that fills the entire frame. "
+    "It will be tiled into the moodboard grid later, so do not draw a grid, collage, borders, frames or spacing."
+)
+
+_HEADER_PATTERN = re.compile(r"^\*\*\[?(?P<name>[^\]*]+?)\]?\*\*\s*$")
+_DETAIL_LINE_PATTERN = re.compile(r"^Image\s+(?P<number>[1-4])\s*(?:\([^)]*\))?\s*:\s*(?P<brief>.+)$", re.IGNORECASE)
+
+logger = get_logger("panel_assembly")
+
+
+class PanelGenerationError(Exception):
+    """Raised when one or more panels still fail after all retries."""
+
+    def __init__(self, failures: dict):
+        self.failures = failures
+        names = ", ".join(f"panel {index + 1} ({error})" for index, error in sorted(failures.items()))
+        super().__init__(f"Could not generate {names}.")
+
+
+def panel_layout(canvas_size=CANVAS_SIZE) -> list[dict]:
+    """Cell boxes (left, top, right, bottom) for the 8 panels, row by row, left to right.
+
+    Columns share the width; each row's height follows its aspect ratio, which puts ~60% of
+    the panel height in the top row. Leftover height is split evenly above and below the grid."""
+    canvas_width, canvas_height = canvas_size
+    column_width = (canvas_width - 2 * CANVAS_MARGIN - 3 * PANEL_GAP) // 4
+    look_height = round(column_width / LOOK_ASPECT)
+    detail_height = round(column_width / DETAIL_ASPECT)
+    grid_height = look_height + PANEL_GAP + detail_height
+    grid_width = 4 * column_width + 3 * PANEL_GAP
+    left_offset = (canvas_width - grid_width) // 2
+    top_offset = max((canvas_height - grid_height) // 2, 0)
+
+    rows = [
+        (1, "Top Row (The Look)", top_offset, look_height, LOOK_MODEL_ASPECT_RATIO),
+        (2, "Bottom Row (The Details)", top_offset + look_height + PANEL_GAP, detail_height, DETAIL_MODEL_ASPECT_RATIO),
+    ]
+    layout = []
+    for row, row_name, top, height, aspect_ratio in rows:
+        for column in range(1, 5):
+            left = left_offset + (column - 1) * (column_width + PANEL_GAP)
+            layout.append({
+                "index": len(layout),
+                "row": row,
+                "column": column,
+                "name": f"{row_name}, Cell {column}",
+                "box": (left, top, left + column_width, top + height),
+                "aspect_ratio": aspect_ratio,
+            })
+    return layout
+
+
+def _template_sections(prompt: str) -> dict:
+    """Split a filled-in prompt template into {header: body} on whole-line bold headers."""
+    sections = {}
+    name = None
+    for line in prompt.splitlines():
+        match = _HEADER_PATTERN.match(line.strip())
+        if match:
+            name = match.group("name").strip().rstrip(":").lower()
+            sections[name] = []
+        elif name is not None and line.strip():
+            sections[name].append(line.strip())
+    return sections
+
+
+def _section(sections: dict, prefix: str) -> list[str]:
+    for name, lines in sections.items():
+        if name.startswith(prefix):
+            return lines
+    return []
+
+
+def _field(lines: list[str], field: str) -> str | None:
+    for line in lines:
+        if line.lower().startswith(field.lower() + ":"):
+            return line.split(":", 1)[1].strip()
+    return None
+
+
+def split_panel_prompts(full_prompt: str, layout: list[dict] | None = None) -> list[str]:
+    """Turn the whole-board prompt into one prompt per panel.
+
+    The subject, constraints and quality notes are shared; each panel gets its own brief from
+    the row sections (falling back to the stock briefs when a custom template omits them)."""
+    layout = layout or panel_layout()
+    sections = _template_sections(full_prompt)
+    subject = " ".join(_section(sections, "subject")) or full_prompt.strip().splitlines()[0]
+    constraints = "\n".join(_section(sections, "critical constraints"))
+    quality = _field(_section(sections, "notes"), "Quality")
+    look_brief = _field(_section(sections, "row 1"), "Content") or DEFAULT_LOOK_BRIEF
+    detail_briefs = list(DEFAULT_DETAIL_BRIEFS)
+    for line in _section(sections, "row 2"):
+        match = _DETAIL_LINE_PATTERN.match(line)
+        if match:
+            detail_briefs[int(match.group("number")) - 1] = match.group("brief").strip()
+
+    prompts = []
+    for panel in layout:
+        if panel["row"] == 1:
+            brief = (
+                f"Look {panel['column']} of 4: {look_brief} "
+                "Use a different model, pose and outfit from the other looks of the same collection."
+            )
+        else:
+            brief = detail_briefs[panel["column"] - 1]
+        parts = [
+            f"**Subject:** {subject}",
+            f"**Panel:** {panel['name']} (panel {panel['index'] + 1} of {len(layout)})",
+            f"{brief}\nAspect Ratio: {panel['aspect_ratio']}.",
+            PANEL_INSTRUCTIONS,
+        ]
+        if constraints:
+            parts.append(constraints)
+        if quality:
+            parts.append(f"Quality: {quality}")
+        prompts.append("\n\n".join(parts))
+    return prompts
+
+
+def _generate_with_retries(panel: dict, prompt: str, generate_panel, max_attempts: int):
+    with span(
+        "panel",
+        **{"moodboard.panel": panel["index"] + 1, "moodboard.panel_aspect_ratio": panel["aspect_ratio"]},
+    ) as panel_span:
+        for attempt in range(1, max_attempts + 1):
+            panel_span.set_attribute("moodboard.attempts", attempt)
+            try:
+                image, reasoning = generate_panel(prompt, panel["aspect_ratio"])
+                if image is None:
+                    raise ValueError("no image data returned")
+                return image, reasoning
+            except RequestCancelled:
+                raise  # the request is gone; retrying would only waste quota
+            except Exception as e:
+                if attempt == max_attempts:
+                    raise
+                log_event(
+                    logger, logging.WARNING, "panel_retry",
+                    panel=panel["index"] + 1, attempt=attempt, error=f"{type(e).__name__}: {e}",
+                )
+
+
+def generate_panels(
+    prompts: list[str],
+    generate_panel,
+    layout: list[dict] | None = None,
+    max_workers: int = PANEL_WORKERS,
+    max_attempts: int = PANEL_MAX_ATTEMPTS,
+) -> list[tuple]:
+    """Run generate_panel(prompt, aspect_ratio) for every panel concurrently.
+
+    A failing panel is retried on its own; finished panels are never regenerated. Returns
+    (image, reasoning) per panel in layout order, or raises PanelGenerationError
+    (RequestCancelled is passed through untouched)."""
+    layout = layout or panel_layout()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(prompts))), thread_name_prefix="panel") as pool:
+        # Each task runs in a copy of the caller's context so its span nests under the request.
+        futures = [
+            pool.submit(contextvars.copy_context().run, _generate_with_retries, panel, prompt, generate_panel, max_attempts)
+            for panel, prompt in zip(layout, prompts)
+        ]
+        results, failures = [], {}
+        for index, future in enumerate(futures):
+            try:
+                results.append(future.result())
+            except RequestCancelled:
+                raise  # sibling panels see the same cancelled token and stop on their own
+            except Exception as e:
+                failures[index] = f"{type(e).__name__}: {e}"
+                results.append(None)
+    if failures:
+        raise PanelGenerationError(failures)
+    return results
+
+
+def compose_moodboard(panel_images: list, layout: list[dict] | None = None, canvas_size=CANVAS_SIZE) -> Image.Image:
+    """Tile the panels into the board, cover-cropping each to its cell and drawing hairline borders."""
+    layout = layout or panel_layout(canvas_size)
+    canvas = Image.new("RGB", canvas_size, CANVAS_BACKGROUND)
+    draw = ImageDraw.Draw(canvas)
+    for panel, image in zip(layout, panel_images):
+        left, top, right, bottom = panel["box"]
+        tile = ImageOps.fit(image.convert("RGB"), (right - left, bottom - top), Image.LANCZOS)
+        canvas.paste(tile, (left, top))
+        draw.rectangle((left, top, right - 1, bottom - 1), outline=BORDER_COLOR, width=BORDER_WIDTH)
+    return canvas
+
+
+def combine_reasoning(layout: list[dict], reasonings: list[str]) -> str:
+    return "\n\n".join(
+        f"**Panel {panel['index'] + 1} ({panel['name']})**\n\n{reasoning}"
+        for panel, reasoning in zip(layout, reasonings)
+    )
@@ -0,0 +1,160 @@
+import logging
+import os
+
+import numpy as np
+
+from output_store import read_sidecar, write_sidecar
+from structured_log import get_logger, log_event
+from tracing import span
+
+
+PANEL_INDEX_KIND = "panels"
+PANEL_INDEX_VERSION = 1
+# Pixels at least this bright count as white gutter/background.
+PANEL_BACKGROUND_THRESHOLD = int(os.environ.get("PANEL_BACKGROUND_THRESHOLD", "235"))
+# A row/column is a gutter when at most this fraction of it is non-background. Kept below
+# 2px per panel height so a panel's own #808080 hairline border never reads as a gutter.
+PANEL_GUTTER_MAX_CONTENT = 0.002
+# Runs shorter than this fraction of the image side are specks, not panels.
+PANEL_MIN_FRACTION = 0.08
+ROW_NAMES = {1: "Top Row (The Look)", 2: "Bottom Row (The Details)"}
+
+logger = get_logger("panel_index")
+
+
+def _runs(mask: np.ndarray, min_length: int) -> list[tuple[int, int]]:
+    """(start, end) of every run of True in a 1-D mask that is at least min_length long."""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.astype(np.int8), [0]))))
+    return [(int(start), int(end)) for start, end in zip(edges[0::2], edges[1::2]) if end - start >= min_length]
+
+
+def detect_panels(image) -> list[dict]:
+    """Find panel rectangles from projection profiles of non-white pixels.
+
+    Rows of the board are separated by all-white horizontal gutters; within each row band the
+    columns are separated by vertical gutters, and each panel is then tightened vertically on
+    its own columns. Returns [] when the image does not look like a multi-panel grid."""
+    gray = np.asarray(image.convert("L"))
+    content = gray < PANEL_BACKGROUND_THRESHOLD
+    height, width = content.shape
+    min_height = max(int(height * PANEL_MIN_FRACTION), 1)
+    min_width = max(int(width * PANEL_MIN_FRACTION), 1)
+
+    panels = []
+    row_bands = _runs(content.mean(axis=1) > PANEL_GUTTER_MAX_CONTENT, min_height)
+    for row, (band_top, band_bottom) in enumerate(row_bands, start=1):
+        band = content[band_top:band_bottom]
+        columns = _runs(band.mean(axis=0) > PANEL_GUTTER_MAX_CONTENT, min_width)
+        for column, (left, right) in enumerate(columns, start=1):
+            rows = _runs(band[:, left:right].mean(axis=1) > PANEL_GUTTER_MAX_CONTENT, 1)
+            top = band_top + rows[0][0] if rows else band_top
+            bottom = band_top + rows[-1][1] if rows else band_bottom
+            panels.append({"row": row, "column": column, "box": [left, top, right, bottom]})
+    return panels if len(panels) >= 2 else []
+
+
+def build_index(image, panels: list[dict] | None = None, source: str | None = None) -> dict:
+    """Build the sidecar payload, detecting panels unless known ones (e.g. from the assembly layout) are given."""
+    if panels is None:
+        panels = detect_panels(image)
+        source = source or ("detected" if panels else "none")
+    return {
+        "version": PANEL_INDEX_VERSION,
+        "image_size": list(image.size),
+        "source": source or "layout",
+        "panels": [{"row": p["row"], "column": p["column"], "box": list(p["box"])} for p in panels],
+    }
+
+
+def index_output(path, image, panels: list[dict] | None = None, source: str | None = None) -> dict:
+    """Index a freshly saved output and store the result next to it."""
+    with span("index_panels") as index_span:
+        index = build_index(image, panels, source)
+        write_sidecar(path, PANEL_INDEX_KIND, index)
+        index_span.set_attributes(**{"moodboard.panels": len(index["panels"]), "moodboard.panel_source": index["source"]})
+    return index
+
+
+def load_index(path, image=None) -> dict | None:
+    """Read an output's panel index; outputs saved before indexing existed are indexed on first use."""
+    index = read_sidecar(path, PANEL_INDEX_KIND)
+    if index and index.get("version") == PANEL_INDEX_VERSION and (
+        image is None or list(image.size) == index.get("image_size")
+    ):
+        return index
+    if image is None:
+        return None
+    try:
+        return index_output(path, image)
+    except OSError as e:
+        log_event(logger, logging.WARNING, "panel_index_write_failed", path=str(path), error=str(e))
+        return build_index(image)
+
+
+def cell_info(row: int, row_name: str, column: int, overlapping_cells: list, cell_left_norm, cell_right_norm) -> dict:
+    """The grid-cell dict used by the edit prompt (same keys as mb_app._calculate_grid_cell)."""
+    if len(overlapping_cells) == 1:
+        cell_desc = f"Cell {overlapping_cells[0]}"
+    elif len(overlapping_cells) == 2:
+        cell_desc = f"Cells {overlapping_cells[0]} and {overlapping_cells[1]}"
+    else:
+        cell_desc = f"Cells {', '.join(map(str, overlapping_cells))}"
+
+    return {
+        "row": row,
+        "row_name": row_name,
+        "column": column,
+        "cell": f"Row {row}, Cell {column}",
+        "cell_description": f"{row_name}, {cell_desc}",
+        "overlapping_cells": overlapping_cells,
+        "cell_left_norm": cell_left_norm,
+        "cell_right_norm": cell_right_norm,
+    }
+
+
+def lookup_cells(index: dict | None, boxes) -> list[dict | None]:
+    """Map N bboxes (x_top, y_top, x_bottom, y_bottom) to indexed panels in one vectorized pass.
+
+    For each bbox the target panel is the one under its centre (or with the largest overlap);
+    the overlapping cells are the panels of that row it touches. None where nothing overlaps."""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    if not index or not index.get("panels"):
+        return [None] * len(boxes)
+    img_width = index["image_size"][0]
+    panels = index["panels"]
+    panel_boxes = np.array([panel["box"] for panel in panels], dtype=np.float64)
+    panel_rows = np.array([panel["row"] for panel in panels])
+
+    # (N, P) intersection areas and centre containment
+    overlap_w = np.minimum(panel_boxes[None, :, 2], boxes[:, None, 2]) - np.maximum(panel_boxes[None, :, 0], boxes[:, None, 0])
+    overlap_h = np.minimum(panel_boxes[None, :, 3], boxes[:, None, 3]) - np.maximum(panel_boxes[None, :, 1], boxes[:, None, 1])
+    overlap = np.clip(overlap_w, 0, None) * np.clip(overlap_h, 0, None)
+    center_x = ((boxes[:, 0] + boxes[:, 2]) / 2)[:, None]
+    center_y = ((boxes[:, 1] + boxes[:, 3]) / 2)[:, None]
+    contains_center = (
+        (panel_boxes[None, :, 0] <= center_x) & (center_x < panel_boxes[None, :, 2])
+        & (panel_boxes[None, :, 1] <= center_y) & (center_y < panel_boxes[None, :, 3])
+    )
+    targets = np.where(contains_center.any(axis=1), contains_center.argmax(axis=1), overlap.argmax(axis=1))
+    touches = (overlap > 0) & (panel_rows[None, :] == panel_rows[targets][:, None])
+
+    cells = []
+    for n, target in enumerate(targets):
+        if not overlap[n].any():
+            cells.append(None)
+            continue
+        panel = panels[target]
+        cells.append(cell_info(
+            panel["row"],
+            ROW_NAMES.get(panel["row"], f"Row {panel['row']}"),
+            panel["column"],
+            sorted(panels[p]["column"] for p in np.flatnonzero(touches[n])),
+            round(panel["box"][0] / img_width, 4),
+            round(panel["box"][2] / img_width, 4),
+        ))
+    return cells
+
+
+def lookup_cell(index: dict | None, x_top, y_top, x_bottom, y_bottom) -> dict | None:
+    """Map a single bbox to indexed panels (see lookup_cells)."""
+    return lookup_cells(index, [(x_top, y_top, x_bottom, y_bottom)])[0]
@@ -0,0 +1,103 @@
+import os
+import re
+from pathlib import Path
+
+from PIL import Image
+
+from output_store import OUTPUT_DIR, output_url, sidecars
+
+
+# Each saved board is cut into its grid panels by a post-save stage, so a single panel can be
+# downloaded without fetching and cropping the full board.
+PANEL_SLICES_ENABLED = os.environ.get("PANEL_SLICES_ENABLED", "1").strip().lower() not in ("0", "false", "no")
+SLICE_KIND = "panel"
+_SLICE_NAME = re.compile(rf"^(?P<stem>[A-Za-z0-9_-]+)\.{SLICE_KIND}_r(?P<row>\d+)c(?P<column>\d+)\.png$")
+
+
+def slice_path(path: str | Path, row: int, column: int) -> Path:
+    """Stable path of one panel of an output, e.g. generated_x.png -> generated_x.panel_r2c3.png."""
+    path = Path(path)
+    return path.with_name(f"{path.stem}.{SLICE_KIND}_r{row}c{column}.png")
+
+
+def slice_url(path: str | Path) -> str:
+    """Same URL scheme as the outputs themselves (served straight from disk behind nginx)."""
+    return output_url(path) or f"/gradio_api/file={path}"
+
+
+def describe(path: str | Path, index: dict | None) -> list[dict]:
+    """The panels of an output as returned to clients. URLs are known at save time; the files
+    behind them are written in the background and made on demand if requested first."""
+    import panel_index
+
+    if not PANEL_SLICES_ENABLED or not index:
+        return []
+    described = []
+    for panel in index["panels"]:
+        target = slice_path(path, panel["row"], panel["column"])
+        described.append({
+            "row": panel["row"],
+            "column": panel["column"],
+            "label": f"{panel_index.ROW_NAMES.get(panel['row'], 'Row %d' % panel['row'])}, panel {panel['column']}",
+            "box": list(panel["box"]),
+            "path": str(target),
+            "url": slice_url(target),
+        })
+    return described
+
+
+def _write_slice(image: Image.Image, box, target: Path) -> Path:
+    tmp_path = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+    try:
+        image.crop(tuple(box)).save(tmp_path, format="PNG")
+        os.replace(tmp_path, target)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    return target
+
+
+def make_slices(path: str | Path) -> list[Path]:
+    """Write every panel of a saved output next to it. Runs as a post-save stage, off the
+    request path; panels already written (e.g. on demand) are kept."""
+    import panel_index
+
+    path = Path(path)
+    if not PANEL_SLICES_ENABLED:
+        return []
+    written = []
+    with Image.open(path) as image:
+        image.load()
+        index = panel_index.load_index(path, image)
+        for panel in index["panels"] if index else []:
+            target = slice_path(path, panel["row"], panel["column"])
+            if not target.is_file():
+                _write_slice(image, panel["box"], target)
+            written.append(target)
+    if not path.is_file():  # deleted while we worked on it: leave no orphaned slices behind
+        for sidecar in sidecars(path):
+            sidecar.unlink(missing_ok=True)
+        return []
+    return written
+
+
+def ensure_slice(target: str | Path) -> Path | None:
+    """Make a requested slice that the background stage has not written yet. None when the
+    name is not a slice, or its output or panel does not exist."""
+    import panel_index
+
+    target = Path(target)
+    match = _SLICE_NAME.match(target.name)
+    if not PANEL_SLICES_ENABLED or match is None:
+        return None
+    path = target.with_name(f"{match['stem']}.png")
+    if not path.is_file() or not path.resolve().is_relative_to(OUTPUT_DIR.resolve()):
+        return None
+    row, column = int(match["row"]), int(match["column"])
+    with Image.open(path) as image:
+        image.load()
+        index = panel_index.load_index(path, image)
+        for panel in index["panels"] if index else []:
+            if (panel["row"], panel["column"]) == (row, column):
+                return _write_slice(image, panel["box"], target)
+    return None
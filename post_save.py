@@ -0,0 +1,90 @@
+import logging
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+
+import metrics
+from structured_log import get_logger, log_event
+from tracing import span
+
+
+# Analysis that is not needed to answer the request (palettes, ...) runs on saved outputs in
+# a background worker, after the response has been sent.
+POST_SAVE_ENABLED = os.environ.get("POST_SAVE_ENABLED", "1").strip().lower() not in ("0", "false", "no")
+# Outputs waiting for analysis. When full, new outputs are skipped and analysed on first use.
+POST_SAVE_QUEUE_SIZE = int(os.environ.get("POST_SAVE_QUEUE_SIZE", "256"))
+
+logger = get_logger("post_save")
+
+_queue: queue.Queue = queue.Queue(maxsize=POST_SAVE_QUEUE_SIZE)
+_worker_lock = threading.Lock()
+_worker: threading.Thread | None = None
+
+
+def _stages() -> list[tuple[str, callable]]:
+    """The (name, function(path)) stages run on every saved output, in order."""
+    import lineage_export
+    import palette_index
+    import panel_slices
+
+    stages = [("thumbnail", lineage_export.make_thumbnail)]
+    if panel_slices.PANEL_SLICES_ENABLED:
+        stages.append(("slices", panel_slices.make_slices))
+    if palette_index.PALETTE_INDEX_ENABLED:
+        stages.append(("palette", palette_index.analyze))
+    return stages
+
+
+def _run(path: Path) -> None:
+    for name, stage in _stages():
+        started = time.perf_counter()
+        try:
+            with span(f"post_save_{name}", **{"moodboard.output": path.name}):
+                stage(path)
+        except Exception as e:  # one failing stage must not stop the others or the worker
+            metrics.inc("moodboard_post_save_failures_total", stage=name)
+            log_event(logger, logging.WARNING, "post_save_stage_failed", stage=name, output=path.name, error=str(e))
+            continue
+        metrics.observe_average("moodboard_post_save_ms", (time.perf_counter() - started) * 1000, stage=name)
+
+
+def _work() -> None:
+    while True:
+        path = _queue.get()
+        try:
+            if path.is_file():  # may have been deleted while queued
+                _run(path)
+        finally:
+            _queue.task_done()
+
+
+def submit(path: str | Path) -> bool:
+    """Queue a freshly saved output for background analysis. Never blocks the caller."""
+    global _worker
+    if not POST_SAVE_ENABLED:
+        return False
+    with _worker_lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_work, name="post-save", daemon=True)
+            _worker.start()
+    try:
+        _queue.put_nowait(Path(path))
+    except queue.Full:
+        metrics.inc("moodboard_post_save_dropped_total")
+        log_event(logger, logging.WARNING, "post_save_queue_full", output=Path(path).name)
+        return False
+    return True
+
+
+def drain(timeout: float | None = None) -> bool:
+    """Wait until every queued output has been analysed. False on timeout."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with _queue.all_tasks_done:
+        while _queue.unfinished_tasks:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            _queue.all_tasks_done.wait(remaining)
+    return True
@@ -0,0 +1,271 @@
+import base64
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+
+import metrics
+from output_store import DATA_DIR, AppendLog
+from structured_log import get_logger, log_event
+
+
+PROMPT_CACHE_ENABLED = os.environ.get("PROMPT_CACHE_ENABLED", "1").strip().lower() not in ("0", "false", "no")
+# Append-only log of cached subjects; shared by all backend processes, which tail it.
+PROMPT_CACHE_FILE = Path(os.environ.get("PROMPT_CACHE_FILE") or DATA_DIR / "prompt_cache.jsonl")
+# Estimated Jaccard similarity of the subjects' shingle sets needed to offer a cached board.
+PROMPT_CACHE_THRESHOLD = float(os.environ.get("PROMPT_CACHE_THRESHOLD", "0.8"))
+# MinHash signature length, split into LSH bands of MINHASH_ROWS rows. With 32 x 4 a pair at
+# the 0.8 threshold shares a band ~99% of the time, one at 0.4 only ~19%.
+MINHASH_PERMUTATIONS = 32
+MINHASH_ROWS = 4
+MINHASH_SEED = 20250101
+# Most entries kept per LSH bucket (the oldest is evicted). Subjects repeated with small variations
+# pile up in the same buckets; without a cap a lookup for them would compare against all of them.
+PROMPT_CACHE_MAX_BUCKET = int(os.environ.get("PROMPT_CACHE_MAX_BUCKET", "64"))
+# The log is loaded in batches of about this many bytes, on a background thread at startup.
+PROMPT_CACHE_LOAD_BYTES = 4 * 1024 * 1024
+
+logger = get_logger("prompt_cache")
+
+_WORD = re.compile(r"[^\W_]+")
+_rng = np.random.default_rng(MINHASH_SEED)
+# Multiply-shift hash family: h(x) = (a*x + b) mod 2**64 >> 32, with odd a
+_HASH_A = _rng.integers(1, 2**63, MINHASH_PERMUTATIONS, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+_HASH_B = _rng.integers(0, 2**63, MINHASH_PERMUTATIONS, dtype=np.uint64)
+_BANDS = MINHASH_PERMUTATIONS // MINHASH_ROWS
+_BAND_MIX = _rng.integers(1, 2**63, MINHASH_ROWS, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+
+
+def normalize(text: str) -> str:
+    """Canonical form of a subject, so that case, Unicode width forms, punctuation, spacing and
+    word order do not matter."""
+    words = _WORD.findall(unicodedata.normalize("NFKC", text or "").casefold())
+    return " ".join(sorted(words))
+
+
+def shingles(normalized: str) -> set[str]:
+    """Order-free shingles: every word, plus the character trigrams of each word (so
+    "dress" / "dresses" still overlap)."""
+    result = set()
+    for word in normalized.split():
+        result.add(word)
+        padded = f"#{word}#"
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def signature(shingle_set: set[str]) -> np.ndarray:
+    """MinHash signature (uint32 per permutation) of a shingle set."""
+    if not shingle_set:
+        return np.zeros(MINHASH_PERMUTATIONS, dtype=np.uint32)
+    values = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "little") for s in shingle_set),
+        dtype=np.uint64, count=len(shingle_set),
+    )
+    with np.errstate(over="ignore"):
+        hashed = (values[:, None] * _HASH_A + _HASH_B) >> np.uint64(32)
+    return hashed.min(axis=0).astype(np.uint32)
+
+
+def _band_keys(signatures: np.ndarray) -> np.ndarray:
+    """LSH band keys: one row of _BANDS uint64 per signature."""
+    with np.errstate(over="ignore"):
+        return (signatures.reshape(-1, _BANDS, MINHASH_ROWS).astype(np.uint64) * _BAND_MIX).sum(axis=2)
+
+
+def _encode_signature(sig: np.ndarray) -> str:
+    return base64.b64encode(sig.astype("<u4").tobytes()).decode("ascii")
+
+
+def _decode_signature(text: str) -> np.ndarray:
+    sig = np.frombuffer(base64.b64decode(text), dtype="<u4")
+    if sig.shape != (MINHASH_PERMUTATIONS,):
+        raise ValueError("signature length does not match MINHASH_PERMUTATIONS")
+    return sig.astype(np.uint32)
+
+
+class PromptIndex:
+    """In-memory MinHash/LSH index over cached subjects.
+
+    An exact dict on (context, normalized subject) answers repeats in O(1); otherwise each LSH
+    band is one dict probe and at most max_bucket colliding entries per band are compared, so a
+    lookup costs the same at 1M entries as at 1K. `context` keeps boards made with a different
+    model, mode, profile or template from matching."""
+
+    def __init__(self, max_bucket: int = PROMPT_CACHE_MAX_BUCKET):
+        self.max_bucket = max_bucket
+        self._lock = threading.Lock()
+        self._entries: list[tuple[str, str, str]] = []  # (context, subject, output)
+        self._signatures = np.empty((1024, MINHASH_PERMUTATIONS), dtype=np.uint32)
+        self._exact: dict[tuple[str, str], int] = {}
+        self._buckets: list[dict[int, int | list[int]]] = [{} for _ in range(_BANDS)]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, context: str, subject: str, output: str) -> None:
+        self.extend([(context, subject, output, None)])
+
+    def extend(self, entries: list[tuple[str, str, str, np.ndarray | None]]) -> None:
+        """Add (context, subject, output, signature) entries in order; a signature that is already
+        known (stored in the log) is not computed again."""
+        if not entries:
+            return
+        normalized = [normalize(subject) for _, subject, _, _ in entries]
+        signatures = np.stack([
+            sig if sig is not None else signature(shingles(text)) for (_, _, _, sig), text in zip(entries, normalized)
+        ])
+        band_keys = _band_keys(signatures).tolist()
+        with self._lock:
+            first = len(self._entries)
+            if first + len(entries) > len(self._signatures):
+                grown = np.empty((max(2 * len(self._signatures), first + len(entries)), MINHASH_PERMUTATIONS),
+                                 dtype=np.uint32)
+                grown[:first] = self._signatures[:first]
+                self._signatures = grown
+            self._signatures[first:first + len(entries)] = signatures
+            for entry_id, (context, subject, output, _), text, keys in zip(
+                range(first, first + len(entries)), entries, normalized, band_keys
+            ):
+                self._entries.append((context, subject, output))
+                self._exact[(context, text)] = entry_id  # newest board wins
+                for bucket, key in zip(self._buckets, keys):
+                    existing = bucket.get(key)
+                    if existing is None:
+                        bucket[key] = entry_id
+                    elif isinstance(existing, list):
+                        existing.append(entry_id)
+                        if len(existing) > self.max_bucket:
+                            del existing[0]  # still found by its exact key and its other bands
+                    else:
+                        bucket[key] = [existing, entry_id]
+
+    def lookup(self, context: str, subject: str, threshold: float = PROMPT_CACHE_THRESHOLD) -> dict | None:
+        """Best cached entry for `subject` under `context` with similarity >= threshold, newest first on ties."""
+        normalized = normalize(subject)
+        with self._lock:
+            entry_id = self._exact.get((context, normalized))
+            if entry_id is not None:
+                return self._match(entry_id, 1.0)
+        sig = signature(shingles(normalized))
+        keys = _band_keys(sig)[0].tolist()
+        with self._lock:
+            candidates = set()
+            for bucket, key in zip(self._buckets, keys):
+                found = bucket.get(key)
+                if isinstance(found, list):
+                    candidates.update(found)
+                elif found is not None:
+                    candidates.add(found)
+            candidates = [c for c in candidates if self._entries[c][0] == context]
+            if not candidates:
+                return None
+            ids = np.array(sorted(candidates, reverse=True))
+            similarity = (self._signatures[ids] == sig).mean(axis=1)
+            best = int(np.argmax(similarity))
+            if similarity[best] < threshold:
+                return None
+            return self._match(int(ids[best]), float(similarity[best]))
+
+    def _match(self, entry_id: int, similarity: float) -> dict:
+        context, subject, output = self._entries[entry_id]
+        return {"subject": subject, "output": output, "similarity": round(similarity, 3)}
+
+
+class PromptCache:
+    """PromptIndex backed by an append-only log; entries written by other processes are
+    picked up on the next lookup.
+
+    The log is loaded on a background thread (warm()); until it is, lookups are misses and
+    requests never wait for it. Entries carry their MinHash signature, so loading a long log
+    does not hash every subject again."""
+
+    def __init__(self, path: Path = PROMPT_CACHE_FILE):
+        self.log = AppendLog(path)
+        self.index = PromptIndex()
+        self._ready = threading.Event()
+        self._warm_lock = threading.Lock()
+        self._warm_thread: threading.Thread | None = None
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def warm(self) -> None:
+        """Start loading the log in the background (once)."""
+        with self._warm_lock:
+            if self._warm_thread is None:
+                self._warm_thread = threading.Thread(target=self._warm, name="prompt-cache-warm", daemon=True)
+                self._warm_thread.start()
+
+    def wait_ready(self, timeout: float | None = None) -> bool:
+        self.warm()
+        return self._ready.wait(timeout)
+
+    def _warm(self) -> None:
+        started = time.perf_counter()
+        try:
+            self._sync()
+        except Exception as e:
+            # Whatever was not loaded is picked up by the next lookup's sync
+            log_event(logger, logging.WARNING, "prompt_cache_warm_failed", error=str(e))
+        finally:
+            self._ready.set()
+        log_event(logger, logging.INFO, "prompt_cache_warmed", entries=len(self.index),
+                  seconds=round(time.perf_counter() - started, 3))
+
+    def _sync(self) -> None:
+        while entries := self.log.read_new(PROMPT_CACHE_LOAD_BYTES):
+            batch = []
+            for entry in entries:
+                try:
+                    sig = _decode_signature(entry["sig"]) if "sig" in entry else None
+                    batch.append((entry["context"], entry["subject"], entry["output"], sig))
+                except (KeyError, TypeError, ValueError):
+                    continue
+            self.index.extend(batch)
+
+    def record(self, context: str, subject: str, output: str) -> None:
+        sig = signature(shingles(normalize(subject)))
+        self.log.append({"context": context, "subject": subject, "output": output,
+                         "sig": _encode_signature(sig), "ts": time.time()})
+        if self.ready:
+            self._sync()
+
+    def lookup(self, context: str, subject: str, threshold: float = PROMPT_CACHE_THRESHOLD) -> dict | None:
+        if not self.ready:
+            self.warm()
+            metrics.inc("moodboard_prompt_cache_lookups_total", result="warming")
+            return None
+        self._sync()
+        started = time.perf_counter()
+        match = self.index.lookup(context, subject, threshold)
+        # Boards can be deleted from the store; a stale entry is just a miss
+        if match is not None and not Path(match["output"]).is_file():
+            match = None
+        metrics.observe_average("moodboard_prompt_cache_lookup_ms", (time.perf_counter() - started) * 1000)
+        metrics.inc("moodboard_prompt_cache_lookups_total", result="hit" if match else "miss")
+        if match is not None:
+            log_event(logger, logging.INFO, "prompt_cache_hit", similarity=match["similarity"],
+                      output=Path(match["output"]).name)
+        return match
+
+
+_cache_lock = threading.Lock()
+_cache: PromptCache | None = None
+
+
+def cache() -> PromptCache:
+    """The process-wide cache; it starts loading in the background the first time it is asked for."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = PromptCache()
+            _cache.warm()
+        return _cache
@@ -0,0 +1,112 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+
+EDIT_MODE_FULL = "full"
+EDIT_MODE_REGIONAL = "regional"
+EDIT_MODES = [EDIT_MODE_FULL, EDIT_MODE_REGIONAL]
+DEFAULT_EDIT_MODE = os.environ.get("DEFAULT_EDIT_MODE", EDIT_MODE_FULL)
+# Context kept around the bbox, as a fraction of the bbox size on each side.
+REGIONAL_EDIT_MARGIN = float(os.environ.get("REGIONAL_EDIT_MARGIN", "0.25"))
+REGIONAL_EDIT_MIN_MARGIN_PX = 16
+# Width of the blend ramp outside the bbox when the patch is composited back.
+REGIONAL_EDIT_FEATHER_PX = int(os.environ.get("REGIONAL_EDIT_FEATHER_PX", "12"))
+SUPPORTED_ASPECT_RATIOS = {
+    "1:1": 1.0,
+    "2:3": 2 / 3,
+    "3:2": 3 / 2,
+    "3:4": 3 / 4,
+    "4:3": 4 / 3,
+    "4:5": 4 / 5,
+    "5:4": 5 / 4,
+    "9:16": 9 / 16,
+    "16:9": 16 / 9,
+    "21:9": 21 / 9,
+}
+REGIONAL_EDIT_PREAMBLE = (
+    "The attached image is a crop of a larger fashion moodboard around the region to edit. "
+    "Return the same crop at the same framing, changing only the requested region; "
+    "everything near the crop edges must stay as it is so it can be blended back seamlessly.\n\n"
+)
+
+
+def context_box(bbox, image_size, margin: float = REGIONAL_EDIT_MARGIN) -> tuple:
+    """Grow (x_top, y_top, x_bottom, y_bottom) by the context margin, clamped to the image."""
+    x_top, y_top, x_bottom, y_bottom = bbox
+    img_width, img_height = image_size
+    pad_x = max(int(round((x_bottom - x_top) * margin)), REGIONAL_EDIT_MIN_MARGIN_PX)
+    pad_y = max(int(round((y_bottom - y_top) * margin)), REGIONAL_EDIT_MIN_MARGIN_PX)
+    return (
+        max(x_top - pad_x, 0),
+        max(y_top - pad_y, 0),
+        min(x_bottom + pad_x, img_width),
+        min(y_bottom + pad_y, img_height),
+    )
+
+
+def closest_aspect_ratio(width: int, height: int) -> str:
+    """Pick the supported image_config aspect ratio closest to width/height (in log space)."""
+    ratio = np.log(width / height)
+    return min(SUPPORTED_ASPECT_RATIOS, key=lambda name: abs(np.log(SUPPORTED_ASPECT_RATIOS[name]) - ratio))
+
+
+def fit_box_to_aspect(box, aspect_ratio: str, image_size) -> tuple:
+    """Widen or heighten the box (centred, clamped) towards the target ratio so the patch is not distorted."""
+    left, top, right, bottom = box
+    img_width, img_height = image_size
+    target = SUPPORTED_ASPECT_RATIOS[aspect_ratio]
+    width, height = right - left, bottom - top
+    if width / height < target:
+        new_width = min(int(round(height * target)), img_width)
+        left = min(max(left - (new_width - width) // 2, 0), img_width - new_width)
+        right = left + new_width
+    else:
+        new_height = min(int(round(width / target)), img_height)
+        top = min(max(top - (new_height - height) // 2, 0), img_height - new_height)
+        bottom = top + new_height
+    return left, top, right, bottom
+
+
+def plan_crop(bbox, image_size, margin: float = REGIONAL_EDIT_MARGIN) -> tuple:
+    """Return (crop_box, aspect_ratio) for sending only the bbox neighbourhood to the model."""
+    box = context_box(bbox, image_size, margin)
+    aspect_ratio = closest_aspect_ratio(box[2] - box[0], box[3] - box[1])
+    return fit_box_to_aspect(box, aspect_ratio, image_size), aspect_ratio
+
+
+def feather_mask(crop_size, inner_box, feather: int = REGIONAL_EDIT_FEATHER_PX) -> np.ndarray:
+    """Alpha mask over the crop: 1 inside inner_box, ramping linearly to 0 `feather` pixels outside it."""
+    width, height = crop_size
+    left, top, right, bottom = inner_box
+    xs = np.arange(width, dtype=np.float32)
+    ys = np.arange(height, dtype=np.float32)
+    dx = np.maximum(np.maximum(left - xs, xs - (right - 1)), 0)
+    dy = np.maximum(np.maximum(top - ys, ys - (bottom - 1)), 0)
+    distance = np.maximum(dy[:, None], dx[None, :])
+    if feather <= 0:
+        return (distance == 0).astype(np.float32)
+    return np.clip(1.0 - distance / feather, 0.0, 1.0).astype(np.float32)
+
+
+def composite_patch(parent, patch, crop_box, bbox, feather: int = REGIONAL_EDIT_FEATHER_PX):
+    """Blend the model's patch back into the parent; pixels outside the feathered bbox stay bit-identical.
+    bbox may also be a list of boxes (multi-region edits); their masks are combined."""
+    left, top, right, bottom = crop_box
+    crop_size = (right - left, bottom - top)
+    mode = parent.mode if parent.mode in ("RGB", "RGBA") else "RGB"
+    result = parent.convert(mode) if parent.mode != mode else parent.copy()
+    patch = patch.convert(mode)
+    if patch.size != crop_size:
+        patch = patch.resize(crop_size, Image.LANCZOS)
+
+    boxes = bbox if isinstance(bbox[0], (list, tuple)) else [bbox]
+    alpha = np.max(
+        [feather_mask(crop_size, (box[0] - left, box[1] - top, box[2] - left, box[3] - top), feather) for box in boxes],
+        axis=0,
+    )[:, :, None]
+    region = np.asarray(result.crop(crop_box), dtype=np.float32)
+    blended = region * (1.0 - alpha) + np.asarray(patch, dtype=np.float32) * alpha
+    result.paste(Image.fromarray(np.rint(blended).astype(np.uint8)).convert(mode), (left, top))
+    return result
@@ -0,0 +1,129 @@
+import atexit
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+
+from tracing import current_correlation_id
+
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# Fraction of INFO/DEBUG records kept; WARNING and above are never sampled out.
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "1.0"))
+LOG_MAX_FIELD_CHARS = int(os.environ.get("LOG_MAX_FIELD_CHARS", "200"))
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+
+_configure_lock = threading.Lock()
+_listener = None
+_queue_handler = None
+
+
+def truncate(value, limit: int = LOG_MAX_FIELD_CHARS):
+    """Clip long strings so a log line never carries a whole prompt."""
+    if isinstance(value, str) and len(value) > limit:
+        return f"{value[:limit]}…(+{len(value) - limit} chars)"
+    return value
+
+
+def text_summary(text: str | None, preview_chars: int = 80) -> dict:
+    """Describe a large text field by size, hash and a short preview instead of its content."""
+    text = text or ""
+    return {
+        "chars": len(text),
+        "sha256": hashlib.sha256(text.encode("utf-8")).hexdigest()[:12],
+        "preview": truncate(text.strip().replace("\n", " "), preview_chars),
+    }
+
+
+class JsonFormatter(logging.Formatter):
+    """Render a record as one JSON object: event name plus its structured fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        payload.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            payload["exc"] = truncate(self.formatException(record.exc_info), 2000)
+        return json.dumps(payload, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a random fraction of low-severity records."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.rate >= 1.0:
+            return True
+        return random.random() < self.rate
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hand records to the background listener without formatting or blocking the caller."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Formatting happens on the listener thread; fields are already small.
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _configure():
+    global _listener, _queue_handler
+    with _configure_lock:
+        if _queue_handler is not None:
+            return _queue_handler
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(JsonFormatter())
+        _queue_handler = _NonBlockingQueueHandler(log_queue)
+        _queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+        _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+        return _queue_handler
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Return a logger whose records are written as JSON by a background thread."""
+    logger = logging.getLogger(name)
+    handler = _configure()
+    if handler not in logger.handlers:
+        logger.addHandler(handler)
+        logger.setLevel(LOG_LEVEL)
+        logger.propagate = False
+    return logger
+
+
+def log_event(logger: logging.Logger, level: int, event: str, **fields) -> None:
+    """Emit `event` with truncated fields tagged by the current correlation ID."""
+    if not logger.isEnabledFor(level):
+        return
+    fields = {key: truncate(value) for key, value in fields.items()}
+    correlation_id = current_correlation_id()
+    if correlation_id:
+        fields["correlation_id"] = correlation_id
+    logger.log(level, event, extra={"fields": fields})
+
+
+def dropped_records() -> int:
+    return _queue_handler.dropped if _queue_handler is not None else 0
@@ -0,0 +1,166 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import metrics
+from structured_log import get_logger, log_event
+
+
+# Named templates are the *.txt files in this directory, referenced by file stem (e.g.
+# "prompt_template") or pinned to one version as "prompt_template@<version>".
+TEMPLATE_DIR = Path(os.environ.get("TEMPLATE_DIR") or Path(__file__).parent / "prompt_templates")
+# How often a template file is checked for changes; 0 checks its mtime on every lookup.
+TEMPLATE_RELOAD_INTERVAL_S = float(os.environ.get("TEMPLATE_RELOAD_INTERVAL_S", "1"))
+# Compiled inline (override) templates kept, most recently used first.
+INLINE_TEMPLATE_CACHE_SIZE = int(os.environ.get("INLINE_TEMPLATE_CACHE_SIZE", "64"))
+INLINE_NAME = "inline"
+
+TEMPLATE_ID = re.compile(r"^(?P<name>[A-Za-z0-9][A-Za-z0-9_-]*)(?:@(?P<version>[0-9a-f]{6,64}))?$")
+_PLACEHOLDER = re.compile(r"(\{[A-Z_]+\})")
+
+logger = get_logger("template_registry")
+
+
+class UnknownTemplate(Exception):
+    """A template ID that names no registered template (or no version of it)."""
+
+
+class Template:
+    """One version of a template, compiled once: the text split into literal and placeholder
+    pieces for rendering, plus the placeholder-free lines that context caching treats as static."""
+
+    __slots__ = ("name", "version", "digest", "text", "placeholders", "static_lines", "_pieces")
+
+    def __init__(self, name: str, text: str):
+        self.name = name
+        self.text = text
+        self.digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        self.version = self.digest[:12]
+        # Literal pieces and placeholders alternate: literal, placeholder, literal, ...
+        self._pieces = _PLACEHOLDER.split(text)
+        self.placeholders = frozenset(self._pieces[1::2])
+        self.static_lines = frozenset(
+            line for line in text.splitlines() if line.strip() and not _PLACEHOLDER.search(line)
+        )
+
+    @property
+    def id(self) -> str:
+        return f"{self.name}@{self.version}"
+
+    def render(self, values: dict[str, str]) -> str:
+        """Fill in placeholders (keyed like "{SUBJECT_PLACEHOLDER}"); unknown ones are kept as written."""
+        return "".join(
+            values.get(piece, piece) if index % 2 else piece for index, piece in enumerate(self._pieces)
+        )
+
+    def describe(self) -> dict:
+        return {"id": self.id, "name": self.name, "version": self.version, "placeholders": sorted(self.placeholders)}
+
+
+class TemplateRegistry:
+    """Named, versioned templates loaded from TEMPLATE_DIR and reloaded when their file changes.
+    Every version seen by this process stays addressable by its pinned ID."""
+
+    def __init__(self, directory: str | Path = TEMPLATE_DIR, reload_interval_s: float = TEMPLATE_RELOAD_INTERVAL_S):
+        self.directory = Path(directory)
+        self.reload_interval_s = reload_interval_s
+        self._lock = threading.Lock()
+        self._current: dict[str, tuple[Template, float, float]] = {}  # name -> (template, mtime, checked at)
+        self._versions: dict[str, dict[str, Template]] = {}
+        self._inline: OrderedDict[str, Template] = OrderedDict()
+
+    def _path(self, name: str) -> Path:
+        return self.directory / f"{name}.txt"
+
+    def _load(self, name: str) -> Template:
+        """Latest version of a named template, re-reading its file when the mtime moved."""
+        now = time.monotonic()
+        with self._lock:
+            current = self._current.get(name)
+        if current and now - current[2] < self.reload_interval_s:
+            return current[0]
+        path = self._path(name)
+        try:
+            mtime = path.stat().st_mtime
+        except OSError:
+            raise UnknownTemplate(f"Template not found: {name}")
+        if current and current[1] == mtime:
+            with self._lock:
+                self._current[name] = (current[0], mtime, now)
+            return current[0]
+        template = Template(name, path.read_text(encoding="utf-8"))
+        with self._lock:
+            versions = self._versions.setdefault(name, {})
+            template = versions.setdefault(template.version, template)
+            self._current[name] = (template, mtime, now)
+        if current is None or current[0].version != template.version:
+            metrics.inc("moodboard_template_loads_total", template=name)
+            log_event(logger, logging.INFO, "template_loaded", template=template.id, reloaded=current is not None)
+        return template
+
+    def get(self, template_id: str) -> Template:
+        """The template for "name" (latest version) or "name@version" (that version)."""
+        match = TEMPLATE_ID.match(template_id.strip())
+        if match is None:
+            raise UnknownTemplate(f"Invalid template ID: {template_id}")
+        if match["name"] == INLINE_NAME:
+            with self._lock:
+                inline = self._inline.get(match["version"] or "")
+            if inline is None:
+                raise UnknownTemplate(f"Unknown inline template: {template_id}")
+            return inline
+        latest = self._load(match["name"])
+        version = match["version"]
+        if version is None or latest.version.startswith(version):
+            return latest
+        with self._lock:
+            found = [t for v, t in self._versions.get(match["name"], {}).items() if v.startswith(version)]
+        if len(found) != 1:
+            raise UnknownTemplate(f"Unknown template version: {template_id}")
+        return found[0]
+
+    def inline(self, text: str) -> Template:
+        """Compile template text sent with a request, reusing the compiled form for repeats."""
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+        with self._lock:
+            template = self._inline.get(digest)
+            if template is not None:
+                self._inline.move_to_end(digest)
+                return template
+        template = Template(INLINE_NAME, text)
+        with self._lock:
+            self._inline[digest] = template
+            while len(self._inline) > INLINE_TEMPLATE_CACHE_SIZE:
+                self._inline.popitem(last=False)
+        return template
+
+    def resolve(self, value: str | None, default: str) -> Template:
+        """A request's template input: empty means `default`, a template ID picks a registered
+        template, and anything else is inline template text overriding it."""
+        value = value if isinstance(value, str) else ""
+        if not value.strip():
+            return self._load(default)
+        if TEMPLATE_ID.match(value.strip()):
+            return self.get(value)
+        return self.inline(value)
+
+    def templates(self) -> list[dict]:
+        """Latest version of every named template."""
+        return [self._load(path.stem).describe() for path in sorted(self.directory.glob("*.txt"))]
+
+
+_registry_lock = threading.Lock()
+_registry: TemplateRegistry | None = None
+
+
+def registry() -> TemplateRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = TemplateRegistry()
+        return _registry
@@ -0,0 +1,83 @@
+"""
+Shared test setup: tests write their outputs and indexes to a scratch directory, never to the repo,
+and talk to a fake model client (fake_client) instead of Gemini.
+Test files also run as scripts, so they import fake_client from here rather than taking a fixture.
+"""
+import asyncio
+import io
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+from PIL import Image
+
+_SCRATCH: Path | None = None
+
+
+def pytest_configure(config):
+    # Runs before any test module imports the app, which reads these paths at import time
+    global _SCRATCH
+    _SCRATCH = Path(tempfile.mkdtemp(prefix="moodboard-test-"))
+    os.environ["MOODBOARD_OUTPUT_DIR"] = str(_SCRATCH / "outputs")
+    os.environ["MOODBOARD_DATA_DIR"] = str(_SCRATCH / "data")
+    for name in ("JOB_QUEUE_DB", "CATALOG_DB", "PROMPT_CACHE_FILE", "IMAGE_INDEX_FILE", "PALETTE_INDEX_FILE"):
+        os.environ.pop(name, None)
+
+
+def pytest_unconfigure(config):
+    if _SCRATCH is not None:
+        shutil.rmtree(_SCRATCH, ignore_errors=True)
+
+
+def fake_client(calls=None, color=(80, 80, 80), image=None, thought=None, before=None, delays=None, **services):
+    """Stands in for a genai client: each generate_content call is recorded in `calls` as
+    (model, contents, config) and answered with one image.
+
+    The image is `image`, else a solid `color` the size of the image in the request (64x48 without
+    one); color may also be a function of the call's number. thought adds a reasoning part.
+    before(model, contents, config) runs first and may wait or raise. With delays the client is
+    async-only and call N sleeps delays[N] seconds, its record noting whether it was cancelled or
+    finished. Other keyword arguments (caches=, files=) are attached to the client as services."""
+    calls = [] if calls is None else calls
+
+    def respond(number, contents):
+        if image is not None:
+            pil_image = image
+        else:
+            source = contents[0] if isinstance(contents, list) and getattr(contents[0], "inline_data", None) else None
+            size = Image.open(io.BytesIO(source.inline_data.data)).size if source else (64, 48)
+            pil_image = Image.new("RGB", size, color(number) if callable(color) else color)
+        image_part = SimpleNamespace(inline_data=True, thought=False, text=None,
+                                     as_image=lambda: SimpleNamespace(_pil_image=pil_image))
+        parts = [SimpleNamespace(inline_data=None, thought=True, text=thought), image_part] if thought else []
+        return SimpleNamespace(parts=[image_part], candidates=[SimpleNamespace(content=SimpleNamespace(parts=parts))])
+
+    def record(model, contents, config):
+        call = SimpleNamespace(model=model, contents=contents, config=config, cancelled=False, finished=False)
+        calls.append(call)
+        if before:
+            before(model, contents, config)
+        return call
+
+    def generate_content(model, contents, config):
+        number = len(calls)
+        record(model, contents, config)
+        return respond(number, contents)
+
+    async def generate_content_async(model, contents, config):
+        number = len(calls)
+        call = record(model, contents, config)
+        try:
+            await asyncio.sleep(delays[number])
+        except asyncio.CancelledError:
+            call.cancelled = True
+            raise
+        call.finished = True
+        return respond(number, contents)
+
+    if delays is not None:
+        return SimpleNamespace(aio=SimpleNamespace(models=SimpleNamespace(generate_content=generate_content_async)),
+                               **services)
+    return SimpleNamespace(models=SimpleNamespace(generate_content=generate_content), **services)
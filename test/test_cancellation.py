@@ -0,0 +1,150 @@
+"""
+Test cancellation of in-flight model calls (supersede, session unload, disconnect probes)
+"""
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from PIL import Image
+
+import cancellation
+import mb_app
+import metrics
+import output_store
+from conftest import fake_client
+
+
+def _session_request(session):
+    return SimpleNamespace(headers={cancellation.SESSION_HEADER: session})
+
+
+def _outputs():
+    return set(output_store.OUTPUT_DIR.glob("*.png"))
+
+
+def test_token_probes():
+    """Test that a shared batch is only cancelled once every client has disconnected"""
+    print("=" * 60)
+    print("Test: Disconnect probes")
+    print("=" * 60)
+
+    original_interval = cancellation.CANCEL_POLL_INTERVAL_MS
+    cancellation.CANCEL_POLL_INTERVAL_MS = 0
+    try:
+        gone = {"a": True, "b": False}
+        token = cancellation.CancelToken("edit_image_region", probes=[lambda: gone["a"], lambda: gone["b"]])
+        assert not token.cancelled
+        gone["b"] = True
+        assert token.cancelled and token.reason == "client_disconnected"
+    finally:
+        cancellation.CANCEL_POLL_INTERVAL_MS = original_interval
+    print("  ✅ Cancelled only when all clients are gone")
+
+    # Requests with no connection to watch (e.g. queued Gradio jobs) are never probed
+    assert cancellation._disconnect_probe(_session_request("tab")) is None
+    print("  ✅ Requests without a live connection are not probed")
+
+
+def test_newer_generate_supersedes_previous():
+    """Test that a second Send from the same tab aborts the first call and saves only one output"""
+    print("\n" + "=" * 60)
+    print("Test: Supersede in-flight generate_image")
+    print("=" * 60)
+
+    calls, results, errors = [], {}, {}
+    original_get_client = mb_app._get_client
+    mb_app._get_client = lambda api_key: fake_client(calls, (30, 60, 90), delays=[5.0, 0.05])
+    metrics.observe_average("moodboard_model_call_seconds", 20.0, model="fake-model")
+    saved_before = metrics.get("moodboard_model_seconds_saved_total", model="fake-model")
+    before = _outputs()
+
+    def fire(name):
+        try:
+            results[name] = mb_app.generate_image(
+                "Noir tailoring", "fake-model", "", None, "single", request=_session_request("tab-1")
+            )
+        except Exception as e:
+            errors[name] = e
+
+    try:
+        first = threading.Thread(target=fire, args=("first",))
+        first.start()
+        while not calls and first.is_alive():  # wait until the first call is in flight
+            time.sleep(0.05)
+        started = time.perf_counter()
+        fire("second")
+        first.join(timeout=5)
+        elapsed = time.perf_counter() - started
+    finally:
+        mb_app._get_client = original_get_client
+
+    new_outputs = _outputs() - before
+    try:
+        print(f"  First: {errors.get('first')!r}, second finished in {elapsed:.2f}s")
+        assert "superseded" in str(errors["first"])
+        assert calls[0].cancelled and not calls[0].finished
+        assert Path(results["second"][0]) in new_outputs and len(new_outputs) == 1
+        assert elapsed < 2
+        print("  ✅ First call torn down, only the newer result saved")
+        assert metrics.get("moodboard_requests_cancelled_total", endpoint="generate_image", reason="superseded") >= 1
+        assert metrics.get("moodboard_model_seconds_saved_total", model="fake-model") > saved_before
+        print("  ✅ Cancellation and saved model seconds counted")
+    finally:
+        for path in new_outputs:
+            path.unlink(missing_ok=True)
+            for sidecar in output_store.sidecars(path):
+                sidecar.unlink(missing_ok=True)
+
+
+def test_session_cancel_discards_edit():
+    """Test that cancelling a session (tab closed) aborts its edit without saving anything"""
+    print("\n" + "=" * 60)
+    print("Test: cancel_session aborts an edit")
+    print("=" * 60)
+
+    calls, errors = [], {}
+    original_get_client = mb_app._get_client
+    mb_app._get_client = lambda api_key: fake_client(calls, (30, 60, 90), delays=[5.0])
+    before = _outputs()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            source = Path(tmp) / "board.png"
+            Image.new("RGB", (64, 48), (200, 200, 200)).save(source)
+
+            def fire():
+                try:
+                    mb_app.edit_image_region(
+                        None, str(source), None, None, None, None, "Make it moodier",
+                        mb_app.GEMINI_25_MODEL_ID, "", None, "full", None, request=_session_request("tab-2"),
+                    )
+                except Exception as e:
+                    errors["edit"] = e
+
+            thread = threading.Thread(target=fire)
+            thread.start()
+            while not calls and thread.is_alive():
+                time.sleep(0.05)
+            assert mb_app.cancel_session("tab-2")["cancelled"] == 1
+            thread.join(timeout=5)
+    finally:
+        mb_app._get_client = original_get_client
+
+    print(f"  Edit: {errors.get('edit')!r}")
+    assert "client_gone" in str(errors["edit"])
+    assert calls[0].cancelled
+    assert _outputs() == before
+    assert mb_app.cancel_session("tab-2")["cancelled"] == 0
+    print("  ✅ Edit aborted, nothing written to OUTPUT_DIR")
+
+
+if __name__ == "__main__":
+    test_token_probes()
+    test_newer_generate_supersedes_previous()
+    test_session_cancel_discards_edit()
+    print("\n✅ ALL TESTS PASSED!")
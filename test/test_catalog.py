@@ -0,0 +1,140 @@
+"""
+Test the full-text catalog of generations (FTS5 search, pagination, batched background writes)
+"""
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+if "MOODBOARD_OUTPUT_DIR" not in os.environ:  # run as a script; under pytest conftest.py does this
+    _scratch = Path(tempfile.mkdtemp(prefix="moodboard-test-"))
+    os.environ.update(MOODBOARD_OUTPUT_DIR=str(_scratch / "outputs"), MOODBOARD_DATA_DIR=str(_scratch / "data"))
+
+import catalog
+import mb_app
+import metrics
+import output_store
+from conftest import fake_client
+
+
+def _entry(output_id, subject, reasoning="", created_at=None, **fields):
+    return dict(
+        output_id=output_id, kind="generated", subject=subject, prompt=f"Create a moodboard. Theme: {subject}",
+        reasoning=reasoning, model=mb_app.GEMINI_3_MODEL_ID, created_at=created_at, **fields,
+    )
+
+
+def test_search_and_pagination():
+    """Test ranking, stemming, prefix matching, pagination and hostile query text"""
+    print("=" * 60)
+    print("Test: Search and pagination")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = catalog.Catalog(Path(tmp) / "catalog.sqlite3")
+        store.write([
+            _entry("a.png", "Sustainable luxury dresses", created_at=1.0),
+            _entry("b.png", "Brutalist menswear", reasoning="Pairing the coats with a luxury leather dress shoe.", created_at=2.0),
+            _entry("c.png", "Coastal knitwear capsule", created_at=3.0),
+        ] + [_entry(f"n{i}.png", f"Neon streetwear look {i}", created_at=10.0 + i) for i in range(45)])
+
+        found = store.search("luxury dress")
+        print(f"  'luxury dress': {[(r['output_id'], r['snippet']) for r in found['results']]}")
+        assert [r["output_id"] for r in found["results"]] == ["a.png", "b.png"]
+        assert "[luxury]" in found["results"][0]["snippet"]
+        print("  ✅ Stemmed matches, subject hits ranked above reasoning hits")
+
+        assert [r["output_id"] for r in store.search("knit")["results"]] == ["c.png"]
+        for hostile in ['"luxury', "luxury OR", "-dress*", "NEAR(luxury", "subject: (", "'; DROP TABLE generations; --"]:
+            store.search(hostile)
+        print("  ✅ Last word matches as a prefix; quotes and operators are never parsed")
+
+        first = store.search("streetwear", page=1, page_size=20)
+        last = store.search("streetwear", page=3, page_size=20)
+        assert (first["total"], first["pages"], len(first["results"]), len(last["results"])) == (45, 3, 20, 5)
+        newest = store.search("", page=1, page_size=2)
+        assert newest["total"] == 48 and [r["output_id"] for r in newest["results"]] == ["n44.png", "n43.png"]
+        assert store.search("", page_size=10_000)["page_size"] == catalog.CATALOG_MAX_PAGE_SIZE
+        print("  ✅ Pages of 20 over 45 matches; empty query lists newest first")
+
+
+def test_batched_background_writes():
+    """Test that record() only queues, and the writer commits many entries per transaction"""
+    print("\n" + "=" * 60)
+    print("Test: Batched writer")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = catalog.Catalog(Path(tmp) / "catalog.sqlite3")
+        batches_before = metrics.get("moodboard_catalog_batches_total")
+        count = 500
+        started = time.perf_counter()
+        for i in range(count):
+            store.record(_entry(f"{i}.png", f"Velvet evening wear {i}", bbox=[1, 2, 3, 4]))
+        per_record_us = (time.perf_counter() - started) * 1e6 / count
+        assert store.flush(timeout=30)
+        batches = metrics.get("moodboard_catalog_batches_total") - batches_before
+        print(f"  {count} records: {per_record_us:.0f} µs each on the request path, written in {batches:.0f} transactions")
+        assert store.search("velvet")["total"] == count
+        assert store.get("7.png")["bbox"] == [1, 2, 3, 4]
+        assert batches <= count / catalog.CATALOG_BATCH_SIZE + 2
+        print("  ✅ Everything written, in batches")
+
+
+def test_generations_and_edits_are_catalogued():
+    """Test that generate_image and edit_image_region record searchable entries"""
+    print("\n" + "=" * 60)
+    print("Test: Catalogued generations and edits")
+    print("=" * 60)
+
+    original_get_client = mb_app._get_client
+    original_catalog = catalog._catalog
+    mb_app._get_client = lambda api_key: fake_client(color=(120, 90, 60), thought="Choosing ochre and rust tones.")
+    outputs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        catalog._catalog = catalog.Catalog(Path(tmp) / "catalog.sqlite3")
+        try:
+            generated, _, _ = mb_app.generate_image(
+                "Desert nomad tailoring", mb_app.GEMINI_3_MODEL_ID, "", None, "single", "fast"
+            )
+            outputs.append(Path(generated))
+            edited, _, _ = mb_app.edit_image_region(
+                None, generated, 0, 0, 32, 24, "Swap the scarf for a turban",
+                mb_app.GEMINI_3_MODEL_ID, "", None, "full",
+            )
+            outputs.append(Path(edited))
+            assert catalog.catalog().flush(timeout=30)
+
+            entry = catalog.catalog().search("nomad tailoring")["results"][0]
+            print(f"  generation: {entry}")
+            assert entry["output_id"] == Path(generated).name and entry["kind"] == "generated"
+            assert entry["subject"] == "Desert nomad tailoring" and entry["latency_profile"] == "fast"
+            assert entry["generation_mode"] == "single" and entry["duration_ms"] >= 0
+            full = catalog.catalog().get(entry["output_id"])
+            assert "Desert nomad tailoring" in full["prompt"] and full["reasoning"] == "Choosing ochre and rust tones."
+
+            page = mb_app.search_catalog("turban")
+            print(f"  edit: {page['results'][0]}")
+            edit = page["results"][0]
+            assert page["total"] == 1 and edit["image"] == edited and edit["kind"] == "edited"
+            assert edit["parent"] == Path(generated).name and edit["bbox"] == [0, 0, 32, 24]
+            assert mb_app.search_catalog("ochre rust")["total"] == 2
+            print("  ✅ Subject, prompt, edit request, bbox, parent and reasoning are all searchable")
+        finally:
+            mb_app._get_client = original_get_client
+            catalog._catalog = original_catalog
+            for path in outputs:
+                path.unlink(missing_ok=True)
+                for sidecar in output_store.sidecars(path):
+                    sidecar.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    test_search_and_pagination()
+    test_batched_background_writes()
+    test_generations_and_edits_are_catalogued()
+    print("\n✅ ALL TESTS PASSED!")
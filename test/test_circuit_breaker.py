@@ -0,0 +1,114 @@
+"""
+Test the per-model circuit breaker and fallback to the faster model
+"""
+import sys
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import circuit_breaker
+import mb_app
+import output_store
+from conftest import fake_client
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_breaker_states():
+    """Test tripping on errors and slow calls, and half-open probing"""
+    print("=" * 60)
+    print("Test: Breaker state machine")
+    print("=" * 60)
+
+    clock = FakeClock()
+    breaker = circuit_breaker.CircuitBreaker("m", clock=clock)
+    for _ in range(circuit_breaker.BREAKER_MIN_CALLS - 1):
+        assert breaker.acquire()
+        breaker.record(False, 1.0)
+    assert breaker.state == circuit_breaker.CLOSED  # not enough calls to judge yet
+    breaker.record(False, 1.0)
+    assert breaker.state == circuit_breaker.OPEN and not breaker.acquire()
+    print("  ✅ Opens once the error rate crosses the threshold")
+
+    clock.now += circuit_breaker.BREAKER_OPEN_SECONDS
+    assert breaker.state == circuit_breaker.HALF_OPEN
+    assert breaker.acquire() and not breaker.acquire()  # one probe at a time
+    breaker.record(False, 1.0)
+    assert breaker.state == circuit_breaker.OPEN
+    clock.now += circuit_breaker.BREAKER_OPEN_SECONDS
+    assert breaker.acquire()
+    breaker.release()  # a cancelled probe frees its slot
+    assert breaker.acquire()
+    breaker.record(True, 1.0)
+    assert breaker.state == circuit_breaker.CLOSED
+    print("  ✅ Half-open: failed probe reopens, healthy probe closes")
+
+    for _ in range(circuit_breaker.BREAKER_MIN_CALLS):
+        breaker.record(True, circuit_breaker.BREAKER_SLOW_CALL_S + 1)
+    assert breaker.state == circuit_breaker.OPEN
+    print("  ✅ Opens when calls are consistently slow")
+
+
+def test_open_breaker_routes_to_fallback():
+    """Test that an open Pro breaker fails fast, or is served by Flash when fallback is enabled"""
+    print("\n" + "=" * 60)
+    print("Test: Fallback while the breaker is open")
+    print("=" * 60)
+
+    calls, outputs = [], []
+    original_get_client = mb_app._get_client
+    original_fallback = circuit_breaker.MODEL_FALLBACK_ENABLED
+    mb_app._get_client = lambda api_key: fake_client(calls, (10, 20, 30))
+    circuit_breaker.reset()
+    try:
+        breaker = circuit_breaker.breaker_for(mb_app.GEMINI_3_MODEL_ID)
+        for _ in range(circuit_breaker.BREAKER_MIN_CALLS):
+            breaker.record(False, 1.0)
+
+        circuit_breaker.MODEL_FALLBACK_ENABLED = False
+        try:
+            mb_app.generate_image("Gorpcore layers", mb_app.GEMINI_3_MODEL_ID, "", None, "single")
+            raise AssertionError("expected the open breaker to reject the call")
+        except mb_app.AppError as e:
+            assert "temporarily unavailable" in str(e) and mb_app.GEMINI_25_MODEL_ID in str(e)
+        assert not calls
+        print("  ✅ Without fallback the request fails fast and no call is made")
+
+        circuit_breaker.MODEL_FALLBACK_ENABLED = True
+        output_path, _, run_info = mb_app.generate_image(
+            "Gorpcore layers", mb_app.GEMINI_3_MODEL_ID, "", None, "single"
+        )
+        outputs.append(Path(output_path))
+        print(f"  run_info={run_info}")
+        assert calls[0].model == mb_app.GEMINI_25_MODEL_ID
+        assert calls[0].config.image_config.image_size is None
+        assert run_info.pop("panels") == []  # the fake board is blank, so no grid panels are detected
+        assert run_info == {
+            "latency_profile": "balanced",
+            "requested_model": mb_app.GEMINI_3_MODEL_ID,
+            "served_model": mb_app.GEMINI_25_MODEL_ID,
+            "fallback": True,
+            "template": mb_app._resolve_template("", mb_app.PROMPT_TEMPLATE_NAME).id,
+        }
+        print("  ✅ Served by the fallback model with its own image config, and reported")
+    finally:
+        mb_app._get_client = original_get_client
+        circuit_breaker.MODEL_FALLBACK_ENABLED = original_fallback
+        circuit_breaker.reset()
+        for path in outputs:
+            path.unlink(missing_ok=True)
+            for sidecar in output_store.sidecars(path):
+                sidecar.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    test_breaker_states()
+    test_open_breaker_routes_to_fallback()
+    print("\n✅ ALL TESTS PASSED!")
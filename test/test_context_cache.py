@@ -0,0 +1,144 @@
+"""
+Test explicit context caching of the static prompt-template instructions
+"""
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import context_cache
+import mb_app
+import output_store
+from conftest import fake_client
+
+
+class LocalCaches:
+    """Stand-in for client.caches: records creates and updates, with a configurable lifetime."""
+
+    def __init__(self, ttl_s: float = 3600, fail: bool = False):
+        self.ttl_s = ttl_s
+        self.fail = fail
+        self.attempts = 0
+        self.created = []
+        self.updated = []
+
+    def _expiry(self):
+        return datetime.now(timezone.utc) + timedelta(seconds=self.ttl_s)
+
+    def create(self, model, config):
+        self.attempts += 1
+        if self.fail:
+            raise RuntimeError("Cached content is too small")
+        self.created.append((model, config.system_instruction))
+        return SimpleNamespace(name=f"cachedContents/local-{len(self.created)}", expire_time=self._expiry())
+
+    def update(self, name, config):
+        self.updated.append(name)
+        return SimpleNamespace(name=name, expire_time=self._expiry())
+
+
+def test_split_prompt():
+    """Test that only the filled-in lines of a built prompt are variable"""
+    print("=" * 60)
+    print("Test: Split prompts into static and variable parts")
+    print("=" * 60)
+
+    template = mb_app._load_prompt_template()
+    static_a, variable_a = context_cache.split_prompt(template, mb_app._build_prompt("tweed tailoring", template))
+    static_b, variable_b = context_cache.split_prompt(template, mb_app._build_prompt("silk slip dresses", template))
+    assert static_a == static_b
+    assert variable_a == "Fashion Moodboard for tweed tailoring"
+    assert context_cache.VARIABLE_MARKER in static_a and "{SUBJECT_PLACEHOLDER}" not in static_a
+    print(f"  ✅ Generate: {len(static_a)} static chars, {len(variable_a)} variable chars")
+
+    edit_template = mb_app._load_edit_template()
+    with_bbox = mb_app._build_edit_prompt(100, 50, 300, 250, "Make it red", edit_template, 1440, 1024)
+    without_bbox = mb_app._build_edit_prompt(None, None, None, None, "Make it red", edit_template, 1440, 1024,
+                                             has_bbox=False)
+    static_bbox, variable_bbox = context_cache.split_prompt(edit_template, with_bbox)
+    static_plain, variable_plain = context_cache.split_prompt(edit_template, without_bbox)
+    assert static_bbox != static_plain and "Grid Cell Location" not in static_plain
+    assert "Make it red" in variable_bbox and "(0.0694, 0.0488)" in variable_bbox
+    assert "Make it red" in variable_plain and "{" not in static_plain
+    print("  ✅ Edit: bbox and whole-image variants cache separately")
+
+    assert context_cache.split_prompt(template, "Something else entirely") is None
+    print("  ✅ Prompts sharing nothing with the template are sent as they are")
+
+
+def test_generations_reference_cached_content():
+    """Test that the template is cached once per model, extended before expiry and skipped when grounded"""
+    print("\n" + "=" * 60)
+    print("Test: Cached content referenced by generations")
+    print("=" * 60)
+
+    original_enabled = context_cache.CONTEXT_CACHE_ENABLED
+    original_caches = context_cache._caches
+    original_get_client = mb_app._get_client
+    context_cache.CONTEXT_CACHE_ENABLED = True
+    context_cache._caches = context_cache.ContextCaches(ttl_s=3600, refresh_s=60, retry_s=600)
+    caches = LocalCaches()
+    calls = []
+    mb_app._get_client = lambda api_key: fake_client(calls, caches=caches)
+    outputs = []
+
+    def generate(subject, profile="fast"):
+        output_path, _, _ = mb_app.generate_image(
+            subject, mb_app.GEMINI_3_MODEL_ID, "", "test-key", "single", profile
+        )
+        outputs.append(Path(output_path))
+
+    try:
+        for subject in ("tweed tailoring", "silk slip dresses", "technical outerwear"):
+            generate(subject)
+        assert len(caches.created) == 1 and caches.created[0][0] == mb_app.GEMINI_25_MODEL_ID
+        assert [call.contents for call in calls] == [
+            "Fashion Moodboard for tweed tailoring",
+            "Fashion Moodboard for silk slip dresses",
+            "Fashion Moodboard for technical outerwear",
+        ]
+        assert {call.config.cached_content for call in calls} == {"cachedContents/local-1"}
+        print("  ✅ 3 generations, 1 cache, only the subject line sent")
+
+        generate("tweed tailoring", profile="quality")
+        assert len(caches.created) == 2 and caches.created[1][0] == mb_app.GEMINI_3_MODEL_ID
+        print("  ✅ Each model gets its own cache")
+
+        calls.clear()
+        generate("Latest 2026 runway trends in technical outerwear", profile="balanced")
+        assert calls[0].config.cached_content is None and "CRITICAL CONSTRAINTS" in calls[0].contents
+        print("  ✅ Grounded requests (tools) send the full prompt")
+
+        context_cache._caches.clear()
+        caches.ttl_s = 30  # already within the refresh margin
+        generate("tweed tailoring")
+        generate("silk slip dresses")
+        assert len(caches.created) == 3 and caches.updated == ["cachedContents/local-3"]
+        print("  ✅ A cache about to expire is extended instead of recreated")
+
+        context_cache._caches.clear()
+        caches.fail = True
+        calls.clear()
+        attempts = caches.attempts
+        generate("tweed tailoring")
+        generate("silk slip dresses")
+        assert all(call.config.cached_content is None and "CRITICAL CONSTRAINTS" in call.contents for call in calls)
+        assert caches.attempts == attempts + 1
+        print("  ✅ A failed create falls back to full prompts without retrying every call")
+    finally:
+        context_cache.CONTEXT_CACHE_ENABLED = original_enabled
+        context_cache._caches = original_caches
+        mb_app._get_client = original_get_client
+        for path in outputs:
+            path.unlink(missing_ok=True)
+            for sidecar in output_store.sidecars(path):
+                sidecar.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    test_split_prompt()
+    test_generations_reference_cached_content()
+    print("\n✅ ALL TESTS PASSED!")
@@ -0,0 +1,137 @@
+"""
+Test the per-lineage edit coalescing queue
+"""
+import io
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from PIL import Image
+
+import edit_queue
+import mb_app
+import output_store
+from conftest import fake_client
+
+
+def test_combine_edits():
+    """Test merging rules: joined instructions, bbox edits as regions, same-region supersede"""
+    print("=" * 60)
+    print("Test: combine_edits")
+    print("=" * 60)
+
+    def edit(edit_request, bbox=(None, None, None, None)):
+        return edit_queue.PendingEdit(dict(zip(edit_queue.BBOX_PARAMS, bbox), edit_request=edit_request, regions=""))
+
+    edits = [
+        edit("Make the background warmer"),
+        edit("Turn the dress blue", (0, 0, 300, 500)),
+        edit("Add a hat", (400, 0, 700, 500)),
+        edit("Turn the dress green", (0, 0, 300, 500)),
+        edit("make the background  WARMER"),
+    ]
+    combined = edit_queue.combine_edits(edits)
+    print(f"  edit_request={combined['edit_request']!r}")
+    print(f"  regions={combined['regions']}")
+    assert combined["x_top"] is None
+    assert combined["edit_request"] == "make the background  WARMER"
+    assert [r["edit_request"] for r in combined["regions"]] == ["Turn the dress green", "Add a hat"]
+    assert [e.superseded for e in edits] == [True, True, False, False, False]
+    print("  ✅ Later instructions for the same region supersede earlier ones")
+
+    single = [edit("Only one")]
+    assert edit_queue.combine_edits(single) == single[0].params
+    print("  ✅ A lone edit passes through unchanged")
+
+
+def test_idle_lineage_is_sent_at_once():
+    """Test that an edit with nothing running on its lineage skips the coalescing window"""
+    print("\n" + "=" * 60)
+    print("Test: Idle lineage")
+    print("=" * 60)
+
+    original_window = edit_queue.EDIT_COALESCE_WINDOW_MS
+    edit_queue.EDIT_COALESCE_WINDOW_MS = 2000
+    try:
+        started = time.perf_counter()
+        result = edit_queue.submit("generated_idle.png", "ctx", {"edit_request": "Add a hat"},
+                                   lambda params, parent_override, requests: [params["edit_request"]])
+        elapsed = time.perf_counter() - started
+    finally:
+        edit_queue.EDIT_COALESCE_WINDOW_MS = original_window
+    print(f"  Sent after {elapsed * 1000:.1f} ms")
+    assert result == ["Add a hat"] and elapsed < 0.5
+    print("  ✅ No window when no call is running")
+
+
+def test_racing_edits_are_serialized_and_coalesced():
+    """Test that edits racing on one parent cost two calls, not four, and chain on each other"""
+    print("\n" + "=" * 60)
+    print("Test: Racing edits on one lineage")
+    print("=" * 60)
+
+    calls = []
+    results = {}
+    original_get_client = mb_app._get_client
+    # Each call takes 0.5 s and returns the received image in a new colour
+    mb_app._get_client = lambda api_key: fake_client(
+        calls, lambda number: ((number + 1) * 40, 0, 0), before=lambda *call: time.sleep(0.5)
+    )
+    before = edit_queue.stats()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            source = Path(tmp) / "generated_board.png"
+            Image.new("RGB", (320, 200), (200, 200, 200)).save(source)
+
+            def fire(name, edit_request, bbox=(None, None, None, None)):
+                results[name] = mb_app.edit_image_region(
+                    None, str(source), *bbox, edit_request, mb_app.GEMINI_25_MODEL_ID, "", None, "full",
+                )
+
+            first = threading.Thread(target=fire, args=("a", "Make it moodier"))
+            first.start()
+            time.sleep(0.4)  # "a" is now in flight; the rest queue behind it
+            followers = [
+                threading.Thread(target=fire, args=("b", "Recolour the shoes", (0, 0, 100, 100))),
+                threading.Thread(target=fire, args=("c", "Recolour the shoes red", (0, 0, 100, 100))),
+                threading.Thread(target=fire, args=("d", "Add a brooch", (200, 0, 300, 100))),
+            ]
+            for thread in followers:
+                thread.start()
+                time.sleep(0.02)
+            for thread in [first] + followers:
+                thread.join(timeout=10)
+    finally:
+        mb_app._get_client = original_get_client
+
+    outputs = {name: Path(path) for name, (path, _, _) in results.items()}
+    try:
+        after = edit_queue.stats()
+        print(f"  Calls: {len(calls)}, stats delta: "
+              f"{ {k: after[k] - before[k] for k in after} }")
+        assert len(calls) == 2
+        assert outputs["b"] == outputs["c"] == outputs["d"] != outputs["a"]
+        received, prompt = calls[1].contents
+        # The second batch is built on the first batch's output
+        assert Image.open(io.BytesIO(received.inline_data.data)).convert("RGB").getpixel((5, 5)) == (40, 0, 0)
+        assert "Recolour the shoes red" in prompt and "Add a brooch" in prompt
+        assert "Recolour the shoes\n" not in prompt
+        assert after["superseded"] - before["superseded"] == 1
+        print("  ✅ Serialized, coalesced into one call, superseded edit never sent")
+    finally:
+        for path in set(outputs.values()):
+            path.unlink(missing_ok=True)
+            for sidecar in output_store.sidecars(path):
+                sidecar.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    test_combine_edits()
+    test_idle_lineage_is_sent_at_once()
+    test_racing_edits_are_serialized_and_coalesced()
+    print("\n✅ ALL TESTS PASSED!")
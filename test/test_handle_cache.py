@@ -0,0 +1,63 @@
+"""
+Test the expiring-handle cache shared by layout references and context caches
+"""
+import sys
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from handle_cache import HandleCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_refresh_retry_and_idle_eviction():
+    """Test refreshing near expiry, the retry window after a failure, and forgetting idle keys"""
+    print("=" * 60)
+    print("Test: Expiring handles")
+    print("=" * 60)
+
+    clock = FakeClock()
+    cache = HandleCache(refresh_s=60, retry_s=300, idle_s=3600, max_entries=2, clock=clock)
+    created = []
+
+    def create(current):
+        created.append(current)
+        return f"handle-{len(created)}", clock.now + 600
+
+    assert cache.get("a", create) == ("handle-1", False)
+    assert cache.get("a", create) == ("handle-1", True)
+    clock.now += 560  # within refresh_s of expiring: replaced, and the live handle is passed on
+    assert cache.get("a", create) == ("handle-2", False) and created[-1] == "handle-1"
+    print("  ✅ Created once, replaced before it expires")
+
+    def fail(current):
+        raise RuntimeError("offline")
+
+    try:
+        cache.get("b", fail)
+        raise AssertionError("expected the create error to be raised")
+    except RuntimeError:
+        pass
+    assert cache.get("b", create) is None
+    clock.now += 301
+    assert cache.get("b", create) == ("handle-3", False)
+    print("  ✅ A failed key is not tried again within retry_s")
+
+    assert cache.get("c", create) is None  # two handles held
+    clock.now += 3601
+    assert cache.get("c", create) == ("handle-4", False)
+    assert len(cache) == 1
+    print("  ✅ Idle keys are forgotten, which also makes room for new ones")
+
+
+if __name__ == "__main__":
+    test_refresh_retry_and_idle_eviction()
+    print("\n✅ ALL TESTS PASSED!")
@@ -0,0 +1,86 @@
+"""
+Test headless API mode (no Gradio import, no Blocks UI)
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+
+HEADLESS_SCRIPT = """
+import json, sys
+import mb_app
+from fastapi.testclient import TestClient
+import headless_app
+
+client = TestClient(headless_app.create_app())
+empty = client.post("/gradio_api/api/generate_image", json={"data": ["   ", "m", "", ""]})
+unknown = client.post("/gradio_api/api/nope", json={"data": []})
+escape = client.get("/gradio_api/file=/etc/passwd")
+(mb_app.OUTPUT_DIR / "generated_20250101_000000_abcd1234.png").write_bytes(b"png")
+accel = client.get("/outputs/generated_20250101_000000_abcd1234.png")
+(mb_app.OUTPUT_DIR / "generated_20250101_000000_abcd1234.run.json").write_text("{}")
+(mb_app.OUTPUT_DIR / "notes.png").write_bytes(b"png")
+private = [
+    client.get("/outputs/generated_20250101_000000_abcd1234.run.json").status_code,
+    client.get("/gradio_api/file=generated_20250101_000000_abcd1234.run.json").status_code,
+    client.get("/outputs/notes.png").status_code,
+]
+print(json.dumps({
+    "gradio_loaded": "gradio" in sys.modules,
+    "genai_loaded": "google.genai" in sys.modules,
+    "demo": mb_app.demo is None,
+    "empty": [empty.status_code, empty.json()],
+    "unknown": unknown.status_code,
+    "escape": escape.status_code,
+    "private": private,
+    "accel": [accel.status_code, accel.headers.get("x-accel-redirect"), accel.content.decode()],
+    "url": headless_app._file_data(str(mb_app.OUTPUT_DIR / "generated_x.png"))["url"],
+}))
+"""
+
+
+def test_headless_mode_skips_gradio():
+    """Test that headless mode serves the endpoints without importing Gradio"""
+    print("=" * 60)
+    print("Test: Headless API mode")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            MOODBOARD_HEADLESS="1",
+            MOODBOARD_OUTPUT_DIR=tmp,
+            MOODBOARD_OUTPUT_URL_PREFIX="/outputs/",
+            MOODBOARD_X_ACCEL_PREFIX="/_protected_outputs/",
+        )
+        completed = subprocess.run(
+            [sys.executable, "-c", HEADLESS_SCRIPT],
+            cwd=ROOT, env=env, capture_output=True, text=True, timeout=120,
+        )
+    assert completed.returncode == 0, completed.stderr
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    print(f"  Result: {result}")
+
+    assert result["gradio_loaded"] is False
+    assert result["genai_loaded"] is False
+    assert result["demo"] is True
+    assert result["empty"][0] == 400
+    assert "cannot be empty" in result["empty"][1]["error"]
+    assert result["unknown"] == 404
+    assert result["escape"] == 404
+    assert result["private"] == [404, 404, 404]
+    print("  ✅ Endpoints served without Gradio or google-genai loaded, only output files downloadable")
+
+    # Image bytes are left to nginx: only the X-Accel-Redirect header comes back
+    assert result["accel"] == [200, "/_protected_outputs/generated_20250101_000000_abcd1234.png", ""]
+    assert result["url"] == "/outputs/generated_x.png"
+    print("  ✅ Downloads handed to nginx via X-Accel-Redirect")
+
+
+if __name__ == "__main__":
+    test_headless_mode_skips_gradio()
+    print("\n✅ ALL TESTS PASSED!")
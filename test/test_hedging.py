@@ -0,0 +1,139 @@
+"""
+Test hedged generate calls for tail-latency control
+"""
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from PIL import Image
+
+import hedging
+import mb_app
+import metrics
+import output_store
+from conftest import fake_client
+
+
+def _by_number(number):
+    """Colour identifying which call an image came from."""
+    return (number * 100, 0, 0)
+
+
+def _configure(enabled=True, min_delay=0.1, budget=None):
+    hedging.HEDGE_ENABLED = enabled
+    hedging.HEDGE_MIN_DELAY_S = min_delay
+    hedging.budget = budget or hedging.HedgeBudget(fraction=0.5, burst=1)
+    hedging.latencies.clear()
+    key = mb_app._latency_key("fake-model", mb_app.LATENCY_PROFILES[mb_app.DEFAULT_LATENCY_PROFILE])
+    for _ in range(hedging.HEDGE_MIN_SAMPLES):
+        hedging.latencies.record(key, 0.2)
+
+
+def test_latency_percentile_and_budget():
+    """Test the per-model percentile and the hedge budget"""
+    print("=" * 60)
+    print("Test: Latency percentile and budget")
+    print("=" * 60)
+
+    tracker = hedging.LatencyTracker(window=100)
+    for seconds in range(1, 101):
+        tracker.record("m", float(seconds))
+    assert tracker.percentile("m", 95) == 95.0
+    assert tracker.percentile("other", 95) is None
+    assert tracker.percentile("m", 95, min_samples=101) is None
+    print("  ✅ p95 of 1..100 is 95; unknown or sparse models are not hedged")
+
+    budget = hedging.HedgeBudget(fraction=0.25, burst=1)
+    assert budget.try_spend() and not budget.try_spend()
+    for _ in range(3):
+        budget.record_call()
+    assert not budget.try_spend()
+    budget.record_call()
+    assert budget.try_spend()
+    print("  ✅ One hedge per four calls at a 25% budget")
+
+    async def call():
+        return "edited"
+
+    hedging.latencies.clear()
+    assert asyncio.run(hedging.race("m", call, hedge=False)) == "edited"
+    assert hedging.latencies.percentile("m", 95) is None
+    assert asyncio.run(hedging.race("m", call)) == "edited"
+    assert hedging.latencies.percentile("m", 95) is not None
+    print("  ✅ Only hedge-eligible calls are recorded")
+
+    fast, quality = mb_app.LATENCY_PROFILES["fast"], mb_app.LATENCY_PROFILES["quality"]
+    assert mb_app._latency_key("m", fast) != mb_app._latency_key("m", quality)
+    assert mb_app._latency_key("m", quality) != mb_app._latency_key("m", quality, tools=[{"google_search": {}}])
+    print("  ✅ Profiles and grounding are tracked separately")
+
+
+def test_slow_call_is_hedged():
+    """Test that a call stuck past the percentile is raced and the faster copy wins"""
+    print("\n" + "=" * 60)
+    print("Test: Hedged generate_image")
+    print("=" * 60)
+
+    original = (hedging.HEDGE_ENABLED, hedging.HEDGE_MIN_DELAY_S, hedging.budget)
+    original_get_client = mb_app._get_client
+    calls = []
+    mb_app._get_client = lambda api_key: fake_client(calls, _by_number, delays=[10.0, 0.05, 10.0, 10.0])
+    wins_before = metrics.get("moodboard_hedge_wins_total", model="fake-model")
+    outputs = []
+    try:
+        _configure()
+        started = time.perf_counter()
+        output_path, _, _ = mb_app.generate_image("Quiet luxury knitwear", "fake-model", "", None, "single")
+        outputs.append(Path(output_path))
+        elapsed = time.perf_counter() - started
+        print(f"  Finished in {elapsed:.2f}s with {len(calls)} calls")
+        assert len(calls) == 2 and calls[0].cancelled
+        assert Image.open(output_path).getpixel((0, 0)) == (100, 0, 0)  # the hedge's image
+        assert elapsed < 2
+        assert metrics.get("moodboard_hedge_wins_total", model="fake-model") == wins_before + 1
+        print("  ✅ Hedge issued after the p95 delay, won, and the slow call was cancelled")
+
+        # The budget is spent: the next slow call waits instead of hedging again
+        calls.clear()
+        mb_app._get_client = lambda api_key: fake_client(calls, _by_number, delays=[0.4, 0.05])
+        output_path, _, _ = mb_app.generate_image("Quiet luxury knitwear", "fake-model", "", None, "single")
+        outputs.append(Path(output_path))
+        assert len(calls) == 1
+        print("  ✅ No hedge once the budget is exhausted")
+
+        # Disabled: never hedged
+        _configure(enabled=False)
+        calls.clear()
+        mb_app._get_client = lambda api_key: fake_client(calls, _by_number, delays=[0.4, 0.05])
+        output_path, _, _ = mb_app.generate_image("Quiet luxury knitwear", "fake-model", "", None, "single")
+        outputs.append(Path(output_path))
+        assert len(calls) == 1
+        print("  ✅ No hedge when HEDGE_ENABLED is off")
+
+        # Panels: each call outlasts the board p95, but panels are neither hedged nor recorded
+        _configure(budget=hedging.HedgeBudget(fraction=1.0, burst=100))
+        calls.clear()
+        mb_app._get_client = lambda api_key: fake_client(calls, _by_number, delays=[0.3] * 8)
+        output_path, _, _ = mb_app.generate_image("Quiet luxury knitwear", "fake-model", "", "test-key", "panels")
+        outputs.append(Path(output_path))
+        assert len(calls) == 8 and not any(call.cancelled for call in calls)
+        key = mb_app._latency_key("fake-model", mb_app.LATENCY_PROFILES[mb_app.DEFAULT_LATENCY_PROFILE])
+        assert hedging.latencies.percentile(key, 95, min_samples=hedging.HEDGE_MIN_SAMPLES + 1) is None
+        print("  ✅ Panel calls are not hedged and do not feed the board latencies")
+    finally:
+        hedging.HEDGE_ENABLED, hedging.HEDGE_MIN_DELAY_S, hedging.budget = original
+        mb_app._get_client = original_get_client
+        for path in outputs:
+            path.unlink(missing_ok=True)
+            for sidecar in output_store.sidecars(path):
+                sidecar.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    test_latency_percentile_and_budget()
+    test_slow_call_is_hedged()
+    print("\n✅ ALL TESTS PASSED!")
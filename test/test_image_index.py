@@ -0,0 +1,131 @@
+"""
+Test perceptual hashing, the multi-index hash table, output dedup and similar-board lookup
+"""
+import io
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+if "MOODBOARD_OUTPUT_DIR" not in os.environ:  # run as a script; under pytest conftest.py does this
+    _scratch = Path(tempfile.mkdtemp(prefix="moodboard-test-"))
+    os.environ.update(MOODBOARD_OUTPUT_DIR=str(_scratch / "outputs"), MOODBOARD_DATA_DIR=str(_scratch / "data"))
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+import image_index
+import mb_app
+import output_store
+
+
+def _board(seed: int) -> Image.Image:
+    """A synthetic moodboard: coloured blocks on white."""
+    rng = np.random.default_rng(seed)
+    image = Image.new("RGB", (512, 384), "white")
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.integers(0, 448), rng.integers(0, 320)
+        draw.rectangle([x, y, x + rng.integers(30, 120), y + rng.integers(30, 120)],
+                       fill=tuple(int(v) for v in rng.integers(0, 255, 3)))
+    return image
+
+
+def test_perceptual_hashes():
+    """Test that hashes survive re-encoding and resizing but separate different boards"""
+    print("=" * 60)
+    print("Test: Perceptual hashes")
+    print("=" * 60)
+
+    board, other = _board(1), _board(2)
+    buffer = io.BytesIO()
+    board.save(buffer, format="JPEG", quality=70)
+    variants = [Image.open(io.BytesIO(buffer.getvalue())), board.resize((1024, 768))]
+    for variant in variants:
+        p = image_index.hamming([image_index.phash(variant)], image_index.phash(board))[0]
+        d = image_index.hamming([image_index.dhash(variant)], image_index.dhash(board))[0]
+        print(f"  re-encoded/resized: pHash distance {p}, dHash distance {d}")
+        assert p <= 4 and d <= 6
+    far = image_index.hamming([image_index.phash(other)], image_index.phash(board))[0]
+    print(f"  different board: pHash distance {far}")
+    assert far > image_index.SIMILAR_BOARD_MAX_DISTANCE
+    assert image_index.content_digest(board) == image_index.content_digest(board.copy())
+    assert image_index.content_digest(board) != image_index.content_digest(variants[0].convert("RGB"))
+    print("  ✅ Robust to re-encoding, discriminative across boards; digest is exact")
+
+    values = np.random.default_rng(3).integers(0, 2**63, 1000, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    assert image_index._popcount(values).tolist() == [bin(value).count("1") for value in values.tolist()]
+    print("  ✅ Table popcount (used on numpy 1.x) matches")
+
+
+def test_hash_index_matches_brute_force():
+    """Test that multi-index lookups return exactly what a full scan would"""
+    print("\n" + "=" * 60)
+    print("Test: Multi-index hash table")
+    print("=" * 60)
+
+    rng = np.random.default_rng(3)
+    base = rng.integers(0, 2**63, 2000, dtype=np.uint64) * np.uint64(2)
+    noisy = base ^ (np.uint64(1) << rng.integers(0, 64, 2000).astype(np.uint64))
+    phashes = np.concatenate([base, noisy])
+    dhashes = phashes.copy()
+    index = image_index.HashIndex()
+    for value in phashes.tolist():
+        index.add(value, value)
+    for radius in (0, 3, 7, 10):
+        for i in range(0, len(phashes), 97):
+            found = index.query(int(phashes[i]), int(dhashes[i]), radius)
+            expected = set(np.flatnonzero(image_index.hamming(phashes, phashes[i]) <= radius).tolist())
+            assert {entry_id for entry_id, _ in found} == expected
+            assert [distance for _, distance in found] == sorted(distance for _, distance in found)
+    print("  ✅ Same results as a brute-force scan at radius 0-10, nearest first")
+
+
+def test_dedup_and_similar_boards():
+    """Test that identical outputs are hard-linked and similar boards are found"""
+    print("\n" + "=" * 60)
+    print("Test: Dedup and find_similar_boards")
+    print("=" * 60)
+
+    original_index = image_index._index
+    outputs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        image_index._index = image_index.ImageIndex(Path(tmp) / "image_hashes.jsonl")
+        try:
+            board = _board(5)
+            first = image_index.save_image(board, "generated")
+            second = image_index.save_image(board.copy(), "edited")
+            tweaked_board = board.copy()
+            ImageDraw.Draw(tweaked_board).rectangle([500, 370, 511, 383], fill="black")
+            tweaked = image_index.save_image(tweaked_board, "edited")
+            unrelated = image_index.save_image(_board(6), "generated")
+            outputs += [first, second, tweaked, unrelated]
+
+            assert first != second and first.stat().st_ino == second.stat().st_ino
+            assert tweaked.stat().st_ino != first.stat().st_ino
+            print(f"  {second.name} -> hard link to {first.name} (links: {first.stat().st_nlink})")
+            print("  ✅ Identical pixels stored once, under both names")
+
+            found = mb_app.find_similar_boards(first.name)["boards"]
+            print(f"  similar to {first.name}: {[(Path(b['image']).name, b['distance']) for b in found]}")
+            names = [Path(b["image"]).name for b in found]
+            assert found[names.index(second.name)]["distance"] == 0
+            assert [b["distance"] for b in found] == sorted(b["distance"] for b in found)
+            assert tweaked.name in names and unrelated.name not in names and first.name not in names
+            print("  ✅ Duplicate and near-duplicate found, unrelated board not")
+        finally:
+            image_index._index = original_index
+            for path in outputs:
+                path.unlink(missing_ok=True)
+                for sidecar in output_store.sidecars(path):
+                    sidecar.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    test_perceptual_hashes()
+    test_hash_index_matches_brute_force()
+    test_dedup_and_similar_boards()
+    print("\n✅ ALL TESTS PASSED!")
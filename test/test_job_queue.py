@@ -0,0 +1,278 @@
+"""
+Test the durable SQLite job queue (submit, workers, restart recovery, cancellation)
+"""
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import cancellation
+import job_queue
+import mb_app
+import output_store
+from conftest import fake_client
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _wait_for(store, job_id, statuses=job_queue.FINISHED, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = store.get(job_id)
+        if job["status"] in statuses:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} stuck in {store.get(job_id)['status']}")
+
+
+def test_claim_lease_and_recovery():
+    """Test that jobs are claimed once, and re-run after their worker's lease runs out"""
+    print("=" * 60)
+    print("Test: Claiming and lease recovery")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        clock = FakeClock()
+        store = job_queue.JobStore(Path(tmp) / "jobs.sqlite3", clock=clock)
+        first = store.submit("generate_image", ["a"])
+        clock.now += 1
+        second = store.submit("generate_image", ["b"])
+        assert store.get(second)["position"] == 1
+
+        job = store.claim("dead-worker")
+        assert job["id"] == first and job["attempts"] == 1
+        assert store.claim("other")["id"] == second
+        assert store.claim("other") is None
+        print("  ✅ Oldest job first, each claimed once")
+
+        # The first worker dies: nothing renews its lease
+        store.renew([second], "other")
+        clock.now += job_queue.JOB_LEASE_SECONDS + 1
+        recovered = store.claim("restarted")
+        assert recovered["id"] == first and recovered["attempts"] == 2
+        assert not store.finish(first, "dead-worker", job_queue.SUCCEEDED, ["late"])
+        assert store.finish(first, "restarted", job_queue.SUCCEEDED, ["out.png", "why"])
+        assert store.get(first)["data"] == ["out.png", "why"]
+        print("  ✅ Expired lease re-claimed; the old owner can no longer record a result")
+
+        for attempt in range(job_queue.JOB_MAX_ATTEMPTS - 1):
+            clock.now += job_queue.JOB_LEASE_SECONDS + 1
+            assert store.claim(f"crashing-{attempt}") is not None
+        clock.now += job_queue.JOB_LEASE_SECONDS + 1
+        assert store.claim("next") is None
+        assert store.get(second)["status"] == job_queue.FAILED
+        print("  ✅ A job interrupted too many times is failed")
+
+        clock.now += job_queue.JOB_RETENTION_HOURS * 3600 + 1
+        assert store.prune() == 2 and store.get(first) is None
+        print("  ✅ Finished jobs pruned after the retention period")
+
+
+def test_workers_run_handlers():
+    """Test that a worker pool runs jobs, records failures, and cancels running jobs"""
+    print("\n" + "=" * 60)
+    print("Test: Worker pool")
+    print("=" * 60)
+
+    started, release = threading.Event(), threading.Event()
+
+    def slow(request=None):
+        import cancellation
+
+        with cancellation.request_scope("slow", request):
+            started.set()
+            while not release.wait(0.05):
+                cancellation.raise_if_cancelled()
+        return "never"
+
+    def echo(text, request=None):
+        return text.upper(), request.headers["x-request-id"]
+
+    def broken(request=None):
+        raise mb_app.AppError("The model did not return any image data. Please try again.")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = job_queue.JobStore(Path(tmp) / "jobs.sqlite3")
+        pool = job_queue.WorkerPool(store, {"echo": echo, "broken": broken, "slow": slow}, workers=2).start()
+        try:
+            job_id = store.submit("echo", ["hello"], correlation_id="req-1")
+            assert _wait_for(store, job_id)["data"] == ["HELLO", "req-1"]
+            print("  ✅ Job ran with its correlation id")
+
+            job = _wait_for(store, store.submit("broken", []))
+            assert job["status"] == job_queue.FAILED and "image data" in job["error"]
+            print("  ✅ Errors recorded on the job")
+
+            job_id = store.submit("slow", [])
+            assert started.wait(5)
+            assert store.cancel(job_id)
+            job = _wait_for(store, job_id)
+            time.sleep(0.3)  # the worker notices within a probe interval and stops
+            assert job["status"] == job_queue.CANCELLED
+            with pool._running_lock:
+                assert job_id not in pool._running
+            print("  ✅ Cancelling a running job stops its work")
+        finally:
+            release.set()
+            pool.stop(timeout=5)
+
+
+def test_private_arguments_stay_in_memory():
+    """Test that API keys are never written to the store and that stored inputs are dropped once done"""
+    print("\n" + "=" * 60)
+    print("Test: Private job arguments")
+    print("=" * 60)
+
+    def echo_key(text, api_key=None, request=None):
+        return text, api_key == "sk-secret"
+
+    def stored_rows(path):
+        with sqlite3.connect(path) as db:
+            return [tuple(row) for row in db.execute("SELECT * FROM jobs")]
+
+    original_store, original_pool = job_queue._store, job_queue._pool
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "jobs.sqlite3"
+        job_queue._store = job_queue.JobStore(path)
+        job_queue._pool = job_queue.WorkerPool(job_queue._store, {"echo": echo_key}, workers=1)
+        try:
+            job_id = job_queue.submit("echo", ["hello", "sk-secret"], private={1: "sk-secret"})
+            assert "sk-secret" not in str(stored_rows(path))
+            job_queue._pool.start()
+            assert _wait_for(job_queue._store, job_id)["data"] == ["hello", True]
+            assert "sk-secret" not in str(stored_rows(path)) and not job_queue._private_args
+            print("  ✅ The key reached the handler without touching the store")
+
+            job_id = job_queue._store.submit("nothing", ["inputs"])
+            assert job_queue._store.cancel(job_id)
+            assert "inputs" not in str(stored_rows(path))
+            print("  ✅ Inputs dropped once a job is finished or cancelled")
+        finally:
+            job_queue._pool.stop(timeout=5)
+            job_queue._store, job_queue._pool = original_store, original_pool
+
+        clock = FakeClock()
+        store = job_queue.JobStore(Path(tmp) / "pinned.sqlite3", clock=clock)
+        job_id = store.submit("echo", ["hello", None], pinned_to="stopped-process")
+        assert store.claim("other") is None
+        clock.now += job_queue.JOB_LEASE_SECONDS + 1
+        assert store.claim("other") is None
+        job = store.get(job_id)
+        assert job["status"] == job_queue.FAILED and "submit it again" in job["error"]
+        print("  ✅ Jobs pinned to a stopped process fail instead of running without their key")
+
+
+def test_submit_job_endpoint():
+    """Test submit_job / get_job end to end with a fake model client"""
+    print("\n" + "=" * 60)
+    print("Test: submit_job endpoint")
+    print("=" * 60)
+
+    original_get_client = mb_app._get_client
+    original_store = job_queue._store
+    mb_app._get_client = lambda api_key: fake_client(color=(120, 90, 60))
+    output_path = None
+    with tempfile.TemporaryDirectory() as tmp:
+        job_queue._store = job_queue.JobStore(Path(tmp) / "jobs.sqlite3")
+        pool = job_queue.WorkerPool(job_queue._store, mb_app.JOB_HANDLERS, workers=1).start()
+        try:
+            try:
+                mb_app.submit_job("delete_everything", [])
+                raise AssertionError("expected an unknown endpoint to be rejected")
+            except mb_app.AppError as e:
+                assert "Unknown job endpoint" in str(e)
+            try:
+                mb_app.submit_job("generate_image", ["Utility workwear", mb_app.GEMINI_25_MODEL_ID, "", "user-key"])
+                raise AssertionError("expected a user key to need workers in this process")
+            except mb_app.AppError as e:
+                assert "own API key" in str(e)
+
+            submitted = mb_app.submit_job("generate_image", ["Utility workwear", mb_app.GEMINI_25_MODEL_ID, ""])
+            assert submitted["status"] == job_queue.QUEUED
+            job = _wait_for(job_queue._store, submitted["job_id"])
+            assert job["status"] == job_queue.SUCCEEDED, job
+            output_path, reasoning, run_info = job["data"]
+            assert Path(output_path).is_file() and run_info["served_model"] == mb_app.GEMINI_25_MODEL_ID
+            assert mb_app.get_job(submitted["job_id"]) == job
+            print(f"  Job: {submitted['job_id']} -> {Path(output_path).name}")
+            print("  ✅ Generate ran through the queue")
+        finally:
+            pool.stop(timeout=5)
+            mb_app._get_client = original_get_client
+            job_queue._store = original_store
+            if output_path:
+                Path(output_path).unlink(missing_ok=True)
+                for sidecar in output_store.sidecars(Path(output_path)):
+                    sidecar.unlink(missing_ok=True)
+
+
+def test_session_jobs_are_superseded_and_cancelled():
+    """Test that a newer generate job from the same session cancels the older one, and that
+    cancel_session (sent when the tab closes) cancels the session's queued jobs"""
+    print("\n" + "=" * 60)
+    print("Test: Session supersede and cancel for jobs")
+    print("=" * 60)
+
+    calls = []
+    tab = SimpleNamespace(headers={cancellation.SESSION_HEADER: "tab-1"})
+    original_get_client = mb_app._get_client
+    original_store = job_queue._store
+    mb_app._get_client = lambda api_key: fake_client(calls, delays=[10.0, 0.05])
+    outputs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        job_queue._store = job_queue.JobStore(Path(tmp) / "jobs.sqlite3")
+        pool = job_queue.WorkerPool(job_queue._store, mb_app.JOB_HANDLERS, workers=1).start()
+        try:
+            first = mb_app.submit_job("generate_image", ["Utility workwear", mb_app.GEMINI_25_MODEL_ID, ""], tab)
+            _wait_for(job_queue._store, first["job_id"], statuses=(job_queue.RUNNING,))
+            deadline = time.monotonic() + 10
+            while not calls and time.monotonic() < deadline:
+                time.sleep(0.02)
+            second = mb_app.submit_job("generate_image", ["Utility workwear", mb_app.GEMINI_25_MODEL_ID, ""], tab)
+            assert job_queue._store.get(first["job_id"])["status"] == job_queue.CANCELLED
+            job = _wait_for(job_queue._store, second["job_id"])
+            assert job["status"] == job_queue.SUCCEEDED, job
+            outputs.append(Path(job["data"][0]))
+            deadline = time.monotonic() + 5
+            while not calls[0].cancelled and time.monotonic() < deadline:
+                time.sleep(0.02)
+            assert calls[0].cancelled and not calls[0].finished
+            print("  ✅ A second submit from the session cancelled the first job and its model call")
+
+            pool.stop(timeout=5)
+            queued = mb_app.submit_job("edit_image_region", [None, "board.png"], tab)
+            other = mb_app.submit_job("generate_image", ["Utility workwear", mb_app.GEMINI_25_MODEL_ID, ""],
+                                      SimpleNamespace(headers={cancellation.SESSION_HEADER: "tab-2"}))
+            assert mb_app.cancel_session("tab-1")["jobs_cancelled"] == 1
+            assert job_queue._store.get(queued["job_id"])["status"] == job_queue.CANCELLED
+            assert job_queue._store.get(other["job_id"])["status"] == job_queue.QUEUED
+            print("  ✅ cancel_session cancelled the session's queued job and left other sessions alone")
+        finally:
+            pool.stop(timeout=5)
+            mb_app._get_client = original_get_client
+            job_queue._store = original_store
+            for path in outputs:
+                path.unlink(missing_ok=True)
+                for sidecar in output_store.sidecars(path):
+                    sidecar.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    test_claim_lease_and_recovery()
+    test_workers_run_handlers()
+    test_private_arguments_stay_in_memory()
+    test_submit_job_endpoint()
+    test_session_jobs_are_superseded_and_cancelled()
+    print("\n✅ ALL TESTS PASSED!")
@@ -0,0 +1,71 @@
+"""
+Test fast / balanced / quality latency profiles
+"""
+import sys
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import mb_app
+import output_store
+from conftest import fake_client
+
+# Mentions "latest" and a year, which normally turns on google_search grounding
+SUBJECT = "Latest 2026 runway trends in technical outerwear"
+
+
+def test_profiles_shape_the_call():
+    """Test that each profile sets model, thinking, image size and grounding, and is recorded"""
+    print("=" * 60)
+    print("Test: Latency profiles")
+    print("=" * 60)
+
+    assert mb_app._contains_real_time_info(SUBJECT)
+    original_get_client = mb_app._get_client
+    outputs = []
+    try:
+        for profile, expected in [
+            ("fast", (mb_app.GEMINI_25_MODEL_ID, False, None, None, False)),
+            ("balanced", (mb_app.GEMINI_3_MODEL_ID, True, None, "1K", True)),
+            ("quality", (mb_app.GEMINI_3_MODEL_ID, True, "HIGH", "2K", True)),
+        ]:
+            calls = []
+            mb_app._get_client = lambda api_key: fake_client(calls)
+            output_path, _, run_info = mb_app.generate_image(
+                SUBJECT, mb_app.GEMINI_3_MODEL_ID, "", None, "single", profile
+            )
+            outputs.append(Path(output_path))
+            config = calls[0].config
+            thinking_level = config.thinking_config.thinking_level
+            actual = (
+                calls[0].model,
+                config.thinking_config.include_thoughts,
+                thinking_level.value if thinking_level else None,
+                config.image_config.image_size,
+                bool(config.tools),
+            )
+            print(f"  {profile}: model={actual[0]}, thoughts={actual[1]}, level={actual[2]}, "
+                  f"size={actual[3]}, grounding={actual[4]}")
+            assert actual == expected
+            assert run_info["latency_profile"] == profile
+            assert output_store.read_sidecar(output_path, mb_app.RUN_SIDECAR_KIND) == run_info
+        print("  ✅ Each profile tunes the call and is recorded next to the output")
+    finally:
+        mb_app._get_client = original_get_client
+        for path in outputs:
+            path.unlink(missing_ok=True)
+            for sidecar in output_store.sidecars(path):
+                sidecar.unlink(missing_ok=True)
+
+    try:
+        mb_app.generate_image(SUBJECT, mb_app.GEMINI_3_MODEL_ID, "", None, "single", "turbo")
+        raise AssertionError("expected an unknown profile to be rejected")
+    except mb_app.AppError as e:
+        assert "Unknown latency profile" in str(e)
+    print("  ✅ Unknown profiles rejected")
+
+
+if __name__ == "__main__":
+    test_profiles_shape_the_call()
+    print("\n✅ ALL TESTS PASSED!")
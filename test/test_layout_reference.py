@@ -0,0 +1,146 @@
+"""
+Test the layout reference image: uploaded once per API key, refreshed before expiry, attached by handle
+"""
+import sys
+import tempfile
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from PIL import Image
+
+import layout_reference
+import mb_app
+import output_store
+from conftest import fake_client
+
+
+def _reference_image(directory: Path) -> Path:
+    path = directory / "layout_reference.png"
+    Image.new("RGB", (144, 102), (255, 255, 255)).save(path)
+    return path
+
+
+class LocalFilesWithDelay(layout_reference.LocalFiles):
+    """LocalFiles whose uploads take a moment, so concurrent requests overlap."""
+
+    def upload(self, file, config=None):
+        threading.Event().wait(0.05)
+        return super().upload(file, config)
+
+
+def test_uploaded_once_and_refreshed():
+    """Test that concurrent requests share one upload per key and expiring handles are replaced"""
+    print("=" * 60)
+    print("Test: Upload once, refresh before expiry")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = _reference_image(Path(tmp))
+        files = LocalFilesWithDelay()
+        client = SimpleNamespace(files=files)
+        references = layout_reference.ReferenceFiles(path, refresh_s=60)
+
+        handles = []
+        threads = [threading.Thread(target=lambda: handles.append(references.handle(client, "key-a"))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert files.uploads == 1 and len({h.name for h in handles}) == 1
+        assert handles[0].mime_type == "image/png"
+        print("  ✅ 8 concurrent requests, 1 upload")
+
+        references.handle(client, "key-b")
+        assert files.uploads == 2
+        print("  ✅ Each API key gets its own upload")
+
+        files.ttl_s = 30  # every new upload is already within the refresh margin
+        references.invalidate("key-a")
+        first = references.handle(client, "key-a")
+        second = references.handle(client, "key-a")
+        assert files.uploads == 4 and first.name != second.name
+        print("  ✅ A handle about to expire is uploaded again")
+
+        files.ttl_s = layout_reference.FILE_TTL_S
+        references.handle(client, "key-a")
+        uploads = files.uploads
+        Image.new("RGB", (144, 102), (0, 0, 0)).save(path)
+        references.handle(client, "key-a")
+        assert files.uploads == uploads + 1
+        print("  ✅ Changing the image uploads it again")
+
+        attempts = []
+
+        def offline(file, config=None):
+            attempts.append(file)
+            raise OSError("offline")
+
+        broken = SimpleNamespace(files=SimpleNamespace(upload=offline))
+        assert references.part(broken, "key-c") is None and references.part(broken, "key-c") is None
+        assert len(attempts) == 1
+        print("  ✅ A failed upload is not retried by every request")
+
+
+def test_attached_to_single_generations():
+    """Test that single-board generations carry the reference by handle and panel ones do not"""
+    print("\n" + "=" * 60)
+    print("Test: Reference attached by handle")
+    print("=" * 60)
+
+    original_references = layout_reference._references
+    original_get_client = mb_app._get_client
+    outputs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        files = layout_reference.LocalFiles()
+        layout_reference._references = layout_reference.ReferenceFiles(_reference_image(Path(tmp)))
+        calls = []
+        mb_app._get_client = lambda api_key: fake_client(calls, files=files)
+        try:
+            for _ in range(3):
+                output_path, _, _ = mb_app.generate_image(
+                    "quiet luxury knitwear", mb_app.GEMINI_3_MODEL_ID, "", "test-key", "single", "fast"
+                )
+                outputs.append(Path(output_path))
+            assert files.uploads == 1
+            for call in calls:
+                reference, prompt = call.contents
+                assert reference.file_data.file_uri == "local://files/local-1"
+                assert reference.inline_data is None
+                assert "attached image" in prompt
+            print(f"  ✅ {len(calls)} generations, 1 upload, reference sent by handle")
+
+            calls.clear()
+            output_path, _, _ = mb_app.generate_image(
+                "quiet luxury knitwear", mb_app.GEMINI_3_MODEL_ID, "", "test-key", "panels", "fast"
+            )
+            outputs.append(Path(output_path))
+            assert calls and all(isinstance(call.contents, str) for call in calls)
+            print("  ✅ Per-panel prompts are sent without it")
+
+            broken = SimpleNamespace(upload=lambda file, config=None: (_ for _ in ()).throw(OSError("offline")))
+            layout_reference._references.clear()
+            calls.clear()
+            mb_app._get_client = lambda api_key: fake_client(calls, files=broken)
+            output_path, _, _ = mb_app.generate_image(
+                "quiet luxury knitwear", mb_app.GEMINI_3_MODEL_ID, "", "test-key", "single", "fast"
+            )
+            outputs.append(Path(output_path))
+            assert isinstance(calls[0].contents, str)
+            print("  ✅ A failed upload falls back to the text prompt")
+        finally:
+            layout_reference._references = original_references
+            mb_app._get_client = original_get_client
+            for path in outputs:
+                path.unlink(missing_ok=True)
+                for sidecar in output_store.sidecars(path):
+                    sidecar.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    test_uploaded_once_and_refreshed()
+    test_attached_to_single_generations()
+    print("\n✅ ALL TESTS PASSED!")
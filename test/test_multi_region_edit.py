@@ -0,0 +1,116 @@
+"""
+Test multi-region edits in a single model call
+"""
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import numpy as np
+from PIL import Image
+
+import mb_app
+import output_store
+from conftest import fake_client
+
+REGIONS = [
+    {"x_top": 0, "y_top": 0, "x_bottom": 360, "y_bottom": 600, "edit_request": "Make the dress red"},
+    {"x_top": 1080, "y_top": 650, "x_bottom": 1440, "y_bottom": 1024, "edit_request": "Swap the swatches to blues"},
+    {"x_top": 400, "y_top": 700, "x_bottom": 700, "y_bottom": 1000},
+]
+
+
+def test_vectorized_cells_match_single_lookup():
+    """Test that the one-pass grid calculation agrees with the per-bbox one"""
+    print("=" * 60)
+    print("Test: Vectorized grid cells")
+    print("=" * 60)
+
+    boxes = [(r["x_top"], r["y_top"], r["x_bottom"], r["y_bottom"]) for r in REGIONS]
+    cells = mb_app._calculate_grid_cells(boxes, 1440, 1024)
+    for box, cell in zip(boxes, cells):
+        assert cell == mb_app._calculate_grid_cell(*box, 1440, 1024)
+        print(f"  {box} -> {cell['cell_description']}")
+    assert [cell["row"] for cell in cells] == [1, 2, 2]
+    print("  ✅ Same cells as the single-bbox calculation")
+
+
+def test_regions_parse_and_prompt():
+    """Test region validation and the combined prompt"""
+    print("\n" + "=" * 60)
+    print("Test: Region parsing and prompt")
+    print("=" * 60)
+
+    regions = mb_app._parse_edit_regions(json.dumps(REGIONS), 1440, 1024, "Keep the lighting warm")
+    assert regions[2]["edit_request"] == "Keep the lighting warm"
+    for region, cell in zip(regions, mb_app._calculate_grid_cells([r["box"] for r in regions], 1440, 1024)):
+        region["grid_info"] = cell
+    prompt = mb_app._build_edit_prompt(
+        None, None, None, None, "Keep the lighting warm", mb_app._load_edit_template(),
+        img_width=1440, img_height=1024, regions=regions,
+    )
+    assert "**Region 1:** Make the dress red" in prompt
+    assert "**Region 2:** Swap the swatches to blues" in prompt
+    assert "Bottom Row (The Details), Cells 3 and 4 (Row 2, Column 4)" in prompt
+    assert "Apply all 3 region edits" in prompt
+    assert "{X_TOP}" not in prompt and "{GRID_CELL_DESCRIPTION}" not in prompt
+    print("  ✅ All regions and instructions described in one prompt")
+
+    for bad, message in [
+        ("not json", "Invalid regions"),
+        ([{"x_top": 0, "y_top": 0, "x_bottom": 2000, "y_bottom": 10, "edit_request": "x"}], "within image bounds"),
+        ([{"x_top": 0, "y_top": 0, "x_bottom": 10, "y_bottom": 10}], "no edit request"),
+        ([REGIONS[0]] * (mb_app.MAX_EDIT_REGIONS + 1), "Too many regions"),
+    ]:
+        try:
+            mb_app._parse_edit_regions(bad, 1440, 1024)
+            raise AssertionError(f"expected an error for {bad!r}")
+        except mb_app.AppError as e:
+            assert message in str(e), str(e)
+    print("  ✅ Invalid regions rejected with clear errors")
+
+
+def test_multi_region_edit_is_one_call():
+    """Test that three regions cost one model call and one saved version"""
+    print("\n" + "=" * 60)
+    print("Test: Multi-region edit_image_region")
+    print("=" * 60)
+
+    for edit_mode in ("full", "regional"):
+        calls = []
+        original_get_client = mb_app._get_client
+        mb_app._get_client = lambda api_key: fake_client(calls, (255, 0, 0))
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                source = Path(tmp) / "board.png"
+                Image.new("RGB", (1440, 1024), (200, 200, 200)).save(source)
+                output_path, _, _ = mb_app.edit_image_region(
+                    None, str(source), 0, 0, 100, 100, "Keep the lighting warm", mb_app.GEMINI_25_MODEL_ID, "",
+                    None, edit_mode, json.dumps(REGIONS),
+                )
+                edited = np.asarray(Image.open(output_path))
+                Path(output_path).unlink()
+                for sidecar in output_store.sidecars(output_path):
+                    sidecar.unlink(missing_ok=True)
+        finally:
+            mb_app._get_client = original_get_client
+
+        assert len(calls) == 1
+        prompt = calls[0].contents[1]
+        assert prompt.count("**Region ") == 3
+        print(f"  {edit_mode}: 1 call, prompt lists 3 regions")
+        if edit_mode == "regional":
+            assert tuple(edited[300, 180]) == (255, 0, 0)  # inside region 1
+            assert tuple(edited[850, 550]) == (255, 0, 0)  # inside region 3
+            assert tuple(edited[300, 800]) == (200, 200, 200)  # outside every region
+            print("  ✅ Regional mode blends every region and leaves the rest untouched")
+
+
+if __name__ == "__main__":
+    test_vectorized_cells_match_single_lookup()
+    test_regions_parse_and_prompt()
+    test_multi_region_edit_is_one_call()
+    print("\n✅ ALL TESTS PASSED!")
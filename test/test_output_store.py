@@ -0,0 +1,43 @@
+"""
+Test the shared output store used by all backend workers
+"""
+import sys
+import tempfile
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from PIL import Image
+
+import output_store
+
+
+def test_save_output_is_atomic_and_unique():
+    """Test that outputs land under unique names with no temp files left behind"""
+    print("=" * 60)
+    print("Test: Atomic saves to the shared store")
+    print("=" * 60)
+
+    original_dir = output_store.OUTPUT_DIR
+    with tempfile.TemporaryDirectory() as tmp:
+        output_store.OUTPUT_DIR = Path(tmp)
+        try:
+            image = Image.new("RGB", (32, 16), "white")
+            first = output_store.save_output(image, "generated")
+            second = output_store.save_output(image, "edited")
+            files = sorted(p.name for p in Path(tmp).iterdir())
+        finally:
+            output_store.OUTPUT_DIR = original_dir
+
+    print(f"  Files: {files}")
+    assert first != second
+    assert first.name.startswith("generated_") and first.suffix == ".png"
+    assert second.name.startswith("edited_")
+    assert files == sorted([first.name, second.name])
+    print("  ✅ Two unique PNGs, no temp files")
+
+
+if __name__ == "__main__":
+    test_save_output_is_atomic_and_unique()
+    print("\n✅ ALL TESTS PASSED!")
@@ -0,0 +1,186 @@
+"""
+Test palette extraction, the Lab palette index and the background post-save pipeline
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+if "MOODBOARD_OUTPUT_DIR" not in os.environ:  # run as a script; under pytest conftest.py does this
+    _scratch = Path(tempfile.mkdtemp(prefix="moodboard-test-"))
+    os.environ.update(MOODBOARD_OUTPUT_DIR=str(_scratch / "outputs"), MOODBOARD_DATA_DIR=str(_scratch / "data"))
+
+import numpy as np
+from PIL import Image
+
+import mb_app
+import output_store
+import palette_index
+import panel_assembly
+import panel_index
+import post_save
+from conftest import fake_client
+
+SWATCHES = [(139, 90, 43), (210, 180, 140), (85, 107, 47), (160, 82, 45), (245, 222, 179)]
+
+
+def _board(swatches=SWATCHES, vertical=True) -> Image.Image:
+    """A generated-looking board: noisy photo panels, and the swatch strip in Details panel 4."""
+    rng = np.random.default_rng(7)
+    tiles = []
+    for panel in panel_assembly.panel_layout():
+        left, top, right, bottom = panel["box"]
+        height, width = bottom - top, right - left
+        if (panel["row"], panel["column"]) == palette_index.SWATCH_PANEL and swatches:
+            pixels = np.zeros((height, width, 3), dtype=np.uint8)
+            for i, color in enumerate(swatches):
+                if vertical:
+                    pixels[:, i * width // len(swatches):(i + 1) * width // len(swatches)] = color
+                else:
+                    pixels[i * height // len(swatches):(i + 1) * height // len(swatches)] = color
+        else:
+            base = rng.integers(40, 200, 3)
+            pixels = (rng.normal(0, 12, (height, width, 3)) + base).clip(0, 255).astype(np.uint8)
+        tiles.append(Image.fromarray(pixels))
+    return panel_assembly.compose_moodboard(tiles, panel_assembly.panel_layout())
+
+
+def _delta_e(hex_a: str, rgb_b) -> float:
+    return float(np.linalg.norm(palette_index.parse_palette([hex_a])[0] - palette_index.srgb_to_lab(np.array(rgb_b))))
+
+
+def test_extracts_swatches_and_panel_palettes():
+    """Test that the swatch strip is read in display order and every panel gets a palette"""
+    print("=" * 60)
+    print("Test: Palette extraction")
+    print("=" * 60)
+
+    for vertical in (True, False):
+        image = _board(vertical=vertical)
+        started = time.perf_counter()
+        palette = palette_index.extract(image, panel_index.detect_panels(image))
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        swatches = [color["hex"] for color in palette["swatches"]]
+        print(f"  {'vertical' if vertical else 'horizontal'} strip: {swatches} ({elapsed_ms:.0f} ms)")
+        assert palette["source"] == "swatches" and len(swatches) == 5
+        for found, expected in zip(swatches, SWATCHES):
+            assert _delta_e(found, expected) < 5, (found, expected)
+        assert len(palette["panels"]) == 8 and all(panel["colors"] for panel in palette["panels"])
+        assert abs(sum(color["weight"] for color in palette["board"]) - 1) < 0.05
+    print("  ✅ Swatches in strip order, within delta E 5 of the drawn colours")
+
+    image = _board(swatches=None)
+    palette = palette_index.extract(image, panel_index.detect_panels(image))
+    assert palette["source"] == "dominant" and palette["swatches"] == []
+    assert palette_index.palette_labs(palette) == [color["lab"] for color in palette["board"]]
+    palette = palette_index.extract(image, [])
+    assert palette["panels"] == [] and palette["board"]
+    print("  ✅ Photo in panel 4 or no panels: indexed by dominant board colours")
+
+
+def test_palette_queries():
+    """Test query parsing and that index lookups match a brute-force Lab comparison"""
+    print("\n" + "=" * 60)
+    print("Test: Palette index")
+    print("=" * 60)
+
+    assert palette_index.parse_palette("#8b5a2b, d2b48c;#abc").shape == (3, 3)
+    assert np.allclose(palette_index.parse_palette(["#aabbcc"]), palette_index.parse_palette("#abc"))
+    for bad in ["", "#12345g", ["red"], ",".join(["#000000"] * 17)]:
+        try:
+            palette_index.parse_palette(bad)
+        except ValueError:
+            continue
+        raise AssertionError(f"accepted {bad!r}")
+    print("  ✅ Hex lists and strings parsed, junk rejected")
+
+    rng = np.random.default_rng(11)
+    boards = rng.uniform([0, -40, -40], [100, 40, 40], (100000, 5, 3)).astype(np.float32)
+    index = palette_index.PaletteIndex()
+    for labs in boards[:, :rng.integers(3, 6)]:
+        index.add(labs)
+    query = palette_index.parse_palette("#8b5a2b, #d2b48c, #556b2f")
+    started = time.perf_counter()
+    found = index.query(query, 25)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    print(f"  {len(index)} palettes: {elapsed_ms:.1f} ms per query, {len(found)} within 25")
+
+    padded = np.stack([index._labs[i] for i in range(len(index))])
+    delta = np.sqrt(((padded[:, :, None, :] - query[None, None]) ** 2).sum(axis=-1))
+    expected = (delta.min(axis=1).mean(axis=1) + delta.min(axis=2).mean(axis=1)) / 2
+    assert {i for i, _ in found} == set(np.flatnonzero(expected <= 25).tolist())
+    assert all(abs(d - expected[i]) < 1e-3 for i, d in found)
+    assert [d for _, d in found] == sorted(d for _, d in found)
+    assert elapsed_ms < 500
+    print("  ✅ Same results as a brute-force comparison, nearest first")
+
+
+def test_post_save_pipeline():
+    """Test that palettes are extracted off the request path and become searchable"""
+    print("\n" + "=" * 60)
+    print("Test: Post-save pipeline and endpoints")
+    print("=" * 60)
+
+    board = _board()
+
+    release = threading.Event()
+    original_analyze = palette_index.analyze
+
+    def slow_analyze(path):
+        release.wait(10)
+        return original_analyze(path)
+
+    original_get_client = mb_app._get_client
+    original_index = palette_index._index
+    mb_app._get_client = lambda api_key: fake_client(image=board)
+    palette_index.analyze = slow_analyze
+    outputs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        palette_index._index = palette_index.BoardPalettes(Path(tmp) / "palettes.jsonl")
+        try:
+            output_path, _, _ = mb_app.generate_image(
+                "earthy linen resort wear", mb_app.GEMINI_3_MODEL_ID, "", None, "single", "fast"
+            )
+            outputs.append(Path(output_path))
+            assert output_store.read_sidecar(output_path, palette_index.PALETTE_KIND) is None
+            print("  ✅ Response returned while palette extraction was still pending")
+
+            release.set()
+            assert post_save.drain(timeout=30)
+            palette = output_store.read_sidecar(output_path, palette_index.PALETTE_KIND)
+            assert palette["source"] == "swatches"
+            assert mb_app.get_board_palette(Path(output_path).name) == palette
+            print(f"  palette: {[color['hex'] for color in palette['swatches']]}")
+
+            query = ", ".join("#%02x%02x%02x" % color for color in SWATCHES)
+            found = mb_app.find_boards_by_palette(query)["boards"]
+            assert found[0]["image"] == output_path and found[0]["distance"] < 5
+            assert mb_app.find_boards_by_palette("#0000ff, #ff00ff")["boards"] == []
+            try:
+                mb_app.find_boards_by_palette("not a colour")
+                raise AssertionError("invalid palette accepted")
+            except mb_app.AppError:
+                pass
+            print("  ✅ Board found by its swatches, not by an unrelated palette")
+        finally:
+            release.set()
+            post_save.drain(timeout=30)
+            mb_app._get_client = original_get_client
+            palette_index.analyze = original_analyze
+            palette_index._index = original_index
+            for path in outputs:
+                path.unlink(missing_ok=True)
+                for sidecar in output_store.sidecars(path):
+                    sidecar.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    test_extracts_swatches_and_panel_palettes()
+    test_palette_queries()
+    test_post_save_pipeline()
+    print("\n✅ ALL TESTS PASSED!")
@@ -0,0 +1,142 @@
+"""
+Test parallel per-panel moodboard assembly
+"""
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from PIL import Image
+
+import mb_app
+import output_store
+import panel_assembly
+from conftest import fake_client
+
+
+def test_layout_matches_template_geometry():
+    """Test the 2x4 grid: 3:4 looks over ~1.1:1 details, inside the canvas, no overlaps"""
+    print("=" * 60)
+    print("Test: Panel layout")
+    print("=" * 60)
+
+    layout = panel_assembly.panel_layout()
+    assert len(layout) == 8
+    for panel in layout:
+        left, top, right, bottom = panel["box"]
+        print(f"  {panel['name']}: {panel['box']}")
+        assert 0 <= left < right <= 1440 and 0 <= top < bottom <= 1024
+        ratio = (right - left) / (bottom - top)
+        expected = panel_assembly.LOOK_ASPECT if panel["row"] == 1 else panel_assembly.DETAIL_ASPECT
+        assert abs(ratio - expected) < 0.01
+    look_height = layout[0]["box"][3] - layout[0]["box"][1]
+    detail_height = layout[4]["box"][3] - layout[4]["box"][1]
+    assert 0.55 < look_height / (look_height + detail_height) < 0.65
+    assert layout[1]["box"][0] - layout[0]["box"][2] == panel_assembly.PANEL_GAP
+    print("  ✅ Layout follows the template geometry")
+
+
+def test_template_splits_into_panel_prompts():
+    """Test that the default template yields one brief per panel"""
+    print("\n" + "=" * 60)
+    print("Test: Per-panel prompts")
+    print("=" * 60)
+
+    full_prompt = mb_app._build_prompt("linen resort wear", mb_app._load_prompt_template())
+    prompts = panel_assembly.split_panel_prompts(full_prompt)
+    assert len(prompts) == 8
+    assert all("linen resort wear" in prompt for prompt in prompts)
+    assert all("NO TEXT" in prompt for prompt in prompts)
+    assert "Look 3 of 4" in prompts[2] and "Aspect Ratio: 3:4" in prompts[2]
+    assert "footwear" in prompts[5]
+    assert "5 distinct, solid earthy color swatches" in prompts[7]
+    assert "2x4 grid" not in prompts[0]
+    print("  ✅ Subject, constraints and the right brief in every panel prompt")
+
+
+def test_failed_panel_is_retried_alone_and_panels_run_concurrently():
+    """Test retries are per panel and wall-clock time is about one panel latency"""
+    print("\n" + "=" * 60)
+    print("Test: Concurrent generation with per-panel retries")
+    print("=" * 60)
+
+    calls = {}
+    lock = threading.Lock()
+
+    def generate_panel(prompt, aspect_ratio):
+        time.sleep(0.3)
+        panel = prompt.split("(panel ")[1].split(" ")[0]
+        with lock:
+            calls[panel] = calls.get(panel, 0) + 1
+            attempt = calls[panel]
+        if panel == "6" and attempt == 1:
+            raise RuntimeError("transient 503")
+        return Image.new("RGB", (300, 400), (10 * int(panel), 0, 0)), f"panel {panel}"
+
+    prompts = panel_assembly.split_panel_prompts(mb_app._build_prompt("x", mb_app._load_prompt_template()))
+    started = time.perf_counter()
+    results = panel_assembly.generate_panels(prompts, generate_panel)
+    elapsed = time.perf_counter() - started
+    print(f"  Calls per panel: {calls}, elapsed {elapsed:.2f}s")
+    assert calls == {str(n): (2 if n == 6 else 1) for n in range(1, 9)}
+    assert [reasoning for _, reasoning in results] == [f"panel {n}" for n in range(1, 9)]
+    assert elapsed < 1.2  # ~2 panel latencies (one retry), not 8
+    print("  ✅ Only the failed panel was retried and panels ran in parallel")
+
+    def always_fails(prompt, aspect_ratio):
+        if "(panel 2 " in prompt:
+            raise RuntimeError("quota")
+        return Image.new("RGB", (10, 10)), ""
+
+    try:
+        panel_assembly.generate_panels(prompts, always_fails, max_attempts=2)
+        raise AssertionError("expected PanelGenerationError")
+    except panel_assembly.PanelGenerationError as e:
+        assert list(e.failures) == [1]
+        print(f"  ✅ Persistent failure reported: {e}")
+
+
+def test_generate_image_panels_mode():
+    """Test generate_image in panels mode against a fake model client"""
+    print("\n" + "=" * 60)
+    print("Test: generate_image(generation_mode='panels')")
+    print("=" * 60)
+
+    calls = []
+    original_get_client = mb_app._get_client
+    mb_app._get_client = lambda api_key: fake_client(
+        calls, image=Image.new("RGB", (600, 800), (0, 120, 0)), thought="thinking"
+    )
+    try:
+        output_path, reasoning, _ = mb_app.generate_image(
+            "linen resort wear", mb_app.GEMINI_25_MODEL_ID, "", "test-key", "panels"
+        )
+    finally:
+        mb_app._get_client = original_get_client
+
+    requested_ratios = [call.config.image_config.aspect_ratio for call in calls]
+    board = Image.open(output_path)
+    Path(output_path).unlink()
+    for sidecar in output_store.sidecars(output_path):
+        sidecar.unlink(missing_ok=True)
+    layout = panel_assembly.panel_layout()
+    left, top, right, bottom = layout[0]["box"]
+    print(f"  Board {board.size}, ratios requested: {sorted(set(requested_ratios))}")
+    assert board.size == (1440, 1024)
+    assert sorted(requested_ratios) == ["1:1"] * 4 + ["3:4"] * 4
+    assert board.getpixel((left, top + 20)) == (128, 128, 128)  # hairline border
+    assert board.getpixel((left + 20, top + 20)) == (0, 120, 0)
+    assert board.getpixel((left - 5, top + 20)) == (255, 255, 255)  # spacing
+    assert reasoning.count("thinking") == 8
+    print("  ✅ Board tiled at 1440x1024 with #808080 borders and white spacing")
+
+
+if __name__ == "__main__":
+    test_layout_matches_template_geometry()
+    test_template_splits_into_panel_prompts()
+    test_failed_panel_is_retried_alone_and_panels_run_concurrently()
+    test_generate_image_panels_mode()
+    print("\n✅ ALL TESTS PASSED!")
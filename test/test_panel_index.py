@@ -0,0 +1,124 @@
+"""
+Test the per-output panel geometry index
+"""
+import sys
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import numpy as np
+from PIL import Image
+
+import mb_app
+import output_store
+import panel_assembly
+import panel_index
+
+
+def _board(layout):
+    """Compose a board from noisy panels; panel 5 has a white product-shot background."""
+    rng = np.random.default_rng(1)
+    tiles = []
+    for panel in layout:
+        left, top, right, bottom = panel["box"]
+        pixels = rng.integers(0, 200, (bottom - top, right - left, 3), dtype=np.uint8)
+        if panel["index"] == 4:
+            pixels[:, :] = 255
+            pixels[40:80, 100:140] = (90, 60, 30)
+        tiles.append(Image.fromarray(pixels))
+    return panel_assembly.compose_moodboard(tiles, layout)
+
+
+def _drifted_layout():
+    """A board whose top row ends at 50% of the height and whose columns are not equal quarters."""
+    widths = [300, 400, 300, 300]
+    layout = []
+    for row, (top, bottom) in enumerate([(20, 512), (528, 1000)], start=1):
+        left = 40
+        for column, width in enumerate(widths, start=1):
+            layout.append({
+                "index": len(layout), "row": row, "column": column,
+                "box": (left, top, left + width, bottom), "aspect_ratio": "1:1",
+            })
+            left += width + 20
+    return layout
+
+
+def test_detects_panels_from_borders_and_gutters():
+    """Test that projection profiles recover every panel rectangle"""
+    print("=" * 60)
+    print("Test: Panel detection")
+    print("=" * 60)
+
+    layout = panel_assembly.panel_layout()
+    detected = panel_index.detect_panels(_board(layout))
+    print(f"  Detected {len(detected)} panels")
+    assert len(detected) == 8
+    for expected, found in zip(layout, detected):
+        assert (found["row"], found["column"]) == (expected["row"], expected["column"])
+        assert np.abs(np.array(found["box"]) - np.array(expected["box"])).max() <= 1, (found, expected)
+    print("  ✅ All 8 panels found, including the mostly-white one")
+
+    assert panel_index.detect_panels(Image.new("RGB", (1440, 1024), (200, 200, 200))) == []
+    print("  ✅ A full-bleed image yields no panels (heuristic fallback)")
+
+
+def test_lookup_uses_real_geometry():
+    """Test that a drifted board maps bboxes to the right cell where the 60/40 heuristic fails"""
+    print("\n" + "=" * 60)
+    print("Test: Bbox to cell lookup")
+    print("=" * 60)
+
+    image = _board(_drifted_layout())
+    index = panel_index.build_index(image)
+    bbox = (400, 560, 700, 620)  # bottom row, second (wide) column, near the top of the row
+    heuristic = mb_app._calculate_grid_cell(*bbox, *image.size)
+    indexed = mb_app._calculate_grid_cell(*bbox, *image.size, index=index)
+    print(f"  Heuristic: {heuristic['cell']}, indexed: {indexed['cell']} ({indexed['cell_description']})")
+    assert heuristic["row"] == 1
+    assert indexed["row"] == 2 and indexed["column"] == 2
+    assert indexed["overlapping_cells"] == [2]
+    assert mb_app._calculate_grid_cell(0, 0, 10, 10, *image.size, index=index) == mb_app._calculate_grid_cell(
+        0, 0, 10, 10, *image.size
+    )
+    print("  ✅ Indexed geometry wins; bboxes in the margins fall back to the heuristic")
+
+
+def test_sidecar_is_written_and_backfilled():
+    """Test index_output, lazy backfill for older outputs, and the get_panel_index endpoint"""
+    print("\n" + "=" * 60)
+    print("Test: Sidecar index")
+    print("=" * 60)
+
+    image = _board(panel_assembly.panel_layout())
+    path = output_store.save_output(image, "generated")
+    sidecar = output_store.sidecar_path(path, panel_index.PANEL_INDEX_KIND)
+    try:
+        assert not sidecar.exists()
+        index = mb_app.get_panel_index(path.name)
+        assert sidecar.exists() and index["source"] == "detected" and len(index["panels"]) == 8
+        print(f"  Backfilled {sidecar.name}")
+
+        layout = panel_assembly.panel_layout()
+        panel_index.index_output(path, image, layout)
+        index = mb_app.get_panel_index(f"/gradio_api/file={path}")
+        assert index["source"] == "layout"
+        assert index["panels"][3]["box"] == list(layout[3]["box"])
+        print("  ✅ Layout index stored at save time and served by get_panel_index")
+    finally:
+        path.unlink()
+        sidecar.unlink(missing_ok=True)
+
+    try:
+        mb_app.get_panel_index("../../etc/passwd")
+        raise AssertionError("expected an error for paths outside the output store")
+    except mb_app.AppError:
+        print("  ✅ Paths outside the output store are rejected")
+
+
+if __name__ == "__main__":
+    test_detects_panels_from_borders_and_gutters()
+    test_lookup_uses_real_geometry()
+    test_sidecar_is_written_and_backfilled()
+    print("\n✅ ALL TESTS PASSED!")
@@ -0,0 +1,141 @@
+"""
+Test per-panel slices: cut after save by the post-save worker, and served from stable URLs
+"""
+import sys
+import threading
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import numpy as np
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import headless_app
+import mb_app
+import output_store
+import panel_assembly
+import panel_slices
+import post_save
+from conftest import fake_client
+
+client = TestClient(headless_app.create_app())
+
+
+def _board() -> Image.Image:
+    """A generated-looking board: a different noisy photo in each of the 8 panels."""
+    rng = np.random.default_rng(3)
+    tiles = []
+    for panel in panel_assembly.panel_layout():
+        left, top, right, bottom = panel["box"]
+        base = rng.integers(40, 200, 3)
+        pixels = (rng.normal(0, 12, (bottom - top, right - left, 3)) + base).clip(0, 255).astype(np.uint8)
+        tiles.append(Image.fromarray(pixels))
+    return panel_assembly.compose_moodboard(tiles, panel_assembly.panel_layout())
+
+
+def _cleanup(outputs):
+    for path in outputs:
+        path.unlink(missing_ok=True)
+        for sidecar in output_store.sidecars(path):
+            sidecar.unlink(missing_ok=True)
+
+
+def test_slices_written_after_save():
+    """Test that generate and edit responses list the panel URLs and the worker writes the slices"""
+    print("=" * 60)
+    print("Test: Slices written after save")
+    print("=" * 60)
+
+    board = _board()
+    release = threading.Event()
+    original_make_slices = panel_slices.make_slices
+
+    def slow_make_slices(path):
+        release.wait(10)
+        return original_make_slices(path)
+
+    original_get_client = mb_app._get_client
+    mb_app._get_client = lambda api_key: fake_client(image=board)
+    panel_slices.make_slices = slow_make_slices
+    outputs = []
+    try:
+        output_path, _, run_info = mb_app.generate_image(
+            "oversized tweed tailoring", mb_app.GEMINI_3_MODEL_ID, "", None, "single", "fast"
+        )
+        outputs.append(Path(output_path))
+        panels = run_info["panels"]
+        print(f"  panel 7: {panels[6]}")
+        assert [(p["row"], p["column"]) for p in panels] == [(r, c) for r in (1, 2) for c in (1, 2, 3, 4)]
+        assert panels[6]["label"] == "Bottom Row (The Details), panel 3"
+        assert panels[6]["path"] == str(panel_slices.slice_path(output_path, 2, 3))
+        assert panels[6]["url"] == f"/gradio_api/file={panels[6]['path']}"
+        assert not any(Path(p["path"]).exists() for p in panels)
+        print("  ✅ Response lists 8 panel URLs before any slice is written")
+
+        release.set()
+        assert post_save.drain(timeout=30)
+        with Image.open(output_path) as saved:
+            for panel in panels:
+                with Image.open(panel["path"]) as piece:
+                    assert np.array_equal(np.asarray(piece), np.asarray(saved.crop(tuple(panel["box"]))))
+        print("  ✅ Worker wrote every slice, pixel-identical to the board")
+
+        edited_path, _, edit_info = mb_app.edit_image_region(
+            None, output_path, 0, 0, 64, 64, "Swap the tweed for houndstooth",
+            mb_app.GEMINI_3_MODEL_ID, "", None, "full",
+        )
+        outputs.append(Path(edited_path))
+        assert [p["box"] for p in edit_info["panels"]] == [p["box"] for p in panels]
+        assert all(Path(p["path"]).parent == Path(edited_path).parent for p in edit_info["panels"])
+        assert post_save.drain(timeout=30)
+        assert all(Path(p["path"]).is_file() for p in edit_info["panels"])
+        print("  ✅ Edited boards get their own slices")
+    finally:
+        release.set()
+        post_save.drain(timeout=30)
+        mb_app._get_client = original_get_client
+        panel_slices.make_slices = original_make_slices
+        _cleanup(outputs)
+    assert not any(Path(p["path"]).exists() for p in panels)
+    print("  ✅ Slices are removed together with their output")
+
+
+def test_slices_served_on_demand():
+    """Test that a slice requested before the worker reached it is cut on the spot"""
+    print("\n" + "=" * 60)
+    print("Test: On-demand slices")
+    print("=" * 60)
+
+    output_path = output_store.save_output(_board(), "generated")
+    outputs = [output_path]
+    try:
+        target = panel_slices.slice_path(output_path, 2, 3)
+        assert not target.exists()
+        response = client.get(panel_slices.slice_url(target))
+        assert response.status_code == 200 and target.is_file()
+        with Image.open(output_path) as saved, Image.open(target) as piece:
+            box = next(p["box"] for p in panel_assembly.panel_layout() if (p["row"], p["column"]) == (2, 3))
+            assert response.content == target.read_bytes()
+            assert np.array_equal(np.asarray(piece), np.asarray(saved.crop(tuple(box))))
+        print(f"  ✅ {target.name} cut on first request ({len(response.content)} bytes)")
+
+        written = panel_slices.make_slices(output_path)
+        assert len(written) == 8 and target in written
+        for missing in (
+            panel_slices.slice_path(output_path, 3, 1),
+            output_path.with_name("generated_missing.panel_r1c1.png"),
+            output_path.with_name(f"{output_path.stem}.thumb_r1c1.png"),
+        ):
+            assert client.get(f"/gradio_api/file={missing}").status_code == 404
+            assert not missing.exists()
+        print("  ✅ Unknown panels, outputs and names still 404")
+    finally:
+        _cleanup(outputs)
+
+
+if __name__ == "__main__":
+    test_slices_written_after_save()
+    test_slices_served_on_demand()
+    print("\n✅ ALL TESTS PASSED!")
@@ -0,0 +1,170 @@
+"""
+Test draft-then-refine progressive generation
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+
+# Add parent directory to path
+sys.path.insert(0, str(ROOT))
+
+import mb_app
+import output_store
+from conftest import fake_client
+
+
+def _pro_waits_for(draft_seen, refine_error=None):
+    """Flash answers at once; Pro only answers after the draft reached the consumer."""
+    def before(model, contents, config):
+        if model == mb_app.GEMINI_3_MODEL_ID:
+            assert draft_seen.wait(10), "refinement should run alongside the draft"
+            if refine_error:
+                raise refine_error
+
+    return before
+
+
+def _cleanup(paths):
+    for path in paths:
+        path = Path(path)
+        path.unlink(missing_ok=True)
+        for sidecar in output_store.sidecars(path):
+            sidecar.unlink(missing_ok=True)
+
+
+def test_draft_then_refine():
+    """Test that the Flash draft is yielded first and the Pro refinement follows"""
+    print("=" * 60)
+    print("Test: Draft then refine")
+    print("=" * 60)
+
+    calls, outputs = [], []
+    draft_seen = threading.Event()
+    original_get_client = mb_app._get_client
+    mb_app._get_client = lambda api_key: fake_client(calls, (30, 60, 90), before=_pro_waits_for(draft_seen))
+    try:
+        results = []
+        for result in mb_app.generate_image_progressive(
+            "Quiet luxury knitwear", mb_app.GEMINI_3_MODEL_ID, "", None, "single"
+        ):
+            results.append(result)
+            outputs.append(result[0])
+            draft_seen.set()
+        assert len(results) == 2
+        (draft_path, _, draft_info), (final_path, _, final_info) = results
+        print(f"  draft={draft_info}")
+        print(f"  final={final_info}")
+        assert draft_info["phase"] == "draft" and draft_info["served_model"] == mb_app.GEMINI_25_MODEL_ID
+        assert final_info["phase"] == "final" and final_info["served_model"] == mb_app.GEMINI_3_MODEL_ID
+        assert final_info["draft"] == Path(draft_path).name
+        pro_call = next(call for call in calls if call.model == mb_app.GEMINI_3_MODEL_ID)
+        assert pro_call.config.image_config.image_size == "2K"
+        print("  ✅ Flash draft first, Pro refinement at 2K second")
+
+        assert output_store.read_sidecar(draft_path, mb_app.RUN_SIDECAR_KIND) == draft_info
+        assert output_store.read_sidecar(final_path, mb_app.RUN_SIDECAR_KIND) == final_info
+        print("  ✅ Both outputs record their phase")
+    finally:
+        mb_app._get_client = original_get_client
+        _cleanup(outputs)
+
+
+def test_failed_refine_keeps_draft():
+    """Test that a failed refinement ends with the draft instead of an error"""
+    print("\n" + "=" * 60)
+    print("Test: Failed refinement keeps the draft")
+    print("=" * 60)
+
+    calls, outputs = [], []
+    draft_seen = threading.Event()
+    original_get_client = mb_app._get_client
+    mb_app._get_client = lambda api_key: fake_client(
+        calls, (30, 60, 90), before=_pro_waits_for(draft_seen, ValueError("quota exhausted"))
+    )
+    try:
+        results = []
+        for result in mb_app.generate_image_progressive(
+            "Quiet luxury knitwear", mb_app.GEMINI_3_MODEL_ID, "", None, "single"
+        ):
+            results.append(result)
+            outputs.append(result[0])
+            draft_seen.set()
+        assert len(results) == 2
+        assert results[1][0] == results[0][0]
+        assert results[1][2]["phase"] == "final" and "refine_error" in results[1][2]
+        print(f"  final={results[1][2]}")
+        print("  ✅ Draft kept as the final result")
+    finally:
+        mb_app._get_client = original_get_client
+        _cleanup(outputs)
+
+
+HEADLESS_SCRIPT = """
+import json
+import sys
+from fastapi.testclient import TestClient
+import mb_app
+import headless_app
+
+sys.path.insert(0, "test")
+from conftest import fake_client
+
+mb_app._get_client = lambda api_key: fake_client(color=(30, 60, 90))
+client = TestClient(headless_app.create_app())
+submitted = client.post("/gradio_api/call/generate_image_progressive",
+                        json={"data": ["Quiet luxury knitwear", mb_app.GEMINI_3_MODEL_ID, "", "", "single"]})
+event_id = submitted.json()["event_id"]
+stream = client.get(f"/gradio_api/call/generate_image_progressive/{event_id}")
+events = []
+for block in stream.text.strip().split("\\n\\n"):
+    lines = dict(line.split(": ", 1) for line in block.splitlines())
+    data = json.loads(lines["data"])
+    events.append([lines["event"], data[2]["phase"] if isinstance(data, list) else data])
+again = client.get(f"/gradio_api/call/generate_image_progressive/{event_id}")
+empty = client.post("/gradio_api/call/generate_image_progressive", json={"data": ["  ", "m", ""]})
+failed = client.get(f"/gradio_api/call/generate_image_progressive/{empty.json()['event_id']}")
+print(json.dumps({
+    "content_type": stream.headers["content-type"],
+    "events": events,
+    "again": again.status_code,
+    "failed": failed.text,
+}))
+"""
+
+
+def test_headless_event_stream():
+    """Test the headless /gradio_api/call event stream"""
+    print("\n" + "=" * 60)
+    print("Test: Headless event stream")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, MOODBOARD_HEADLESS="1", MOODBOARD_OUTPUT_DIR=tmp)
+        completed = subprocess.run(
+            [sys.executable, "-c", HEADLESS_SCRIPT],
+            cwd=ROOT, env=env, capture_output=True, text=True, timeout=120,
+        )
+    assert completed.returncode == 0, completed.stderr
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    print(f"  Result: {result}")
+
+    assert result["content_type"].startswith("text/event-stream")
+    assert result["events"][0] == ["generating", "draft"]
+    assert result["events"][-1] == ["complete", "final"]
+    print("  ✅ Draft streamed as `generating`, refinement as `complete`")
+    assert result["again"] == 404
+    assert result["failed"].startswith("event: error") and "cannot be empty" in result["failed"]
+    print("  ✅ Event ids are single-use and errors are streamed")
+
+
+if __name__ == "__main__":
+    test_draft_then_refine()
+    test_failed_refine_keeps_draft()
+    test_headless_event_stream()
+    print("\n✅ ALL TESTS PASSED!")
@@ -0,0 +1,162 @@
+"""
+Test the near-duplicate prompt cache (normalization, MinHash/LSH lookup, reuse in the API)
+"""
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+if "MOODBOARD_OUTPUT_DIR" not in os.environ:  # run as a script; under pytest conftest.py does this
+    _scratch = Path(tempfile.mkdtemp(prefix="moodboard-test-"))
+    os.environ.update(MOODBOARD_OUTPUT_DIR=str(_scratch / "outputs"), MOODBOARD_DATA_DIR=str(_scratch / "data"))
+
+import mb_app
+import output_store
+import prompt_cache
+from conftest import fake_client
+
+
+def test_normalization_and_similarity():
+    """Test that trivial variants match exactly and near-duplicates match above the threshold"""
+    print("=" * 60)
+    print("Test: Normalization and similarity")
+    print("=" * 60)
+
+    base = "sustainable luxury dress collection"
+    for variant in [
+        "Sustainable Luxury Dress Collection.",
+        "  sustainable   luxury, dress collection ",
+        "dress collection: sustainable luxury",
+        "ＳＵＳＴＡＩＮＡＢＬＥ luxury dress collection",
+    ]:
+        assert prompt_cache.normalize(variant) == prompt_cache.normalize(base), variant
+    print("  ✅ Case, punctuation, spacing, width and word order normalized away")
+
+    index = prompt_cache.PromptIndex()
+    index.add("ctx", base, "/out/a.png")
+    index.add("ctx", "brutalist concrete architecture inspired menswear", "/out/b.png")
+
+    exact = index.lookup("ctx", "Sustainable Luxury Dress Collection.")
+    assert exact == {"subject": base, "output": "/out/a.png", "similarity": 1.0}
+    near = index.lookup("ctx", "sustainable luxury dresses collection", threshold=0.6)
+    print(f"  near-duplicate: {near}")
+    assert near is not None and near["output"] == "/out/a.png" and near["similarity"] < 1.0
+    assert index.lookup("ctx", "neon cyberpunk streetwear") is None
+    assert index.lookup("other-model", base) is None
+    print("  ✅ Near-duplicates found, unrelated subjects and other contexts are not")
+
+
+def test_lookup_speed_and_tailing():
+    """Test lookup latency on a large index, and that other processes' entries are picked up"""
+    print("\n" + "=" * 60)
+    print("Test: Lookup speed and shared log")
+    print("=" * 60)
+
+    index = prompt_cache.PromptIndex()
+    words = ["silk", "denim", "linen", "wool", "leather", "velvet", "tweed", "satin", "cotton", "mesh",
+             "noir", "pastel", "neon", "earthy", "regal", "utility", "coastal", "alpine", "desert", "urban"]
+    count = 20000
+    for i in range(count):
+        subject = f"{words[i % 20]} {words[(i // 20) % 20]} {words[(i // 400) % 20]} look {i}"
+        index.add("ctx", subject, f"/out/{i}.png")
+    queries = [f"{words[i % 20]} {words[(i // 3) % 20]} capsule wardrobe {i * 7}" for i in range(500)]
+    started = time.perf_counter()
+    for query in queries:
+        index.lookup("ctx", query)
+    per_lookup_ms = (time.perf_counter() - started) * 1000 / len(queries)
+    print(f"  {count} entries: {per_lookup_ms:.3f} ms per near-duplicate lookup")
+    assert per_lookup_ms < 1.0
+    print("  ✅ Sub-millisecond lookups (benchmarks/bench_prompt_cache.py runs this at 1M entries)")
+
+    index = prompt_cache.PromptIndex(max_bucket=16)
+    for i in range(2000):
+        index.add("ctx", f"quiet luxury knitwear capsule {i}", f"/out/hot-{i}.png")
+    largest = max(len(found) for bucket in index._buckets for found in bucket.values() if isinstance(found, list))
+    assert largest == 16
+    assert index.lookup("ctx", "quiet luxury knitwear capsule 1999")["output"] == "/out/hot-1999.png"
+    assert index.lookup("ctx", "quiet luxury knitwear capsule variant", threshold=0.6) is not None
+    print("  ✅ Buckets of a much-repeated subject stay capped; its newest boards are still found")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "prompt_cache.jsonl"
+        writer, reader = prompt_cache.PromptCache(path), prompt_cache.PromptCache(path)
+        assert writer.wait_ready(5) and reader.wait_ready(5)
+        output = Path(tmp) / "generated_x.png"
+        output.write_bytes(b"png")
+        writer.record("ctx", "Quiet luxury knitwear", str(output))
+        assert reader.lookup("ctx", "knitwear, quiet luxury")["output"] == str(output)
+        output.unlink()
+        assert reader.lookup("ctx", "knitwear, quiet luxury") is None
+        print("  ✅ Entries shared through the log; deleted boards are misses")
+
+        output.write_bytes(b"png")
+        writer.log.append({"context": "ctx", "subject": "Tweed hunting jackets", "output": str(output)})
+        restarted = prompt_cache.PromptCache(path)
+        assert restarted.lookup("ctx", "knitwear, quiet luxury") is None  # still loading: a miss, not a wait
+        assert restarted.wait_ready(5)
+        assert restarted.lookup("ctx", "knitwear, quiet luxury")["output"] == str(output)
+        assert restarted.lookup("ctx", "tweed hunting jacket", threshold=0.6)["output"] == str(output)
+        print("  ✅ A new process loads the log in the background, with or without stored signatures")
+
+
+def test_find_similar_moodboard():
+    """Test that a generated board is offered for a near-identical later request"""
+    print("\n" + "=" * 60)
+    print("Test: find_similar_moodboard")
+    print("=" * 60)
+
+    original_get_client = mb_app._get_client
+    original_cache = prompt_cache._cache
+    mb_app._get_client = lambda api_key: fake_client(color=(200, 180, 160))
+    outputs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        prompt_cache._cache = prompt_cache.PromptCache(Path(tmp) / "prompt_cache.jsonl")
+        assert prompt_cache._cache.wait_ready(5)
+        try:
+            output_path, _, run_info = mb_app.generate_image(
+                "sustainable luxury dress collection", mb_app.GEMINI_3_MODEL_ID, "", None, "single", "fast"
+            )
+            outputs.append(Path(output_path))
+
+            found = mb_app.find_similar_moodboard(
+                "Sustainable Luxury Dress Collection.", mb_app.GEMINI_3_MODEL_ID, "", "single", "fast"
+            )["match"]
+            print(f"  match: {found}")
+            assert found["image"] == output_path and found["similarity"] == 1.0
+            assert found["run_info"] == run_info
+            print("  ✅ Earlier board offered for the variant")
+
+            assert mb_app.find_similar_moodboard(
+                "sustainable luxury dress collection", mb_app.GEMINI_3_MODEL_ID, "", "single", "quality"
+            ) == {"match": None}
+            assert mb_app.find_similar_moodboard(
+                "sustainable luxury dress collection", mb_app.GEMINI_3_MODEL_ID, "", "panels", "fast"
+            ) == {"match": None}
+            print("  ✅ Other profiles and modes do not reuse it")
+
+            output_path, _, _ = mb_app.generate_image(
+                "Latest 2026 runway trends", mb_app.GEMINI_3_MODEL_ID, "", None, "single", "fast"
+            )
+            outputs.append(Path(output_path))
+            assert mb_app.find_similar_moodboard(
+                "latest 2026 runway trends", mb_app.GEMINI_3_MODEL_ID, "", "single", "fast"
+            ) == {"match": None}
+            print("  ✅ Time-sensitive subjects are never served from the cache")
+        finally:
+            mb_app._get_client = original_get_client
+            prompt_cache._cache = original_cache
+            for path in outputs:
+                path.unlink(missing_ok=True)
+                for sidecar in output_store.sidecars(path):
+                    sidecar.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    test_normalization_and_similarity()
+    test_lookup_speed_and_tailing()
+    test_find_similar_moodboard()
+    print("\n✅ ALL TESTS PASSED!")
@@ -0,0 +1,102 @@
+"""
+Test crop-and-composite regional edits
+"""
+import sys
+import tempfile
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import numpy as np
+from PIL import Image
+
+import mb_app
+import output_store
+import regional_edit
+from conftest import fake_client
+
+
+def test_crop_plan_stays_in_bounds():
+    """Test that the crop covers the bbox plus margin and matches a supported ratio"""
+    print("=" * 60)
+    print("Test: Crop planning")
+    print("=" * 60)
+
+    bbox = (400, 100, 560, 380)
+    crop_box, aspect_ratio = regional_edit.plan_crop(bbox, (1440, 1024))
+    print(f"  bbox={bbox} crop={crop_box} aspect={aspect_ratio}")
+    left, top, right, bottom = crop_box
+    assert 0 <= left <= bbox[0] and 0 <= top <= bbox[1]
+    assert bbox[2] <= right <= 1440 and bbox[3] <= bottom <= 1024
+    assert aspect_ratio in regional_edit.SUPPORTED_ASPECT_RATIOS
+    ratio = (right - left) / (bottom - top)
+    assert abs(ratio - regional_edit.SUPPORTED_ASPECT_RATIOS[aspect_ratio]) < 0.02
+    print("  ✅ Crop is in bounds and close to the requested ratio")
+
+
+def test_composite_keeps_untouched_pixels_identical():
+    """Test that only the feathered bbox changes when a patch is blended back"""
+    print("\n" + "=" * 60)
+    print("Test: Feathered composite")
+    print("=" * 60)
+
+    rng = np.random.default_rng(0)
+    parent = Image.fromarray(rng.integers(0, 255, (256, 320, 3), dtype=np.uint8))
+    bbox = (100, 80, 180, 160)
+    crop_box = (60, 40, 220, 200)
+    patch = Image.new("RGB", (80, 80), (255, 0, 0))  # deliberately not crop-sized
+    result = regional_edit.composite_patch(parent, patch, crop_box, bbox, feather=8)
+
+    before = np.asarray(parent)
+    after = np.asarray(result)
+    changed = np.argwhere(np.any(before != after, axis=2))
+    ys, xs = changed[:, 0], changed[:, 1]
+    print(f"  Changed pixels span x={xs.min()}..{xs.max()}, y={ys.min()}..{ys.max()}")
+    assert xs.min() >= bbox[0] - 8 and xs.max() <= bbox[2] + 8
+    assert ys.min() >= bbox[1] - 8 and ys.max() <= bbox[3] + 8
+    assert tuple(after[120, 140]) == (255, 0, 0)
+    print("  ✅ Pixels outside the feathered bbox are bit-identical")
+
+
+def test_regional_edit_sends_only_the_crop():
+    """Test edit_image_region in regional mode against a fake model client"""
+    print("\n" + "=" * 60)
+    print("Test: Regional edit end to end")
+    print("=" * 60)
+
+    calls = []
+    original_get_client = mb_app._get_client
+    mb_app._get_client = lambda api_key: fake_client(calls, (255, 0, 0), thought="Recolouring the panel.")
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            source = Path(tmp) / "board.png"
+            Image.new("RGB", (1440, 1024), (200, 200, 200)).save(source)
+            output_path, reasoning, _ = mb_app.edit_image_region(
+                None, str(source), 0, 0, 360, 400, "Make it red", mb_app.GEMINI_25_MODEL_ID, "",
+                None, "regional",
+            )
+            edited = np.asarray(Image.open(output_path))
+            Path(output_path).unlink()
+            for sidecar in output_store.sidecars(output_path):
+                sidecar.unlink(missing_ok=True)
+    finally:
+        mb_app._get_client = original_get_client
+
+    call = calls[0]
+    sent = Image.open(__import__("io").BytesIO(call.contents[0].inline_data.data))
+    print(f"  Sent {sent.size} instead of (1440, 1024); aspect={call.config.image_config.aspect_ratio}")
+    assert sent.size[0] < 1440 and sent.size[1] < 1024
+    assert "crop of a larger fashion moodboard" in call.contents[1]
+    assert "Top Row (The Look), Cells 1 and 2" in call.contents[1]
+    assert tuple(edited[100, 100]) == (255, 0, 0)
+    assert tuple(edited[900, 1300]) == (200, 200, 200)
+    assert reasoning == "Recolouring the panel."
+    print("  ✅ Only the crop was sent and the rest of the board is unchanged")
+
+
+if __name__ == "__main__":
+    test_crop_plan_stays_in_bounds()
+    test_composite_keeps_untouched_pixels_identical()
+    test_regional_edit_sends_only_the_crop()
+    print("\n✅ ALL TESTS PASSED!")
@@ -0,0 +1,79 @@
+"""
+Test the queue-backed structured logger
+"""
+import json
+import logging
+import queue
+import sys
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from structured_log import (
+    JsonFormatter,
+    SamplingFilter,
+    _NonBlockingQueueHandler,
+    text_summary,
+    truncate,
+)
+
+
+def test_prompt_is_summarized_not_logged():
+    """Test that large text fields are reduced to size, hash and preview"""
+    print("=" * 60)
+    print("Test: Prompt summarization and truncation")
+    print("=" * 60)
+
+    prompt = "Fashion Moodboard for linen. " * 200
+    summary = text_summary(prompt)
+    print(f"  Summary: {summary}")
+    assert summary["chars"] == len(prompt)
+    assert len(summary["preview"]) < 120
+    assert len(summary["sha256"]) == 12
+    assert truncate("x" * 500, 10).startswith("x" * 10)
+    assert truncate("short", 10) == "short"
+    print("  ✅ Prompt reduced to fields")
+
+
+def test_records_render_as_json():
+    """Test that a record with fields renders as a single JSON object"""
+    print("\n" + "=" * 60)
+    print("Test: JSON rendering")
+    print("=" * 60)
+
+    record = logging.LogRecord("mb_app", logging.INFO, __file__, 1, "generate_complete", None, None)
+    record.fields = {"model": "gemini-2.5-flash-image", "output": "generated_x.png"}
+    line = JsonFormatter().format(record)
+    print(f"  Line: {line}")
+    payload = json.loads(line)
+    assert payload["event"] == "generate_complete"
+    assert payload["level"] == "info"
+    assert payload["output"] == "generated_x.png"
+    print("  ✅ Record rendered as JSON")
+
+
+def test_full_queue_drops_instead_of_blocking():
+    """Test that a saturated queue drops records rather than blocking the caller"""
+    print("\n" + "=" * 60)
+    print("Test: Non-blocking enqueue and sampling")
+    print("=" * 60)
+
+    handler = _NonBlockingQueueHandler(queue.Queue(maxsize=1))
+    record = logging.LogRecord("mb_app", logging.INFO, __file__, 1, "event", None, None)
+    handler.enqueue(record)
+    handler.enqueue(record)
+    assert handler.dropped == 1
+
+    sampler = SamplingFilter(0.0)
+    warning = logging.LogRecord("mb_app", logging.WARNING, __file__, 1, "warn", None, None)
+    assert not sampler.filter(record)
+    assert sampler.filter(warning)
+    print("  ✅ Dropped 1 record, warnings bypass sampling")
+
+
+if __name__ == "__main__":
+    test_prompt_is_summarized_not_logged()
+    test_records_render_as_json()
+    test_full_queue_drops_instead_of_blocking()
+    print("\n✅ ALL TESTS PASSED!")
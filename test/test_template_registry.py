@@ -0,0 +1,106 @@
+"""
+Test the template registry: named, versioned templates with hot reload, referenced by ID
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import mb_app
+import output_store
+import template_registry
+from conftest import fake_client
+
+
+def test_versions_and_hot_reload():
+    """Test that edited files are reloaded as new versions and older versions stay pinnable"""
+    print("=" * 60)
+    print("Test: Versions and hot reload")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "capsule.txt"
+        path.write_text("Capsule wardrobe for {SUBJECT_PLACEHOLDER}\nNo text.\n", encoding="utf-8")
+        registry = template_registry.TemplateRegistry(tmp, reload_interval_s=0)
+
+        first = registry.get("capsule")
+        assert first is registry.get("capsule") and first is registry.get(first.id)
+        assert first.placeholders == {"{SUBJECT_PLACEHOLDER}"}
+        assert first.static_lines == {"No text."}
+        assert first.render({"{SUBJECT_PLACEHOLDER}": "linen"}) == "Capsule wardrobe for linen\nNo text.\n"
+        print(f"  ✅ Loaded {first.id}")
+
+        path.write_text("Travel capsule for {SUBJECT_PLACEHOLDER}\nNo text.\n", encoding="utf-8")
+        os.utime(path, (path.stat().st_atime, path.stat().st_mtime + 5))
+        second = registry.get("capsule")
+        assert second.version != first.version and second.text.startswith("Travel")
+        assert registry.get(f"capsule@{first.version}") is first
+        assert registry.get(f"capsule@{second.version[:8]}") is second
+        print(f"  ✅ Reloaded as {second.id}; {first.id} still resolves")
+
+        assert [t["id"] for t in registry.templates()] == [second.id]
+        for missing in ("nothing", "capsule@abcdef0123", "capsule@" + "0" * 12):
+            try:
+                registry.get(missing)
+            except template_registry.UnknownTemplate:
+                pass
+            else:
+                raise AssertionError(f"{missing} resolved")
+        print("  ✅ Unknown names and versions are rejected")
+
+        inline = registry.resolve("Resort edit of {SUBJECT_PLACEHOLDER}\nBright light.", "capsule")
+        assert inline is registry.resolve("Resort edit of {SUBJECT_PLACEHOLDER}\nBright light.", "capsule")
+        assert registry.get(inline.id) is inline and inline.name == template_registry.INLINE_NAME
+        assert registry.resolve("", "capsule") is second and registry.resolve("capsule", "x") is second
+        print("  ✅ Inline text is compiled once; empty input falls back to the default")
+
+
+def test_requests_reference_templates_by_id():
+    """Test that generate_image accepts an ID, inline text or nothing, and records the version"""
+    print("\n" + "=" * 60)
+    print("Test: Requests reference templates by ID")
+    print("=" * 60)
+
+    default = template_registry.registry().get(mb_app.PROMPT_TEMPLATE_NAME)
+    original_get_client = mb_app._get_client
+    calls = []
+    mb_app._get_client = lambda api_key: fake_client(calls)
+    outputs = []
+    try:
+        for template in ("", mb_app.PROMPT_TEMPLATE_NAME, default.id, default.text):
+            output_path, _, run_info = mb_app.generate_image(
+                "quiet luxury knitwear", mb_app.GEMINI_3_MODEL_ID, template, "test-key", "single", "fast"
+            )
+            outputs.append(Path(output_path))
+            expected = default.id if template != default.text else f"{template_registry.INLINE_NAME}@{default.version}"
+            assert run_info["template"] == expected
+        assert len({call.contents for call in calls}) == 1
+        assert calls[0].contents == default.text.replace(mb_app.SUBJECT_PLACEHOLDER, "quiet luxury knitwear")
+        print("  ✅ Empty, name, pinned ID and inline text build the same prompt")
+
+        try:
+            mb_app.generate_image("quiet luxury knitwear", mb_app.GEMINI_3_MODEL_ID, "no_such_template")
+        except mb_app.AppError as e:
+            assert "no_such_template" in str(e)
+        else:
+            raise AssertionError("unknown template accepted")
+        print("  ✅ Unknown template IDs are reported")
+
+        listed = mb_app.list_templates()["templates"]
+        assert {t["name"] for t in listed} >= {mb_app.PROMPT_TEMPLATE_NAME, mb_app.EDIT_TEMPLATE_NAME}
+        print(f"  ✅ list_templates: {[t['id'] for t in listed]}")
+    finally:
+        mb_app._get_client = original_get_client
+        for path in outputs:
+            path.unlink(missing_ok=True)
+            for sidecar in output_store.sidecars(path):
+                sidecar.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    test_versions_and_hot_reload()
+    test_requests_reference_templates_by_id()
+    print("\n✅ ALL TESTS PASSED!")
@@ -0,0 +1,83 @@
+"""
+Test request-scoped tracing spans and correlation IDs
+"""
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import tracing
+
+
+class FakeRequest:
+    def __init__(self, headers):
+        self.headers = headers
+
+
+def _read_spans(path):
+    spans = []
+    for line in Path(path).read_text().splitlines():
+        payload = json.loads(line)
+        spans.extend(payload["resourceSpans"][0]["scopeSpans"][0]["spans"])
+    return spans
+
+
+def test_spans_share_correlation_trace_id():
+    """Test that nested spans reuse nginx's request id as the trace id"""
+    print("=" * 60)
+    print("Test: Span nesting and correlation IDs")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        export_path = Path(tmp) / "spans.jsonl"
+        exporter = tracing.FileSpanExporter(export_path)
+        tracing.set_exporter(exporter)
+        try:
+            request_id = "0123456789abcdef0123456789abcdef"
+            request = FakeRequest({
+                "x-request-id": request_id,
+                "x-request-start": f"t={time.time() - 0.05:.3f}",
+            })
+            with tracing.request_span("generate_image", request) as root:
+                with tracing.span("model_call", **{"gen_ai.request.model": "m", "moodboard.grounding": False}):
+                    pass
+            assert exporter.flush(timeout=5)
+            # Background work left running by other tests may export spans of its own meanwhile
+            spans = [s for s in _read_spans(export_path) if s["traceId"] == request_id]
+        finally:
+            tracing.set_exporter(None)
+
+    print(f"  Exported {len(spans)} spans: {[s['name'] for s in spans]}")
+    assert [s["name"] for s in spans] == ["model_call", "generate_image"]
+    assert spans[0]["parentSpanId"] == root.span_id
+    attributes = {a["key"]: a["value"] for a in spans[0]["attributes"]}
+    assert attributes["moodboard.grounding"] == {"boolValue": False}
+    assert root.attributes["proxy.wait_ms"] >= 0
+    print("  ✅ Child span shares the correlation trace id")
+
+
+def test_error_status_is_recorded():
+    """Test that an exception marks the span as failed and still propagates"""
+    print("\n" + "=" * 60)
+    print("Test: Span error status")
+    print("=" * 60)
+
+    try:
+        with tracing.request_span("edit_image_region", None) as root:
+            raise ValueError("boom")
+    except ValueError:
+        pass
+    assert root.status == "error"
+    assert "boom" in root.status_message
+    assert len(root.trace_id) == 32
+    print("  ✅ Error status recorded, trace id minted for direct calls")
+
+
+if __name__ == "__main__":
+    test_spans_share_correlation_trace_id()
+    test_error_status_is_recorded()
+    print("\n✅ ALL TESTS PASSED!")
@@ -0,0 +1,264 @@
+import atexit
+import contextvars
+import hashlib
+import json
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+
+TRACE_SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME", "ai-fashion-moodboard")
+# Empty string disables export; spans are still created so callers never need to branch.
+TRACE_EXPORT_FILE = os.environ.get("TRACE_EXPORT_FILE", "")
+# Finished spans waiting for the background writer; spans beyond this are dropped, not waited on.
+TRACE_QUEUE_SIZE = int(os.environ.get("TRACE_QUEUE_SIZE", "10000"))
+CORRELATION_HEADER = "x-request-id"
+REQUEST_START_HEADER = "x-request-start"
+
+_TRACE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+_STATUS_CODES = {"unset": 0, "ok": 1, "error": 2}
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_correlation_id = contextvars.ContextVar("correlation_id", default=None)
+
+
+class Span:
+    """A single timed operation, serialised in the OTLP/JSON span shape."""
+
+    __slots__ = (
+        "name",
+        "trace_id",
+        "span_id",
+        "parent_span_id",
+        "start_ns",
+        "end_ns",
+        "attributes",
+        "status",
+        "status_message",
+    )
+
+    def __init__(self, name: str, trace_id: str, parent_span_id: str | None = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent_span_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = {}
+        self.status = "unset"
+        self.status_message = ""
+
+    def set_attribute(self, key: str, value) -> None:
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_attributes(self, **attributes) -> None:
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    @property
+    def duration_ms(self) -> float:
+        end_ns = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end_ns - self.start_ns) / 1e6
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": _STATUS_CODES[self.status]},
+        }
+        if self.parent_span_id:
+            span["parentSpanId"] = self.parent_span_id
+        if self.status_message:
+            span["status"]["message"] = self.status_message
+        return span
+
+
+def _otlp_attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+class FileSpanExporter:
+    """Append finished spans as OTLP/JSON lines (readable by the collector's otlpjsonfile receiver).
+    Requests only queue the span; a background thread serialises and writes them."""
+
+    def __init__(self, path: str | Path, service_name: str = TRACE_SERVICE_NAME, queue_size: int = TRACE_QUEUE_SIZE):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._resource = {
+            "attributes": [
+                _otlp_attribute("service.name", service_name),
+                _otlp_attribute("process.pid", os.getpid()),
+            ]
+        }
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._writer: threading.Thread | None = None
+        self._writer_lock = threading.Lock()
+        self.dropped = 0
+
+    def export(self, span: Span) -> None:
+        """Queue a finished span for the background writer. Never blocks the caller."""
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_spans, name="span-writer", daemon=True)
+                self._writer.start()
+                atexit.register(self.flush, 5)
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self._count_dropped(1)
+
+    def _count_dropped(self, spans: int) -> None:
+        # Request threads and the writer both count drops
+        with self._writer_lock:
+            self.dropped += spans
+
+    def _line(self, span: Span) -> str:
+        payload = {
+            "resourceSpans": [
+                {
+                    "resource": self._resource,
+                    "scopeSpans": [{"scope": {"name": "mb_app"}, "spans": [span.to_otlp()]}],
+                }
+            ]
+        }
+        return json.dumps(payload, separators=(",", ":")) + "\n"
+
+    def _write_spans(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write("".join(self._line(span) for span in batch))
+            except OSError:
+                self._count_dropped(len(batch))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Wait until every queued span has been written. False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+
+_exporter = FileSpanExporter(TRACE_EXPORT_FILE) if TRACE_EXPORT_FILE else None
+
+
+def set_exporter(exporter) -> None:
+    """Replace the active exporter (None disables export)."""
+    global _exporter
+    _exporter = exporter
+
+
+def _trace_id_for(correlation_id: str) -> str:
+    """Reuse nginx's 32-hex $request_id as the trace id; hash anything else into one."""
+    candidate = correlation_id.replace("-", "").lower()
+    if _TRACE_ID_PATTERN.match(candidate):
+        return candidate
+    return hashlib.sha256(correlation_id.encode("utf-8")).hexdigest()[:32]
+
+
+def _header(request, name: str) -> str | None:
+    headers = getattr(request, "headers", None)
+    if not headers:
+        return None
+    value = headers.get(name)
+    return value.strip() if value else None
+
+
+def correlation_id_from_request(request) -> str:
+    """Return the X-Request-ID injected by nginx, or mint one for direct calls."""
+    return _header(request, CORRELATION_HEADER) or uuid.uuid4().hex
+
+
+def proxy_wait_ms(request) -> float | None:
+    """Time between nginx accepting the request (X-Request-Start: t=<msec>) and the handler starting."""
+    value = _header(request, REQUEST_START_HEADER)
+    if not value:
+        return None
+    try:
+        started_at = float(value.removeprefix("t="))
+    except ValueError:
+        return None
+    return round(max(time.time() - started_at, 0.0) * 1000, 2)
+
+
+def current_correlation_id() -> str | None:
+    return _correlation_id.get()
+
+
+def current_span() -> Span | None:
+    return _current_span.get()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a stage as a child of the current span (or as a new root if there is none)."""
+    parent = _current_span.get()
+    if parent is not None:
+        new_span = Span(name, parent.trace_id, parent.span_id)
+    else:
+        new_span = Span(name, _trace_id_for(_correlation_id.get() or uuid.uuid4().hex))
+    new_span.set_attributes(**attributes)
+    token = _current_span.set(new_span)
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.status = "error"
+        new_span.status_message = f"{type(e).__name__}: {e}"[:500]
+        raise
+    else:
+        if new_span.status == "unset":
+            new_span.status = "ok"
+    finally:
+        new_span.end_ns = time.time_ns()
+        _current_span.reset(token)
+        if _exporter is not None:
+            _exporter.export(new_span)
+
+
+@contextmanager
+def request_span(name: str, request=None, **attributes):
+    """Open the root span for one request, keyed by its correlation ID."""
+    correlation_id = correlation_id_from_request(request)
+    correlation_token = _correlation_id.set(correlation_id)
+    parent_token = _current_span.set(None)
+    try:
+        with span(name, **attributes) as root:
+            root.set_attribute("correlation.id", correlation_id)
+            root.set_attribute("proxy.wait_ms", proxy_wait_ms(request))
+            yield root
+    finally:
+        _current_span.reset(parent_token)
+        _correlation_id.reset(correlation_token)